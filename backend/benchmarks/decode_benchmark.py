@@ -0,0 +1,80 @@
+"""
+So sánh đường decode cũ (Image.open -> convert -> np.array -> cvtColor)
+với src.imaging.decode_image_bgr trên các ảnh kích thước điện thoại.
+
+Chạy từ thư mục backend:
+    python -m benchmarks.decode_benchmark
+"""
+import argparse
+import io
+import time
+
+import cv2
+import numpy as np
+from PIL import Image
+
+from src.imaging import DECODE_MAX_SIDE, decode_image_bgr
+
+# (tên, kích thước, EXIF orientation)
+PHONE_PHOTOS = [
+    ("12MP landscape", (4032, 3024), 1),
+    ("12MP portrait (EXIF 6)", (4032, 3024), 6),
+    ("24MP landscape", (6000, 4000), 1),
+    ("48MP landscape", (8000, 6000), 1),
+]
+
+
+def make_photo(size, orientation: int, quality: int = 90) -> bytes:
+    """Tạo ảnh JPEG tổng hợp có gradient và nhiễu để kích thước file gần với ảnh thật."""
+    width, height = size
+    x = np.linspace(0, 255, width, dtype=np.float32)
+    y = np.linspace(0, 255, height, dtype=np.float32)[:, None]
+    rng = np.random.default_rng(0)
+    noise = rng.normal(0, 12, (height, width)).astype(np.float32)
+    channels = [x + noise * 0.5, y + noise, (x + y) / 2 + noise]
+    array = np.clip(np.stack(channels, axis=-1), 0, 255).astype(np.uint8)
+
+    exif = Image.Exif()
+    exif[0x0112] = orientation
+    output = io.BytesIO()
+    Image.fromarray(array).save(output, format="JPEG", quality=quality, exif=exif)
+    return output.getvalue()
+
+
+def legacy_decode(image_bytes: bytes) -> np.ndarray:
+    image_pil = Image.open(io.BytesIO(image_bytes)).convert("RGB")
+    np_image = np.array(image_pil)
+    return cv2.cvtColor(np_image, cv2.COLOR_RGB2BGR)
+
+
+def fast_decode(image_bytes: bytes) -> np.ndarray:
+    return decode_image_bgr(image_bytes)
+
+
+def measure(fn, image_bytes: bytes, repeat: int):
+    result = fn(image_bytes)  # warm-up
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn(image_bytes)
+    return (time.perf_counter() - start) / repeat * 1000, result.shape
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    print(f"DECODE_MAX_SIDE={DECODE_MAX_SIDE}")
+    print(f"{'photo':<26}{'file':>9}{'legacy ms':>11}{'fast ms':>9}{'speedup':>9}  output (legacy -> fast)")
+    for name, size, orientation in PHONE_PHOTOS:
+        image_bytes = make_photo(size, orientation)
+        legacy_ms, legacy_shape = measure(legacy_decode, image_bytes, args.repeat)
+        fast_ms, fast_shape = measure(fast_decode, image_bytes, args.repeat)
+        print(
+            f"{name:<26}{len(image_bytes) / 1e6:>7.1f}MB{legacy_ms:>11.1f}{fast_ms:>9.1f}"
+            f"{legacy_ms / fast_ms:>8.1f}x  {legacy_shape} -> {fast_shape}"
+        )
+
+
+if __name__ == "__main__":
+    main()
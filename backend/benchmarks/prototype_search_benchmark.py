@@ -0,0 +1,115 @@
+"""
+So sánh tìm kiếm hai tầng qua prototype với tìm kiếm toàn bộ ảnh của tenant.
+
+Gallery tổng hợp: mỗi người có một tâm và N ảnh nhiễu quanh tâm đó; probe là
+một ảnh mới của một người ngẫu nhiên. Báo cáo độ chính xác top-1 theo danh
+tính, tỉ lệ trùng kết quả với tìm kiếm toàn bộ và độ trễ p50/p95.
+
+    python -m benchmarks.prototype_search_benchmark --people 5000 --images-per-person 20 --engine numpy
+"""
+import argparse
+import asyncio
+import shutil
+import tempfile
+import time
+import uuid
+
+import numpy as np
+
+from src.prototypes import PrototypeIndex
+from src.qdrant_client import VECTOR_SIZE
+from src.vector_store import VectorRecord
+
+TENANT = "bench-tenant"
+UPSERT_BATCH_SIZE = 2000
+
+
+def normalize(vectors: np.ndarray) -> np.ndarray:
+    return vectors / np.linalg.norm(vectors, axis=-1, keepdims=True)
+
+
+def noisy(rng, centers: np.ndarray, noise: float) -> np.ndarray:
+    samples = centers + noise * rng.standard_normal(centers.shape).astype(np.float32) / np.sqrt(VECTOR_SIZE)
+    return normalize(samples).astype(np.float32)
+
+
+def make_store(engine: str, collection_name: str, path: str):
+    if engine == "numpy":
+        from src.vector_store.numpy_store import NumpyVectorStore
+        return NumpyVectorStore(collection_name, VECTOR_SIZE, path)
+    from src.vector_store.hnsw_store import HnswVectorStore
+    return HnswVectorStore(collection_name, VECTOR_SIZE, path)
+
+
+async def timed(coro):
+    start = time.perf_counter()
+    result = await coro
+    return result, (time.perf_counter() - start) * 1000
+
+
+async def run(args):
+    rng = np.random.default_rng(0)
+    centers = normalize(rng.standard_normal((args.people, VECTOR_SIZE)).astype(np.float32))
+    owners = np.repeat(np.arange(args.people), args.images_per_person)
+    gallery = noisy(rng, centers[owners], args.noise)
+
+    path = tempfile.mkdtemp(prefix="prototype_bench_")
+    images = make_store(args.engine, "bench_images", path)
+    index = PrototypeIndex(images, make_store(args.engine, "bench_prototypes", path))
+    try:
+        await images.setup()
+        started = time.perf_counter()
+        for start in range(0, len(gallery), UPSERT_BATCH_SIZE):
+            await images.upsert([
+                VectorRecord(id=str(uuid.uuid4()), vector=vector, payload={"user_id": TENANT, "name": f"person-{owners[i]}"})
+                for i, vector in enumerate(gallery[start:start + UPSERT_BATCH_SIZE], start)
+            ])
+        print(f"Gallery: {args.people} người x {args.images_per_person} ảnh ({time.perf_counter() - started:.1f}s)")
+        started = time.perf_counter()
+        await index.setup()
+        print(f"Dựng prototype: {time.perf_counter() - started:.1f}s")
+
+        truth = rng.integers(0, args.people, args.queries)
+        probes = noisy(rng, centers[truth], args.noise)
+
+        exhaustive_ms, two_stage_ms = [], []
+        exhaustive_correct = two_stage_correct = agree = 0
+        for probe, person in zip(probes, truth):
+            full, ms = await timed(images.search(probe, payload_filter={"user_id": TENANT}, limit=1))
+            exhaustive_ms.append(ms)
+            staged, ms = await timed(index.search(probe, TENANT, limit=1, candidates=args.candidates))
+            two_stage_ms.append(ms)
+
+            expected = f"person-{person}"
+            exhaustive_correct += bool(full) and full[0].payload["name"] == expected
+            two_stage_correct += bool(staged) and staged[0].payload["name"] == expected
+            agree += bool(full) and bool(staged) and full[0].id == staged[0].id
+
+        n = len(probes)
+        print(f"{'mode':>12}{'top-1 acc':>11}{'p50 ms':>9}{'p95 ms':>9}")
+        for mode, correct, latencies in (
+            ("exhaustive", exhaustive_correct, exhaustive_ms),
+            (f"two-stage/{args.candidates}", two_stage_correct, two_stage_ms),
+        ):
+            print(f"{mode:>12}{correct / n:>11.3f}{np.percentile(latencies, 50):>9.2f}{np.percentile(latencies, 95):>9.2f}")
+        print(f"Trùng kết quả top-1 với tìm kiếm toàn bộ: {agree / n:.3f}")
+    finally:
+        await index.close()
+        await images.close()
+        shutil.rmtree(path, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--people", type=int, default=5000)
+    parser.add_argument("--images-per-person", type=int, default=20)
+    parser.add_argument("--queries", type=int, default=300)
+    parser.add_argument("--candidates", type=int, default=10, help="Số danh tính giữ lại sau tầng prototype.")
+    parser.add_argument("--noise", type=float, default=0.9, help="Độ lệch của mỗi ảnh so với tâm danh tính.")
+    parser.add_argument("--engine", default="numpy", choices=["numpy", "hnsw"])
+    args = parser.parse_args()
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+"""
+Đo độ trễ của truy vấn vector có lọc theo user_id (và name) với và không có
+payload index, ở 1k/10k/100k điểm mỗi tenant.
+
+Payload index chỉ có tác dụng trên Qdrant server:
+    docker run -p 6333:6333 qdrant/qdrant
+    python -m benchmarks.qdrant_filter_benchmark --url http://localhost:6333
+
+Không có --url thì chạy Qdrant local (:memory:) để làm mốc so sánh.
+"""
+import argparse
+import time
+
+import numpy as np
+from qdrant_client import QdrantClient, models
+
+from src.qdrant_client import VECTOR_SIZE, payload_indexes, tenant_hnsw_config
+
+COLLECTION_NAME = "bench_face_collection"
+NAMES_PER_TENANT = 100
+
+
+def random_vectors(rng, n: int) -> np.ndarray:
+    vectors = rng.standard_normal((n, VECTOR_SIZE)).astype(np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def build_collection(client: QdrantClient, points_per_tenant: int, tenants: int, indexed: bool, rng):
+    if client.collection_exists(COLLECTION_NAME):
+        client.delete_collection(COLLECTION_NAME)
+    client.create_collection(
+        collection_name=COLLECTION_NAME,
+        vectors_config=models.VectorParams(size=VECTOR_SIZE, distance=models.Distance.COSINE),
+        hnsw_config=tenant_hnsw_config() if indexed else None,
+    )
+    if indexed:
+        for field_name, field_schema in payload_indexes().items():
+            client.create_payload_index(COLLECTION_NAME, field_name, field_schema=field_schema, wait=True)
+
+    batch_size = 1000
+    for tenant in range(tenants):
+        for start in range(0, points_per_tenant, batch_size):
+            n = min(batch_size, points_per_tenant - start)
+            vectors = random_vectors(rng, n)
+            client.upsert(
+                collection_name=COLLECTION_NAME,
+                points=models.Batch(
+                    ids=list(range(tenant * points_per_tenant + start, tenant * points_per_tenant + start + n)),
+                    vectors=vectors.tolist(),
+                    payloads=[
+                        {"user_id": f"tenant-{tenant}", "name": f"person-{(start + i) % NAMES_PER_TENANT}"}
+                        for i in range(n)
+                    ],
+                ),
+                wait=True,
+            )
+
+    # Chờ Qdrant server xây xong index trước khi đo
+    while client.get_collection(COLLECTION_NAME).status != models.CollectionStatus.GREEN:
+        time.sleep(0.5)
+
+
+def measure(client: QdrantClient, query_filter: models.Filter, queries: np.ndarray):
+    latencies = []
+    for query in queries:
+        start = time.perf_counter()
+        client.query_points(COLLECTION_NAME, query=query.tolist(), query_filter=query_filter, limit=5)
+        latencies.append((time.perf_counter() - start) * 1000)
+    return np.percentile(latencies, 50), np.percentile(latencies, 95)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", help="URL của Qdrant server. Bỏ trống để dùng local :memory:.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1_000, 10_000, 100_000], help="Số điểm mỗi tenant.")
+    parser.add_argument("--tenants", type=int, default=3)
+    parser.add_argument("--queries", type=int, default=200)
+    args = parser.parse_args()
+
+    client = QdrantClient(url=args.url) if args.url else QdrantClient(":memory:")
+    rng = np.random.default_rng(0)
+    queries = random_vectors(rng, args.queries)
+
+    tenant_filter = models.Filter(
+        must=[models.FieldCondition(key="user_id", match=models.MatchValue(value="tenant-0"))]
+    )
+    name_filter = models.Filter(
+        must=[
+            models.FieldCondition(key="user_id", match=models.MatchValue(value="tenant-0")),
+            models.FieldCondition(key="name", match=models.MatchValue(value="person-7")),
+        ]
+    )
+
+    print(f"{'points/tenant':>14}{'indexed':>9}{'user_id p50/p95 ms':>22}{'+name p50/p95 ms':>20}")
+    for size in args.sizes:
+        for indexed in (False, True):
+            build_collection(client, size, args.tenants, indexed, rng)
+            tenant_p50, tenant_p95 = measure(client, tenant_filter, queries)
+            name_p50, name_p95 = measure(client, name_filter, queries)
+            print(
+                f"{size:>14}{str(indexed):>9}{tenant_p50:>13.2f} / {tenant_p95:<6.2f}"
+                f"{name_p50:>11.2f} / {name_p95:<6.2f}"
+            )
+    client.delete_collection(COLLECTION_NAME)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+"""
+Đo bộ nhớ và recall@1 của vector lượng tử (float16 / int8) so với float32
+trên engine numpy, với một gallery tổng hợp của một tenant.
+
+recall@1 là tỉ lệ truy vấn có top-1 trùng với tìm kiếm chính xác float32;
+cột "no rescore" là khi chỉ dùng điểm xấp xỉ, không chấm lại bằng float32.
+
+    python -m benchmarks.quantization_benchmark --size 100000
+"""
+import argparse
+import asyncio
+import shutil
+import tempfile
+import time
+import uuid
+
+import numpy as np
+
+from src.qdrant_client import VECTOR_SIZE
+from src.vector_store import QUANTIZATION_TYPES, VectorRecord
+from src.vector_store.numpy_store import NumpyVectorStore
+
+TENANT = "bench-tenant"
+IMAGES_PER_PERSON = 5
+UPSERT_BATCH_SIZE = 5000
+
+
+def normalize(vectors: np.ndarray) -> np.ndarray:
+    return vectors / np.linalg.norm(vectors, axis=-1, keepdims=True)
+
+
+def noisy(rng, centers: np.ndarray, noise: float) -> np.ndarray:
+    samples = centers + noise * rng.standard_normal(centers.shape).astype(np.float32) / np.sqrt(VECTOR_SIZE)
+    return normalize(samples).astype(np.float32)
+
+
+def search_matrix_bytes(partition, rows: int) -> int:
+    """Số byte của ma trận được quét mỗi truy vấn (float32 nếu không lượng tử)."""
+    if partition.codes is None:
+        return rows * partition.vectors.dtype.itemsize * partition.dim
+    scale_bytes = partition.scales.dtype.itemsize if partition.scales is not None else 0
+    return rows * (partition.codes.dtype.itemsize * partition.dim + scale_bytes)
+
+
+async def run(args):
+    rng = np.random.default_rng(0)
+    centers = normalize(rng.standard_normal((args.size // IMAGES_PER_PERSON, VECTOR_SIZE)).astype(np.float32))
+    gallery = noisy(rng, np.repeat(centers, IMAGES_PER_PERSON, axis=0), args.noise)
+    probes = noisy(rng, centers[rng.integers(0, len(centers), args.queries)], args.noise)
+    truth = np.argmax(probes @ gallery.T, axis=1)
+
+    print(f"{'quantization':>13}{'matrix MB':>11}{'saving':>8}{'recall@1':>10}{'no rescore':>12}{'p50 ms':>9}")
+    baseline_bytes = None
+    for quantization in QUANTIZATION_TYPES:
+        path = tempfile.mkdtemp(prefix="quantization_bench_")
+        store = NumpyVectorStore("bench_quantization", VECTOR_SIZE, path, quantization)
+        try:
+            await store.setup()
+            for start in range(0, len(gallery), UPSERT_BATCH_SIZE):
+                await store.upsert([
+                    VectorRecord(id=str(uuid.uuid4()), vector=vector, payload={"user_id": TENANT, "row": i})
+                    for i, vector in enumerate(gallery[start:start + UPSERT_BATCH_SIZE], start)
+                ])
+            partition = next(iter(store.partitions.values()))
+            matrix_bytes = search_matrix_bytes(partition, len(gallery))
+            baseline_bytes = baseline_bytes or matrix_bytes
+
+            latencies, hits, approximate_hits = [], 0, 0
+            rows = np.flatnonzero(partition.alive[: partition.size])
+            for probe, expected in zip(probes, truth):
+                start = time.perf_counter()
+                result = await store.search(probe, payload_filter={"user_id": TENANT}, limit=1)
+                latencies.append((time.perf_counter() - start) * 1000)
+                hits += result[0].payload["row"] == expected
+                if partition.codes is not None:
+                    best = rows[np.argmax(partition.approximate_scores(probe, rows))]
+                    approximate_hits += partition.payloads[best]["row"] == expected
+                else:
+                    approximate_hits += result[0].payload["row"] == expected
+
+            n = len(probes)
+            print(
+                f"{quantization:>13}{matrix_bytes / 2**20:>11.1f}{baseline_bytes / matrix_bytes:>7.1f}x"
+                f"{hits / n:>10.3f}{approximate_hits / n:>12.3f}{np.percentile(latencies, 50):>9.2f}"
+            )
+        finally:
+            await store.close()
+            shutil.rmtree(path, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--size", type=int, default=100_000, help="Số ảnh trong gallery.")
+    parser.add_argument("--queries", type=int, default=300)
+    parser.add_argument("--noise", type=float, default=1.5, help="Độ lệch của mỗi ảnh so với tâm danh tính.")
+    args = parser.parse_args()
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+"""
+So sánh các engine vector store (qdrant / numpy / hnsw) trên một gallery
+tổng hợp có cấu trúc cụm (mỗi người vài ảnh quanh một tâm), nhiều tenant.
+
+Đo recall@k so với tìm kiếm chính xác và độ trễ p50/p95 của truy vấn lọc
+theo tenant. Engine numpy/hnsw ghi dữ liệu vào một thư mục tạm; engine qdrant
+dùng collection riêng `bench_face_collection` (Qdrant local hoặc QDRANT_URL),
+nên server phải dừng nếu dùng local mode.
+
+    python -m benchmarks.vector_store_benchmark --engines numpy hnsw qdrant --sizes 1000 10000 100000
+"""
+import argparse
+import asyncio
+import shutil
+import tempfile
+import time
+import uuid
+
+import numpy as np
+
+from src.qdrant_client import VECTOR_SIZE
+from src.vector_store import VectorRecord, VectorStore
+
+COLLECTION_NAME = "bench_face_collection"
+IMAGES_PER_PERSON = 5
+UPSERT_BATCH_SIZE = 1000
+
+
+def normalize(vectors: np.ndarray) -> np.ndarray:
+    return vectors / np.linalg.norm(vectors, axis=-1, keepdims=True)
+
+
+def clustered_gallery(rng, n: int, noise: float = 0.6) -> np.ndarray:
+    """n embedding, cứ IMAGES_PER_PERSON ảnh liên tiếp là cùng một người."""
+    people = max(1, n // IMAGES_PER_PERSON)
+    centers = normalize(rng.standard_normal((people, VECTOR_SIZE)).astype(np.float32))
+    owners = np.arange(n) % people
+    samples = centers[owners] + noise * rng.standard_normal((n, VECTOR_SIZE)).astype(np.float32) / np.sqrt(VECTOR_SIZE)
+    return normalize(samples).astype(np.float32)
+
+
+def make_store(engine: str, path: str) -> VectorStore:
+    if engine == "qdrant":
+        from src.vector_store.qdrant import QdrantVectorStore
+        return QdrantVectorStore(COLLECTION_NAME, VECTOR_SIZE)
+    if engine == "numpy":
+        from src.vector_store.numpy_store import NumpyVectorStore
+        return NumpyVectorStore(COLLECTION_NAME, VECTOR_SIZE, path)
+    from src.vector_store.hnsw_store import HnswVectorStore
+    return HnswVectorStore(COLLECTION_NAME, VECTOR_SIZE, path)
+
+
+async def fill(store: VectorStore, galleries: dict):
+    for tenant, vectors in galleries.items():
+        for start in range(0, len(vectors), UPSERT_BATCH_SIZE):
+            chunk = vectors[start:start + UPSERT_BATCH_SIZE]
+            await store.upsert([
+                VectorRecord(
+                    id=str(uuid.uuid5(uuid.NAMESPACE_URL, f"{tenant}/{start + i}")),
+                    vector=vector,
+                    payload={"user_id": tenant, "name": f"person-{(start + i) // IMAGES_PER_PERSON}", "row": start + i},
+                )
+                for i, vector in enumerate(chunk)
+            ])
+
+
+async def measure(store: VectorStore, gallery: np.ndarray, queries: np.ndarray, k: int):
+    truth = np.argsort(-(queries @ gallery.T), axis=1)[:, :k]
+    latencies, hits = [], 0
+    for query, expected in zip(queries, truth):
+        start = time.perf_counter()
+        results = await store.search(query, payload_filter={"user_id": "tenant-0"}, limit=k)
+        latencies.append((time.perf_counter() - start) * 1000)
+        hits += len(set(expected.tolist()) & {r.payload["row"] for r in results})
+    recall = hits / (len(queries) * k)
+    return recall, np.percentile(latencies, 50), np.percentile(latencies, 95)
+
+
+async def run(args):
+    rng = np.random.default_rng(0)
+    print(f"{'engine':>8}{'points/tenant':>15}{'build s':>9}{f'recall@{args.k}':>11}{'p50 ms':>9}{'p95 ms':>9}")
+    for size in args.sizes:
+        galleries = {f"tenant-{t}": clustered_gallery(rng, size) for t in range(args.tenants)}
+        gallery = galleries["tenant-0"]
+        # Truy vấn là ảnh mới của những người đã có trong gallery
+        picks = rng.integers(0, size, args.queries)
+        queries = normalize(gallery[picks] + 0.3 * rng.standard_normal((args.queries, VECTOR_SIZE)).astype(np.float32) / np.sqrt(VECTOR_SIZE))
+
+        for engine in args.engines:
+            path = tempfile.mkdtemp(prefix="vector_store_bench_")
+            store = make_store(engine, path)
+            try:
+                await store.setup()
+                await store.delete(payload_filter={"user_id": list(galleries)})
+                started = time.perf_counter()
+                await fill(store, galleries)
+                build_seconds = time.perf_counter() - started
+                recall, p50, p95 = await measure(store, gallery, queries, args.k)
+                print(f"{engine:>8}{size:>15}{build_seconds:>9.1f}{recall:>11.3f}{p50:>9.2f}{p95:>9.2f}")
+                await store.delete(payload_filter={"user_id": list(galleries)})
+            finally:
+                await store.close()
+                shutil.rmtree(path, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--engines", nargs="+", default=["numpy", "hnsw"], choices=["qdrant", "numpy", "hnsw"])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1_000, 10_000, 100_000], help="Số điểm mỗi tenant.")
+    parser.add_argument("--tenants", type=int, default=3)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("-k", type=int, default=5)
+    args = parser.parse_args()
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,10 @@
+# Cấu hình gunicorn, được nạp tự động khi chạy từ thư mục backend (xem scripts/serve.sh)
+import os
+
+
+def child_exit(server, worker):
+    # Gauge "livesum" của worker đã thoát không còn được cộng vào /metrics (src/metrics.py)
+    if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        from prometheus_client import multiprocess
+
+        multiprocess.mark_process_dead(worker.pid)
@@ -4,7 +4,6 @@
 
 import cv2
 import numpy as np
-from skimage.transform import SimilarityTransform
 from typing import Tuple
 
 
@@ -54,6 +53,9 @@ def estimate_norm(landmark: np.ndarray, image_size: int = 112) -> Tuple[np.ndarr
     alignment = reference_alignment * ratio
     alignment[:, 0] += diff_x
 
+    # skimage pulls in scipy; import it on first use to keep module import cheap
+    from skimage.transform import SimilarityTransform
+
     # Compute the transformation matrix
     transform = SimilarityTransform()
     transform.estimate(landmark, alignment)
@@ -122,6 +124,8 @@ def bbox_center_alignment(image, center, output_size, scale, rotation):
         M (np.ndarray): 2x3 affine transform matrix used.
     """
 
+    from skimage.transform import SimilarityTransform
+
     # Convert rotation from degrees to radians
     rot = float(rotation) * np.pi / 180.0
 
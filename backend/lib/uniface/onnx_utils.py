@@ -6,6 +6,7 @@
 Utilities for ONNX Runtime configuration and provider selection.
 """
 
+import os
 from typing import List
 
 import onnxruntime as ort
@@ -76,8 +77,14 @@ def create_onnx_session(model_path: str, providers: List[str] = None) -> ort.Inf
     if providers is None:
         providers = get_available_providers()
 
+    # Optionally cap intra-op threads (e.g. when several processes share the CPU)
+    session_options = ort.SessionOptions()
+    intra_op_threads = os.getenv("ORT_INTRA_OP_THREADS")
+    if intra_op_threads:
+        session_options.intra_op_num_threads = int(intra_op_threads)
+
     try:
-        session = ort.InferenceSession(model_path, providers=providers)
+        session = ort.InferenceSession(model_path, sess_options=session_options, providers=providers)
         active_provider = session.get_providers()[0]
         print(f"Session created with provider: {active_provider}")
         return session
@@ -147,3 +147,42 @@ class BaseRecognizer(ABC):
         embedding = self.get_embedding(image, landmarks, use_landmarks)
         norm = np.linalg.norm(embedding)
         return embedding / norm if norm > 0 else embedding
+
+    def get_normalized_embeddings(self, image: np.ndarray, landmarks_list: List[np.ndarray]) -> np.ndarray:
+        """
+        Extracts L2-normalized embeddings for several faces of the same image in one inference call.
+
+        Args:
+            image: Input image (BGR format).
+            landmarks_list: 5-point landmarks of each face, used for alignment.
+
+        Returns:
+            Array of shape (num_faces, embedding_dim), in the order of `landmarks_list`.
+        """
+        return self.get_normalized_embeddings_aligned(
+            [face_alignment(image, np.asarray(landmarks))[0] for landmarks in landmarks_list]
+        )
+
+    def get_normalized_embeddings_aligned(self, aligned_faces: List[np.ndarray]) -> np.ndarray:
+        """
+        Extracts L2-normalized embeddings for faces that were already aligned, in one inference call.
+
+        Args:
+            aligned_faces: Aligned face crops (BGR format), e.g. from `face_alignment`.
+
+        Returns:
+            Array of shape (num_faces, embedding_dim), in the order of `aligned_faces`.
+        """
+        if len(aligned_faces) == 0:
+            return np.zeros((0, self.output_shape[-1]), dtype=np.float32)
+        blobs = np.concatenate([self.preprocess(face) for face in aligned_faces])
+        batch_dim = self.session.get_inputs()[0].shape[0]
+        if isinstance(batch_dim, int):
+            # Model exported with a fixed batch size: run one face at a time
+            embeddings = np.concatenate(
+                [self.session.run(self.output_names, {self.input_name: blob[None]})[0] for blob in blobs]
+            )
+        else:
+            embeddings = self.session.run(self.output_names, {self.input_name: blobs})[0]
+        norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+        return embeddings / np.where(norms > 0, norms, 1.0)
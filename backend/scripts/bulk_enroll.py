@@ -0,0 +1,263 @@
+"""
+Đăng ký khuôn mặt hàng loạt từ một thư mục cục bộ (mỗi người một thư mục con).
+
+    roster/
+        Nguyen Van A/  1.jpg 2.jpg ...
+        Tran Thi B/    1.jpg ...
+
+Detection và embedding chạy trên một process pool, mỗi process giữ một
+ONNX session riêng. Embedding được ghi vào vector store theo lô lớn, sau đó
+số ảnh của các FaceGroup được đối soát lại với vector store.
+
+Chạy từ thư mục backend (server phải dừng nếu dùng Qdrant local mode hoặc
+engine numpy/hnsw, vì thư mục dữ liệu cục bộ chỉ được mở bởi một process):
+    python -m scripts.bulk_enroll --user admin /data/roster
+"""
+import argparse
+import asyncio
+import itertools
+import mimetypes
+import os
+import time
+import uuid
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from typing import Iterator, List, Optional, Set
+
+import numpy as np
+
+from src import models
+from src.database import SessionLocal, engine
+from src.embeddings import get_image_store, load_active_version, model_path_for_version
+from src.gallery import reconcile_face_groups
+from src.imaging import ImageDecodeError, decode_image, to_bgr_array
+from src.model_registry import DETECTOR_MODEL, model_path
+from src.models import User
+from src.prototypes import get_prototype_index
+from src.quality import FaceQualityError
+from src.vector_store import VectorRecord
+from src.utils import encode_face_images, generate_embedding_for_largest_face, upload_encoded_face_images
+
+IMAGE_EXTENSIONS = {".jpg", ".jpeg", ".png", ".webp", ".bmp"}
+# Số ảnh được tải lên R2 đồng thời khi ghi một lô
+UPLOAD_CONCURRENCY = 16
+
+# Model của từng process con, được nạp một lần trong _init_worker
+_detector = None
+_recognizer = None
+
+
+def _init_worker(detector_path: str, recognizer_path: str, threads: int):
+    global _detector, _recognizer
+    if threads:
+        os.environ["ORT_INTRA_OP_THREADS"] = str(threads)
+
+    from lib.uniface.detection.srcfd import SCRFD
+    from lib.uniface.recogition.models import ArcFace
+
+    _detector = SCRFD(model_path=detector_path)
+    _recognizer = ArcFace(model_path=recognizer_path)
+
+
+def _process_image(task):
+    """Chạy trong process con: decode, detect, embed và encode ảnh lưu trữ."""
+    path, relpath, label = task
+    try:
+        with open(path, "rb") as f:
+            image_bytes = f.read()
+        image_pil = decode_image(image_bytes)
+        embedding, face = generate_embedding_for_largest_face(
+            to_bgr_array(image_pil), _detector, _recognizer, check_quality=True
+        )
+        if embedding is None:
+            return relpath, label, None, None, "No face detected."
+        return relpath, label, embedding.tolist(), encode_face_images(image_pil, face["bbox"], image_bytes), None
+    except (ImageDecodeError, FaceQualityError, OSError) as e:
+        return relpath, label, None, None, str(e)
+    except Exception as e:
+        # Lỗi của OpenCV / onnxruntime với một ảnh không được làm dừng cả lần chạy
+        return relpath, label, None, None, f"{type(e).__name__}: {e}"
+
+
+def person_dirs(root: str) -> List[str]:
+    """Tên các thư mục con (mỗi thư mục một người) của `root`."""
+    return [
+        person
+        for person in sorted(os.listdir(root))
+        if os.path.isdir(os.path.join(root, person)) and not person.startswith(".")
+    ]
+
+
+def collect_tasks(root: str, done: Set[str]) -> List[tuple]:
+    tasks = []
+    for person in person_dirs(root):
+        person_dir = os.path.join(root, person)
+        for dirpath, _, filenames in os.walk(person_dir):
+            for filename in sorted(filenames):
+                if os.path.splitext(filename)[1].lower() not in IMAGE_EXTENSIONS:
+                    continue
+                path = os.path.join(dirpath, filename)
+                relpath = os.path.relpath(path, root).replace(os.sep, "/")
+                if relpath not in done:
+                    tasks.append((path, relpath, person.strip()))
+    return tasks
+
+
+def load_checkpoint(path: str) -> Set[str]:
+    if not os.path.exists(path):
+        return set()
+    with open(path, encoding="utf-8") as f:
+        return {line.rstrip("\n") for line in f if line.strip()}
+
+
+def append_checkpoint(path: str, relpaths: List[str]):
+    with open(path, "a", encoding="utf-8") as f:
+        f.writelines(f"{relpath}\n" for relpath in relpaths)
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def _bounded_map(pool: ProcessPoolExecutor, tasks: List[tuple], window: int) -> Iterator[tuple]:
+    """
+    Như `pool.map(_process_image, tasks)` nhưng chỉ giữ tối đa `window` ảnh đang xử lý
+    hoặc chờ lấy kết quả, nên ảnh đã encode không dồn lại trong bộ nhớ khi vòng lặp
+    chính đang chờ tải lên R2. Kết quả trả về theo thứ tự hoàn thành.
+    """
+    pending = iter(tasks)
+    running = set()
+    while True:
+        for task in itertools.islice(pending, window - len(running)):
+            running.add(pool.submit(_process_image, task))
+        if not running:
+            return
+        done, running = wait(running, return_when=FIRST_COMPLETED)
+        for future in done:
+            yield future.result()
+
+
+async def delete_tenant_gallery(user: User):
+    await get_image_store().delete(payload_filter={"user_id": user.username})
+    await get_prototype_index().rebuild(user.username)
+
+
+async def flush_batch(user: User, results: List[tuple]) -> List[str]:
+    """Tải ảnh lên R2 và upsert một lô embedding. Trả về các relpath đã ghi."""
+    semaphore = asyncio.Semaphore(UPLOAD_CONCURRENCY)
+    point_ids = [str(uuid.uuid5(uuid.NAMESPACE_URL, f"{user.username}/{relpath}")) for relpath, *_ in results]
+
+    async def upload(encoded, point_id: str):
+        async with semaphore:
+            # Key theo point id: chạy lại sau khi bị ngắt ghi đè đúng các ảnh đã tải
+            return await upload_encoded_face_images(encoded, point_id)
+
+    url_lists = await asyncio.gather(
+        *(upload(encoded, point_id) for (_, _, _, encoded, _), point_id in zip(results, point_ids))
+    )
+    points = [
+        VectorRecord(
+            id=point_id,
+            vector=np.asarray(vector, dtype=np.float32),
+            payload={
+                **image_urls,
+                "user_id": user.username,
+                "content_type": mimetypes.guess_type(relpath)[0] or "image/jpeg",
+                "name": label,
+            },
+        )
+        for (relpath, label, vector, _, _), point_id, image_urls in zip(results, point_ids, url_lists)
+    ]
+    await get_image_store().upsert(points)
+    return [relpath for relpath, *_ in results]
+
+
+async def run(args):
+    models.Base.metadata.create_all(bind=engine)
+    # Ghi vào collection của phiên bản embedding đang hoạt động, bằng đúng model của phiên bản đó
+    version = load_active_version()
+    args.recognizer_model = args.recognizer_model or model_path_for_version(version)
+    print(f"Phiên bản embedding: {version} ({args.recognizer_model}).")
+    store = get_image_store()
+    prototypes = get_prototype_index()
+    await store.setup()
+    await prototypes.setup()
+    try:
+        await enroll(args)
+    finally:
+        await prototypes.close()
+        await store.close()
+
+
+async def enroll(args):
+    db = SessionLocal()
+    try:
+        user: Optional[User] = db.query(User).filter(User.username == args.user).first()
+    finally:
+        db.close()
+    if user is None:
+        raise SystemExit(f"User '{args.user}' not found.")
+
+    checkpoint = args.checkpoint or f"bulk_enroll_{args.user}.checkpoint"
+    if args.rebuild:
+        print(f"Rebuild: xóa toàn bộ gallery của '{args.user}' trong vector store.")
+        await delete_tenant_gallery(user)
+        if os.path.exists(checkpoint):
+            os.remove(checkpoint)
+
+    done = load_checkpoint(checkpoint)
+    tasks = collect_tasks(args.directory, done)
+    # Mọi người trong thư mục, kể cả người đã xong hết theo checkpoint: lần chạy bị ngắt
+    # có thể đã ghi ảnh của họ mà chưa kịp đối soát FaceGroup / prototype
+    labels = {person.strip() for person in person_dirs(args.directory)}
+    print(f"{len(tasks)} ảnh cần xử lý ({len(done)} đã xong theo checkpoint), {args.workers} process.")
+
+    processed = failed = 0
+    started = time.perf_counter()
+    batch: List[tuple] = []
+
+    with ProcessPoolExecutor(
+        max_workers=args.workers,
+        initializer=_init_worker,
+        initargs=(args.detector_model, args.recognizer_model, args.threads_per_worker),
+    ) as pool:
+        for result in _bounded_map(pool, tasks, window=args.workers * 4):
+            relpath, _, vector, _, reason = result
+            processed += 1
+            if vector is None:
+                failed += 1
+                print(f"  bỏ qua {relpath}: {reason}")
+                append_checkpoint(checkpoint, [relpath])
+            else:
+                batch.append(result)
+
+            if len(batch) >= args.batch_size:
+                append_checkpoint(checkpoint, await flush_batch(user, batch))
+                batch = []
+                elapsed = time.perf_counter() - started
+                print(f"  {processed}/{len(tasks)} ảnh, {failed} lỗi, {processed / elapsed:.1f} ảnh/giây")
+
+        if batch:
+            append_checkpoint(checkpoint, await flush_batch(user, batch))
+
+    elapsed = time.perf_counter() - started
+    print(f"Hoàn tất {processed} ảnh ({failed} lỗi) trong {elapsed:.1f}s: {processed / max(elapsed, 1e-9):.1f} ảnh/giây.")
+
+    await reconcile_face_groups(user, labels)
+    await get_prototype_index().rebuild(user.username, names=labels)
+    print("Đã đối soát số ảnh và prototype của các FaceGroup.")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("directory", help="Thư mục gốc, mỗi thư mục con là một người.")
+    parser.add_argument("--user", required=True, help="Username của tenant sở hữu gallery.")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--threads-per-worker", type=int, default=1, help="Số luồng ONNX Runtime mỗi process.")
+    parser.add_argument("--batch-size", type=int, default=256, help="Số điểm mỗi lần upsert.")
+    parser.add_argument("--checkpoint", help="File checkpoint (mặc định bulk_enroll_<user>.checkpoint).")
+    parser.add_argument("--rebuild", action="store_true", help="Xóa gallery hiện có của tenant trước khi đăng ký lại.")
+    parser.add_argument("--detector-model", default=model_path(DETECTOR_MODEL))
+    parser.add_argument("--recognizer-model", help="Mặc định là model của phiên bản embedding đang hoạt động.")
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+"""
+Xuất / nhập gallery của một tenant ra snapshot .npz (xem src/gallery.py).
+
+Chạy từ thư mục backend (server phải dừng nếu dùng Qdrant local mode hoặc
+engine numpy/hnsw, vì thư mục dữ liệu cục bộ chỉ được mở bởi một process):
+    python -m scripts.gallery_snapshot export --user admin admin-gallery.npz
+    python -m scripts.gallery_snapshot import --user admin admin-gallery.npz [--replace]
+"""
+import argparse
+import asyncio
+import time
+from typing import Optional
+
+from src import models
+from src.database import SessionLocal, engine
+from src.embeddings import get_image_store, load_active_version
+from src.gallery import SnapshotError, export_gallery, import_gallery
+from src.models import User
+from src.prototypes import get_prototype_index
+from src.vector_store import close_vector_stores
+
+
+def load_user(username: str) -> User:
+    db = SessionLocal()
+    try:
+        user: Optional[User] = db.query(User).filter(User.username == username).first()
+    finally:
+        db.close()
+    if user is None:
+        raise SystemExit(f"User '{username}' not found.")
+    return user
+
+
+async def run(args):
+    models.Base.metadata.create_all(bind=engine)
+    version = load_active_version()
+    await get_image_store().setup()
+    await get_prototype_index().setup()
+    try:
+        user = load_user(args.user)
+        started = time.perf_counter()
+        if args.command == "export":
+            count = await export_gallery(user, args.path)
+            print(f"Đã xuất {count} bản ghi ({version}) ra {args.path} trong {time.perf_counter() - started:.1f}s.")
+        else:
+            try:
+                result = await import_gallery(user, args.path, replace=args.replace)
+            except SnapshotError as e:
+                raise SystemExit(str(e))
+            print(
+                f"Đã nhập {result.imported} bản ghi, {result.groups} nhóm ({result.embedding_version}) "
+                f"trong {time.perf_counter() - started:.1f}s."
+            )
+    finally:
+        await close_vector_stores()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("command", choices=["export", "import"])
+    parser.add_argument("path", help="File snapshot .npz.")
+    parser.add_argument("--user", required=True, help="Username của tenant.")
+    parser.add_argument("--replace", action="store_true", help="Khi nhập: xóa gallery hiện có của tenant trước.")
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
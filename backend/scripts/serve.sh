@@ -0,0 +1,57 @@
+#!/bin/sh
+# Khởi động server.
+#   WEB_CONCURRENCY=1 (mặc định): một tiến trình như trước.
+#   WEB_CONCURRENCY=N>1: một tiến trình inference (model + vector store + worker nền,
+#   xem src/inference_service.py) và N worker gunicorn nói chuyện với nó qua Unix socket.
+#   INFERENCE_MODEL_PROCESSES=M>1: thêm M-1 tiến trình chỉ chạy model để chia tải.
+set -e
+
+PORT="${PORT:-8000}"
+WORKERS="${WEB_CONCURRENCY:-1}"
+MODEL_PROCESSES="${INFERENCE_MODEL_PROCESSES:-1}"
+SOCKET_DIR="${INFERENCE_SOCKET_DIR:-/tmp}"
+
+if [ "$WORKERS" -le 1 ]; then
+    exec gunicorn -w 1 -k uvicorn.workers.UvicornWorker src.server:app --bind "0.0.0.0:$PORT"
+fi
+
+# Số liệu của mọi tiến trình được gộp qua thư mục này (src/metrics.py); xóa số liệu của lần chạy trước
+PROMETHEUS_MULTIPROC_DIR="${PROMETHEUS_MULTIPROC_DIR:-$SOCKET_DIR/face-metrics}"
+mkdir -p "$PROMETHEUS_MULTIPROC_DIR"
+rm -f "$PROMETHEUS_MULTIPROC_DIR"/*.db
+export PROMETHEUS_MULTIPROC_DIR
+
+SOCKETS="$SOCKET_DIR/face-inference.sock"
+python -m src.inference_service --socket "$SOCKETS" &
+PIDS=$!
+i=2
+while [ "$i" -le "$MODEL_PROCESSES" ]; do
+    socket="$SOCKET_DIR/face-inference-$i.sock"
+    python -m src.inference_service --socket "$socket" --models-only &
+    PIDS="$PIDS $!"
+    SOCKETS="$SOCKETS,$socket"
+    i=$((i + 1))
+done
+
+INFERENCE_SOCKETS="$SOCKETS" gunicorn -w "$WORKERS" -k uvicorn.workers.UvicornWorker src.server:app --bind "0.0.0.0:$PORT" &
+ALL_PIDS="$! $PIDS"
+STOPPING=0
+trap 'STOPPING=1; kill -TERM $ALL_PIDS 2>/dev/null || true' TERM INT
+
+# Giám sát mọi tiến trình: khi một tiến trình (gunicorn hoặc inference) chết, dừng các
+# tiến trình còn lại và thoát lỗi để supervisor (Docker, systemd, ...) khởi động lại cả nhóm,
+# thay vì để worker API chạy tiếp với socket inference không còn ai phục vụ.
+while [ "$STOPPING" -eq 0 ]; do
+    for pid in $ALL_PIDS; do
+        if ! kill -0 "$pid" 2>/dev/null; then
+            status=0
+            wait "$pid" || status=$?
+            echo "Process $pid exited (status $status), stopping the server." >&2
+            kill -TERM $ALL_PIDS 2>/dev/null || true
+            wait
+            exit 1
+        fi
+    done
+    sleep 1
+done
+wait
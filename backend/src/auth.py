@@ -1,3 +1,5 @@
+import os
+
 from fastapi import Depends, HTTPException, status, Cookie, WebSocket, WebSocketException
 from jose import JWTError, jwt
 from passlib.context import CryptContext
@@ -12,6 +14,8 @@ SECRET_KEY = "your_secret_key"
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 15
 REFRESH_TOKEN_EXPIRE_DAYS = 7
+# Danh sách username (phân tách bởi dấu phẩy) được dùng các endpoint quản trị
+ADMIN_USERNAMES = {name.strip() for name in os.getenv("ADMIN_USERNAMES", "").split(",") if name.strip()}
 
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 
@@ -69,6 +73,11 @@ def get_current_active_user(
         raise HTTPException(status_code=404, detail="User not found")
     return user
 
+def get_current_admin_user(current_user: User = Depends(get_current_active_user)) -> User:
+    if current_user.username not in ADMIN_USERNAMES:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Admin privileges required")
+    return current_user
+
 async def get_current_user_ws(
     websocket: WebSocket,
     db: Session = Depends(get_db)
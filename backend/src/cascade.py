@@ -0,0 +1,225 @@
+"""
+Cascade hai model cho nhận dạng trong stream.
+
+Khuôn mặt được embed bằng model nhẹ của phiên bản đang hoạt động. Kết quả có
+điểm từ `threshold + CASCADE_ACCEPT_MARGIN` trở lên được nhận ngay, dưới
+`threshold - CASCADE_REJECT_MARGIN` là Unknown; chỉ vùng mơ hồ ở giữa được
+gửi sang model nặng (CASCADE_VERIFIER_VERSION).
+
+Model nặng có gallery riêng: collection ảnh của phiên bản đó, cùng point id
+với gallery chính. Gallery này được worker re-embedding (src/reembedding.py)
+dựng và cập nhật trong nền khi không có migration: ảnh chưa có vector, hoặc có
+`image_url` đã đổi, được tải từ R2 (thumbnail nếu STORE_ORIGINAL_IMAGES tắt)
+và embed. Vòng xử lý khung hình chỉ đọc gallery đó; khi ảnh ứng viên đứng đầu
+chưa có vector của model nặng, quyết định của model nhẹ được dùng. Xóa / đổi
+tên được ghi vào collection này qua `get_mirror_stores`. Nếu sau này migration
+chuyển sang chính model nặng, các vector đã có được dùng lại.
+"""
+import os
+import threading
+import time
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+from fastapi import APIRouter, Depends
+from pydantic import BaseModel
+from starlette.concurrency import run_in_threadpool
+
+from src.auth import get_current_admin_user
+from src.embeddings import get_image_store, get_recognizer, get_verifier_version
+from src.faces import MATCH_THRESHOLD
+from src.models import User
+from src.prototypes import search_gallery_batch
+from src.vector_store import ScoredRecord
+
+CASCADE_ACCEPT_MARGIN = float(os.getenv("CASCADE_ACCEPT_MARGIN", "0.1"))
+CASCADE_REJECT_MARGIN = float(os.getenv("CASCADE_REJECT_MARGIN", "0.1"))
+# Ngưỡng khớp trên thang điểm của model nặng
+CASCADE_VERIFIER_THRESHOLD = float(os.getenv("CASCADE_VERIFIER_THRESHOLD", "0.4"))
+# Số ảnh ứng viên (theo model nhẹ) được model nặng chấm lại cho mỗi khuôn mặt mơ hồ
+CASCADE_CANDIDATES = int(os.getenv("CASCADE_CANDIDATES", "5"))
+
+router = APIRouter(
+    prefix="/cascade",
+    tags=["cascade"],
+)
+
+
+@dataclass
+class CascadeStats:
+    faces: int = 0
+    accepted_fast: int = 0
+    rejected_fast: int = 0
+    verified: int = 0
+    verified_accepted: int = 0
+    # Khuôn mặt mơ hồ dùng quyết định của model nhẹ vì gallery của model nặng chưa có ảnh
+    fallbacks: int = 0
+    verifier_seconds: float = 0.0
+
+
+_stats = CascadeStats()
+_stats_lock = threading.Lock()
+
+
+def _count(**deltas):
+    with _stats_lock:
+        for key, delta in deltas.items():
+            setattr(_stats, key, getattr(_stats, key) + delta)
+
+
+def get_cascade_stats() -> CascadeStats:
+    with _stats_lock:
+        return CascadeStats(**vars(_stats))
+
+
+async def setup_cascade():
+    """Nạp model nặng và gallery của nó khi khởi động (không làm gì nếu cascade tắt)."""
+    version = get_verifier_version()
+    if version is None:
+        return
+    await run_in_threadpool(get_recognizer, version)
+    await get_image_store(version).setup()
+
+
+async def _verifier_vectors(version: str, candidates: Dict[str, ScoredRecord]) -> Dict[str, np.ndarray]:
+    """Vector của model nặng cho các ảnh ứng viên đã có trong gallery của nó (ảnh đã bị thay thì bỏ qua)."""
+    records = await get_image_store(version).retrieve(list(candidates), with_vectors=True)
+    return {
+        record.id: record.vector
+        for record in records
+        if record.payload.get("image_url") == candidates[record.id].payload.get("image_url")
+    }
+
+
+async def _verify(
+    image: np.ndarray,
+    faces: Sequence[Dict],
+    candidates: Sequence[List[ScoredRecord]],
+    version: str,
+    threshold: float,
+) -> List[Optional[ScoredRecord]]:
+    started = time.perf_counter()
+    gallery = await _verifier_vectors(version, {hit.id: hit for hits in candidates for hit in hits})
+    # Ứng viên đứng đầu chưa được embed bằng model nặng: giữ quyết định của model nhẹ
+    results: List[Optional[ScoredRecord]] = [
+        None if hits[0].id in gallery else (hits[0] if hits[0].score >= threshold else None)
+        for hits in candidates
+    ]
+    verify = [i for i, hits in enumerate(candidates) if hits[0].id in gallery]
+    if verify:
+        recognizer = await run_in_threadpool(get_recognizer, version)
+        probes = await run_in_threadpool(
+            recognizer.get_normalized_embeddings, image, [faces[i]["landmarks"] for i in verify]
+        )
+        for i, probe in zip(verify, probes):
+            best: Optional[ScoredRecord] = None
+            for hit in candidates[i]:
+                if hit.id not in gallery:
+                    continue
+                score = float(np.dot(probe, gallery[hit.id]))
+                if score >= CASCADE_VERIFIER_THRESHOLD and (best is None or score > best.score):
+                    best = ScoredRecord(id=hit.id, score=score, payload=hit.payload)
+            results[i] = best
+    _count(
+        verified=len(verify),
+        verified_accepted=sum(results[i] is not None for i in verify),
+        fallbacks=len(candidates) - len(verify),
+        verifier_seconds=time.perf_counter() - started,
+    )
+    return results
+
+
+async def match_faces(
+    image: np.ndarray,
+    faces: Sequence[Dict],
+    embeddings: Sequence[np.ndarray],
+    username: str,
+    version: str,
+    threshold: float = MATCH_THRESHOLD,
+) -> List[Optional[ScoredRecord]]:
+    """
+    Kết quả khớp tốt nhất (hoặc None) cho từng khuôn mặt của một khung hình.
+    `embeddings` là embedding của model nhẹ phiên bản `version`; `image` (BGR) chỉ
+    được dùng khi có khuôn mặt cần model nặng xác minh. Điểm của kết quả được xác
+    minh là điểm trên thang của model nặng. Không bao giờ embed ảnh gallery.
+    """
+    if len(embeddings) == 0:
+        return []
+    verifier_version = get_verifier_version()
+    if verifier_version is None:
+        searches = await search_gallery_batch(
+            list(embeddings), username, limit=1, score_threshold=threshold, version=version
+        )
+        return [hits[0] if hits else None for hits in searches]
+
+    searches = await search_gallery_batch(
+        list(embeddings),
+        username,
+        limit=CASCADE_CANDIDATES,
+        score_threshold=threshold - CASCADE_REJECT_MARGIN,
+        version=version,
+    )
+    results: List[Optional[ScoredRecord]] = [None] * len(searches)
+    ambiguous = []
+    for i, hits in enumerate(searches):
+        if hits and hits[0].score >= threshold + CASCADE_ACCEPT_MARGIN:
+            results[i] = hits[0]
+        elif hits:
+            ambiguous.append(i)
+    _count(
+        faces=len(searches),
+        accepted_fast=sum(result is not None for result in results),
+        rejected_fast=len(searches) - len(ambiguous) - sum(result is not None for result in results),
+    )
+
+    if ambiguous:
+        verified = await _verify(
+            image, [faces[i] for i in ambiguous], [searches[i] for i in ambiguous], verifier_version, threshold
+        )
+        for i, result in zip(ambiguous, verified):
+            results[i] = result
+    return results
+
+
+# --- API ENDPOINTS ---
+
+class CascadeStatsOut(BaseModel):
+    enabled: bool
+    verifier_version: Optional[str] = None
+    threshold: float
+    accept_margin: float
+    reject_margin: float
+    verifier_threshold: float
+    faces: int
+    accepted_fast: int
+    rejected_fast: int
+    verified: int
+    verified_accepted: int
+    # Tỉ lệ khuôn mặt phải chạy model nặng
+    verified_percent: float
+    fallbacks: int
+    verifier_ms_per_face: float
+
+
+@router.get("/stats", response_model=CascadeStatsOut)
+def get_cascade_stats_endpoint(current_user: User = Depends(get_current_admin_user)):
+    """Cấu hình cascade và số lần mỗi nhánh được dùng kể từ khi server khởi động."""
+    stats = get_cascade_stats()
+    verifier_version = get_verifier_version()
+    return CascadeStatsOut(
+        enabled=verifier_version is not None,
+        verifier_version=verifier_version,
+        threshold=MATCH_THRESHOLD,
+        accept_margin=CASCADE_ACCEPT_MARGIN,
+        reject_margin=CASCADE_REJECT_MARGIN,
+        verifier_threshold=CASCADE_VERIFIER_THRESHOLD,
+        faces=stats.faces,
+        accepted_fast=stats.accepted_fast,
+        rejected_fast=stats.rejected_fast,
+        verified=stats.verified,
+        verified_accepted=stats.verified_accepted,
+        verified_percent=round(100.0 * stats.verified / stats.faces, 2) if stats.faces else 0.0,
+        fallbacks=stats.fallbacks,
+        verifier_ms_per_face=round(1000.0 * stats.verifier_seconds / stats.verified, 2) if stats.verified else 0.0,
+    )
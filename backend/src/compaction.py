@@ -0,0 +1,374 @@
+"""
+Thu gọn gallery: loại bỏ các ảnh gần trùng lặp trong từng FaceGroup.
+
+Với mỗi nhóm, các ảnh được duyệt từ ảnh điển hình nhất (gần tâm nhóm nhất)
+trở đi; một ảnh được giữ nếu độ tương đồng với mọi ảnh đã giữ nhỏ hơn
+`threshold`, ngược lại nó là bản trùng của một ảnh đã giữ. Kết quả là một tập
+đại diện đa dạng, luôn có ít nhất `min_keep` ảnh.
+
+Job chạy trong nền, từng nhóm một. Ở chế độ dry run job chỉ lập báo cáo
+(gallery sẽ nhỏ đi bao nhiêu, ảnh nào bị đánh dấu); ngược lại các ảnh thừa
+bị xóa khỏi vector store và prototype, `image_count` được cập nhật và URL
+ảnh trên R2 được ghi vào bảng PendingImageDeletion trong cùng transaction;
+vòng lặp của worker xóa chúng sau đó, kể cả sau khi khởi động lại.
+"""
+import asyncio
+import json
+import os
+import time
+import uuid
+from contextlib import suppress
+from datetime import datetime, timezone
+from typing import List, Optional
+
+import numpy as np
+from fastapi import APIRouter, Depends, HTTPException, Path, status
+from pydantic import BaseModel, Field
+from sqlalchemy.orm import Session
+
+from src.auth import get_current_active_user
+from src.database import SessionLocal, get_db
+from src.embeddings import get_active_version, get_image_store, get_mirror_stores
+from src.inference_client import RemoteWorker, is_remote
+from src.models import CompactionGroupReport, CompactionJob, FaceGroup, PendingImageDeletion, User
+from src.prototypes import get_prototype_index
+from src.utils import delete_img_from_r2, owned_image_urls
+from src.vector_store import TENANT_FIELD, VectorRecord
+
+# Hai ảnh có cosine similarity từ ngưỡng này trở lên được coi là trùng lặp
+COMPACTION_THRESHOLD = float(os.getenv("COMPACTION_THRESHOLD", "0.92"))
+COMPACTION_POLL_INTERVAL = float(os.getenv("COMPACTION_POLL_INTERVAL", "10"))
+COMPACTION_PAGE_SIZE = 256
+# Số thao tác xóa ảnh R2 chạy đồng thời, và số URL được đọc từ bảng mỗi lượt
+STORAGE_DELETE_CONCURRENCY = 8
+STORAGE_DELETE_BATCH_SIZE = 256
+MAX_REPORTED_IDS = 100
+
+JOB_PENDING = "pending"
+JOB_RUNNING = "running"
+JOB_COMPLETED = "completed"
+JOB_FAILED = "failed"
+
+router = APIRouter(
+    prefix="/compaction",
+    tags=["compaction"],
+    responses={404: {"description": "Not found"}},
+)
+
+
+class CreateCompactionJob(BaseModel):
+    dry_run: bool = Field(True, description="Chỉ lập báo cáo, không xóa ảnh nào.")
+    threshold: float = Field(COMPACTION_THRESHOLD, gt=0.0, le=1.0, description="Ngưỡng cosine similarity của ảnh trùng lặp.")
+    min_keep: int = Field(3, ge=1, description="Số ảnh tối thiểu được giữ lại mỗi nhóm.")
+    group_names: Optional[List[str]] = Field(None, description="Chỉ xử lý các nhóm này (mặc định: mọi nhóm).")
+
+
+class GroupCompaction(BaseModel):
+    name: str
+    before: int
+    after: int
+    removed_ids: List[str]
+
+
+class CompactionJobOut(BaseModel):
+    id: str
+    status: str
+    dry_run: bool
+    threshold: float
+    min_keep: int
+    groups_total: int
+    groups_processed: int
+    images_before: int
+    images_removed: int
+    shrink_percent: float
+    error: Optional[str] = None
+    groups: List[GroupCompaction]
+    created_at: Optional[datetime] = None
+    started_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
+
+
+def _job_out(db: Session, job: CompactionJob) -> CompactionJobOut:
+    before = job.images_before or 0
+    removed = job.images_removed or 0
+    return CompactionJobOut(
+        id=job.id,
+        status=job.status,
+        dry_run=job.dry_run,
+        threshold=job.threshold,
+        min_keep=job.min_keep,
+        groups_total=job.groups_total or 0,
+        groups_processed=job.groups_processed or 0,
+        images_before=before,
+        images_removed=removed,
+        shrink_percent=round(100.0 * removed / before, 2) if before else 0.0,
+        error=job.error,
+        groups=[
+            GroupCompaction(
+                name=row.name,
+                before=row.images_before,
+                after=row.images_after,
+                removed_ids=json.loads(row.removed_ids or "[]"),
+            )
+            for row in db.query(CompactionGroupReport).filter_by(job_id=job.id).order_by(CompactionGroupReport.id)
+        ],
+        created_at=job.created_at,
+        started_at=job.started_at,
+        finished_at=job.finished_at,
+    )
+
+
+def select_representatives(vectors: np.ndarray, threshold: float, min_keep: int = 1) -> np.ndarray:
+    """
+    Chỉ số (tăng dần) của các ảnh được giữ: duyệt theo độ gần tâm nhóm giảm dần,
+    giữ ảnh nếu nó khác mọi ảnh đã giữ (similarity < threshold). Nếu chưa đủ
+    `min_keep` ảnh, bổ sung lần lượt ảnh khác biệt nhất với tập đã giữ.
+    """
+    n = len(vectors)
+    if n <= min_keep:
+        return np.arange(n)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    unit = vectors / np.where(norms > 0, norms, 1.0)
+    order = np.argsort(-(unit @ unit.mean(axis=0)))
+
+    kept: List[int] = []
+    # Similarity lớn nhất của mỗi ảnh với các ảnh đã giữ
+    closest = np.full(n, -np.inf, dtype=np.float32)
+    for i in order:
+        if closest[i] < threshold:
+            kept.append(int(i))
+            closest = np.maximum(closest, unit @ unit[i])
+    while len(kept) < min_keep:
+        candidates = np.setdiff1d(np.arange(n), kept)
+        i = int(candidates[np.argmin(closest[candidates])])
+        kept.append(i)
+        closest = np.maximum(closest, unit @ unit[i])
+    return np.sort(np.array(kept))
+
+
+async def delete_pending_images():
+    """Xóa các ảnh R2 đang chờ trong PendingImageDeletion, từng lô một, cho tới khi bảng trống."""
+    sem = asyncio.Semaphore(STORAGE_DELETE_CONCURRENCY)
+
+    async def limited_delete(url: str):
+        async with sem:
+            await delete_img_from_r2(url)
+
+    while True:
+        db = SessionLocal()
+        try:
+            rows = db.query(PendingImageDeletion).order_by(PendingImageDeletion.id).limit(STORAGE_DELETE_BATCH_SIZE).all()
+            if not rows:
+                return
+            await asyncio.gather(*(limited_delete(row.image_url) for row in rows))
+            db.query(PendingImageDeletion).filter(
+                PendingImageDeletion.id.in_([row.id for row in rows])
+            ).delete(synchronize_session=False)
+            db.commit()
+        finally:
+            db.close()
+
+
+# --- BACKGROUND WORKER ---
+
+class CompactionWorker:
+    """Xử lý lần lượt từng CompactionJob trong nền; tiến độ được commit sau mỗi nhóm."""
+
+    def __init__(self):
+        self._task: Optional[asyncio.Task] = None
+        self._wakeup = asyncio.Event()
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            with suppress(asyncio.CancelledError):
+                await self._task
+            self._task = None
+
+    def notify(self):
+        self._wakeup.set()
+
+    def _next_job_id(self) -> Optional[str]:
+        db = SessionLocal()
+        try:
+            job = (
+                db.query(CompactionJob)
+                .filter(CompactionJob.status.in_([JOB_PENDING, JOB_RUNNING]))
+                .order_by(CompactionJob.created_at)
+                .first()
+            )
+            return job.id if job else None
+        finally:
+            db.close()
+
+    async def _run(self):
+        while True:
+            self._wakeup.clear()
+            try:
+                await delete_pending_images()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"Deleting compacted images failed, will retry: {e}")
+            job_id = self._next_job_id()
+            if job_id is None:
+                with suppress(asyncio.TimeoutError):
+                    await asyncio.wait_for(self._wakeup.wait(), COMPACTION_POLL_INTERVAL)
+                continue
+
+            try:
+                await self._process_job(job_id)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"Compaction job {job_id} failed: {e}")
+                self._mark_failed(job_id, str(e))
+
+    def _mark_failed(self, job_id: str, error: str):
+        db = SessionLocal()
+        try:
+            job = db.get(CompactionJob, job_id)
+            if job:
+                job.status = JOB_FAILED
+                job.error = error
+                job.finished_at = datetime.now(timezone.utc)
+                db.commit()
+        finally:
+            db.close()
+
+    async def _process_job(self, job_id: str):
+        db: Session = SessionLocal()
+        try:
+            job = db.get(CompactionJob, job_id)
+            user = db.get(User, job.user_id)
+            if user is None:
+                raise RuntimeError("Job owner no longer exists.")
+
+            if job.status == JOB_PENDING:
+                if job.group_names is None:
+                    names = sorted(g.name for g in db.query(FaceGroup).filter_by(user_id=user.id).all())
+                    job.group_names = json.dumps(names, ensure_ascii=False)
+                job.groups_total = len(json.loads(job.group_names))
+                job.status = JOB_RUNNING
+                job.started_at = datetime.now(timezone.utc)
+                db.commit()
+
+            names = json.loads(job.group_names)
+            while job.groups_processed < len(names):
+                await self._compact_group(db, job, user, names[job.groups_processed])
+                await delete_pending_images()
+
+            job.status = JOB_COMPLETED
+            job.finished_at = datetime.now(timezone.utc)
+            db.commit()
+            print(f"Compaction job {job_id} completed: {job.images_removed}/{job.images_before} images redundant.")
+        finally:
+            db.close()
+
+    async def _compact_group(self, db: Session, job: CompactionJob, user: User, name: str):
+        started = time.perf_counter()
+        version = get_active_version()
+        store = get_image_store(version)
+        group_filter = {TENANT_FIELD: user.username, "name": name}
+
+        records: List[VectorRecord] = []
+        async for page in store.iter_pages(payload_filter=group_filter, page_size=COMPACTION_PAGE_SIZE, with_vectors=True):
+            records.extend(page)
+        removed: List[VectorRecord] = []
+        if records:
+            keep = select_representatives(np.stack([record.vector for record in records]), job.threshold, job.min_keep)
+            keep_set = set(keep.tolist())
+            removed = [record for i, record in enumerate(records) if i not in keep_set]
+
+        if removed and not job.dry_run:
+            ids = [record.id for record in removed]
+            await store.delete(ids=ids)
+            for mirror_store in get_mirror_stores():
+                await mirror_store.delete(ids=ids)
+            await get_prototype_index(version).remove(user.username, [(name, record.vector) for record in removed])
+            group = db.query(FaceGroup).filter_by(name=name, user_id=user.id).first()
+            if group:
+                group.image_count = max(group.image_count - len(removed), 0)
+            # Ảnh R2 được xóa sau khi commit, bởi vòng lặp của worker
+            db.add_all(
+                PendingImageDeletion(image_url=url)
+                for record in removed
+                for url in owned_image_urls(record.payload)
+            )
+
+        db.add(CompactionGroupReport(
+            job_id=job.id,
+            name=name,
+            images_before=len(records),
+            images_after=len(records) - len(removed),
+            removed_ids=json.dumps([record.id for record in removed[:MAX_REPORTED_IDS]]),
+        ))
+        job.images_before += len(records)
+        job.images_removed += len(removed)
+        job.groups_processed += 1
+        job.processing_seconds += time.perf_counter() - started
+        db.commit()
+
+
+compaction_worker = RemoteWorker("compaction") if is_remote() else CompactionWorker()
+
+
+# --- API ENDPOINTS ---
+
+@router.post("/jobs", response_model=CompactionJobOut, status_code=status.HTTP_202_ACCEPTED)
+def create_compaction_job(
+    request: CreateCompactionJob,
+    current_user: User = Depends(get_current_active_user),
+    db: Session = Depends(get_db),
+):
+    """
+    Tạo job thu gọn gallery. Mặc định là dry run: xem báo cáo trước, rồi chạy lại
+    với `dry_run=false` để xóa các ảnh trùng lặp.
+    """
+    group_names = None
+    if request.group_names is not None:
+        group_names = json.dumps(sorted({name.strip() for name in request.group_names if name.strip()}), ensure_ascii=False)
+    job = CompactionJob(
+        id=str(uuid.uuid4()),
+        user_id=current_user.id,
+        status=JOB_PENDING,
+        dry_run=request.dry_run,
+        threshold=request.threshold,
+        min_keep=request.min_keep,
+        group_names=group_names,
+    )
+    db.add(job)
+    db.commit()
+    db.refresh(job)
+    compaction_worker.notify()
+    return _job_out(db, job)
+
+
+@router.get("/jobs", response_model=List[CompactionJobOut])
+def list_compaction_jobs(
+    current_user: User = Depends(get_current_active_user),
+    db: Session = Depends(get_db),
+):
+    jobs = (
+        db.query(CompactionJob)
+        .filter_by(user_id=current_user.id)
+        .order_by(CompactionJob.created_at.desc())
+        .all()
+    )
+    return [_job_out(db, job) for job in jobs]
+
+
+@router.get("/jobs/{job_id}", response_model=CompactionJobOut)
+def get_compaction_job(
+    job_id: str = Path(..., description="ID của job"),
+    current_user: User = Depends(get_current_active_user),
+    db: Session = Depends(get_db),
+):
+    """Báo cáo của job: số ảnh trước/sau của từng nhóm và các ảnh bị đánh dấu trùng lặp."""
+    job = db.get(CompactionJob, job_id)
+    if job is None or job.user_id != current_user.id:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Job not found")
+    return _job_out(db, job)
@@ -0,0 +1,146 @@
+"""
+Phiên bản embedding đang hoạt động.
+
+Mỗi phiên bản ứng với một model nhận dạng (models/<version>.onnx) và một
+collection riêng trong vector store, nên embedding của các model khác nhau
+không bao giờ bị trộn lẫn. Phiên bản đang hoạt động là đích của migration
+hoàn tất gần nhất (xem src/reembedding.py), hoặc EMBEDDING_VERSION nếu
+chưa có migration nào.
+"""
+import os
+from typing import TYPE_CHECKING, List, Optional, Tuple
+
+from src.database import SessionLocal
+from src.inference_client import SERVICE_TARGET, call_all, is_remote, remote_recognizer
+from src.model_registry import (
+    RECOGNIZER_ROLE_PREFIX,
+    LoadedModel,
+    check_recognizer_compatible,
+    load_recognizer,
+    model_path,
+    registry,
+)
+from src.models import EmbeddingMigration
+from src.qdrant_client import IMAGE_COLLECTION_NAME
+from src.vector_store import VectorStore, get_vector_store
+
+if TYPE_CHECKING:
+    from lib.uniface.recogition.models import ArcFace
+
+# Phiên bản của collection gốc (không có hậu tố), tạo bởi models/w600k_mbf.onnx
+LEGACY_EMBEDDING_VERSION = "w600k_mbf"
+EMBEDDING_VERSION = os.getenv("EMBEDDING_VERSION", LEGACY_EMBEDDING_VERSION)
+
+# Model nặng dùng để xác minh các kết quả khớp mơ hồ trong stream (src/cascade.py), rỗng để tắt
+CASCADE_VERIFIER_VERSION = os.getenv("CASCADE_VERIFIER_VERSION", "")
+
+_active_version = EMBEDDING_VERSION
+# (nguồn, đích) của migration đang chạy, nếu có. Xóa/đổi tên được ghi vào cả hai collection.
+_migration_versions: Optional[Tuple[str, str]] = None
+
+
+def model_path_for_version(version: str) -> str:
+    return model_path(version)
+
+
+def collection_for_version(version: str) -> str:
+    if version == LEGACY_EMBEDDING_VERSION:
+        return IMAGE_COLLECTION_NAME
+    return f"{IMAGE_COLLECTION_NAME}__{version}"
+
+
+def get_active_version() -> str:
+    return _active_version
+
+
+def set_active_version(version: str):
+    """Chuyển mọi truy vấn và ghi mới sang phiên bản `version` (một phép gán, nguyên tử)."""
+    global _active_version
+    _active_version = version
+
+
+def set_migration_versions(versions: Optional[Tuple[str, str]]):
+    global _migration_versions
+    _migration_versions = versions
+
+
+def get_migration_versions() -> Optional[Tuple[str, str]]:
+    return _migration_versions
+
+
+def load_active_version() -> str:
+    """Nạp phiên bản đang hoạt động từ migration hoàn tất gần nhất."""
+    db = SessionLocal()
+    try:
+        migration = (
+            db.query(EmbeddingMigration)
+            .filter_by(status="completed")
+            .order_by(EmbeddingMigration.finished_at.desc())
+            .first()
+        )
+    finally:
+        db.close()
+    set_active_version(migration.target_version if migration else EMBEDDING_VERSION)
+    return _active_version
+
+
+def recognizer_role(version: str) -> str:
+    return f"{RECOGNIZER_ROLE_PREFIX}{version}"
+
+
+def get_recognizer(version: Optional[str] = None) -> "ArcFace":
+    """
+    Recognizer của `version` (mặc định: phiên bản đang hoạt động), nạp và warm-up một lần.
+    Lấy lại ở mỗi request / lô để hot-swap (src/model_registry.py) có hiệu lực ngay.
+    """
+    version = version or _active_version
+    if is_remote():
+        return remote_recognizer(version)
+    return registry.get(recognizer_role(version), version, model_path_for_version(version), load_recognizer)
+
+
+def swap_recognizer(version: str) -> LoadedModel:
+    """Nạp lại models/<version>.onnx và thay recognizer đang dùng nếu embedding tương đương."""
+    path = model_path_for_version(version)
+    if is_remote():
+        return call_all(SERVICE_TARGET, "swap_recognizer", version)[0]
+    return registry.swap(
+        recognizer_role(version),
+        version,
+        path,
+        load_recognizer,
+        check=check_recognizer_compatible,
+    )
+
+
+def get_image_store(version: Optional[str] = None) -> VectorStore:
+    """Collection ảnh của `version` (mặc định: phiên bản đang hoạt động)."""
+    return get_vector_store(collection_for_version(version or _active_version))
+
+
+def get_verifier_version() -> Optional[str]:
+    """Phiên bản của model xác minh trong cascade, hoặc None nếu cascade tắt."""
+    if not CASCADE_VERIFIER_VERSION or CASCADE_VERIFIER_VERSION == _active_version:
+        return None
+    return CASCADE_VERIFIER_VERSION
+
+
+def get_mirror_stores() -> List[VectorStore]:
+    """
+    Các collection giữ bản sao theo id của collection đang hoạt động: collection còn
+    lại của migration đang chạy (đích trước khi chuyển, nguồn sau khi chuyển) và
+    gallery của model xác minh trong cascade.
+
+    Xóa và đổi tên trên collection đang hoạt động cần được áp dụng cả ở đây để
+    lần đối soát của migration không khôi phục lại dữ liệu cũ và embedding của
+    ảnh đã xóa không còn sót lại; ảnh mới hoặc ảnh bị thay thế sẽ được migration
+    (hoặc cascade, khi cần) embed lại.
+    """
+    versions = []
+    if _migration_versions is not None:
+        source, target = _migration_versions
+        versions.append(source if _active_version == target else target)
+    verifier_version = get_verifier_version()
+    if verifier_version is not None and verifier_version not in versions:
+        versions.append(verifier_version)
+    return [get_image_store(version) for version in versions]
@@ -1,11 +1,12 @@
-import io
+import asyncio
+import os
 import uuid
 from fastapi import APIRouter, Depends, File, UploadFile, HTTPException, status, Form, Path, Body, Query
 from pydantic import Field
-from typing import List
+from typing import Dict, List, Optional
 
-import cv2
 import numpy as np
+
 from fastapi import (
     APIRouter,
     Body,
@@ -19,16 +20,19 @@ from fastapi import (
 )
 from PIL import Image
 from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
 
-from lib.uniface.detection.srcfd import SCRFD
-from lib.uniface.recogition.models import ArcFace
-from qdrant_client import models as qdrant_models
 from src.auth import get_current_active_user
+from src.embeddings import get_active_version, get_image_store, get_mirror_stores, get_recognizer
+from src.model_registry import get_detector
 from src.models import FaceGroup, User
-from src.qdrant_client import get_qdrant_client, IMAGE_COLLECTION_NAME
+from src.vector_store import VectorRecord
+from src.prototypes import get_prototype_index, search_gallery, search_gallery_batch
 from src.schemas import BaseModel
-from src.utils import upload_img_to_r2, generate_embedding_for_largest_face, delete_img_from_r2
+from src.utils import upload_face_images, generate_embedding_for_largest_face, generate_embeddings_for_faces, delete_face_images, SHARED_IMAGES_FIELD
 from src.database import get_db
+from src.imaging import ImageDecodeError, ImageTooLargeError, decode_image, to_bgr_array
+from src.quality import FaceQualityError
 from src.schemas import BaseModel
 
 # --- UTILITY FUNCTION (Unchanged) ---
@@ -46,15 +50,22 @@ class UploadResult(BaseModel):
     filename: str
     label: str
 
+class RejectedUpload(BaseModel):
+    filename: str
+    reason: str
+
 class MultiUploadResponse(BaseModel):
     message: str
     successful_uploads: List[UploadResult]
     failed_uploads: List[str]
+    # Lý do thất bại của từng file trong failed_uploads
+    rejected_uploads: List[RejectedUpload] = []
 
 class FaceRecord(BaseModel):
     id: str
     name: str
     image_url: str
+    thumbnail_url: Optional[str] = None
 
 class UpdateFaceName(BaseModel):
     name: str
@@ -63,11 +74,70 @@ class SearchResult(BaseModel):
     id: str
     name: str
     image_url: str
+    thumbnail_url: Optional[str] = None
     score: float
 
-# --- LOAD ML MODELS ---
-detector = SCRFD(model_path="models/scrfd_500m_kps.onnx")
-recognizer = ArcFace(model_path="models/w600k_mbf.onnx")
+class FaceSearchResult(BaseModel):
+    box: List[int]
+    confidence: float
+    matches: List[SearchResult]
+
+class MultiFaceSearchResponse(BaseModel):
+    faces: List[FaceSearchResult]
+
+class VerifyRequest(BaseModel):
+    point_id: str
+    other_point_id: Optional[str] = Field(None, description="So sánh với một bản ghi khác...")
+    group_name: Optional[str] = Field(None, description="...hoặc với ảnh giống nhất của một nhóm.")
+    threshold: Optional[float] = Field(None, ge=-1.0, le=1.0, description="Mặc định là MATCH_THRESHOLD.")
+
+class VerifyResponse(BaseModel):
+    score: float
+    is_match: bool
+    threshold: float
+    matched_point_id: str
+
+# Chỉ lấy các trường payload cần hiển thị khi duyệt vector store
+FACE_RECORD_FIELDS = ["name", "image_url", "thumbnail_url"]
+# Ngưỡng cosine similarity để coi hai khuôn mặt là cùng một người
+MATCH_THRESHOLD = float(os.getenv("MATCH_THRESHOLD", "0.4"))
+
+
+
+async def decode_upload(image_bytes: bytes) -> Image.Image:
+    """Decode ảnh tải lên trong threadpool, chuyển lỗi decode thành HTTP 413/400."""
+    try:
+        return await run_in_threadpool(decode_image, image_bytes)
+    except ImageTooLargeError as e:
+        raise HTTPException(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE, detail=str(e))
+    except ImageDecodeError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+
+async def get_owned_point(vector_store, point_id: str, current_user: User, with_vectors: bool = False):
+    """Lấy một bản ghi của người dùng hiện tại, 404 nếu không có và 403 nếu thuộc người khác."""
+    points = await vector_store.retrieve([point_id], with_vectors=with_vectors)
+    if not points:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Face record not found")
+    if points[0].payload.get("user_id") != current_user.username:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Not authorized to access this record")
+    return points[0]
+
+def cosine_similarity(a: np.ndarray, b: np.ndarray) -> float:
+    norm = float(np.linalg.norm(a) * np.linalg.norm(b))
+    return float(np.dot(a, b) / norm) if norm > 0 else 0.0
+
+def add_to_face_groups(db: Session, user_id: int, label_counts: Dict[str, int]):
+    """Cộng số ảnh mới vào các FaceGroup, tạo nhóm nếu chưa có. Không commit."""
+    for label, count in label_counts.items():
+        # Kiểm tra xem nhóm đã tồn tại cho user này chưa
+        group = db.query(FaceGroup).filter_by(name=label, user_id=user_id).first()
+        if group:
+            # Nếu có, cập nhật số lượng
+            group.image_count += count
+        else:
+            # Nếu chưa, tạo mới
+            new_group = FaceGroup(name=label, user_id=user_id, image_count=count)
+            db.add(new_group)
 
 # --- API ENDPOINTS ---
 
@@ -83,34 +153,40 @@ async def upload_faces(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail=f"Số lượng file ({len(files)}) và số lượng nhãn ({len(labels)}) không khớp."
         )
-    qdrant_client = get_qdrant_client()
+    # Cố định phiên bản cho cả request để embedding và collection luôn khớp nhau
+    version = get_active_version()
+    recognizer = get_recognizer(version)
+    vector_store = get_image_store(version)
     points_to_upsert = []
     successful_results = []
-    failed_filenames = []
+    rejected = []
 
     for file, label in zip(files, labels):
         filename = file.filename or "unknown_file"
         if not file.content_type or not file.content_type.startswith("image/"):
-            failed_filenames.append(filename)
+            rejected.append(RejectedUpload(filename=filename, reason="Invalid file type. Must be an image."))
             continue
         try:
             image_bytes = await file.read()
-            image_pil = Image.open(io.BytesIO(image_bytes)).convert("RGB")
-            image_url = await upload_img_to_r2(image_pil)
-            np_image = np.array(image_pil)
-            np_bgr_img = cv2.cvtColor(np_image, cv2.COLOR_RGB2BGR)
+            image_pil = await run_in_threadpool(decode_image, image_bytes)
+            np_bgr_img = to_bgr_array(image_pil)
 
-            embedding_vector, _ = generate_embedding_for_largest_face(np_bgr_img, detector, recognizer)
+            embedding_vector, face = await run_in_threadpool(
+                generate_embedding_for_largest_face, np_bgr_img, get_detector(), recognizer, check_quality=True
+            )
             if embedding_vector is None:
-                failed_filenames.append(filename)
+                rejected.append(RejectedUpload(filename=filename, reason="No face detected."))
                 continue
 
+            # Chỉ tải ảnh lên R2 sau khi đã tìm thấy khuôn mặt
+            image_urls = await upload_face_images(image_pil, face["bbox"], image_bytes)
+
             point_id = str(uuid.uuid4())
-            point = qdrant_models.PointStruct(
+            point = VectorRecord(
                 id=point_id,
-                vector=embedding_vector.tolist(),
+                vector=embedding_vector,
                 payload={
-                    "image_url": image_url,
+                    **image_urls,
                     "user_id": current_user.username,
                     "content_type": file.content_type,
                     "name": label
@@ -118,32 +194,29 @@ async def upload_faces(
             )
             points_to_upsert.append(point)
             successful_results.append(UploadResult(point_id=point_id, filename=filename, label=label))
+        except (ImageDecodeError, FaceQualityError) as e:
+            rejected.append(RejectedUpload(filename=filename, reason=str(e)))
         except Exception as e:
             print(f"Lỗi khi xử lý file {filename}: {e}")
-            failed_filenames.append(filename)
+            rejected.append(RejectedUpload(filename=filename, reason="Processing error."))
 
     if points_to_upsert:
-        qdrant_client.upsert(collection_name=IMAGE_COLLECTION_NAME, points=points_to_upsert, wait=True)
+        await vector_store.upsert(points_to_upsert)
+        await get_prototype_index(version).add(
+            current_user.username, [(point.payload["name"], point.vector) for point in points_to_upsert]
+        )
         label_counts = {}
         for result in successful_results:
             label_counts[result.label] = label_counts.get(result.label, 0) + 1
 
-        for label, count in label_counts.items():
-            # Kiểm tra xem nhóm đã tồn tại cho user này chưa
-            group = db.query(FaceGroup).filter_by(name=label, user_id=current_user.id).first()
-            if group:
-                # Nếu có, cập nhật số lượng
-                group.image_count += count
-            else:
-                # Nếu chưa, tạo mới
-                new_group = FaceGroup(name=label, user_id=current_user.id, image_count=count)
-                db.add(new_group)
+        add_to_face_groups(db, current_user.id, label_counts)
         db.commit()
 
     return MultiUploadResponse(
-        message=f"Đã xử lý xong. Thành công: {len(successful_results)}, Thất bại: {len(failed_filenames)}.",
+        message=f"Đã xử lý xong. Thành công: {len(successful_results)}, Thất bại: {len(rejected)}.",
         successful_uploads=successful_results,
-        failed_uploads=failed_filenames
+        failed_uploads=[r.filename for r in rejected],
+        rejected_uploads=rejected,
     )
 
 # --- NEW ENDPOINTS FOR MANAGEMENT ---
@@ -160,16 +233,20 @@ class PaginatedGroupResponse(BaseModel):
 
 # API ENDPOINT MỚI
 @router.get("/my-faces/grouped", response_model=PaginatedGroupResponse)
-def get_my_faces_grouped(
+async def get_my_faces_grouped(
     current_user: User = Depends(get_current_active_user),
     db: Session = Depends(get_db),
     page: int = Query(1, ge=1),
-    page_size: int = Query(10, ge=1, le=50)
+    page_size: int = Query(10, ge=1, le=50),
+    thumbnails: bool = Query(True, description="Trả về thumbnail khuôn mặt trong image_url thay vì ảnh gốc."),
+    images_per_group: int = Query(50, ge=1, le=200, description="Số ảnh tối đa trả về cho mỗi nhóm."),
 ):
     """
     Lấy danh sách các nhóm khuôn mặt đã được phân trang hiệu quả.
+    Mặc định `image_url` trỏ tới thumbnail (nếu bản ghi có thumbnail).
+    Mỗi nhóm trả về tối đa `images_per_group` ảnh; `image_count` là tổng số ảnh của nhóm.
     """
-    qdrant_client = get_qdrant_client()
+    vector_store = get_image_store()
     # === BƯỚC 1: TRUY VẤN CHỈ MỤC NHANH ĐỂ LẤY CÁC NHÓM CỦA TRANG HIỆN TẠI ===
     offset = (page - 1) * page_size
 
@@ -184,27 +261,24 @@ def get_my_faces_grouped(
 
     group_names = [g.name for g in groups_for_page]
 
-    # === BƯỚC 2: TRUY VẤN QDRANT ĐỂ LẤY TẤT CẢ ẢNH CỦA CÁC NHÓM ĐÓ ===
-    # Sử dụng bộ lọc "should" (OR) để lấy ảnh của nhiều nhóm cùng lúc
-    records, _ = qdrant_client.scroll(
-        collection_name=IMAGE_COLLECTION_NAME,
-        scroll_filter=qdrant_models.Filter(
-            must=[
-                qdrant_models.FieldCondition(key="user_id", match=qdrant_models.MatchValue(value=current_user.username))
-            ],
-            should=[
-                qdrant_models.FieldCondition(key="name", match=qdrant_models.MatchValue(value=name)) for name in group_names
-            ]
-        ),
-        limit=1000 # Lấy đủ ảnh cho các nhóm
-    )
+    # === BƯỚC 2+3: LẤY ẢNH CỦA TỪNG NHÓM ===
+    # Mỗi nhóm một lần scroll giới hạn `images_per_group` (chạy song song), nên nhóm lớn
+    # không bị duyệt hết; chỉ lấy payload cần thiết. Tổng số ảnh lấy từ FaceGroup.
+    async def group_images(name: str) -> List[FaceRecord]:
+        records, _ = await vector_store.scroll(
+            payload_filter={"user_id": current_user.username, "name": name},
+            limit=images_per_group,
+            payload_fields=FACE_RECORD_FIELDS,
+        )
+        images = []
+        for rec in records:
+            record = FaceRecord(id=rec.id, **rec.payload)
+            if thumbnails and record.thumbnail_url:
+                record.image_url = record.thumbnail_url
+            images.append(record)
+        return images
 
-    # === BƯỚC 3: NHÓM DỮ LIỆU LẠI TRONG PYTHON ===
-    images_by_group = {name: [] for name in group_names}
-    for rec in records:
-        name = rec.payload.get("name")
-        if name in images_by_group:
-            images_by_group[name].append(FaceRecord(id=rec.id, **rec.payload))
+    images_by_group = dict(zip(group_names, await asyncio.gather(*(group_images(name) for name in group_names))))
 
     # Tạo response cuối cùng
     response_items = []
@@ -230,9 +304,10 @@ async def delete_face(
     current_user: User = Depends(get_current_active_user),
     db: Session = Depends(get_db)
 ):
-    qdrant_client = get_qdrant_client()
     """Xóa một bản ghi khuôn mặt. Đảm bảo bản ghi đó thuộc về người dùng."""
-    points = qdrant_client.retrieve(collection_name=IMAGE_COLLECTION_NAME, ids=[point_id])
+    version = get_active_version()
+    vector_store = get_image_store(version)
+    points = await vector_store.retrieve([point_id], with_vectors=True)
     if not points:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Face record not found")
 
@@ -249,18 +324,15 @@ async def delete_face(
                 # Nếu là ảnh cuối cùng, xóa cả nhóm
                 db.delete(group)
             db.commit()
-    # Xóa ảnh khỏi R2
-    old_image_url = point.payload.get("image_url")
-    if old_image_url:
-        await delete_img_from_r2(old_image_url)
+    # Xóa ảnh gốc và thumbnail khỏi R2
+    await delete_face_images(point.payload)
 
     # Xóa ảnh khỏi vector db
-    qdrant_client.delete(
-        collection_name=IMAGE_COLLECTION_NAME,
-        points_selector=qdrant_models.PointIdsList(points=[point_id])
-    )
-
-
+    await vector_store.delete(ids=[point_id])
+    for mirror_store in get_mirror_stores():
+        await mirror_store.delete(ids=[point_id])
+    if label_to_update:
+        await get_prototype_index(version).remove(current_user.username, [(label_to_update, point.vector)])
 
     return
 
@@ -284,11 +356,12 @@ async def rename_face_group(
     Hành động này sẽ cập nhật tất cả các bản ghi ảnh có cùng tên cũ
     và đồng bộ hóa bảng FaceGroup trong SQL.
     """
-    qdrant_client = get_qdrant_client()
+    version = get_active_version()
+    vector_store = get_image_store(version)
     new_name = update_data.name.strip()
 
     # --- BƯỚC 1: Lấy thông tin điểm ban đầu và tên cũ ---
-    initial_points = qdrant_client.retrieve(collection_name=IMAGE_COLLECTION_NAME, ids=[point_id], with_payload=True)
+    initial_points = await vector_store.retrieve([point_id])
     if not initial_points:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Face record not found")
 
@@ -308,20 +381,10 @@ async def rename_face_group(
             image_count=group_info.image_count if group_info else 0
         )
 
-    # --- BƯỚC 2: Tìm tất cả các điểm trong nhóm cũ ---
-    records, _ = qdrant_client.scroll(
-        collection_name=IMAGE_COLLECTION_NAME,
-        scroll_filter=qdrant_models.Filter(
-            must=[
-                qdrant_models.FieldCondition(key="user_id", match=qdrant_models.MatchValue(value=current_user.username)),
-                qdrant_models.FieldCondition(key="name", match=qdrant_models.MatchValue(value=old_name))
-            ]
-        ),
-        limit=10000 # Giới hạn hợp lý để tránh query vô hạn
-    )
-
-    point_ids_to_update = [rec.id for rec in records]
-    if not point_ids_to_update:
+    # --- BƯỚC 2: Đếm các điểm trong nhóm cũ ---
+    old_group_filter = {"user_id": current_user.username, "name": old_name}
+    images_to_update = await vector_store.count(old_group_filter)
+    if not images_to_update:
         # Nếu không có điểm nào trong Qdrant, có thể dữ liệu không nhất quán.
         # Ta vẫn nên thử dọn dẹp SQL
         old_group_sql = db.query(FaceGroup).filter_by(name=old_name, user_id=current_user.id).first()
@@ -331,19 +394,17 @@ async def rename_face_group(
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"No images found for group '{old_name}' to rename.")
 
 
-    # --- BƯỚC 3: Cập nhật tất cả các điểm trong Qdrant ---
-    qdrant_client.set_payload(
-        collection_name=IMAGE_COLLECTION_NAME,
-        payload={"name": new_name},
-        points=point_ids_to_update,
-        wait=True
-    )
+    # --- BƯỚC 3: Cập nhật tất cả các điểm theo bộ lọc, không cần lấy danh sách id ---
+    await vector_store.set_payload({"name": new_name}, payload_filter=old_group_filter)
+    for mirror_store in get_mirror_stores():
+        await mirror_store.set_payload({"name": new_name}, payload_filter=old_group_filter)
+    await get_prototype_index(version).rename(current_user.username, old_name, new_name)
 
     # --- BƯỚC 4: Xử lý logic cập nhật trong SQL ---
     old_group_sql = db.query(FaceGroup).filter_by(name=old_name, user_id=current_user.id).first()
     if not old_group_sql:
         # Dữ liệu không nhất quán, tạo lại bản ghi group mới
-        new_group_sql = FaceGroup(name=new_name, user_id=current_user.id, image_count=len(point_ids_to_update))
+        new_group_sql = FaceGroup(name=new_name, user_id=current_user.id, image_count=images_to_update)
         db.add(new_group_sql)
         db.commit()
         db.refresh(new_group_sql)
@@ -387,10 +448,12 @@ async def replace_face_image(
     - Cập nhật bản ghi trong Qdrant.
     - Xóa ảnh cũ khỏi R2.
     """
-    qdrant_client = get_qdrant_client()
+    version = get_active_version()
+    recognizer = get_recognizer(version)
+    vector_store = get_image_store(version)
 
     # 1. Truy xuất và xác thực bản ghi hiện có
-    points = qdrant_client.retrieve(collection_name=IMAGE_COLLECTION_NAME, ids=[point_id], with_payload=True)
+    points = await vector_store.retrieve([point_id], with_vectors=True)
     if not points:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Face record not found")
 
@@ -398,51 +461,57 @@ async def replace_face_image(
     if point.payload.get("user_id") != current_user.username:
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Not authorized to modify this record")
 
-    # Lưu lại URL ảnh cũ để xóa sau
-    old_image_url = point.payload.get("image_url")
+    # Lưu lại payload cũ để xóa ảnh cũ sau
+    old_payload = point.payload
 
     # 2. Xử lý file ảnh mới
     if not file.content_type or not file.content_type.startswith("image/"):
         raise HTTPException(status_code=400, detail="Invalid file type. Must be an image.")
 
+    image_bytes = await file.read()
+    image_pil = await decode_upload(image_bytes)
+
     try:
-        image_bytes = await file.read()
-        image_pil = Image.open(io.BytesIO(image_bytes)).convert("RGB")
-        np_image = np.array(image_pil)
-        np_bgr_img = cv2.cvtColor(np_image, cv2.COLOR_RGB2BGR)
+        np_bgr_img = to_bgr_array(image_pil)
 
         # Tạo embedding mới từ khuôn mặt lớn nhất trong ảnh
-        new_embedding, _ = generate_embedding_for_largest_face(np_bgr_img, detector, recognizer)
+        new_embedding, face = await run_in_threadpool(
+            generate_embedding_for_largest_face, np_bgr_img, get_detector(), recognizer, check_quality=True
+        )
         if new_embedding is None:
             raise HTTPException(status_code=400, detail="No face could be detected in the new image.")
 
-        # 3. Tải ảnh mới lên R2
-        new_image_url = await upload_img_to_r2(image_pil)
+        # 3. Tải ảnh mới (và thumbnail) lên R2
+        new_image_urls = await upload_face_images(image_pil, face["bbox"], image_bytes)
 
         # 4. Cập nhật (Upsert) bản ghi trong Qdrant
         # Upsert sẽ ghi đè lên điểm đã có nếu `id` trùng khớp.
         updated_payload = point.payload.copy()
-        updated_payload["image_url"] = new_image_url
-
-        qdrant_client.upsert(
-            collection_name=IMAGE_COLLECTION_NAME,
-            points=[
-                qdrant_models.PointStruct(
-                    id=point.id,
-                    vector=new_embedding.tolist(),
-                    payload=updated_payload
-                )
-            ],
-            wait=True
+        updated_payload.update(new_image_urls)
+        # Ảnh mới thuộc riêng bản ghi này kể cả khi ảnh cũ là ảnh dùng chung
+        updated_payload.pop(SHARED_IMAGES_FIELD, None)
+
+        await vector_store.upsert(
+            [VectorRecord(id=point.id, vector=new_embedding, payload=updated_payload)]
         )
+        # Embedding cũ ở collection còn lại không còn đúng; migration sẽ re-embed ảnh mới
+        for mirror_store in get_mirror_stores():
+            await mirror_store.delete(ids=[point.id])
+        if updated_payload.get("name"):
+            prototypes = get_prototype_index(version)
+            await prototypes.remove(current_user.username, [(updated_payload["name"], point.vector)])
+            await prototypes.add(current_user.username, [(updated_payload["name"], new_embedding)])
 
         # 5. Xóa ảnh cũ khỏi R2
-        if old_image_url:
-            await delete_img_from_r2(old_image_url)
+        await delete_face_images(old_payload)
 
         # 6. Trả về bản ghi đã được cập nhật
         return FaceRecord(id=point.id, **updated_payload)
 
+    except HTTPException:
+        raise
+    except FaceQualityError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
     except Exception as e:
         # Ghi lại lỗi chi tiết hơn ở server
         print(f"An error occurred during image replacement: {e}")
@@ -458,38 +527,124 @@ async def search_faces(
     if not file.content_type or not file.content_type.startswith("image/"):
         raise HTTPException(status_code=400, detail="Invalid file type")
 
-    try:
-
-        image_bytes = await file.read()
-        image = Image.open(io.BytesIO(image_bytes)).convert("RGB")
-        np_image = np.array(image)
+    image_bytes = await file.read()
+    image_pil = await decode_upload(image_bytes)
 
-        np_bgr_img = cv2.cvtColor(np_image, cv2.COLOR_RGB2BGR)
+    try:
+        np_bgr_img = to_bgr_array(image_pil)
+        version = get_active_version()
 
-        embedding_vector, _ = generate_embedding_for_largest_face(np_bgr_img, detector, recognizer)
+        embedding_vector, _ = await run_in_threadpool(
+            generate_embedding_for_largest_face, np_bgr_img, get_detector(), get_recognizer(version)
+        )
 
         if embedding_vector is None:
             raise HTTPException(status_code=400, detail="No face detected in the uploaded image.")
-        qdrant_client = get_qdrant_client()
-        user_filter = qdrant_models.Filter(
-            must=[
-                qdrant_models.FieldCondition(
-                    key="user_id",
-                    match=qdrant_models.MatchValue(value=current_user.username)
-                )
-            ]
-        )
-
-        hits = qdrant_client.query_points(
-            collection_name=IMAGE_COLLECTION_NAME,
-            query=embedding_vector.tolist(),
-            query_filter=user_filter,
-            limit=5
-        )
-        hits = hits.points
+        hits = await search_gallery(embedding_vector, current_user.username, limit=5, version=version)
         return [
             SearchResult(id=hit.id, score=hit.score, **hit.payload) for hit in hits
         ]
 
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"An error occurred during search: {e}")
+
+@router.post("/search-faces", response_model=MultiFaceSearchResponse)
+async def search_all_faces(
+    file: UploadFile = File(...),
+    limit: int = Query(5, ge=1, le=50, description="Số kết quả cho mỗi khuôn mặt."),
+    min_face_size: int = Query(20, ge=0, description="Bỏ qua khuôn mặt có cạnh nhỏ hơn (pixel)."),
+    max_faces: int = Query(20, ge=1, le=100, description="Số khuôn mặt lớn nhất được tìm kiếm."),
+    score_threshold: Optional[float] = Query(None, ge=-1.0, le=1.0),
+    current_user: User = Depends(get_current_active_user)
+):
+    """
+    Tìm kiếm mọi khuôn mặt trong ảnh (ảnh nhóm): detect một lần, embed các khuôn mặt
+    trong một lần gọi model và tìm kiếm tất cả bằng một truy vấn gộp.
+    Khuôn mặt được trả về theo diện tích giảm dần.
+    """
+    if not file.content_type or not file.content_type.startswith("image/"):
+        raise HTTPException(status_code=400, detail="Invalid file type")
+
+    image_bytes = await file.read()
+    image_pil = await decode_upload(image_bytes)
+
+    try:
+        np_bgr_img = to_bgr_array(image_pil)
+        version = get_active_version()
+
+        detected, embeddings = await run_in_threadpool(
+            generate_embeddings_for_faces, np_bgr_img, get_detector(), get_recognizer(version), min_face_size, max_faces
+        )
+        searches = await search_gallery_batch(
+            list(embeddings), current_user.username, limit=limit, score_threshold=score_threshold, version=version
+        )
+        return MultiFaceSearchResponse(
+            faces=[
+                FaceSearchResult(
+                    box=[int(v) for v in face["bbox"][:4]],
+                    confidence=float(face.get("confidence", 0.0)),
+                    matches=[SearchResult(id=hit.id, score=hit.score, **hit.payload) for hit in hits],
+                )
+                for face, hits in zip(detected, searches)
+            ]
+        )
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"An error occurred during search: {e}")
+
+@router.get("/{point_id}/similar", response_model=List[SearchResult])
+async def search_similar_faces(
+    point_id: str = Path(..., description="ID của bản ghi dùng làm ảnh truy vấn."),
+    limit: int = Query(5, ge=1, le=50),
+    score_threshold: Optional[float] = Query(None, ge=-1.0, le=1.0),
+    current_user: User = Depends(get_current_active_user)
+):
+    """
+    Tìm các bản ghi giống một bản ghi đã lưu (vd. ảnh trùng lặp) bằng embedding
+    đã có trong vector store, không cần tải ảnh lên hay chạy lại model.
+    """
+    version = get_active_version()
+    point = await get_owned_point(get_image_store(version), point_id, current_user, with_vectors=True)
+    hits = await search_gallery(
+        point.vector, current_user.username, limit=limit + 1, score_threshold=score_threshold, version=version
+    )
+    return [SearchResult(id=hit.id, score=hit.score, **hit.payload) for hit in hits if hit.id != point_id][:limit]
+
+@router.post("/verify", response_model=VerifyResponse)
+async def verify_faces(
+    request: VerifyRequest,
+    current_user: User = Depends(get_current_active_user)
+):
+    """
+    So sánh một bản ghi đã lưu với một bản ghi khác (`other_point_id`) hoặc với
+    ảnh giống nhất trong nhóm `group_name`, dùng embedding đã lưu.
+    """
+    if (request.other_point_id is None) == (request.group_name is None):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Provide exactly one of 'other_point_id' or 'group_name'.",
+        )
+    threshold = MATCH_THRESHOLD if request.threshold is None else request.threshold
+    vector_store = get_image_store()
+    point = await get_owned_point(vector_store, request.point_id, current_user, with_vectors=True)
+
+    if request.other_point_id is not None:
+        other = await get_owned_point(vector_store, request.other_point_id, current_user, with_vectors=True)
+        score, matched_point_id = cosine_similarity(point.vector, other.vector), other.id
+    else:
+        hits = await vector_store.search(
+            point.vector,
+            payload_filter={"user_id": current_user.username, "name": request.group_name.strip()},
+            limit=2,
+        )
+        # Bản thân bản ghi không được tính khi nó nằm trong nhóm được so sánh
+        hits = [hit for hit in hits if hit.id != point.id]
+        if not hits:
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"No other images found in group '{request.group_name}'.")
+        score, matched_point_id = hits[0].score, hits[0].id
+
+    return VerifyResponse(score=score, is_match=score >= threshold, threshold=threshold, matched_point_id=matched_point_id)
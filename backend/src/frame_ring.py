@@ -0,0 +1,232 @@
+"""
+Vùng nhớ chia sẻ cho khung hình stream giữa worker API và tiến trình inference.
+
+Khi chạy nhiều worker (src/inference_client.py), mỗi worker API tạo một
+segment shared memory gồm STREAM_FRAME_SLOTS slot kích thước cố định. Mỗi
+phiên stream mượn một slot khi kết nối và trả lại khi ngắt: khung hình mới
+nhất của phiên (latest-frame-wins như FrameManager, khung cũ chưa xử lý bị
+bỏ và được đếm là overrun) được decode thẳng vào slot đó. Khi một mảng nằm
+trong segment được truyền cho detector / recognizer ở tiến trình inference,
+chỉ tham chiếu (tên segment, offset, shape) được gửi qua socket; phía bên kia
+đọc trực tiếp từ cùng vùng nhớ, không pickle 640x640x3 byte mỗi lời gọi.
+
+Phiên chỉ decode khung tiếp theo sau khi mọi lời gọi của khung trước đã trả
+về, nên thông thường slot không bị ghi đè trong lúc tiến trình inference đang
+đọc. Ngoại lệ là lời gọi quá thời gian (hoặc mất kết nối): phía inference có
+thể vẫn đang đọc slot, nên phiên `retire()` slot đó và mượn slot khác; slot bị
+cách ly STREAM_SLOT_QUARANTINE giây rồi mới được cho mượn lại. Kết quả của lời
+gọi quá hạn bị bỏ cùng kết nối, nên nếu nó còn chạy lâu hơn thời gian cách ly
+thì chỉ kết quả bị bỏ đó đọc phải dữ liệu của khung khác.
+Hết slot hoặc khung lớn hơn slot thì quay về gửi mảng như bình thường.
+
+Segment nằm trong /dev/shm; trang nhớ chỉ được cấp khi ghi nên kích thước
+thực tế là số phiên đồng thời x kích thước khung (lưu ý giới hạn --shm-size
+của Docker, mặc định 64 MB).
+"""
+import os
+import threading
+import time
+from contextlib import suppress
+from dataclasses import dataclass
+from multiprocessing import resource_tracker
+from multiprocessing.shared_memory import SharedMemory
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+STREAM_FRAME_SLOTS = int(os.getenv("STREAM_FRAME_SLOTS", "8"))
+# Mặc định đủ cho khung 1280x720 BGR; client gửi 640x640
+STREAM_FRAME_SLOT_BYTES = int(os.getenv("STREAM_FRAME_SLOT_BYTES", str(1280 * 720 * 3)))
+# Thời gian (giây) một slot bị bỏ sau lời gọi quá hạn chưa được cho mượn lại
+STREAM_SLOT_QUARANTINE = float(os.getenv("STREAM_SLOT_QUARANTINE", "120"))
+
+
+@dataclass(frozen=True)
+class SharedArray:
+    """Tham chiếu tới một mảng nằm trong segment shared memory; pickle chỉ vài chục byte."""
+
+    segment: str
+    offset: int
+    shape: Tuple[int, ...]
+    dtype: str
+
+
+@dataclass
+class FrameRingStats:
+    slots: int
+    slot_bytes: int
+    in_use: int
+    # Số lần một phiên mượn slot
+    leases: int
+    # Phiên không mượn được slot (đã hết) và dùng đường gửi mảng thông thường
+    exhausted: int
+    # Khung lớn hơn slot, được decode ra bộ nhớ thường
+    oversize: int
+    # Số mảng được gửi sang tiến trình inference bằng tham chiếu
+    shared: int
+    # Slot bị bỏ sau lời gọi quá hạn, đang bị cách ly hoặc đã được trả lại
+    retired: int
+
+
+class FrameSlot:
+    """Một slot của FrameRing, thuộc về một phiên stream cho tới khi `release()`."""
+
+    def __init__(self, ring: "FrameRing", index: int):
+        self.ring = ring
+        self.index = index
+
+    def frame(self, shape: Tuple[int, ...], dtype=np.uint8) -> Optional[np.ndarray]:
+        """Mảng `shape` nằm trong slot để decode vào, hoặc None nếu khung không vừa slot."""
+        nbytes = int(np.prod(shape)) * np.dtype(dtype).itemsize
+        if nbytes > self.ring.slot_bytes:
+            self.ring._count("oversize")
+            return None
+        offset = self.index * self.ring.slot_bytes
+        return np.ndarray(shape, dtype=dtype, buffer=self.ring.buffer, offset=offset)
+
+    def release(self):
+        self.ring.release(self)
+
+    def retire(self):
+        """Trả slot khi tiến trình inference có thể vẫn đang đọc nó (lời gọi quá hạn)."""
+        self.ring.retire(self)
+
+
+class FrameRing:
+    """Các slot khung hình của một tiến trình worker API, trong một segment shared memory."""
+
+    def __init__(self, slots: int = STREAM_FRAME_SLOTS, slot_bytes: int = STREAM_FRAME_SLOT_BYTES):
+        self.slots = slots
+        self.slot_bytes = slot_bytes
+        self._shm = SharedMemory(create=True, size=slots * slot_bytes)
+        self.buffer = self._shm.buf
+        self._address = np.frombuffer(self.buffer, dtype=np.uint8, count=1).ctypes.data
+        self._free: List[int] = list(range(slots))
+        # (thời điểm hết cách ly, slot) của các slot bị bỏ
+        self._quarantined: List[Tuple[float, int]] = []
+        self._lock = threading.Lock()
+        self._counters = {"leases": 0, "exhausted": 0, "oversize": 0, "shared": 0, "retired": 0}
+
+    @property
+    def name(self) -> str:
+        return self._shm.name
+
+    def _count(self, counter: str):
+        with self._lock:
+            self._counters[counter] += 1
+
+    def lease(self) -> Optional[FrameSlot]:
+        with self._lock:
+            now = time.monotonic()
+            self._free.extend(index for until, index in self._quarantined if until <= now)
+            self._quarantined = [(until, index) for until, index in self._quarantined if until > now]
+            if not self._free:
+                self._counters["exhausted"] += 1
+                return None
+            self._counters["leases"] += 1
+            return FrameSlot(self, self._free.pop())
+
+    def release(self, slot: FrameSlot):
+        with self._lock:
+            self._free.append(slot.index)
+
+    def retire(self, slot: FrameSlot, quarantine: float = STREAM_SLOT_QUARANTINE):
+        with self._lock:
+            self._counters["retired"] += 1
+            self._quarantined.append((time.monotonic() + quarantine, slot.index))
+
+    def share(self, array: np.ndarray) -> Optional[SharedArray]:
+        """Tham chiếu tới `array` nếu nó nằm liền một khối trong segment, ngược lại None."""
+        if not array.flags.c_contiguous:
+            return None
+        offset = array.ctypes.data - self._address
+        if offset < 0 or offset + array.nbytes > self.slots * self.slot_bytes:
+            return None
+        self._count("shared")
+        return SharedArray(segment=self.name, offset=offset, shape=array.shape, dtype=array.dtype.str)
+
+    def stats(self) -> FrameRingStats:
+        with self._lock:
+            return FrameRingStats(
+                slots=self.slots,
+                slot_bytes=self.slot_bytes,
+                in_use=self.slots - len(self._free),
+                **self._counters,
+            )
+
+    def close(self):
+        self.buffer = None
+        self._shm.unlink()
+        # Mảng của phiên còn tham chiếu tới segment thì ánh xạ được giải phóng khi chúng bị thu hồi
+        with suppress(BufferError):
+            self._shm.close()
+
+
+_ring: Optional[FrameRing] = None
+_ring_lock = threading.Lock()
+
+
+def get_frame_ring() -> FrameRing:
+    """FrameRing của tiến trình này, tạo ở lần gọi đầu tiên."""
+    global _ring
+    with _ring_lock:
+        if _ring is None:
+            _ring = FrameRing()
+        return _ring
+
+
+def close_frame_ring():
+    global _ring
+    with _ring_lock:
+        if _ring is not None:
+            _ring.close()
+            _ring = None
+
+
+def share_arrays(args: tuple, kwargs: Dict[str, Any]) -> Tuple[tuple, Dict[str, Any]]:
+    """Thay các mảng nằm trong FrameRing bằng SharedArray trước khi gửi qua socket."""
+    ring = _ring
+    if ring is None:
+        return args, kwargs
+
+    def share(value):
+        if isinstance(value, np.ndarray):
+            return ring.share(value) or value
+        return value
+
+    return tuple(share(arg) for arg in args), {key: share(value) for key, value in kwargs.items()}
+
+
+# --- phía tiến trình inference ---
+
+_attached: Dict[str, SharedMemory] = {}
+_attached_lock = threading.Lock()
+
+
+def _attach(name: str) -> SharedMemory:
+    with _attached_lock:
+        shm = _attached.get(name)
+        if shm is None:
+            # Segment của worker đã thoát (vd. gunicorn khởi động lại worker) thì bỏ ánh xạ
+            for stale in [key for key in _attached if not os.path.exists(f"/dev/shm/{key}")]:
+                with suppress(BufferError):
+                    _attached.pop(stale).close()
+            shm = _attached[name] = SharedMemory(name=name)
+            # Segment thuộc về worker API; resource tracker của tiến trình này không được xóa nó khi thoát
+            resource_tracker.unregister(shm._name, "shared_memory")
+        return shm
+
+
+def resolve_arrays(args: tuple, kwargs: Dict[str, Any]) -> Tuple[tuple, Dict[str, Any]]:
+    """Đổi SharedArray thành mảng (chỉ đọc) trỏ thẳng vào segment của worker API."""
+
+    def resolve(value):
+        if not isinstance(value, SharedArray):
+            return value
+        array = np.ndarray(
+            value.shape, dtype=np.dtype(value.dtype), buffer=_attach(value.segment).buf, offset=value.offset
+        )
+        array.flags.writeable = False
+        return array
+
+    return tuple(resolve(arg) for arg in args), {key: resolve(value) for key, value in kwargs.items()}
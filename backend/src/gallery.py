@@ -0,0 +1,368 @@
+"""
+Xuất / nhập gallery của một tenant dưới dạng snapshot .npz.
+
+Snapshot là một file ZIP (đọc được bằng `np.load`) gồm:
+
+- embeddings.npy: ma trận float32 liền khối (n x dim).
+- id.npy, name.npy, image_url.npy, thumbnail_url.npy, content_type.npy:
+  các cột payload, mỗi cột một mảng chuỗi cùng thứ tự với embeddings.
+- manifest.npy: chuỗi JSON (phiên bản định dạng, tenant, phiên bản embedding, dim, số bản ghi).
+
+Cả hai chiều đều chạy theo lô: khi xuất, các trang scroll được ghi nối vào
+file tạm trên đĩa rồi ghép thành các mảng .npy; khi nhập, các mảng được đọc
+dần từ trong ZIP và upsert theo lô. Bộ nhớ chỉ giữ một lô mỗi lúc nên dùng
+được cho tenant hàng triệu vector.
+
+Ảnh trên R2 không được sao chép: snapshot giữ nguyên URL, nên gallery được
+nhập tham chiếu tới cùng các object với gallery gốc. Bản ghi được nhập vì vậy
+được đánh dấu `shared_images` và việc xóa / thay ảnh / gộp chúng không xóa
+object trên R2. Snapshot do người dùng tải lên nên không được tin: id điểm
+chỉ được giữ khi trỏ tới bản ghi của chính tenant nhập, và URL ảnh phải nằm
+trong bucket R2.
+"""
+import json
+import os
+import shutil
+import tempfile
+import uuid
+import zipfile
+from contextlib import suppress
+from typing import Dict, Iterator, List, Optional, Set, Tuple
+
+import numpy as np
+from fastapi import APIRouter, Depends, File, Form, HTTPException, UploadFile, status
+from fastapi.responses import FileResponse
+from pydantic import BaseModel
+from starlette.background import BackgroundTask
+from starlette.concurrency import run_in_threadpool
+
+from src.auth import get_current_active_user
+from src.database import SessionLocal
+from src.embeddings import get_active_version, get_image_store, get_mirror_stores
+from src.models import FaceGroup, User
+from src.prototypes import get_prototype_index
+from src.utils import SHARED_IMAGES_FIELD, is_stored_image_url
+from src.vector_store import TENANT_FIELD, VectorRecord
+
+SNAPSHOT_FORMAT_VERSION = 1
+SNAPSHOT_DIR = os.getenv("GALLERY_SNAPSHOT_DIR", "./gallery_snapshots")
+SNAPSHOT_BATCH_SIZE = int(os.getenv("GALLERY_SNAPSHOT_BATCH_SIZE", "1024"))
+# Cột payload được lưu, theo thứ tự; "id" là id điểm
+PAYLOAD_COLUMNS = ("name", "image_url", "thumbnail_url", "content_type")
+URL_COLUMNS = ("image_url", "thumbnail_url")
+SNAPSHOT_COLUMNS = ("id",) + PAYLOAD_COLUMNS
+COPY_CHUNK_SIZE = 1024 * 1024
+
+router = APIRouter(
+    prefix="/gallery",
+    tags=["gallery"],
+    responses={404: {"description": "Not found"}},
+)
+
+
+class SnapshotError(ValueError):
+    """Snapshot không hợp lệ hoặc không tương thích với gallery hiện tại."""
+
+
+class ImportResult(BaseModel):
+    imported: int
+    groups: int
+    embedding_version: str
+
+
+# --- FACE GROUPS ---
+
+async def reconcile_face_groups(user: User, labels: Set[str], version: Optional[str] = None):
+    """Đặt lại image_count của các FaceGroup theo số điểm thực tế trong vector store."""
+    store = get_image_store(version)
+    db = SessionLocal()
+    try:
+        groups = {g.name: g for g in db.query(FaceGroup).filter_by(user_id=user.id).all()}
+        for label in sorted(labels | set(groups)):
+            count = await store.count({TENANT_FIELD: user.username, "name": label})
+            group = groups.get(label)
+            if count == 0:
+                if group:
+                    db.delete(group)
+            elif group:
+                group.image_count = count
+            else:
+                db.add(FaceGroup(name=label, user_id=user.id, image_count=count))
+        db.commit()
+    finally:
+        db.close()
+
+
+# --- SNAPSHOT FORMAT ---
+
+def _write_npy_header(f, dtype: np.dtype, shape: Tuple[int, ...]):
+    np.lib.format.write_array_header_2_0(
+        f, {"descr": np.lib.format.dtype_to_descr(dtype), "fortran_order": False, "shape": shape}
+    )
+
+
+class SnapshotWriter:
+    """Ghi nối các lô bản ghi ra file tạm, rồi ghép thành snapshot .npz ở `finish`."""
+
+    def __init__(self, dim: int):
+        self.dim = dim
+        self.count = 0
+        self.directory = tempfile.mkdtemp(prefix="gallery_export_")
+        self._vectors = open(os.path.join(self.directory, "embeddings.f32"), "wb")
+        # Mỗi cột chuỗi là một file JSON lines; độ dài lớn nhất quyết định dtype "<U{n}"
+        self._columns = {
+            column: open(os.path.join(self.directory, f"{column}.jsonl"), "w", encoding="utf-8")
+            for column in SNAPSHOT_COLUMNS
+        }
+        self._max_lengths = {column: 1 for column in SNAPSHOT_COLUMNS}
+
+    def append(self, records: List[VectorRecord]):
+        if not records:
+            return
+        vectors = np.asarray([record.vector for record in records], dtype=np.float32).reshape(len(records), self.dim)
+        self._vectors.write(vectors.tobytes())
+        for column, f in self._columns.items():
+            values = [record.id if column == "id" else str(record.payload.get(column) or "") for record in records]
+            self._max_lengths[column] = max(self._max_lengths[column], *map(len, values))
+            f.writelines(json.dumps(value, ensure_ascii=False) + "\n" for value in values)
+        self.count += len(records)
+
+    def finish(self, path: str, manifest: Dict):
+        self._vectors.close()
+        for f in self._columns.values():
+            f.close()
+
+        with zipfile.ZipFile(path, "w", zipfile.ZIP_STORED, allowZip64=True) as archive:
+            with archive.open("manifest.npy", "w") as f:
+                np.save(f, np.array(json.dumps({**manifest, "dim": self.dim, "count": self.count})))
+
+            with archive.open("embeddings.npy", "w", force_zip64=True) as f:
+                _write_npy_header(f, np.dtype(np.float32), (self.count, self.dim))
+                with open(os.path.join(self.directory, "embeddings.f32"), "rb") as src:
+                    shutil.copyfileobj(src, f, COPY_CHUNK_SIZE)
+
+            for column in SNAPSHOT_COLUMNS:
+                dtype = np.dtype(f"<U{self._max_lengths[column]}")
+                with archive.open(f"{column}.npy", "w", force_zip64=True) as f:
+                    _write_npy_header(f, dtype, (self.count,))
+                    with open(os.path.join(self.directory, f"{column}.jsonl"), encoding="utf-8") as src:
+                        while lines := src.readlines(COPY_CHUNK_SIZE):
+                            f.write(np.array([json.loads(line) for line in lines], dtype=dtype).tobytes())
+
+    def cleanup(self):
+        self._vectors.close()
+        for f in self._columns.values():
+            f.close()
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+
+class SnapshotReader:
+    """Đọc tuần tự một snapshot .npz theo lô, không nạp toàn bộ mảng vào bộ nhớ."""
+
+    def __init__(self, path: str):
+        try:
+            self._archive = zipfile.ZipFile(path)
+            with self._archive.open("manifest.npy") as f:
+                self.manifest = json.loads(str(np.load(f)))
+        except (zipfile.BadZipFile, KeyError, ValueError) as e:
+            raise SnapshotError(f"Not a gallery snapshot: {e}")
+        if self.manifest.get("format") != SNAPSHOT_FORMAT_VERSION:
+            raise SnapshotError(f"Unsupported snapshot format {self.manifest.get('format')}.")
+
+        self.count = int(self.manifest["count"])
+        self.dim = int(self.manifest["dim"])
+        self._members = {}
+        for name, shape in [("embeddings", (self.count, self.dim))] + [(column, (self.count,)) for column in SNAPSHOT_COLUMNS]:
+            try:
+                f = self._archive.open(f"{name}.npy")
+            except KeyError:
+                raise SnapshotError(f"Snapshot is missing '{name}.npy'.")
+            version = np.lib.format.read_magic(f)
+            header = np.lib.format.read_array_header_1_0 if version == (1, 0) else np.lib.format.read_array_header_2_0
+            member_shape, fortran_order, dtype = header(f)
+            if member_shape != shape or fortran_order:
+                raise SnapshotError(f"'{name}.npy' has shape {member_shape}, expected {shape}.")
+            self._members[name] = (f, dtype)
+
+    def _read(self, name: str, rows: int) -> np.ndarray:
+        f, dtype = self._members[name]
+        width = self.dim if name == "embeddings" else 1
+        data = f.read(rows * width * dtype.itemsize)
+        return np.frombuffer(data, dtype=dtype)
+
+    def batches(self, batch_size: int) -> Iterator[Tuple[np.ndarray, Dict[str, List[str]]]]:
+        for start in range(0, self.count, batch_size):
+            rows = min(batch_size, self.count - start)
+            vectors = self._read("embeddings", rows).reshape(rows, self.dim)
+            yield vectors, {column: self._read(column, rows).tolist() for column in SNAPSHOT_COLUMNS}
+
+    def column_batches(self, column: str, batch_size: int) -> Iterator[List[str]]:
+        """Chỉ đọc một cột chuỗi theo lô (dùng một reader riêng, vì mỗi cột được đọc tuần tự)."""
+        for start in range(0, self.count, batch_size):
+            yield self._read(column, min(batch_size, self.count - start)).tolist()
+
+    def close(self):
+        for f, _ in self._members.values():
+            f.close()
+        self._archive.close()
+
+
+# --- EXPORT / IMPORT ---
+
+async def export_gallery(user: User, path: str) -> int:
+    """Ghi gallery của `user` (phiên bản embedding đang hoạt động) ra snapshot. Trả về số bản ghi."""
+    version = get_active_version()
+    store = get_image_store(version)
+    writer = SnapshotWriter(store.vector_size)
+    try:
+        async for records in store.iter_pages(
+            payload_filter={TENANT_FIELD: user.username},
+            page_size=SNAPSHOT_BATCH_SIZE,
+            with_vectors=True,
+            payload_fields=PAYLOAD_COLUMNS,
+        ):
+            await run_in_threadpool(writer.append, records)
+        manifest = {"format": SNAPSHOT_FORMAT_VERSION, "tenant": user.username, "embedding_version": version}
+        await run_in_threadpool(writer.finish, path, manifest)
+        return writer.count
+    finally:
+        writer.cleanup()
+
+
+def check_image_urls(path: str):
+    """Từ chối snapshot có URL ảnh nằm ngoài bucket R2 (chỉ đọc các cột URL)."""
+    reader = SnapshotReader(path)
+    try:
+        for column in URL_COLUMNS:
+            for values in reader.column_batches(column, SNAPSHOT_BATCH_SIZE):
+                bad_url = next((url for url in values if url and not is_stored_image_url(url)), None)
+                if bad_url is not None:
+                    raise SnapshotError(f"Snapshot {column} '{bad_url}' is not an image stored by this service.")
+    finally:
+        reader.close()
+
+
+def _next_batch(batches: Iterator):
+    return next(batches, None)
+
+
+def imported_point_id(username: str, point_id: str) -> str:
+    """Id điểm của một bản ghi snapshot khi nhập vào gallery của `username`."""
+    return str(uuid.uuid5(uuid.NAMESPACE_URL, f"{username}/{point_id}"))
+
+
+def _is_uuid(value: str) -> bool:
+    try:
+        uuid.UUID(value)
+    except ValueError:
+        return False
+    return True
+
+
+async def _own_records(store, username: str, ids: List[str]) -> Dict[str, Dict]:
+    """Payload của các id đã có trong gallery của `username` (id của tenant khác bị bỏ qua)."""
+    records = await store.retrieve([point_id for point_id in ids if _is_uuid(point_id)])
+    return {record.id: record.payload for record in records if record.payload.get(TENANT_FIELD) == username}
+
+
+async def import_gallery(user: User, path: str, replace: bool = False) -> ImportResult:
+    """
+    Upsert snapshot vào gallery của `user`. `replace` xóa gallery hiện có trước.
+
+    Id trong snapshot chỉ được giữ khi điểm đó đã có trong gallery của chính
+    `user` (nhập lại bản xuất của mình không tạo bản ghi trùng); mọi id khác
+    được suy ra từ tenant và id gốc, nên một snapshot sửa tay không thể ghi đè
+    điểm của tenant khác. URL ảnh ngoài bucket R2 làm snapshot bị từ chối.
+    """
+    version = get_active_version()
+    store = get_image_store(version)
+    await run_in_threadpool(check_image_urls, path)
+    reader = await run_in_threadpool(SnapshotReader, path)
+    try:
+        if reader.manifest.get("embedding_version") != version:
+            raise SnapshotError(
+                f"Snapshot embeddings are '{reader.manifest.get('embedding_version')}', "
+                f"the active embedding version is '{version}'."
+            )
+        if reader.dim != store.vector_size:
+            raise SnapshotError(f"Snapshot vectors are {reader.dim}-d, expected {store.vector_size}.")
+
+        if replace:
+            await store.delete(payload_filter={TENANT_FIELD: user.username})
+            for mirror_store in get_mirror_stores():
+                await mirror_store.delete(payload_filter={TENANT_FIELD: user.username})
+
+        labels: Set[str] = set()
+        imported = 0
+        batches = reader.batches(SNAPSHOT_BATCH_SIZE)
+        while (batch := await run_in_threadpool(_next_batch, batches)) is not None:
+            vectors, columns = batch
+            existing = await _own_records(store, user.username, columns["id"])
+
+            points = []
+            for i, point_id in enumerate(columns["id"]):
+                payload = {column: columns[column][i] for column in PAYLOAD_COLUMNS if columns[column][i]}
+                payload[TENANT_FIELD] = user.username
+                own = existing.get(point_id)
+                if own is not None and all(own.get(column) == payload.get(column) for column in URL_COLUMNS):
+                    # Bản ghi gốc của chính tenant: giữ id và quyền sở hữu ảnh
+                    if own.get(SHARED_IMAGES_FIELD):
+                        payload[SHARED_IMAGES_FIELD] = True
+                else:
+                    point_id = imported_point_id(user.username, point_id)
+                    payload[SHARED_IMAGES_FIELD] = True
+                points.append(VectorRecord(id=point_id, vector=vectors[i], payload=payload))
+                if payload.get("name"):
+                    labels.add(payload["name"])
+            await store.upsert(points)
+            imported += len(points)
+    finally:
+        reader.close()
+
+    await reconcile_face_groups(user, labels, version)
+    if replace:
+        await get_prototype_index(version).rebuild(user.username)
+    else:
+        await get_prototype_index(version).rebuild(user.username, names=labels)
+    return ImportResult(imported=imported, groups=len(labels), embedding_version=version)
+
+
+# --- API ENDPOINTS ---
+
+@router.get("/export", response_class=FileResponse)
+async def export_my_gallery(current_user: User = Depends(get_current_active_user)):
+    """Tải về snapshot .npz của toàn bộ gallery (id, nhãn, URL ảnh, embedding)."""
+    os.makedirs(SNAPSHOT_DIR, exist_ok=True)
+    path = os.path.join(SNAPSHOT_DIR, f"{uuid.uuid4()}.npz")
+    try:
+        await export_gallery(current_user, path)
+    except Exception:
+        with suppress(OSError):
+            os.remove(path)
+        raise
+    return FileResponse(
+        path,
+        media_type="application/octet-stream",
+        filename=f"{current_user.username}-gallery.npz",
+        background=BackgroundTask(os.remove, path),
+    )
+
+
+@router.post("/import", response_model=ImportResult)
+async def import_my_gallery(
+    snapshot: UploadFile = File(..., description="Snapshot .npz tạo bởi /gallery/export."),
+    replace: bool = Form(False, description="Xóa gallery hiện có trước khi nhập."),
+    current_user: User = Depends(get_current_active_user),
+):
+    os.makedirs(SNAPSHOT_DIR, exist_ok=True)
+    path = os.path.join(SNAPSHOT_DIR, f"{uuid.uuid4()}.npz")
+    try:
+        with open(path, "wb") as out:
+            while chunk := await snapshot.read(COPY_CHUNK_SIZE):
+                out.write(chunk)
+        return await import_gallery(current_user, path, replace=replace)
+    except SnapshotError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    finally:
+        with suppress(OSError):
+            os.remove(path)
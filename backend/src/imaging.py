@@ -0,0 +1,92 @@
+import io
+import os
+from typing import Optional
+
+import cv2
+import numpy as np
+from PIL import Image, ImageOps, UnidentifiedImageError
+
+# Giới hạn số điểm ảnh của ảnh tải lên (mặc định 50 MP)
+MAX_IMAGE_PIXELS = int(os.getenv("MAX_IMAGE_PIXELS", "50000000"))
+# Cạnh dài nhất sau khi decode. Detector chạy ở 640 px nên không cần giữ
+# toàn bộ độ phân giải của ảnh chụp từ điện thoại.
+DECODE_MAX_SIDE = int(os.getenv("DECODE_MAX_SIDE", "1920"))
+
+
+class ImageDecodeError(ValueError):
+    """Dữ liệu không phải là ảnh hợp lệ."""
+
+
+class ImageTooLargeError(ImageDecodeError):
+    """Ảnh vượt quá giới hạn MAX_IMAGE_PIXELS."""
+
+
+def decode_image(
+    image_bytes: bytes,
+    max_side: Optional[int] = DECODE_MAX_SIDE,
+    max_pixels: int = MAX_IMAGE_PIXELS,
+) -> Image.Image:
+    """
+    Decode ảnh thành PIL.Image RGB đã xoay theo EXIF và thu nhỏ về `max_side`.
+
+    Với JPEG, `Image.draft` cho phép libjpeg decode trực tiếp ở độ phân giải
+    1/2, 1/4 hoặc 1/8, nên ảnh 24 MP không bao giờ được giải nén đầy đủ.
+
+    Raises:
+        ImageTooLargeError: Nếu ảnh có nhiều hơn `max_pixels` điểm ảnh.
+        ImageDecodeError: Nếu không đọc được ảnh.
+    """
+    try:
+        img = Image.open(io.BytesIO(image_bytes))
+    except Image.DecompressionBombError as e:
+        raise ImageTooLargeError(str(e)) from e
+    except (UnidentifiedImageError, OSError) as e:
+        raise ImageDecodeError(f"Cannot decode image: {e}") from e
+
+    # Kiểm tra kích thước từ header trước khi decode
+    width, height = img.size
+    if width * height > max_pixels:
+        raise ImageTooLargeError(
+            f"Image has {width * height} pixels, the limit is {max_pixels}."
+        )
+
+    try:
+        scale = max_side / max(width, height) if max_side else 1.0
+        if scale < 1.0:
+            # Tỷ lệ này không phụ thuộc vào hướng xoay EXIF nên có thể áp dụng trước
+            img.draft("RGB", (int(width * scale), int(height * scale)))
+
+        img = ImageOps.exif_transpose(img)
+        if img.mode != "RGB":
+            img = img.convert("RGB")
+
+        if max_side and max(img.size) > max_side:
+            img.thumbnail((max_side, max_side), Image.Resampling.BILINEAR)
+        img.load()
+    except (OSError, ValueError) as e:
+        raise ImageDecodeError(f"Cannot decode image: {e}") from e
+
+    return img
+
+
+def to_bgr_array(img: Image.Image, out: Optional[np.ndarray] = None) -> np.ndarray:
+    """
+    Chuyển ảnh PIL RGB sang mảng BGR (HWC, uint8) mà detector và recognizer sử dụng.
+    `out` (cùng shape, vd. một slot shared memory) nhận kết quả thay cho mảng mới.
+    """
+    if out is not None:
+        cv2.cvtColor(np.asarray(img), cv2.COLOR_RGB2BGR, dst=out)
+        return out
+    array = np.array(img)
+    # Đảo kênh tại chỗ, không tạo thêm bản sao
+    cv2.cvtColor(array, cv2.COLOR_RGB2BGR, dst=array)
+    return array
+
+
+def decode_image_bgr(
+    image_bytes: bytes,
+    max_side: Optional[int] = DECODE_MAX_SIDE,
+    max_pixels: int = MAX_IMAGE_PIXELS,
+) -> np.ndarray:
+    """Decode ảnh thẳng thành mảng BGR, dùng cho các đường chỉ cần inference."""
+    return to_bgr_array(decode_image(image_bytes, max_side=max_side, max_pixels=max_pixels))
@@ -0,0 +1,286 @@
+"""
+Client của tiến trình inference (src/inference_service.py).
+
+Khi INFERENCE_SOCKETS được đặt (danh sách Unix socket, phân cách bằng dấu
+phẩy), tiến trình API / WebSocket không tự nạp model hay mở vector store:
+`get_detector()`, `get_recognizer()`, `get_vector_store()`,
+`get_prototype_index()` và `get_unknown_store()` trả về các proxy ở đây,
+mỗi lời gọi phương thức được chuyển qua socket tới tiến trình inference.
+Nhờ vậy có thể chạy nhiều worker gunicorn trên cùng một máy mà chỉ có một
+bản model và một vector index.
+
+Socket đầu tiên là tiến trình chính: giữ vector store, prototype, kho khuôn
+mặt lạ và chạy các worker nền. Các socket còn lại (`--models-only`) chỉ phục
+vụ detector / recognizer; lời gọi model được chia vòng tròn cho mọi tiến trình.
+
+Mỗi phản hồi kèm phiên bản embedding đang hoạt động và migration đang chạy
+của tiến trình chính, nên trạng thái đó ở worker API luôn theo kịp sau mỗi
+lời gọi (chỉ tiến trình chính đổi phiên bản).
+"""
+import asyncio
+import itertools
+import os
+import queue
+import threading
+import time
+from dataclasses import dataclass
+from functools import lru_cache
+from multiprocessing.connection import Client, Connection
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+from starlette.concurrency import run_in_threadpool
+
+from src.frame_ring import share_arrays
+
+INFERENCE_SOCKETS = [path.strip() for path in os.getenv("INFERENCE_SOCKETS", "").split(",") if path.strip()]
+# Khóa xác thực kết nối (tùy chọn); socket được tạo với quyền 0600 nên chỉ cùng user kết nối được
+INFERENCE_AUTHKEY = os.getenv("INFERENCE_AUTHKEY", "").encode() or None
+# Thời gian chờ tối đa cho một lời gọi (giây)
+INFERENCE_TIMEOUT = float(os.getenv("INFERENCE_TIMEOUT", "30"))
+
+# Các đích chỉ cần model, có thể gửi tới bất kỳ tiến trình inference nào
+MODEL_TARGETS = ("detector", "recognizer")
+# Lệnh của chính tiến trình inference: ping, danh sách model và hot-swap
+SERVICE_TARGET = ("service",)
+
+Target = Tuple[str, ...]
+
+
+class InferenceUnavailableError(RuntimeError):
+    """Không kết nối được (hoặc mất kết nối) tới tiến trình inference."""
+
+
+def is_remote() -> bool:
+    return bool(INFERENCE_SOCKETS)
+
+
+class _ConnectionPool:
+    """Các kết nối tới một socket; mỗi lời gọi giữ riêng một kết nối."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._idle: "queue.LifoQueue[Connection]" = queue.LifoQueue()
+
+    def _acquire(self) -> Connection:
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        try:
+            return Client(self.path, family="AF_UNIX", authkey=INFERENCE_AUTHKEY)
+        except OSError as e:
+            raise InferenceUnavailableError(f"Cannot connect to inference service at {self.path}: {e}") from e
+
+    def call(self, target: Target, method: str, args: tuple, kwargs: dict) -> Any:
+        # Khung hình nằm trong shared memory chỉ được gửi bằng tham chiếu (src/frame_ring.py)
+        args, kwargs = share_arrays(args, kwargs)
+        conn = self._acquire()
+        try:
+            conn.send((target, method, args, kwargs))
+            if not conn.poll(INFERENCE_TIMEOUT):
+                raise TimeoutError(f"Inference service did not answer {target[0]}.{method} in {INFERENCE_TIMEOUT}s.")
+            ok, result, state = conn.recv()
+        except (OSError, EOFError, TimeoutError) as e:
+            # Kết nối có thể còn dở một phản hồi: bỏ hẳn, không trả lại pool
+            conn.close()
+            raise InferenceUnavailableError(f"Inference service at {self.path} failed: {e}") from e
+        self._idle.put(conn)
+        _apply_state(state)
+        if not ok:
+            raise result
+        return result
+
+    def close(self):
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                return
+
+
+_pools = [_ConnectionPool(path) for path in INFERENCE_SOCKETS]
+_round_robin = itertools.cycle(range(len(_pools))) if _pools else None
+_round_robin_lock = threading.Lock()
+
+
+def _apply_state(state: Optional[Tuple[str, Optional[Tuple[str, str]]]]):
+    if state is None:
+        return
+    from src.embeddings import set_active_version, set_migration_versions
+
+    active_version, migration_versions = state
+    set_active_version(active_version)
+    set_migration_versions(migration_versions)
+
+
+def _pool_for(target: Target) -> _ConnectionPool:
+    if target[0] not in MODEL_TARGETS or len(_pools) == 1:
+        return _pools[0]
+    with _round_robin_lock:
+        return _pools[next(_round_robin)]
+
+
+def call(target: Target, method: str, *args, **kwargs) -> Any:
+    """Gọi `method` của đối tượng `target` ở tiến trình inference (chặn; dùng trong threadpool)."""
+    return _pool_for(target).call(target, method, args, kwargs)
+
+
+async def acall(target: Target, method: str, *args, **kwargs) -> Any:
+    """Như `call` nhưng không chặn event loop."""
+    return await run_in_threadpool(call, target, method, *args, **kwargs)
+
+
+def call_all(target: Target, method: str, *args, **kwargs) -> List[Any]:
+    """Gọi trên mọi tiến trình inference (vd. hot-swap model), kết quả theo thứ tự socket."""
+    return [pool.call(target, method, args, kwargs) for pool in _pools]
+
+
+def close_connections():
+    for pool in _pools:
+        pool.close()
+
+
+async def wait_for_services(timeout: float):
+    """Chờ mọi tiến trình inference nhận kết nối (chúng chỉ mở socket sau khi đã warm-up xong)."""
+    deadline = time.monotonic() + timeout
+    for pool in _pools:
+        while True:
+            try:
+                await run_in_threadpool(pool.call, SERVICE_TARGET, "ping", (), {})
+                break
+            except InferenceUnavailableError:
+                if time.monotonic() > deadline:
+                    raise
+                await asyncio.sleep(0.5)
+
+
+# --- proxy ---
+
+class RemoteDetector:
+    """SCRFD ở tiến trình inference."""
+
+    target: Target = ("detector",)
+
+    def detect(self, image: np.ndarray) -> List[Dict[str, Any]]:
+        return call(self.target, "detect", image)
+
+
+class RemoteRecognizer:
+    """ArcFace của một phiên bản embedding ở tiến trình inference."""
+
+    def __init__(self, version: str):
+        self.version = version
+        self.target: Target = ("recognizer", version)
+        self._output_shape = None
+
+    @property
+    def output_shape(self):
+        if self._output_shape is None:
+            self._output_shape = call(self.target, "output_shape")
+        return self._output_shape
+
+    def get_normalized_embedding(self, image: np.ndarray, landmarks: np.ndarray) -> np.ndarray:
+        return call(self.target, "get_normalized_embedding", image=image, landmarks=landmarks)
+
+    def get_normalized_embeddings(self, image: np.ndarray, landmarks_list: Sequence[np.ndarray]) -> np.ndarray:
+        return call(self.target, "get_normalized_embeddings", image, landmarks_list)
+
+    def get_normalized_embeddings_aligned(self, aligned_faces: Sequence[np.ndarray]) -> np.ndarray:
+        return call(self.target, "get_normalized_embeddings_aligned", aligned_faces)
+
+
+@lru_cache(maxsize=1)
+def remote_detector() -> RemoteDetector:
+    return RemoteDetector()
+
+
+@lru_cache(maxsize=None)
+def remote_recognizer(version: str) -> RemoteRecognizer:
+    return RemoteRecognizer(version)
+
+
+class RemotePrototypeIndex:
+    """PrototypeIndex của một phiên bản ở tiến trình chính (cập nhật được tuần tự hóa ở đó)."""
+
+    def __init__(self, version: str, images, prototypes):
+        self.target: Target = ("prototypes", version)
+        self.images = images
+        self.prototypes = prototypes
+
+    async def setup(self):
+        await acall(self.target, "setup")
+
+    async def close(self):
+        pass
+
+    async def add(self, username: str, items, sign: int = 1):
+        await acall(self.target, "add", username, items, sign=sign)
+
+    async def remove(self, username: str, items):
+        await acall(self.target, "remove", username, items)
+
+    async def rename(self, username: str, old_name: str, new_name: str):
+        await acall(self.target, "rename", username, old_name, new_name)
+
+    async def rebuild(self, username: Optional[str] = None, names=None):
+        await acall(self.target, "rebuild", username, names=list(names) if names is not None else None)
+
+    async def search(self, vector: np.ndarray, username: str, **kwargs):
+        return await acall(self.target, "search", vector, username, **kwargs)
+
+    async def search_batch(self, vectors, username: str, **kwargs):
+        return await acall(self.target, "search_batch", list(vectors), username, **kwargs)
+
+
+class RemoteUnknownStore:
+    """Kho khuôn mặt lạ của một tenant ở tiến trình chính, dùng chung cho mọi worker API."""
+
+    def __init__(self, username: str, version: str):
+        self.version = version
+        self.target: Target = ("unknown", username, version)
+
+    def observe_faces(self, thumbnails, faces, embeddings):
+        call(self.target, "observe_faces", thumbnails, faces, embeddings)
+
+    def clusters(self):
+        return call(self.target, "clusters")
+
+    def get(self, cluster_id: str):
+        return call(self.target, "get", cluster_id)
+
+    def pop(self, cluster_id: str):
+        return call(self.target, "pop", cluster_id)
+
+    def restore(self, cluster):
+        call(self.target, "restore", cluster)
+
+
+@dataclass
+class RemoteWorker:
+    """Worker nền chạy ở tiến trình chính; worker API chỉ đánh thức nó."""
+
+    name: str
+
+    def start(self):
+        pass
+
+    async def stop(self):
+        pass
+
+    def notify(self):
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            # Handler đồng bộ (đã ở trong threadpool): gọi thẳng
+            self._notify()
+            return
+        # Từ handler async: lời gọi socket (chờ tới INFERENCE_TIMEOUT) không được chặn event loop
+        loop.run_in_executor(None, self._notify)
+
+    def _notify(self):
+        try:
+            call(("worker", self.name), "notify")
+        except InferenceUnavailableError as e:
+            # Worker vẫn tự kiểm tra job mới theo chu kỳ
+            print(f"Cannot notify the {self.name} worker: {e}")
@@ -0,0 +1,232 @@
+"""
+Tiến trình inference cho triển khai nhiều worker trên một máy.
+
+Tiến trình này giữ các ONNX session (detector, recognizer) và vector store,
+và phục vụ các worker API / WebSocket qua một Unix socket (xem
+src/inference_client.py). Mỗi kết nối được phục vụ bởi một thread: lời gọi
+model chạy ngay trong thread đó (onnxruntime nhả GIL nên các kết nối chạy
+song song trên nhiều core), lời gọi vector store / prototype được chuyển vào
+event loop của tiến trình.
+
+Tiến trình chính còn giữ prototype, kho khuôn mặt lạ và chạy các worker nền
+(enrollment, migration, compaction). Có thể chạy thêm tiến trình
+`--models-only` để chia tải model; chúng chỉ phục vụ detector / recognizer.
+
+    python -m src.inference_service --socket /tmp/face-inference.sock
+    python -m src.inference_service --socket /tmp/face-inference-2.sock --models-only
+    INFERENCE_SOCKETS=/tmp/face-inference.sock,/tmp/face-inference-2.sock \\
+        gunicorn -w 4 -k uvicorn.workers.UvicornWorker src.server:app
+
+Socket chỉ được mở sau khi warm-up xong, nên worker API (chờ ở bước
+"inference" của src/startup.py) chỉ sẵn sàng khi tiến trình inference đã sẵn sàng.
+"""
+import os
+
+# Tiến trình này là đích của INFERENCE_SOCKETS nên không bao giờ chuyển tiếp tới chính
+# nó. Đặt rỗng (không xóa) để load_dotenv không nạp lại giá trị từ .env; phải chạy trước
+# khi import các module src.
+_CONFIGURED_SOCKETS = os.getenv("INFERENCE_SOCKETS", "")
+os.environ["INFERENCE_SOCKETS"] = ""
+
+import argparse
+import asyncio
+import inspect
+import signal
+import threading
+from dataclasses import replace
+from multiprocessing import AuthenticationError
+from multiprocessing.connection import Connection, Listener
+from typing import Any, List, Optional
+
+from sqlalchemy.exc import OperationalError
+from starlette.concurrency import run_in_threadpool
+
+from src import compaction, jobs, reembedding, startup
+from src.embeddings import (
+    get_active_version,
+    get_migration_versions,
+    get_recognizer,
+    load_active_version,
+    swap_recognizer,
+)
+from src.frame_ring import resolve_arrays
+from src.inference_client import INFERENCE_AUTHKEY, Target
+from src.model_registry import LoadedModel, get_detector, model_entries, swap_detector
+from src.prototypes import get_prototype_index
+from src.streaming import record_remote_streams
+from src.unknown_faces import get_unknown_store
+from src.vector_store import close_vector_stores, get_vector_store
+
+DEFAULT_SOCKET = (_CONFIGURED_SOCKETS.split(",")[0].strip() or "/tmp/face-inference.sock")
+# Số kết nối đang chờ accept tối đa (mỗi worker API mở vài kết nối khi tải cao)
+LISTEN_BACKLOG = 128
+
+WORKERS = {
+    "enrollment": jobs.enrollment_worker,
+    "reembedding": reembedding.reembedding_worker,
+    "compaction": compaction.compaction_worker,
+}
+
+
+def _without_model(entry: LoadedModel) -> LoadedModel:
+    # ONNX session không pickle được và cũng không cần ở phía worker API
+    return replace(entry, model=None)
+
+
+class InferenceService:
+    def __init__(self, loop: asyncio.AbstractEventLoop, models_only: bool):
+        self.loop = loop
+        self.models_only = models_only
+
+    # --- lệnh của target ("service",) ---
+
+    def ping(self) -> bool:
+        return True
+
+    def model_entries(self) -> List[LoadedModel]:
+        return [_without_model(entry) for entry in model_entries()]
+
+    def swap_detector(self, name: Optional[str] = None) -> LoadedModel:
+        return _without_model(swap_detector(name))
+
+    def swap_recognizer(self, version: str) -> LoadedModel:
+        return _without_model(swap_recognizer(version))
+
+    def report_streams(self, worker_pid: int, count: int):
+        """Worker API báo số stream đang mở, để worker nền giảm tốc (xem reembedding._throttle)."""
+        record_remote_streams(worker_pid, count)
+
+    # --- điều phối ---
+
+    def _resolve(self, target: Target) -> Any:
+        kind, *params = target
+        if kind == "service":
+            return self
+        if kind == "detector":
+            return get_detector()
+        if kind == "recognizer":
+            return get_recognizer(*params)
+        if self.models_only:
+            raise RuntimeError(f"'{kind}' is only served by the primary inference process.")
+        if kind == "store":
+            return get_vector_store(*params)
+        if kind == "prototypes":
+            return get_prototype_index(*params)
+        if kind == "unknown":
+            return get_unknown_store(*params)
+        if kind == "worker":
+            return WORKERS[params[0]]
+        raise ValueError(f"Unknown inference target '{kind}'.")
+
+    def _state(self):
+        # Tiến trình models-only không quản lý phiên bản, không được ghi đè trạng thái của tiến trình chính
+        if self.models_only:
+            return None
+        return get_active_version(), get_migration_versions()
+
+    def handle(self, target: Target, method: str, args: tuple, kwargs: dict) -> Any:
+        if method.startswith("_"):
+            raise AttributeError(f"'{method}' is not callable remotely.")
+        attribute = getattr(self._resolve(target), method)
+        if not callable(attribute):
+            return attribute
+        args, kwargs = resolve_arrays(args, kwargs)
+        if inspect.iscoroutinefunction(attribute):
+            return asyncio.run_coroutine_threadsafe(attribute(*args, **kwargs), self.loop).result()
+        if target[0] == "worker":
+            # Worker sống trong event loop (asyncio.Event không thread-safe)
+            self.loop.call_soon_threadsafe(lambda: attribute(*args, **kwargs))
+            return None
+        return attribute(*args, **kwargs)
+
+    def _serve_connection(self, conn: Connection):
+        with conn:
+            while True:
+                try:
+                    target, method, args, kwargs = conn.recv()
+                except (EOFError, OSError):
+                    return
+                try:
+                    response = (True, self.handle(target, method, args, kwargs), self._state())
+                except Exception as e:
+                    response = (False, e, self._state())
+                try:
+                    conn.send(response)
+                except (EOFError, OSError):
+                    return
+                except Exception as e:
+                    # Kết quả hoặc exception không pickle được
+                    conn.send((False, RuntimeError(f"{target[0]}.{method}: {type(e).__name__}: {e}"), self._state()))
+
+    def _accept(self, listener: Listener):
+        while True:
+            try:
+                conn = listener.accept()
+            except AuthenticationError as e:
+                print(f"Inference service: rejected connection: {e}")
+                continue
+            except OSError:
+                # Listener đã đóng khi tắt tiến trình
+                return
+            threading.Thread(target=self._serve_connection, args=(conn,), daemon=True).start()
+
+    def listen(self, path: str) -> Listener:
+        if os.path.exists(path):
+            os.unlink(path)
+        # Socket chỉ cho phép cùng user kết nối (0600)
+        old_umask = os.umask(0o177)
+        try:
+            listener = Listener(path, family="AF_UNIX", backlog=LISTEN_BACKLOG, authkey=INFERENCE_AUTHKEY)
+        finally:
+            os.umask(old_umask)
+        threading.Thread(target=self._accept, args=(listener,), daemon=True).start()
+        return listener
+
+
+async def _warm_up_models():
+    # Bảng do tiến trình chính tạo; CSDL mới (chưa có bảng) nghĩa là chưa có migration nào
+    try:
+        await run_in_threadpool(load_active_version)
+    except OperationalError:
+        pass
+    await asyncio.gather(run_in_threadpool(get_detector), run_in_threadpool(get_recognizer))
+
+
+async def serve(path: str, models_only: bool):
+    loop = asyncio.get_running_loop()
+    if models_only:
+        await _warm_up_models()
+    else:
+        await startup.warm_up()
+        if not startup.is_ready():
+            raise SystemExit(1)
+
+    listener = InferenceService(loop, models_only).listen(path)
+    print(f"Inference service listening on {path}{' (models only)' if models_only else ''}.")
+    stopped = asyncio.Event()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stopped.set)
+    await stopped.wait()
+
+    listener.close()
+    if os.path.exists(path):
+        os.unlink(path)
+    if not models_only:
+        await startup.stop_background_workers()
+        await close_vector_stores()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Model and vector store process for multi-worker deployments.")
+    parser.add_argument("--socket", default=DEFAULT_SOCKET, help="Unix socket path to listen on.")
+    parser.add_argument(
+        "--models-only",
+        action="store_true",
+        help="Only serve the detector and recognizers (extra inference capacity next to the primary process).",
+    )
+    args = parser.parse_args()
+    asyncio.run(serve(args.socket, args.models_only))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,459 @@
+import asyncio
+import csv
+import io
+import json
+import mimetypes
+import os
+import shutil
+import time
+import uuid
+import zipfile
+from contextlib import suppress
+from datetime import datetime, timezone
+from typing import Dict, List, Optional, Tuple
+
+from fastapi import APIRouter, Depends, File, Form, HTTPException, Path, UploadFile, status
+from pydantic import BaseModel
+from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
+
+from src.auth import get_current_active_user
+from src.database import SessionLocal, get_db
+from src.embeddings import get_active_version, get_image_store, get_recognizer
+from src.faces import add_to_face_groups
+from src.imaging import ImageDecodeError, decode_image, to_bgr_array
+from src.inference_client import RemoteWorker, is_remote
+from src.metrics import scrape_gauge
+from src.model_registry import get_detector
+from src.models import EnrollmentJob, User
+from src.utils import align_largest_face, upload_face_images
+from src.prototypes import get_prototype_index
+from src.quality import FaceQualityError
+from src.vector_store import VectorRecord
+
+JOBS_DIR = os.getenv("ENROLLMENT_JOBS_DIR", "./enrollment_jobs")
+JOB_BATCH_SIZE = int(os.getenv("ENROLLMENT_JOB_BATCH_SIZE", "32"))
+JOB_POLL_INTERVAL = float(os.getenv("ENROLLMENT_JOB_POLL_INTERVAL", "5"))
+MAX_RECORDED_FAILURES = 200
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+# Số ảnh của một lô được tải lên R2 đồng thời
+JOB_UPLOAD_CONCURRENCY = 8
+
+JOB_PENDING = "pending"
+JOB_RUNNING = "running"
+JOB_COMPLETED = "completed"
+JOB_FAILED = "failed"
+
+IMAGE_EXTENSIONS = {".jpg", ".jpeg", ".png", ".webp", ".bmp"}
+MANIFEST_NAMES = ("labels.json", "labels.csv")
+
+router = APIRouter(
+    prefix="/jobs",
+    tags=["jobs"],
+    responses={404: {"description": "Not found"}},
+)
+
+
+class JobFailure(BaseModel):
+    entry: str
+    reason: str
+
+
+class EnrollmentJobOut(BaseModel):
+    id: str
+    status: str
+    total_entries: int
+    processed: int
+    succeeded: int
+    failed: int
+    images_per_second: float
+    error: Optional[str] = None
+    failures: List[JobFailure]
+    created_at: Optional[datetime] = None
+    started_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
+
+
+def _job_out(job: EnrollmentJob) -> EnrollmentJobOut:
+    processed = job.next_index or 0
+    seconds = job.processing_seconds or 0.0
+    return EnrollmentJobOut(
+        id=job.id,
+        status=job.status,
+        total_entries=job.total_entries or 0,
+        processed=processed,
+        succeeded=job.succeeded_count or 0,
+        failed=job.failed_count or 0,
+        images_per_second=round(processed / seconds, 2) if seconds > 0 else 0.0,
+        error=job.error,
+        failures=json.loads(job.failures or "[]"),
+        created_at=job.created_at,
+        started_at=job.started_at,
+        finished_at=job.finished_at,
+    )
+
+
+# --- ARCHIVE LAYOUT ---
+
+def _read_manifest(archive: zipfile.ZipFile, name: str) -> Dict[str, str]:
+    """Đọc labels.json ({"file": "label"}) hoặc labels.csv (file,label)."""
+    raw = archive.read(name).decode("utf-8-sig")
+    if name.endswith(".json"):
+        return {str(k): str(v) for k, v in json.loads(raw).items()}
+    labels = {}
+    for row in csv.reader(io.StringIO(raw)):
+        if len(row) >= 2 and row[0].strip():
+            labels[row[0].strip()] = row[1].strip()
+    return labels
+
+
+def list_archive_entries(archive: zipfile.ZipFile) -> Tuple[List[str], Dict[str, Optional[str]]]:
+    """
+    Liệt kê các ảnh trong archive theo thứ tự cố định và xác định nhãn của từng ảnh.
+
+    Nhãn lấy từ labels.json / labels.csv ở gốc archive (khớp theo đường dẫn
+    hoặc tên file); nếu không có manifest thì dùng tên thư mục chứa ảnh
+    (bố cục thư mục theo từng người).
+    """
+    names = [info.filename for info in archive.infolist() if not info.is_dir()]
+    manifest = {}
+    for manifest_name in MANIFEST_NAMES:
+        if manifest_name in names:
+            manifest = _read_manifest(archive, manifest_name)
+            break
+
+    entries = sorted(
+        name for name in names
+        if os.path.splitext(name)[1].lower() in IMAGE_EXTENSIONS
+        and not name.startswith("__MACOSX/")
+        and not os.path.basename(name).startswith(".")
+    )
+
+    labels = {}
+    for entry in entries:
+        label = manifest.get(entry) or manifest.get(os.path.basename(entry))
+        if not label and not manifest:
+            parts = entry.split("/")
+            label = parts[-2] if len(parts) >= 2 else None
+        labels[entry] = label.strip() if label else None
+    return entries, labels
+
+
+def _write_batch_archive(path: str, files: List[UploadFile], labels: List[str]):
+    """Ghi một lô multipart thành archive ZIP kèm labels.json để worker xử lý như ZIP thường."""
+    manifest = {}
+    with zipfile.ZipFile(path, "w", zipfile.ZIP_STORED) as archive:
+        for i, (file, label) in enumerate(zip(files, labels)):
+            name = f"{i:06d}_{os.path.basename(file.filename or 'image.jpg')}"
+            file.file.seek(0)
+            with archive.open(name, "w") as dst:
+                shutil.copyfileobj(file.file, dst, UPLOAD_CHUNK_SIZE)
+            manifest[name] = label
+        archive.writestr("labels.json", json.dumps(manifest, ensure_ascii=False))
+
+
+async def _save_upload(upload: UploadFile, path: str):
+    """Ghi file tải lên ra đĩa theo từng chunk, không giữ toàn bộ trong bộ nhớ."""
+    with open(path, "wb") as out:
+        while chunk := await upload.read(UPLOAD_CHUNK_SIZE):
+            out.write(chunk)
+
+
+# --- BACKGROUND WORKER ---
+
+def _prepare_image(image_bytes: bytes):
+    image_pil = decode_image(image_bytes)
+    aligned, face = align_largest_face(to_bgr_array(image_pil), get_detector())
+    return image_pil, aligned, face
+
+
+class EnrollmentWorker:
+    """
+    Xử lý lần lượt từng EnrollmentJob trong nền.
+
+    Tiến độ (`next_index`) được commit sau mỗi lô, và point id được sinh
+    cố định từ job id + tên entry, nên khi server khởi động lại job đang
+    chạy sẽ tiếp tục từ lô chưa commit mà không tạo bản ghi trùng.
+    """
+
+    def __init__(self):
+        self._task: Optional[asyncio.Task] = None
+        self._wakeup = asyncio.Event()
+
+    def start(self):
+        os.makedirs(JOBS_DIR, exist_ok=True)
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            with suppress(asyncio.CancelledError):
+                await self._task
+            self._task = None
+
+    def notify(self):
+        """Đánh thức worker ngay khi có job mới."""
+        self._wakeup.set()
+
+    def _next_job_id(self) -> Optional[str]:
+        db = SessionLocal()
+        try:
+            job = (
+                db.query(EnrollmentJob)
+                .filter(EnrollmentJob.status.in_([JOB_PENDING, JOB_RUNNING]))
+                .order_by(EnrollmentJob.created_at)
+                .first()
+            )
+            return job.id if job else None
+        finally:
+            db.close()
+
+    async def _run(self):
+        while True:
+            self._wakeup.clear()
+            job_id = self._next_job_id()
+            if job_id is None:
+                with suppress(asyncio.TimeoutError):
+                    await asyncio.wait_for(self._wakeup.wait(), JOB_POLL_INTERVAL)
+                continue
+
+            try:
+                await self._process_job(job_id)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"Enrollment job {job_id} failed: {e}")
+                self._mark_failed(job_id, str(e))
+
+    def _mark_failed(self, job_id: str, error: str):
+        db = SessionLocal()
+        try:
+            job = db.get(EnrollmentJob, job_id)
+            if job:
+                job.status = JOB_FAILED
+                job.error = error
+                job.finished_at = datetime.now(timezone.utc)
+                db.commit()
+        finally:
+            db.close()
+
+    async def _process_job(self, job_id: str):
+        db: Session = SessionLocal()
+        try:
+            job = db.get(EnrollmentJob, job_id)
+            user = db.get(User, job.user_id)
+            if user is None:
+                raise RuntimeError("Job owner no longer exists.")
+
+            archive = await run_in_threadpool(zipfile.ZipFile, job.archive_path)
+            try:
+                entries, labels = await run_in_threadpool(list_archive_entries, archive)
+                job.status = JOB_RUNNING
+                job.total_entries = len(entries)
+                job.started_at = job.started_at or datetime.now(timezone.utc)
+                db.commit()
+
+                while job.next_index < len(entries):
+                    batch = entries[job.next_index:job.next_index + JOB_BATCH_SIZE]
+                    await self._process_batch(db, job, user, archive, batch, labels)
+            finally:
+                archive.close()
+
+            job.status = JOB_COMPLETED
+            job.finished_at = datetime.now(timezone.utc)
+            db.commit()
+            with suppress(OSError):
+                os.remove(job.archive_path)
+            print(f"Enrollment job {job_id} completed: {job.succeeded_count} ok, {job.failed_count} failed.")
+        finally:
+            db.close()
+
+    async def _process_batch(
+        self,
+        db: Session,
+        job: EnrollmentJob,
+        user: User,
+        archive: zipfile.ZipFile,
+        batch: List[str],
+        labels: Dict[str, Optional[str]],
+    ):
+        started = time.perf_counter()
+        # Cả lô dùng một phiên bản embedding, kể cả khi migration chuyển phiên bản giữa chừng
+        version = get_active_version()
+        recognizer = get_recognizer(version)
+        points = []
+        label_counts: Dict[str, int] = {}
+        failures = []
+        # (entry, label, dữ liệu ảnh, ảnh đã decode, khuôn mặt đã căn chỉnh, face)
+        prepared = []
+
+        for entry in batch:
+            label = labels.get(entry)
+            if not label:
+                failures.append({"entry": entry, "reason": "No label for this file."})
+                continue
+            try:
+                image_bytes = await run_in_threadpool(archive.read, entry)
+                image_pil, aligned, face = await run_in_threadpool(_prepare_image, image_bytes)
+                if aligned is None:
+                    failures.append({"entry": entry, "reason": "No face detected."})
+                    continue
+                prepared.append((entry, label, image_bytes, image_pil, aligned, face))
+            except (ImageDecodeError, FaceQualityError) as e:
+                failures.append({"entry": entry, "reason": str(e)})
+            except Exception as e:
+                print(f"Lỗi khi xử lý {entry} trong job {job.id}: {e}")
+                failures.append({"entry": entry, "reason": "Processing error."})
+
+        # Mọi khuôn mặt của lô được embed trong một lần gọi model
+        embeddings = []
+        if prepared:
+            try:
+                embeddings = await run_in_threadpool(
+                    recognizer.get_normalized_embeddings_aligned, [aligned for *_, aligned, _ in prepared]
+                )
+            except Exception as e:
+                print(f"Lỗi khi embed lô của job {job.id}: {e}")
+                failures.extend({"entry": entry, "reason": "Processing error."} for entry, *_ in prepared)
+                prepared = []
+
+        # Key R2 lấy theo point id (tất định) nên khi lô được chạy lại, ảnh cũ bị ghi đè thay vì bị bỏ rơi
+        semaphore = asyncio.Semaphore(JOB_UPLOAD_CONCURRENCY)
+
+        async def upload(point_id: str, image_pil, face, image_bytes: bytes):
+            async with semaphore:
+                return await upload_face_images(image_pil, face["bbox"], image_bytes, key=point_id)
+
+        point_ids = [str(uuid.uuid5(uuid.NAMESPACE_URL, f"{job.id}/{entry}")) for entry, *_ in prepared]
+        uploads = await asyncio.gather(
+            *(
+                upload(point_id, image_pil, face, image_bytes)
+                for point_id, (_, _, image_bytes, image_pil, _, face) in zip(point_ids, prepared)
+            ),
+            return_exceptions=True,
+        )
+        for point_id, (entry, label, *_), embedding, image_urls in zip(point_ids, prepared, embeddings, uploads):
+            if isinstance(image_urls, Exception):
+                print(f"Lỗi khi tải {entry} của job {job.id} lên R2: {image_urls}")
+                failures.append({"entry": entry, "reason": "Processing error."})
+                continue
+            points.append(
+                VectorRecord(
+                    id=point_id,
+                    vector=embedding,
+                    payload={
+                        **image_urls,
+                        "user_id": user.username,
+                        "content_type": mimetypes.guess_type(entry)[0] or "image/jpeg",
+                        "name": label,
+                    },
+                )
+            )
+            label_counts[label] = label_counts.get(label, 0) + 1
+
+        if points:
+            await get_image_store(version).upsert(points)
+            # Id điểm là tất định nên một lô có thể được ghi lại sau khi khởi động lại;
+            # dựng lại prototype của các nhóm trong lô thay vì cộng dồn để tránh đếm trùng
+            await get_prototype_index(version).rebuild(user.username, names=label_counts)
+
+        # Số ảnh của nhóm và con trỏ tiến độ được commit cùng nhau
+        add_to_face_groups(db, user.id, label_counts)
+        recorded = json.loads(job.failures or "[]")
+        job.failures = json.dumps((recorded + failures)[:MAX_RECORDED_FAILURES], ensure_ascii=False)
+        job.next_index += len(batch)
+        job.succeeded_count += len(points)
+        job.failed_count += len(failures)
+        job.processing_seconds += time.perf_counter() - started
+        db.commit()
+
+
+# Khi chạy nhiều worker, job được xử lý ở tiến trình inference chính (src/inference_service.py)
+enrollment_worker = RemoteWorker("enrollment") if is_remote() else EnrollmentWorker()
+
+
+def queued_job_count() -> int:
+    db = SessionLocal()
+    try:
+        return db.query(EnrollmentJob).filter(EnrollmentJob.status.in_([JOB_PENDING, JOB_RUNNING])).count()
+    finally:
+        db.close()
+
+
+scrape_gauge("face_enrollment_jobs_queued", "Enrollment jobs pending or running.", queued_job_count)
+
+
+# --- API ENDPOINTS ---
+
+@router.post("/enroll", response_model=EnrollmentJobOut, status_code=status.HTTP_202_ACCEPTED)
+async def create_enrollment_job(
+    archive: Optional[UploadFile] = File(None, description="ZIP chứa labels.json/labels.csv hoặc thư mục theo từng người."),
+    files: Optional[List[UploadFile]] = File(None),
+    labels: Optional[List[str]] = Form(None),
+    current_user: User = Depends(get_current_active_user),
+    db: Session = Depends(get_db),
+):
+    """
+    Tạo job đăng ký khuôn mặt hàng loạt và trả về job id ngay lập tức.
+    Gửi `archive` (ZIP) hoặc một lô `files` + `labels` như /images/upload-faces.
+    """
+    if (archive is None) == (not files):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Provide either an 'archive' ZIP or 'files' with 'labels'.",
+        )
+
+    os.makedirs(JOBS_DIR, exist_ok=True)
+    job_id = str(uuid.uuid4())
+    archive_path = os.path.join(JOBS_DIR, f"{job_id}.zip")
+
+    try:
+        if archive is not None:
+            await _save_upload(archive, archive_path)
+            if not zipfile.is_zipfile(archive_path):
+                raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Archive must be a ZIP file.")
+        else:
+            if not labels or len(files) != len(labels):
+                raise HTTPException(
+                    status_code=status.HTTP_400_BAD_REQUEST,
+                    detail=f"Số lượng file ({len(files)}) và số lượng nhãn ({len(labels or [])}) không khớp.",
+                )
+            await run_in_threadpool(_write_batch_archive, archive_path, files, labels)
+    except HTTPException:
+        with suppress(OSError):
+            os.remove(archive_path)
+        raise
+
+    job = EnrollmentJob(id=job_id, user_id=current_user.id, status=JOB_PENDING, archive_path=archive_path)
+    db.add(job)
+    db.commit()
+    db.refresh(job)
+    enrollment_worker.notify()
+    return _job_out(job)
+
+
+@router.get("/", response_model=List[EnrollmentJobOut])
+def list_enrollment_jobs(
+    current_user: User = Depends(get_current_active_user),
+    db: Session = Depends(get_db),
+):
+    jobs = (
+        db.query(EnrollmentJob)
+        .filter_by(user_id=current_user.id)
+        .order_by(EnrollmentJob.created_at.desc())
+        .all()
+    )
+    return [_job_out(job) for job in jobs]
+
+
+@router.get("/{job_id}", response_model=EnrollmentJobOut)
+def get_enrollment_job(
+    job_id: str = Path(..., description="ID của job"),
+    current_user: User = Depends(get_current_active_user),
+    db: Session = Depends(get_db),
+):
+    """Trả về tiến độ của job: số ảnh đã xử lý, thất bại và tốc độ xử lý."""
+    job = db.get(EnrollmentJob, job_id)
+    if job is None or job.user_id != current_user.id:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Job not found")
+    return _job_out(job)
@@ -0,0 +1,117 @@
+"""
+Số liệu vận hành ở định dạng văn bản của Prometheus (`GET /metrics`).
+
+Các module tự khai báo số liệu của mình bằng prometheus_client ở mức module
+(vd. thời gian từng bước xử lý khung hình trong src/streaming.py);
+`http_metrics` đo mọi route HTTP theo mẫu đường dẫn (vd. `/faces/{face_id}`)
+để số series không tăng theo id.
+
+Khi chạy nhiều worker (scripts/serve.sh), PROMETHEUS_MULTIPROC_DIR được đặt
+cho mọi tiến trình: mỗi tiến trình ghi số liệu vào file mmap trong thư mục đó
+và /metrics gộp số liệu của mọi tiến trình, dù request rơi vào worker nào.
+Gauge theo tiến trình (vd. số phiên stream) dùng `multiprocess_mode="livesum"`
+và được cập nhật khi giá trị đổi. Số liệu đọc được từ bất kỳ tiến trình nào
+(vd. số job trong database) khai báo bằng `scrape_gauge`, được tính lúc scrape
+ở tiến trình trả lời request.
+"""
+import os
+import time
+from typing import Callable
+
+from fastapi import APIRouter, Request
+from fastapi.responses import Response
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    REGISTRY,
+    CollectorRegistry,
+    Histogram,
+    disable_created_metrics,
+    generate_latest,
+    multiprocess,
+)
+from prometheus_client.core import GaugeMetricFamily
+
+# Tắt để bỏ hẳn middleware đo request HTTP
+HTTP_METRICS = os.getenv("HTTP_METRICS", "true").lower() in ("1", "true", "yes")
+
+# Gộp số liệu của mọi tiến trình qua các file trong thư mục này (xem scripts/serve.sh)
+MULTIPROCESS = bool(os.getenv("PROMETHEUS_MULTIPROC_DIR"))
+
+# Giây; đủ dải từ một lần decode (vài ms) tới một lần embed gallery của cascade
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Không xuất series *_created của counter / histogram
+disable_created_metrics()
+
+router = APIRouter(
+    tags=["metrics"],
+)
+
+
+class _ScrapeGauge:
+    """Collector của một gauge tính lúc scrape."""
+
+    def __init__(self, name: str, documentation: str, function: Callable[[], float]):
+        self.name = name
+        self.documentation = documentation
+        self.function = function
+
+    def describe(self):
+        return [GaugeMetricFamily(self.name, self.documentation)]
+
+    def collect(self):
+        try:
+            value = self.function()
+        except Exception as e:
+            print(f"Metric {self.name} unavailable: {e}")
+            return
+        yield GaugeMetricFamily(self.name, self.documentation, value=value)
+
+
+# Gauge tính lúc scrape nằm ngoài REGISTRY: ở chế độ nhiều tiến trình chúng không có file mmap
+_scrape_registry = CollectorRegistry()
+
+
+def scrape_gauge(name: str, documentation: str, function: Callable[[], float]):
+    """Gauge đọc giá trị tại thời điểm scrape; `function` phải cho cùng kết quả ở mọi tiến trình."""
+    gauge = _ScrapeGauge(name, documentation, function)
+    _scrape_registry.register(gauge)
+    return gauge
+
+
+def render_metrics() -> bytes:
+    if MULTIPROCESS:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry) + generate_latest(_scrape_registry)
+
+
+HTTP_REQUEST_SECONDS = Histogram(
+    "face_http_request_seconds",
+    "HTTP request latency by route template.",
+    ("method", "route", "status"),
+    buckets=LATENCY_BUCKETS,
+)
+
+
+async def http_metrics(request: Request, call_next):
+    """Middleware HTTP: đo thời gian mỗi request theo method, mẫu route và status."""
+    started = time.perf_counter()
+    response = await call_next(request)
+    # Router ghi route khớp vào scope; request không khớp route nào gộp chung một nhãn
+    route = request.scope.get("route")
+    HTTP_REQUEST_SECONDS.labels(
+        request.method,
+        getattr(route, "path", "unmatched"),
+        str(response.status_code),
+    ).observe(time.perf_counter() - started)
+    return response
+
+
+# --- API ENDPOINTS ---
+
+@router.get("/metrics")
+def get_metrics():
+    return Response(render_metrics(), media_type=CONTENT_TYPE_LATEST)
@@ -0,0 +1,78 @@
+"""
+API quản trị model: xem các model đang nạp và hot-swap (xem src/model_registry.py).
+"""
+from datetime import datetime
+from typing import List, Optional
+
+from fastapi import APIRouter, Depends, HTTPException, Path, status
+from pydantic import BaseModel, Field
+from starlette.concurrency import run_in_threadpool
+
+from src.auth import get_current_admin_user
+from src.embeddings import swap_recognizer
+from src.model_registry import InvalidModelNameError, LoadedModel, ModelSwapError, model_entries, swap_detector
+from src.models import User
+
+router = APIRouter(
+    prefix="/models",
+    tags=["models"],
+    responses={404: {"description": "Not found"}},
+)
+
+
+class LoadedModelOut(BaseModel):
+    role: str
+    name: str
+    path: str
+    sha256: str
+    loaded_at: datetime
+
+
+class SwapDetector(BaseModel):
+    name: Optional[str] = Field(None, description="Tên detector mới (models/<name>.onnx); mặc định nạp lại file hiện tại.")
+
+
+def _model_out(entry: LoadedModel) -> LoadedModelOut:
+    return LoadedModelOut(role=entry.role, name=entry.name, path=entry.path, sha256=entry.sha256, loaded_at=entry.loaded_at)
+
+
+async def _swap(swap, *args) -> LoadedModelOut:
+    try:
+        entry = await run_in_threadpool(swap, *args)
+    except FileNotFoundError as e:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=str(e))
+    except InvalidModelNameError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    except ModelSwapError as e:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=str(e))
+    except Exception as e:
+        print(f"Model swap failed: {e}")
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"Cannot load model: {e}")
+    return _model_out(entry)
+
+
+@router.get("/", response_model=List[LoadedModelOut])
+def list_models(current_user: User = Depends(get_current_admin_user)):
+    return [_model_out(entry) for entry in model_entries()]
+
+
+@router.post("/detector/swap", response_model=LoadedModelOut)
+async def swap_detector_model(request: SwapDetector, current_user: User = Depends(get_current_admin_user)):
+    """
+    Nạp và warm-up detector mới rồi thay detector đang dùng. Request và stream
+    đang chạy hoàn tất với detector cũ; không cần khởi động lại server.
+    """
+    return await _swap(swap_detector, request.name.strip() if request.name else None)
+
+
+@router.post("/recognizers/{version}/swap", response_model=LoadedModelOut)
+async def swap_recognizer_model(
+    version: str = Path(..., description="Phiên bản embedding (models/<version>.onnx)"),
+    current_user: User = Depends(get_current_admin_user),
+):
+    """
+    Nạp lại models/<version>.onnx (vd. bản export tối ưu của cùng trọng số) và thay
+    recognizer đang dùng. Bị từ chối (409) nếu embedding khác model hiện tại; để đổi
+    sang model khác, dùng migration ở /embeddings/migrations.
+    """
+    return await _swap(swap_recognizer, version)
@@ -0,0 +1,215 @@
+"""
+Registry các model ONNX (detector và recognizer) và hot-swap không gián đoạn.
+
+Mỗi vai trò ("detector", "recognizer/<phiên bản embedding>") trỏ tới một
+model đã nạp. Code xử lý lấy model qua `get_detector()` / `get_recognizer()`
+ở đầu mỗi request hoặc khung hình thay vì giữ biến toàn cục, nên khi swap:
+
+1. Model mới được nạp và warm-up (một lần inference giả) trong threadpool,
+   trong lúc model cũ vẫn phục vụ.
+2. Tham chiếu trong registry được thay bằng một phép gán (nguyên tử).
+3. Request đang chạy vẫn giữ model cũ cho tới khi xong; session cũ được giải
+   phóng khi không còn ai tham chiếu. WebSocket không bị ngắt.
+
+Recognizer của một phiên bản embedding chỉ được thay bằng file cho embedding
+tương đương (vd. bản export tối ưu / fp16 của cùng trọng số), vì gallery đã
+được embed bằng model cũ; đổi sang model khác phải đi qua migration
+(src/reembedding.py).
+"""
+import hashlib
+import os
+import re
+import threading
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from typing import TYPE_CHECKING, Callable, Dict, List, Optional
+
+import numpy as np
+
+from src.inference_client import SERVICE_TARGET, call, call_all, is_remote, remote_detector
+
+if TYPE_CHECKING:
+    from lib.uniface.detection.srcfd import SCRFD
+    from lib.uniface.recogition.models import ArcFace
+
+MODELS_DIR = os.getenv("EMBEDDING_MODELS_DIR", "models")
+# Tên detector (models/<tên>.onnx) dùng khi khởi động
+DETECTOR_MODEL = os.getenv("DETECTOR_MODEL", "scrfd_500m_kps")
+# Cosine similarity tối thiểu giữa embedding của recognizer cũ và mới trên ảnh mẫu
+RECOGNIZER_SWAP_MIN_SIMILARITY = float(os.getenv("RECOGNIZER_SWAP_MIN_SIMILARITY", "0.99"))
+
+DETECTOR_ROLE = "detector"
+RECOGNIZER_ROLE_PREFIX = "recognizer/"
+# Tên model là tên file trong MODELS_DIR (không gồm đuôi .onnx), không được chứa đường dẫn
+MODEL_NAME_PATTERN = re.compile(r"^[\w.-]+$")
+
+# Ảnh mẫu cố định để warm-up và so sánh recognizer cũ / mới
+_PROBE_FACE = np.random.default_rng(0).integers(0, 256, size=(112, 112, 3), dtype=np.uint8)
+_PROBE_FRAME = np.zeros((640, 640, 3), dtype=np.uint8)
+
+
+class ModelSwapError(ValueError):
+    """Model mới không thể thay thế model đang dùng."""
+
+
+class InvalidModelNameError(ValueError):
+    """Tên model không phải một tên file hợp lệ trong MODELS_DIR."""
+
+
+@dataclass
+class LoadedModel:
+    role: str
+    name: str
+    path: str
+    sha256: str
+    loaded_at: datetime
+    model: object
+
+
+def model_path(name: str) -> str:
+    if not MODEL_NAME_PATTERN.match(name):
+        raise InvalidModelNameError(f"Invalid model name '{name}': use letters, digits, '_', '.' or '-'.")
+    return os.path.join(MODELS_DIR, f"{name}.onnx")
+
+
+def _file_sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def load_detector(path: str) -> "SCRFD":
+    # onnxruntime chỉ được import khi nạp model đầu tiên
+    from lib.uniface.detection.srcfd import SCRFD
+
+    detector = SCRFD(model_path=path)
+    detector.detect(_PROBE_FRAME)
+    return detector
+
+
+def load_recognizer(path: str) -> "ArcFace":
+    from lib.uniface.recogition.models import ArcFace
+
+    recognizer = ArcFace(model_path=path)
+    recognizer.get_normalized_embeddings_aligned([_PROBE_FACE])
+    return recognizer
+
+
+def check_recognizer_compatible(current: "ArcFace", candidate: "ArcFace"):
+    """Từ chối recognizer cho embedding khác với recognizer hiện tại trên ảnh mẫu."""
+    if candidate.output_shape[-1] != current.output_shape[-1]:
+        raise ModelSwapError(
+            f"New model outputs {candidate.output_shape[-1]}-d embeddings, expected {current.output_shape[-1]}."
+        )
+    old, new = (model.get_normalized_embeddings_aligned([_PROBE_FACE])[0] for model in (current, candidate))
+    similarity = float(np.dot(old, new))
+    if similarity < RECOGNIZER_SWAP_MIN_SIMILARITY:
+        raise ModelSwapError(
+            f"New model's embeddings differ from the current ones (similarity {similarity:.3f} < "
+            f"{RECOGNIZER_SWAP_MIN_SIMILARITY}); switch models with an embedding migration instead."
+        )
+
+
+class ModelRegistry:
+    """
+    Model đã nạp theo vai trò. Đọc không cần khóa; nạp và swap được tuần tự hóa
+    theo từng vai trò, nên các model khác nhau có thể nạp song song khi khởi động.
+    """
+
+    def __init__(self):
+        self._models: Dict[str, LoadedModel] = {}
+        self._locks: Dict[str, threading.Lock] = {}
+        self._locks_guard = threading.Lock()
+
+    def _lock(self, role: str) -> threading.Lock:
+        with self._locks_guard:
+            return self._locks.setdefault(role, threading.Lock())
+
+    def _load(self, role: str, name: str, path: str, loader: Callable[[str], object]) -> LoadedModel:
+        if not os.path.isfile(path):
+            raise FileNotFoundError(f"Model file '{path}' not found.")
+        return LoadedModel(
+            role=role,
+            name=name,
+            path=path,
+            sha256=_file_sha256(path),
+            loaded_at=datetime.now(timezone.utc),
+            model=loader(path),
+        )
+
+    def get(self, role: str, name: str, path: str, loader: Callable[[str], object]) -> object:
+        """Model của `role`, nạp (và warm-up) ở lần gọi đầu tiên."""
+        entry = self._models.get(role)
+        if entry is None:
+            with self._lock(role):
+                entry = self._models.get(role)
+                if entry is None:
+                    entry = self._models[role] = self._load(role, name, path, loader)
+        return entry.model
+
+    def swap(
+        self,
+        role: str,
+        name: str,
+        path: str,
+        loader: Callable[[str], object],
+        check: Optional[Callable[[object, object], None]] = None,
+    ) -> LoadedModel:
+        """
+        Nạp và warm-up model mới rồi thay model của `role`. Chạy đồng bộ (tốn thời gian),
+        gọi qua run_in_threadpool. `check(current, candidate)` có thể raise ModelSwapError.
+        Chỉ thay được vai trò đã nạp: model đầu tiên của một vai trò được nạp qua `get`.
+        """
+        with self._lock(role):
+            current = self._models.get(role)
+            if current is None:
+                raise ModelSwapError(f"No '{role}' model is loaded, nothing to swap.")
+            entry = self._load(role, name, path, loader)
+            if check is not None:
+                check(current.model, entry.model)
+            self._models[role] = entry
+        print(f"Model '{role}' swapped to {name} ({entry.sha256[:12]}).")
+        return entry
+
+    def entries(self) -> List[LoadedModel]:
+        return sorted(self._models.values(), key=lambda entry: entry.role)
+
+    def entry(self, role: str) -> Optional[LoadedModel]:
+        return self._models.get(role)
+
+
+registry = ModelRegistry()
+
+
+def get_detector() -> "SCRFD":
+    """
+    Detector đang dùng; lấy lại ở mỗi request để hot-swap có hiệu lực ngay.
+    Khi chạy nhiều worker (INFERENCE_SOCKETS) đây là proxy tới tiến trình inference.
+    """
+    if is_remote():
+        return remote_detector()
+    return registry.get(DETECTOR_ROLE, DETECTOR_MODEL, model_path(DETECTOR_MODEL), load_detector)
+
+
+def get_detector_name() -> str:
+    entry = registry.entry(DETECTOR_ROLE)
+    return entry.name if entry else DETECTOR_MODEL
+
+
+def model_entries() -> List[LoadedModel]:
+    """Các model đang nạp (của tiến trình inference chính khi chạy nhiều worker)."""
+    if is_remote():
+        return call(SERVICE_TARGET, "model_entries")
+    return registry.entries()
+
+
+def swap_detector(name: Optional[str] = None) -> LoadedModel:
+    """Thay detector (mặc định nạp lại file hiện tại) ở tiến trình này hoặc ở mọi tiến trình inference."""
+    if name is not None:
+        model_path(name)
+    if is_remote():
+        return call_all(SERVICE_TARGET, "swap_detector", name)[0]
+    name = name or get_detector_name()
+    return registry.swap(DETECTOR_ROLE, name, model_path(name), load_detector)
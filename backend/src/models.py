@@ -1,4 +1,4 @@
-from sqlalchemy import Column, DateTime, ForeignKey, Integer, String
+from sqlalchemy import Boolean, Column, DateTime, Float, ForeignKey, Integer, String, Text
 from sqlalchemy.sql import func
 
 from .database import Base
@@ -25,3 +25,110 @@ class FaceGroup(Base):
 
     # ADD THIS LINE
     last_seen_at = Column(DateTime(timezone=True), nullable=True)
+
+
+class EnrollmentJob(Base):
+    __tablename__ = "enrollment_jobs"
+
+    id = Column(String, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False, index=True)
+
+    # pending -> running -> completed | failed
+    status = Column(String, nullable=False, default="pending", index=True)
+    archive_path = Column(String, nullable=False)
+    error = Column(Text, nullable=True)
+
+    total_entries = Column(Integer, default=0)
+    # Vị trí entry tiếp theo cần xử lý, dùng để tiếp tục job sau khi khởi động lại
+    next_index = Column(Integer, default=0)
+    succeeded_count = Column(Integer, default=0)
+    failed_count = Column(Integer, default=0)
+    # JSON list [{"entry": ..., "reason": ...}], bị giới hạn số lượng
+    failures = Column(Text, default="[]")
+    processing_seconds = Column(Float, default=0.0)
+
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    started_at = Column(DateTime(timezone=True), nullable=True)
+    finished_at = Column(DateTime(timezone=True), nullable=True)
+
+
+class EmbeddingMigration(Base):
+    __tablename__ = "embedding_migrations"
+
+    id = Column(String, primary_key=True, index=True)
+    source_version = Column(String, nullable=False)
+    target_version = Column(String, nullable=False)
+
+    # pending -> running -> completed | failed
+    status = Column(String, nullable=False, default="pending", index=True)
+    # copy: re-embed theo thứ tự scroll; verify: đối soát và chuyển sang phiên bản mới
+    phase = Column(String, nullable=False, default="copy")
+    # Offset scroll của collection nguồn, dùng để tiếp tục sau khi khởi động lại
+    scroll_offset = Column(String, nullable=True)
+    error = Column(Text, nullable=True)
+    # Số ảnh không re-embed được mà vẫn cho phép chuyển phiên bản
+    max_failures = Column(Integer, default=0)
+
+    source_total = Column(Integer, default=0)
+    processed_count = Column(Integer, default=0)
+    embedded_count = Column(Integer, default=0)
+    failed_count = Column(Integer, default=0)
+    # JSON list [{"id": ..., "reason": ...}], bị giới hạn số lượng
+    failures = Column(Text, default="[]")
+    processing_seconds = Column(Float, default=0.0)
+
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    started_at = Column(DateTime(timezone=True), nullable=True)
+    finished_at = Column(DateTime(timezone=True), nullable=True)
+
+
+class CompactionJob(Base):
+    __tablename__ = "compaction_jobs"
+
+    id = Column(String, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False, index=True)
+
+    # pending -> running -> completed | failed
+    status = Column(String, nullable=False, default="pending", index=True)
+    # dry run chỉ lập báo cáo, không xóa gì
+    dry_run = Column(Boolean, nullable=False, default=True)
+    threshold = Column(Float, nullable=False)
+    min_keep = Column(Integer, nullable=False, default=1)
+    # JSON list tên nhóm cần xử lý (null: mọi nhóm của user, chốt khi job bắt đầu)
+    group_names = Column(Text, nullable=True)
+    error = Column(Text, nullable=True)
+
+    groups_total = Column(Integer, default=0)
+    # Số nhóm đã xử lý xong, dùng để tiếp tục job sau khi khởi động lại
+    groups_processed = Column(Integer, default=0)
+    images_before = Column(Integer, default=0)
+    images_removed = Column(Integer, default=0)
+    # Báo cáo từng nhóm nằm ở CompactionGroupReport
+    processing_seconds = Column(Float, default=0.0)
+
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    started_at = Column(DateTime(timezone=True), nullable=True)
+    finished_at = Column(DateTime(timezone=True), nullable=True)
+
+
+class CompactionGroupReport(Base):
+    __tablename__ = "compaction_group_reports"
+
+    id = Column(Integer, primary_key=True)
+    job_id = Column(String, ForeignKey("compaction_jobs.id"), nullable=False, index=True)
+    name = Column(String, nullable=False)
+    images_before = Column(Integer, default=0)
+    images_after = Column(Integer, default=0)
+    # JSON list id ảnh bị đánh dấu trùng lặp, bị giới hạn số lượng
+    removed_ids = Column(Text, default="[]")
+
+
+class PendingImageDeletion(Base):
+    """Ảnh R2 cần xóa, ghi cùng transaction với thay đổi gallery để không bị mất khi dừng giữa chừng."""
+
+    __tablename__ = "pending_image_deletions"
+
+    id = Column(Integer, primary_key=True)
+    image_url = Column(Text, nullable=False)
+
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
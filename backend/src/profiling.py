@@ -0,0 +1,386 @@
+"""
+Chế độ profiling lấy mẫu, bật / tắt bởi admin khi server đang chạy.
+
+Khi một phiên profiling đang chạy, mỗi request HTTP và mỗi khung hình stream
+được chọn ngẫu nhiên với xác suất `sample_rate`. Trong lúc có ít nhất một
+request / khung hình được chọn đang xử lý, một thread lấy mẫu đọc stack của
+mọi thread (`sys._current_frames()`) mỗi PROFILE_INTERVAL_MS và đếm từng
+stack; thread đang rảnh (event loop chờ I/O, thread pool chờ việc) bị bỏ qua.
+Ngoài phiên profiling không có thread nào chạy và mỗi request chỉ tốn một
+phép so sánh.
+
+Stack được lấy trên toàn tiến trình nên khi nhiều request chạy đồng thời,
+mẫu gồm cả công việc của request không được chọn: báo cáo cho biết thời gian
+của tiến trình đi đâu trong lúc phục vụ các mẫu, không phải của riêng từng
+request. Phiên chỉ áp dụng cho tiến trình nhận lệnh, nên khi chạy nhiều worker
+(src/inference_client.py) không bật được profiling: request rơi ngẫu nhiên vào
+các worker, lệnh dừng / xem trạng thái sẽ không tới đúng worker đã bật phiên.
+Để profile, chạy một worker (WEB_CONCURRENCY=1).
+
+Khi dừng (hoặc hết `duration_seconds`), báo cáo được ghi vào PROFILE_DIR:
+`<id>.collapsed` (collapsed stacks, dùng trực tiếp với flamegraph.pl /
+speedscope) và `<id>.json` (thời gian self / total theo hàm).
+"""
+import json
+import os
+import random
+import re
+import secrets
+import sys
+import threading
+import time
+from collections import Counter
+from dataclasses import asdict, dataclass, field
+from datetime import datetime, timezone
+from functools import lru_cache
+from types import CodeType, FrameType
+from typing import Dict, List, Optional
+
+from fastapi import APIRouter, Depends, HTTPException, Path, Query, Request, status
+from fastapi.responses import FileResponse
+from pydantic import BaseModel, Field
+
+from src.auth import get_current_admin_user
+from src.inference_client import is_remote
+from src.models import User
+
+PROFILE_DIR = os.getenv("PROFILE_DIR", "./profiles")
+PROFILE_INTERVAL_MS = float(os.getenv("PROFILE_INTERVAL_MS", "10"))
+# Phiên tự dừng sau thời gian này nếu admin không chỉ định (giây)
+PROFILE_MAX_SECONDS = int(os.getenv("PROFILE_MAX_SECONDS", "600"))
+# Frame sâu hơn bị cắt để giới hạn chi phí mỗi lần lấy mẫu
+PROFILE_MAX_DEPTH = 128
+# Request tới các đường dẫn này không bao giờ được lấy mẫu
+PROFILE_EXEMPT_PATHS = ("/profiling", "/metrics", "/health")
+
+# <thời điểm>-<pid>-<hậu tố ngẫu nhiên>; báo cáo cũ không có hậu tố
+REPORT_ID_PATTERN = r"^[0-9]{8}-[0-9]{6}-[0-9]+(-[0-9a-f]{8})?$"
+
+# (file, hàm) của frame đầu tiên (tính từ lá, bỏ qua threading / selectors) khi thread đang rảnh
+_IDLE_FRAMES = {
+    ("base_events.py", "_run_once"),
+    ("queue.py", "get"),
+    ("thread.py", "_worker"),
+}
+_WAIT_MODULES = ("threading.py", "selectors.py")
+
+router = APIRouter(
+    prefix="/profiling",
+    tags=["profiling"],
+    responses={404: {"description": "Not found"}},
+)
+
+
+@dataclass
+class ProfileSession:
+    id: str
+    sample_rate: float
+    interval_ms: float
+    started_at: datetime
+    deadline: float
+    stopped_at: Optional[datetime] = None
+    # Số lần thread lấy mẫu đọc stack (có ít nhất một mẫu đang xử lý)
+    ticks: int = 0
+    # Request / khung hình được chọn và tổng thời gian xử lý của chúng, theo loại
+    units: Dict[str, int] = field(default_factory=dict)
+    unit_seconds: Dict[str, float] = field(default_factory=dict)
+    stacks: Counter = field(default_factory=Counter)
+
+
+@dataclass
+class ProfileSample:
+    session: ProfileSession
+    kind: str
+    started: float
+
+
+@lru_cache(maxsize=None)
+def _short_path(filename: str) -> str:
+    for marker in ("site-packages/", "backend/"):
+        index = filename.rfind(marker)
+        if index >= 0:
+            return filename[index + len(marker):]
+    return os.path.basename(filename)
+
+
+@lru_cache(maxsize=16384)
+def _frame_label(code: CodeType) -> str:
+    name = getattr(code, "co_qualname", code.co_name)
+    return f"{name} ({_short_path(code.co_filename)})"
+
+
+def _is_idle(frame: FrameType) -> bool:
+    while frame is not None and os.path.basename(frame.f_code.co_filename) in _WAIT_MODULES:
+        frame = frame.f_back
+    return frame is not None and (os.path.basename(frame.f_code.co_filename), frame.f_code.co_name) in _IDLE_FRAMES
+
+
+class Profiler:
+    def __init__(self):
+        self.session: Optional[ProfileSession] = None
+        self.last: Optional[ProfileSession] = None
+        self._active = 0
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self, sample_rate: float, duration_seconds: int) -> ProfileSession:
+        with self._lock:
+            if self.session is not None:
+                raise RuntimeError(f"Profiling session {self.session.id} is already running.")
+            started_at = datetime.now(timezone.utc)
+            self.session = ProfileSession(
+                # Hai phiên trong cùng một giây không được ghi đè báo cáo của nhau
+                id=f"{started_at:%Y%m%d-%H%M%S}-{os.getpid()}-{secrets.token_hex(4)}",
+                sample_rate=sample_rate,
+                interval_ms=PROFILE_INTERVAL_MS,
+                started_at=started_at,
+                deadline=time.monotonic() + duration_seconds,
+            )
+            self._stopped.clear()
+            self._thread = threading.Thread(target=self._run, args=(self.session,), name="profiler", daemon=True)
+            self._thread.start()
+            return self.session
+
+    def stop(self) -> Optional[ProfileSession]:
+        """Dừng phiên đang chạy và ghi báo cáo; trả về phiên đó (None nếu không có phiên nào)."""
+        with self._lock:
+            session, thread = self.session, self._thread
+            if session is None:
+                return None
+            self.session = None
+            self._thread = None
+            self._stopped.set()
+        if thread is not threading.current_thread():
+            thread.join()
+        session.stopped_at = datetime.now(timezone.utc)
+        write_report(session)
+        self.last = session
+        return session
+
+    def begin(self, kind: str) -> Optional[ProfileSample]:
+        session = self.session
+        if session is None or random.random() >= session.sample_rate:
+            return None
+        with self._lock:
+            self._active += 1
+        return ProfileSample(session, kind, time.perf_counter())
+
+    def end(self, sample: ProfileSample):
+        seconds = time.perf_counter() - sample.started
+        with self._lock:
+            self._active -= 1
+            session = sample.session
+            session.units[sample.kind] = session.units.get(sample.kind, 0) + 1
+            session.unit_seconds[sample.kind] = session.unit_seconds.get(sample.kind, 0.0) + seconds
+
+    def _run(self, session: ProfileSession):
+        interval = session.interval_ms / 1000
+        while not self._stopped.wait(interval):
+            if time.monotonic() >= session.deadline:
+                print(f"Profiling session {session.id} reached its time limit.")
+                self.stop()
+                return
+            if self._active > 0:
+                self._sample(session)
+
+    def _sample(self, session: ProfileSession):
+        own = threading.get_ident()
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+        session.ticks += 1
+        for ident, frame in sys._current_frames().items():
+            if ident == own or _is_idle(frame):
+                continue
+            labels = []
+            while frame is not None and len(labels) < PROFILE_MAX_DEPTH:
+                labels.append(_frame_label(frame.f_code))
+                frame = frame.f_back
+            labels.append(names.get(ident, f"thread-{ident}"))
+            session.stacks[";".join(reversed(labels))] += 1
+
+
+_profiler = Profiler()
+
+
+def begin_sample(kind: str) -> Optional[ProfileSample]:
+    """Chọn ngẫu nhiên một đơn vị công việc (request, khung hình) để lấy mẫu; None nếu không chọn."""
+    return _profiler.begin(kind)
+
+
+def end_sample(sample: Optional[ProfileSample]):
+    if sample is not None:
+        _profiler.end(sample)
+
+
+async def profile_requests(request: Request, call_next):
+    """Middleware HTTP: lấy mẫu request theo `sample_rate` của phiên profiling đang chạy."""
+    if _profiler.session is None or request.url.path.startswith(PROFILE_EXEMPT_PATHS):
+        return await call_next(request)
+    sample = begin_sample("http")
+    try:
+        return await call_next(request)
+    finally:
+        end_sample(sample)
+
+
+def stop_profiling():
+    _profiler.stop()
+
+
+# --- REPORT ---
+
+class FunctionTime(BaseModel):
+    function: str
+    self_seconds: float
+    total_seconds: float
+
+
+class ProfileSummary(BaseModel):
+    id: str
+    running: bool
+    sample_rate: float
+    interval_ms: float
+    started_at: datetime
+    stopped_at: Optional[datetime] = None
+    samples: int
+    # Số request / khung hình được lấy mẫu và thời gian xử lý trung bình (ms), theo loại
+    units: Dict[str, int]
+    unit_ms: Dict[str, float]
+
+
+class ProfileReport(ProfileSummary):
+    # Sắp xếp theo self time giảm dần
+    functions: List[FunctionTime]
+
+
+def _summary(session: ProfileSession, running: bool = False) -> ProfileSummary:
+    return ProfileSummary(
+        id=session.id,
+        running=running,
+        sample_rate=session.sample_rate,
+        interval_ms=session.interval_ms,
+        started_at=session.started_at,
+        stopped_at=session.stopped_at,
+        samples=session.ticks,
+        units=dict(session.units),
+        unit_ms={
+            kind: round(1000 * seconds / session.units[kind], 2) for kind, seconds in session.unit_seconds.items()
+        },
+    )
+
+
+def _function_times(session: ProfileSession) -> List[FunctionTime]:
+    self_counts: Counter = Counter()
+    total_counts: Counter = Counter()
+    for stack, count in session.stacks.items():
+        # Phần tử đầu là tên thread
+        frames = stack.split(";")[1:]
+        if frames:
+            self_counts[frames[-1]] += count
+        # Hàm đệ quy chỉ được tính một lần cho mỗi stack
+        for label in set(frames):
+            total_counts[label] += count
+    seconds = session.interval_ms / 1000
+    return [
+        FunctionTime(
+            function=label,
+            self_seconds=round(self_counts[label] * seconds, 4),
+            total_seconds=round(count * seconds, 4),
+        )
+        for label, count in sorted(total_counts.items(), key=lambda item: (-self_counts[item[0]], -item[1]))
+    ]
+
+
+def _report_path(report_id: str, extension: str) -> str:
+    return os.path.join(PROFILE_DIR, f"{report_id}.{extension}")
+
+
+def write_report(session: ProfileSession):
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    with open(_report_path(session.id, "collapsed"), "w") as f:
+        for stack, count in session.stacks.most_common():
+            f.write(f"{stack} {count}\n")
+    report = ProfileReport(**_summary(session).model_dump(), functions=_function_times(session))
+    with open(_report_path(session.id, "json"), "w") as f:
+        f.write(report.model_dump_json())
+    print(f"Profiling session {session.id} saved to {PROFILE_DIR} ({session.ticks} samples).")
+
+
+def read_report(report_id: str) -> ProfileReport:
+    with open(_report_path(report_id, "json")) as f:
+        return ProfileReport(**json.load(f))
+
+
+# --- API ENDPOINTS ---
+
+class StartProfiling(BaseModel):
+    sample_rate: float = Field(0.1, gt=0, le=1, description="Tỉ lệ request / khung hình stream được lấy mẫu.")
+    duration_seconds: int = Field(
+        PROFILE_MAX_SECONDS, ge=1, le=PROFILE_MAX_SECONDS, description="Phiên tự dừng và ghi báo cáo sau thời gian này."
+    )
+
+
+@router.get("/", response_model=Optional[ProfileSummary])
+def get_profiling_status(current_user: User = Depends(get_current_admin_user)):
+    """Phiên đang chạy, hoặc phiên gần nhất của worker này (null nếu chưa có)."""
+    session = _profiler.session
+    if session is not None:
+        return _summary(session, running=True)
+    return _summary(_profiler.last) if _profiler.last is not None else None
+
+
+@router.post("/start", response_model=ProfileSummary)
+def start_profiling(request: StartProfiling, current_user: User = Depends(get_current_admin_user)):
+    if is_remote():
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail="Profiling is per process and unavailable with multiple workers; run a single worker to profile.",
+        )
+    try:
+        session = _profiler.start(request.sample_rate, request.duration_seconds)
+    except RuntimeError as e:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=str(e))
+    return _summary(session, running=True)
+
+
+@router.post("/stop", response_model=ProfileSummary)
+def stop_profiling_session(current_user: User = Depends(get_current_admin_user)):
+    session = _profiler.stop()
+    if session is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="No profiling session is running.")
+    return _summary(session)
+
+
+@router.get("/reports", response_model=List[str])
+def list_profile_reports(current_user: User = Depends(get_current_admin_user)):
+    """ID các báo cáo đã ghi, mới nhất trước."""
+    if not os.path.isdir(PROFILE_DIR):
+        return []
+    ids = [name[: -len(".json")] for name in os.listdir(PROFILE_DIR) if name.endswith(".json")]
+    return sorted((report_id for report_id in ids if re.match(REPORT_ID_PATTERN, report_id)), reverse=True)
+
+
+@router.get("/reports/{report_id}", response_model=ProfileReport)
+def get_profile_report(
+    report_id: str = Path(..., pattern=REPORT_ID_PATTERN, description="ID báo cáo"),
+    limit: int = Query(50, ge=1, le=1000, description="Số hàm trả về, theo self time giảm dần."),
+    current_user: User = Depends(get_current_admin_user),
+):
+    try:
+        report = read_report(report_id)
+    except FileNotFoundError:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Profile report not found.")
+    report.functions = report.functions[:limit]
+    return report
+
+
+@router.get("/reports/{report_id}/collapsed", response_class=FileResponse)
+def download_collapsed_stacks(
+    report_id: str = Path(..., pattern=REPORT_ID_PATTERN, description="ID báo cáo"),
+    current_user: User = Depends(get_current_admin_user),
+):
+    """Collapsed stacks (`thread;hàm;...;hàm số_mẫu`), đầu vào của flamegraph.pl / speedscope."""
+    path = _report_path(report_id, "collapsed")
+    if not os.path.exists(path):
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Profile report not found.")
+    return FileResponse(path, media_type="text/plain", filename=f"profile-{report_id}.collapsed")
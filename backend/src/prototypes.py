@@ -0,0 +1,243 @@
+"""
+Vector đại diện (prototype) cho mỗi FaceGroup và tìm kiếm hai tầng.
+
+Mỗi nhóm (user_id, name) có một điểm trong collection prototype, vector là
+trung bình đã chuẩn hóa của các embedding trong nhóm. Tổng chưa chuẩn hóa
+được khôi phục từ `vector * sum_norm` nên có thể cập nhật tăng dần khi thêm,
+xóa, đổi tên hoặc thay ảnh mà không cần đọc lại cả nhóm.
+
+Khi tìm kiếm, tầng 1 chọn PROTOTYPE_CANDIDATES danh tính gần nhất theo
+prototype, tầng 2 chỉ so probe với từng ảnh của các danh tính đó.
+"""
+import asyncio
+import os
+import uuid
+from collections import defaultdict
+from functools import lru_cache
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from src.embeddings import collection_for_version, get_active_version
+from src.inference_client import RemotePrototypeIndex, is_remote
+from src.vector_store import ScoredRecord, VectorRecord, VectorStore, get_vector_store
+
+# Collection prototype của mỗi phiên bản embedding là "<collection ảnh>_prototypes"
+PROTOTYPE_COLLECTION_SUFFIX = "_prototypes"
+# Tắt (0) để quay lại tìm kiếm trên toàn bộ ảnh của tenant
+PROTOTYPE_SEARCH = os.getenv("PROTOTYPE_SEARCH", "1") == "1"
+# Số danh tính được giữ lại sau tầng 1 để so khớp với từng ảnh
+PROTOTYPE_CANDIDATES = int(os.getenv("PROTOTYPE_CANDIDATES", "10"))
+
+SCROLL_PAGE_SIZE = 1000
+
+
+def prototype_id(username: str, name: str) -> str:
+    return str(uuid.uuid5(uuid.NAMESPACE_URL, f"prototype/{username}/{name}"))
+
+
+class PrototypeIndex:
+    """Duy trì prototype của các FaceGroup song song với collection ảnh."""
+
+    def __init__(self, images: VectorStore, prototypes: VectorStore):
+        self.images = images
+        self.prototypes = prototypes
+        # Các cập nhật là read-modify-write trên cùng một điểm nên được tuần tự hóa
+        self._lock = asyncio.Lock()
+
+    async def setup(self):
+        """Tạo collection prototype; dựng lại toàn bộ nếu collection còn trống mà đã có ảnh."""
+        await self.prototypes.setup()
+        if await self.prototypes.count() == 0 and await self.images.count() > 0:
+            print("Prototype collection is empty, rebuilding from the image collection...")
+            await self.rebuild()
+
+    async def close(self):
+        await self.prototypes.close()
+
+    # --- cập nhật tăng dần ---
+
+    async def _load_sums(self, username: str, names: Iterable[str]) -> Dict[str, Tuple[np.ndarray, int]]:
+        names = list(names)
+        records = await self.prototypes.retrieve([prototype_id(username, name) for name in names], with_vectors=True)
+        sums = {}
+        for record in records:
+            sum_norm = float(record.payload.get("sum_norm", 0.0))
+            sums[record.payload["name"]] = (record.vector * sum_norm, int(record.payload.get("image_count", 0)))
+        return sums
+
+    async def _store_sums(self, username: str, sums: Dict[str, Tuple[np.ndarray, int]]):
+        upserts, deletes = [], []
+        for name, (total, count) in sums.items():
+            sum_norm = float(np.linalg.norm(total))
+            if count <= 0 or sum_norm < 1e-6:
+                deletes.append(prototype_id(username, name))
+                continue
+            upserts.append(VectorRecord(
+                id=prototype_id(username, name),
+                vector=(total / sum_norm).astype(np.float32),
+                payload={"user_id": username, "name": name, "image_count": count, "sum_norm": sum_norm},
+            ))
+        if deletes:
+            await self.prototypes.delete(ids=deletes)
+        await self.prototypes.upsert(upserts)
+
+    async def add(self, username: str, items: Sequence[Tuple[str, np.ndarray]], sign: int = 1):
+        """Cộng (sign=1) hoặc trừ (sign=-1) các embedding (name, vector) vào prototype của nhóm."""
+        if not items:
+            return
+        async with self._lock:
+            sums = await self._load_sums(username, {name for name, _ in items})
+            for name, vector in items:
+                vector = np.asarray(vector, dtype=np.float32)
+                vector = vector / max(float(np.linalg.norm(vector)), 1e-12)
+                total, count = sums.get(name, (np.zeros_like(vector), 0))
+                sums[name] = (total + sign * vector, count + sign)
+            await self._store_sums(username, sums)
+
+    async def remove(self, username: str, items: Sequence[Tuple[str, np.ndarray]]):
+        await self.add(username, items, sign=-1)
+
+    async def rename(self, username: str, old_name: str, new_name: str):
+        """Chuyển prototype sang tên mới, gộp với nhóm cùng tên nếu đã có."""
+        async with self._lock:
+            sums = await self._load_sums(username, [old_name, new_name])
+            if old_name not in sums:
+                return
+            old_total, old_count = sums[old_name]
+            new_total, new_count = sums.get(new_name, (np.zeros_like(old_total), 0))
+            await self._store_sums(username, {
+                old_name: (old_total, 0),
+                new_name: (new_total + old_total, new_count + old_count),
+            })
+
+    async def rebuild(self, username: Optional[str] = None, names: Optional[Iterable[str]] = None):
+        """Tính lại prototype từ ảnh (mọi tenant, một tenant, hoặc một số nhóm của tenant)."""
+        image_filter = {"user_id": username} if username is not None else {}
+        if names is not None:
+            names = list(names)
+            if not names:
+                return
+            image_filter["name"] = names
+
+        sums: Dict[str, Dict[str, List]] = defaultdict(dict)
+        async for records in self.images.iter_pages(
+            payload_filter=image_filter,
+            page_size=SCROLL_PAGE_SIZE,
+            with_vectors=True,
+            payload_fields=["user_id", "name"],
+        ):
+            for record in records:
+                name = record.payload.get("name")
+                if not name or record.vector is None:
+                    continue
+                vector = record.vector / max(float(np.linalg.norm(record.vector)), 1e-12)
+                entry = sums[record.payload["user_id"]].setdefault(name, [np.zeros_like(vector), 0])
+                entry[0] += vector
+                entry[1] += 1
+
+        async with self._lock:
+            if username is not None and names is None:
+                await self.prototypes.delete(payload_filter={"user_id": username})
+            for tenant, groups in sums.items():
+                await self._store_sums(tenant, {name: (total, count) for name, (total, count) in groups.items()})
+            if names is not None:
+                # Nhóm không còn ảnh nào thì bị xóa prototype
+                missing = [name for name in names if name not in sums.get(username, {})]
+                if missing:
+                    await self.prototypes.delete(ids=[prototype_id(username, name) for name in missing])
+
+    # --- tìm kiếm ---
+
+    async def search(
+        self,
+        vector: np.ndarray,
+        username: str,
+        limit: int = 5,
+        score_threshold: Optional[float] = None,
+        candidates: int = PROTOTYPE_CANDIDATES,
+    ) -> List[ScoredRecord]:
+        """Tìm hai tầng: prototype -> ảnh của các danh tính ứng viên."""
+        user_filter = {"user_id": username}
+        prototype_hits = await self.prototypes.search(vector, payload_filter=user_filter, limit=candidates)
+        if not prototype_hits:
+            # Chưa có prototype (vd. dữ liệu cũ chưa được dựng lại): tìm trên toàn bộ ảnh
+            return await self.images.search(vector, payload_filter=user_filter, limit=limit, score_threshold=score_threshold)
+        names = [hit.payload["name"] for hit in prototype_hits]
+        return await self.images.search(
+            vector, payload_filter={"user_id": username, "name": names}, limit=limit, score_threshold=score_threshold
+        )
+
+    async def search_batch(
+        self,
+        vectors: Sequence[np.ndarray],
+        username: str,
+        limit: int = 5,
+        score_threshold: Optional[float] = None,
+        candidates: int = PROTOTYPE_CANDIDATES,
+    ) -> List[List[ScoredRecord]]:
+        """
+        `search` cho nhiều khuôn mặt: mỗi tầng là một truy vấn gộp. Tầng hai tìm trên
+        hợp các danh tính ứng viên của mọi khuôn mặt, nên không kém hơn tìm riêng từng mặt.
+        """
+        user_filter = {"user_id": username}
+        prototype_hits = await self.prototypes.search_batch(vectors, payload_filter=user_filter, limit=candidates)
+        names = sorted({hit.payload["name"] for hits in prototype_hits for hit in hits})
+        if not names:
+            return await self.images.search_batch(vectors, payload_filter=user_filter, limit=limit, score_threshold=score_threshold)
+        return await self.images.search_batch(
+            vectors, payload_filter={"user_id": username, "name": names}, limit=limit, score_threshold=score_threshold
+        )
+
+
+@lru_cache(maxsize=None)
+def _prototype_index(version: str) -> PrototypeIndex:
+    collection_name = collection_for_version(version)
+    images = get_vector_store(collection_name)
+    prototypes = get_vector_store(collection_name + PROTOTYPE_COLLECTION_SUFFIX)
+    if is_remote():
+        # Cập nhật prototype là read-modify-write: chỉ tiến trình inference chính được làm
+        return RemotePrototypeIndex(version, images, prototypes)
+    return PrototypeIndex(images, prototypes)
+
+
+def get_prototype_index(version: Optional[str] = None) -> PrototypeIndex:
+    """Prototype của `version` (mặc định: phiên bản embedding đang hoạt động)."""
+    return _prototype_index(version or get_active_version())
+
+
+async def search_gallery(
+    vector: np.ndarray,
+    username: str,
+    limit: int = 5,
+    score_threshold: Optional[float] = None,
+    version: Optional[str] = None,
+) -> List[ScoredRecord]:
+    """
+    Điểm vào chung cho search và stream: hai tầng nếu PROTOTYPE_SEARCH bật, ngược lại tìm toàn bộ.
+    `version` phải là phiên bản của model đã tạo ra `vector`.
+    """
+    prototypes = get_prototype_index(version)
+    if PROTOTYPE_SEARCH:
+        return await prototypes.search(vector, username, limit=limit, score_threshold=score_threshold)
+    return await prototypes.images.search(
+        vector, payload_filter={"user_id": username}, limit=limit, score_threshold=score_threshold
+    )
+
+
+async def search_gallery_batch(
+    vectors: Sequence[np.ndarray],
+    username: str,
+    limit: int = 5,
+    score_threshold: Optional[float] = None,
+    version: Optional[str] = None,
+) -> List[List[ScoredRecord]]:
+    """Như `search_gallery` cho nhiều khuôn mặt của cùng một ảnh / khung hình, kết quả theo thứ tự."""
+    if len(vectors) == 0:
+        return []
+    prototypes = get_prototype_index(version)
+    if PROTOTYPE_SEARCH:
+        return await prototypes.search_batch(vectors, username, limit=limit, score_threshold=score_threshold)
+    return await prototypes.images.search_batch(
+        vectors, payload_filter={"user_id": username}, limit=limit, score_threshold=score_threshold
+    )
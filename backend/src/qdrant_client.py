@@ -1,37 +1,144 @@
-from qdrant_client import QdrantClient, models
 import os
 from functools import lru_cache # Import lru_cache
+from typing import TYPE_CHECKING
+
+# qdrant_client nặng (~1s để import) nên chỉ được import khi backend qdrant thực sự được dùng
+if TYPE_CHECKING:
+    from qdrant_client import AsyncQdrantClient, models
 
 # Định nghĩa tên cho collection Qdrant của chúng ta
 IMAGE_COLLECTION_NAME = "face_collection"
 VECTOR_SIZE = 512
 
+# Nếu đặt QDRANT_URL thì dùng Qdrant server, ngược lại dùng local mode (./local_vector_db).
+# Payload index và HNSW config luôn được yêu cầu; local mode chấp nhận nhưng bỏ qua chúng.
+QDRANT_URL = os.getenv("QDRANT_URL")
+QDRANT_API_KEY = os.getenv("QDRANT_API_KEY")
+
+
+def payload_indexes() -> dict:
+    """Mọi truy vấn đều lọc theo user_id (tenant) và thường theo name."""
+    from qdrant_client import models
+
+    return {
+        "user_id": models.KeywordIndexParams(type=models.KeywordIndexType.KEYWORD, is_tenant=True),
+        "name": models.KeywordIndexParams(type=models.KeywordIndexType.KEYWORD),
+    }
+
+def tenant_hnsw_config() -> "models.HnswConfigDiff":
+    """
+    Bố cục multitenant: bỏ đồ thị HNSW toàn cục (m=0) và xây đồ thị riêng
+    cho từng giá trị payload được index (payload_m), tức là theo từng tenant.
+    """
+    from qdrant_client import models
+
+    return models.HnswConfigDiff(m=0, payload_m=16)
+
+def int8_quantization_config() -> "models.ScalarQuantization":
+    """
+    int8: vector gốc float32 để trên đĩa, bản lượng tử int8 giữ trong RAM và được dùng để tìm;
+    float16: lưu trực tiếp vector ở dạng float16 (không còn bản float32 để chấm lại).
+    """
+    from qdrant_client import models
+
+    return models.ScalarQuantization(
+        scalar=models.ScalarQuantizationConfig(type=models.ScalarType.INT8, quantile=0.99, always_ram=True)
+    )
+
 # Bỏ dòng này đi:
 # qdrant_client = QdrantClient(path="./local_vector")
 
 @lru_cache(maxsize=1) # Cache sẽ đảm bảo hàm này chỉ chạy 1 lần
-def get_qdrant_client() -> QdrantClient:
+def get_qdrant_client() -> "AsyncQdrantClient":
     """
-    Tạo và trả về một instance duy nhất của QdrantClient.
+    Tạo và trả về một instance duy nhất của AsyncQdrantClient.
     Sử dụng lru_cache để đảm bảo singleton pattern.
+    Mọi lời gọi đều phải được await để không chặn event loop.
     """
+    from qdrant_client import AsyncQdrantClient
+
     print("Initializing Qdrant client...")
+    if QDRANT_URL:
+        return AsyncQdrantClient(url=QDRANT_URL, api_key=QDRANT_API_KEY)
     os.makedirs("./local_vector", exist_ok=True)
-    client = QdrantClient(path="./local_vector_db")
+    client = AsyncQdrantClient(path="./local_vector_db")
     return client
 
-def setup_qdrant():
+def vector_params(vector_size: int, quantization: str = "none") -> "models.VectorParams":
+    from qdrant_client import models
+
+    if quantization == "float16":
+        return models.VectorParams(size=vector_size, distance=models.Distance.COSINE, datatype=models.Datatype.FLOAT16)
+    if quantization == "int8":
+        return models.VectorParams(size=vector_size, distance=models.Distance.COSINE, on_disk=True)
+    return models.VectorParams(size=vector_size, distance=models.Distance.COSINE)
+
+async def setup_qdrant(collection_name: str = IMAGE_COLLECTION_NAME, vector_size: int = VECTOR_SIZE, quantization: str = "none"):
     """
-    Đảm bảo collection Qdrant được tạo khi ứng dụng khởi động.
+    Đảm bảo collection Qdrant được tạo khi ứng dụng khởi động,
+    và collection cũ được bổ sung payload index (idempotent).
     """
+    from qdrant_client import models
+
     client = get_qdrant_client() # Lấy client thông qua hàm
+    hnsw_config, int8_config = tenant_hnsw_config(), int8_quantization_config()
     try:
-        client.get_collection(collection_name=IMAGE_COLLECTION_NAME)
-        print(f"Collection '{IMAGE_COLLECTION_NAME}' đã tồn tại.")
+        info = await client.get_collection(collection_name=collection_name)
+        print(f"Collection '{collection_name}' đã tồn tại.")
     except Exception:
-        print(f"Đang tạo collection '{IMAGE_COLLECTION_NAME}'.")
-        client.create_collection(
-            collection_name=IMAGE_COLLECTION_NAME,
-            vectors_config=models.VectorParams(size=VECTOR_SIZE, distance=models.Distance.COSINE),
+        print(f"Đang tạo collection '{collection_name}'.")
+        await client.create_collection(
+            collection_name=collection_name,
+            vectors_config=vector_params(vector_size, quantization),
+            hnsw_config=hnsw_config,
+            quantization_config=int8_config if quantization == "int8" else None,
         )
         print("Tạo collection thành công.")
+    else:
+        if quantization == "int8" and info.config.quantization_config is None:
+            print(f"Đang bật int8 quantization cho '{collection_name}'.")
+            await client.update_collection(collection_name=collection_name, quantization_config=int8_config)
+        elif quantization == "float16" and info.config.params.vectors.datatype != models.Datatype.FLOAT16:
+            # datatype không đổi được sau khi tạo; cần chuyển gallery sang một collection mới
+            print(f"Cảnh báo: '{collection_name}' không lưu float16, bỏ qua quantization=float16.")
+
+    await ensure_payload_indexes(client, collection_name)
+
+
+def index_matches(existing: "models.PayloadIndexInfo", expected: "models.KeywordIndexParams") -> bool:
+    """Index đã có cùng kiểu và cùng cờ is_tenant với index mong muốn."""
+    from qdrant_client import models
+
+    if existing.data_type != models.PayloadSchemaType.KEYWORD:
+        return False
+    return bool(getattr(existing.params, "is_tenant", None)) == bool(expected.is_tenant)
+
+
+async def ensure_payload_indexes(client: "AsyncQdrantClient", collection_name: str):
+    """
+    Tạo các payload index còn thiếu, tạo lại index sai schema (vd. `user_id`
+    thiếu is_tenant) và chuyển collection sang bố cục multitenant. Chỉ thay
+    đổi những gì chưa đúng, nên có thể gọi mỗi lần khởi động.
+    """
+    info = await client.get_collection(collection_name=collection_name)
+    for field_name, field_schema in payload_indexes().items():
+        existing = info.payload_schema.get(field_name)
+        if existing is not None and index_matches(existing, field_schema):
+            continue
+        if existing is not None:
+            print(f"Payload index '{field_name}' của '{collection_name}' sai schema, đang tạo lại.")
+            await client.delete_payload_index(collection_name=collection_name, field_name=field_name, wait=True)
+        await client.create_payload_index(
+            collection_name=collection_name,
+            field_name=field_name,
+            field_schema=field_schema,
+            wait=True,
+        )
+        if QDRANT_URL:
+            print(f"Đã tạo payload index '{field_name}' cho '{collection_name}'.")
+
+    hnsw, tenant_config = info.config.hnsw_config, tenant_hnsw_config()
+    if hnsw.m != tenant_config.m or hnsw.payload_m != tenant_config.payload_m:
+        # Local mode trả về False và giữ nguyên config
+        if await client.update_collection(collection_name=collection_name, hnsw_config=tenant_config):
+            print(f"Đã cập nhật HNSW config của '{collection_name}' theo tenant.")
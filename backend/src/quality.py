@@ -0,0 +1,120 @@
+"""
+Đánh giá chất lượng khuôn mặt trước khi embed.
+
+Điểm chất lượng gồm độ tin cậy của SCRFD, kích thước khuôn mặt, góc quay
+yaw/pitch ước lượng từ 5 landmark và độ nét (phương sai Laplacian) của ảnh
+đã căn chỉnh 112x112. Ảnh căn chỉnh được tạo một lần và dùng lại để embed,
+nên cổng chất lượng gần như không tốn thêm chi phí.
+
+Stream bỏ qua (không embed) các khuôn mặt không đạt; enrollment từ chối
+chúng kèm lý do. Ngưỡng được cấu hình qua biến môi trường.
+"""
+import math
+import os
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Tuple
+
+import cv2
+import numpy as np
+
+from lib.uniface.face_utils import face_alignment, reference_alignment
+
+# Tắt (0) để embed mọi khuôn mặt như trước
+QUALITY_GATE = os.getenv("QUALITY_GATE", "1") == "1"
+QUALITY_MIN_CONFIDENCE = float(os.getenv("QUALITY_MIN_CONFIDENCE", "0.6"))
+# Cạnh ngắn nhất của bbox (px)
+QUALITY_MIN_FACE_SIZE = int(os.getenv("QUALITY_MIN_FACE_SIZE", "50"))
+# Góc quay tối đa (độ)
+QUALITY_MAX_YAW = float(os.getenv("QUALITY_MAX_YAW", "45"))
+QUALITY_MAX_PITCH = float(os.getenv("QUALITY_MAX_PITCH", "30"))
+# Phương sai Laplacian tối thiểu của ảnh xám đã căn chỉnh
+QUALITY_MIN_SHARPNESS = float(os.getenv("QUALITY_MIN_SHARPNESS", "30"))
+
+# Độ nhô của mũi so với mặt phẳng mắt-miệng, tính theo khoảng cách hai mắt
+# (số liệu nhân trắc trung bình), dùng để đổi độ lệch landmark ra góc
+NOSE_DEPTH_RATIO = 0.5
+_EYE_DISTANCE = float(np.linalg.norm(reference_alignment[1] - reference_alignment[0]))
+_EYE_Y = float(reference_alignment[:2, 1].mean())
+_MOUTH_Y = float(reference_alignment[3:, 1].mean())
+# Vị trí dọc của mũi giữa mắt và miệng khi nhìn thẳng
+_FRONTAL_NOSE_RATIO = (float(reference_alignment[2, 1]) - _EYE_Y) / (_MOUTH_Y - _EYE_Y)
+_PITCH_SCALE = NOSE_DEPTH_RATIO * _EYE_DISTANCE / (_MOUTH_Y - _EYE_Y)
+
+
+class FaceQualityError(ValueError):
+    """Khuôn mặt không đạt ngưỡng chất lượng để enrollment."""
+
+
+@dataclass
+class FaceQuality:
+    confidence: float
+    size: float
+    yaw: float
+    pitch: float
+    sharpness: float
+    # Lý do không đạt đầu tiên, None nếu đạt
+    reason: Optional[str] = None
+
+    @property
+    def passed(self) -> bool:
+        return self.reason is None
+
+
+def estimate_pose(landmarks: np.ndarray) -> Tuple[float, float]:
+    """
+    Ước lượng (yaw, pitch) theo độ từ 5 landmark (mắt trái, mắt phải, mũi,
+    mép trái, mép phải). Roll được loại bỏ trước bằng cách xoay đường nối hai
+    mắt về nằm ngang; sau đó độ lệch của mũi khỏi trục giữa mặt được đổi ra
+    góc qua độ nhô NOSE_DEPTH_RATIO. Chỉ là xấp xỉ, đủ để loại mặt nghiêng.
+    """
+    points = np.asarray(landmarks, dtype=np.float64).reshape(5, 2)
+    eye_vector = points[1] - points[0]
+    eye_distance = float(np.linalg.norm(eye_vector))
+    if eye_distance == 0:
+        return 90.0, 90.0
+    cos, sin = eye_vector / eye_distance
+    points = (points - points[0]) @ np.array([[cos, -sin], [sin, cos]])
+
+    eye_mid, nose, mouth_mid = points[:2].mean(axis=0), points[2], points[3:].mean(axis=0)
+    axis_x = (eye_mid[0] + mouth_mid[0]) / 2
+    yaw = math.degrees(math.atan((nose[0] - axis_x) / (NOSE_DEPTH_RATIO * eye_distance)))
+
+    face_height = mouth_mid[1] - eye_mid[1]
+    if face_height <= 0:
+        return yaw, 90.0
+    nose_ratio = (nose[1] - eye_mid[1]) / face_height
+    pitch = math.degrees(math.atan((nose_ratio - _FRONTAL_NOSE_RATIO) / _PITCH_SCALE))
+    return yaw, pitch
+
+
+def sharpness(aligned_face: np.ndarray) -> float:
+    """Phương sai Laplacian của ảnh xám: càng nhỏ càng mờ."""
+    gray = cv2.cvtColor(aligned_face, cv2.COLOR_BGR2GRAY)
+    return float(cv2.Laplacian(gray, cv2.CV_64F).var())
+
+
+def assess_face(face: Dict[str, Any], aligned_face: np.ndarray) -> FaceQuality:
+    """Chấm chất lượng một khuôn mặt đã detect, dùng ảnh đã căn chỉnh của nó."""
+    x1, y1, x2, y2 = face["bbox"][:4]
+    size = float(min(x2 - x1, y2 - y1))
+    confidence = float(face["confidence"])
+    yaw, pitch = estimate_pose(face["landmarks"])
+    quality = FaceQuality(confidence=confidence, size=size, yaw=yaw, pitch=pitch, sharpness=sharpness(aligned_face))
+
+    if size < QUALITY_MIN_FACE_SIZE:
+        quality.reason = f"Face too small ({size:.0f} px < {QUALITY_MIN_FACE_SIZE} px)."
+    elif confidence < QUALITY_MIN_CONFIDENCE:
+        quality.reason = f"Low detection confidence ({confidence:.2f} < {QUALITY_MIN_CONFIDENCE:.2f})."
+    elif abs(yaw) > QUALITY_MAX_YAW:
+        quality.reason = f"Face turned too far sideways (yaw {yaw:.0f}° > {QUALITY_MAX_YAW:.0f}°)."
+    elif abs(pitch) > QUALITY_MAX_PITCH:
+        quality.reason = f"Face tilted too far up or down (pitch {pitch:.0f}° > {QUALITY_MAX_PITCH:.0f}°)."
+    elif quality.sharpness < QUALITY_MIN_SHARPNESS:
+        quality.reason = f"Face too blurry (sharpness {quality.sharpness:.1f} < {QUALITY_MIN_SHARPNESS:.1f})."
+    return quality
+
+
+def align_and_assess(image: np.ndarray, faces: List[Dict[str, Any]]) -> Tuple[List[np.ndarray], List[FaceQuality]]:
+    """Căn chỉnh mọi khuôn mặt một lần và chấm chất lượng từng mặt."""
+    aligned = [face_alignment(image, np.asarray(face["landmarks"]))[0] for face in faces]
+    return aligned, [assess_face(face, crop) for face, crop in zip(faces, aligned)]
@@ -0,0 +1,520 @@
+"""
+Migration embedding sang model nhận dạng mới mà không cần dừng dịch vụ.
+
+Migration re-embed mọi ảnh của collection nguồn vào collection của phiên bản
+đích theo lô, trong khi tìm kiếm vẫn dùng phiên bản nguồn:
+
+1. copy: duyệt collection nguồn theo offset scroll (được commit sau mỗi lô,
+   nên có thể tiếp tục sau khi khởi động lại), tải ảnh từ R2 và embed bằng
+   model mới.
+2. verify: đối soát toàn bộ nguồn/đích, re-embed ảnh còn thiếu (ảnh mới tải
+   lên hoặc bị thay thế trong lúc migration), đồng bộ payload, xóa điểm thừa.
+3. Khi độ phủ đạt 100% (trừ tối đa `max_failures` ảnh không embed được),
+   prototype của phiên bản đích được dựng, migration được đánh dấu hoàn tất
+   và phiên bản đang hoạt động được chuyển trong một phép gán. Sau một khoảng
+   chờ ngắn, một lượt đối soát cuối bổ sung các ảnh được ghi vào nguồn ngay
+   trước thời điểm chuyển.
+
+Giữa các lô worker tạm nghỉ (lâu hơn khi có stream đang mở) để không tranh
+CPU với nhận dạng trực tiếp.
+
+Khi không có migration, cùng worker này giữ gallery của model xác minh cascade
+(src/cascade.py) theo kịp collection đang hoạt động, mỗi CASCADE_SYNC_INTERVAL
+giây: embed ảnh chưa có và ảnh đã bị thay.
+"""
+import asyncio
+import json
+import os
+import time
+import uuid
+from contextlib import suppress
+from datetime import datetime, timezone
+from typing import TYPE_CHECKING, Dict, List, Optional, Tuple
+
+from fastapi import APIRouter, Depends, HTTPException, Path, status
+from pydantic import BaseModel, Field
+from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
+
+from src.auth import get_current_admin_user
+from src.database import SessionLocal, get_db
+from src.embeddings import (
+    get_active_version,
+    get_image_store,
+    get_migration_versions,
+    get_recognizer,
+    get_verifier_version,
+    model_path_for_version,
+    set_active_version,
+    set_migration_versions,
+)
+from src.imaging import decode_image, to_bgr_array
+from src.inference_client import RemoteWorker, is_remote
+from src.model_registry import InvalidModelNameError, get_detector
+from src.models import EmbeddingMigration, User
+from src.prototypes import PrototypeIndex, get_prototype_index
+from src.streaming import active_stream_count
+from src.utils import download_img_from_r2, generate_embedding_for_largest_face
+from src.vector_store import TENANT_FIELD, VectorRecord, VectorStore
+
+if TYPE_CHECKING:
+    from lib.uniface.recogition.models import ArcFace
+
+MIGRATION_BATCH_SIZE = int(os.getenv("MIGRATION_BATCH_SIZE", "32"))
+# Thời gian nghỉ giữa các lô, và khi có ít nhất một stream đang mở
+MIGRATION_BATCH_PAUSE = float(os.getenv("MIGRATION_BATCH_PAUSE", "0.5"))
+MIGRATION_STREAM_PAUSE = float(os.getenv("MIGRATION_STREAM_PAUSE", "5"))
+# Chờ các request đang ghi vào phiên bản cũ hoàn tất trước lượt đối soát cuối
+MIGRATION_SWITCH_GRACE = float(os.getenv("MIGRATION_SWITCH_GRACE", "5"))
+MIGRATION_POLL_INTERVAL = float(os.getenv("MIGRATION_POLL_INTERVAL", "10"))
+# Chu kỳ đồng bộ gallery của model xác minh cascade khi worker rảnh
+CASCADE_SYNC_INTERVAL = float(os.getenv("CASCADE_SYNC_INTERVAL", "60"))
+MAX_RECORDED_FAILURES = 200
+
+MIGRATION_PENDING = "pending"
+MIGRATION_RUNNING = "running"
+MIGRATION_COMPLETED = "completed"
+MIGRATION_FAILED = "failed"
+
+PHASE_COPY = "copy"
+PHASE_VERIFY = "verify"
+
+router = APIRouter(
+    prefix="/embeddings",
+    tags=["embeddings"],
+    responses={404: {"description": "Not found"}},
+)
+
+
+class MigrationFailure(BaseModel):
+    id: str
+    reason: str
+
+
+class EmbeddingMigrationOut(BaseModel):
+    id: str
+    source_version: str
+    target_version: str
+    status: str
+    phase: str
+    source_total: int
+    processed: int
+    embedded: int
+    failed: int
+    coverage_percent: float
+    images_per_second: float
+    error: Optional[str] = None
+    failures: List[MigrationFailure]
+    created_at: Optional[datetime] = None
+    started_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
+
+
+class EmbeddingStatusOut(BaseModel):
+    active_version: str
+    migrating_from: Optional[str] = None
+    migrating_to: Optional[str] = None
+
+
+class CreateMigration(BaseModel):
+    target_version: str = Field(..., description="Tên model mới, tương ứng với models/<target_version>.onnx.")
+    max_failures: int = Field(0, ge=0, description="Số ảnh không re-embed được vẫn cho phép chuyển phiên bản.")
+
+
+def _migration_out(migration: EmbeddingMigration) -> EmbeddingMigrationOut:
+    total = migration.source_total or 0
+    processed = migration.processed_count or 0
+    seconds = migration.processing_seconds or 0.0
+    if migration.status == MIGRATION_COMPLETED:
+        coverage = 100.0
+    else:
+        coverage = round(100.0 * min(processed, total) / total, 2) if total else 0.0
+    return EmbeddingMigrationOut(
+        id=migration.id,
+        source_version=migration.source_version,
+        target_version=migration.target_version,
+        status=migration.status,
+        phase=migration.phase,
+        source_total=total,
+        processed=processed,
+        embedded=migration.embedded_count or 0,
+        failed=migration.failed_count or 0,
+        coverage_percent=coverage,
+        images_per_second=round((migration.embedded_count or 0) / seconds, 2) if seconds > 0 else 0.0,
+        error=migration.error,
+        failures=json.loads(migration.failures or "[]"),
+        created_at=migration.created_at,
+        started_at=migration.started_at,
+        finished_at=migration.finished_at,
+    )
+
+
+# --- BACKGROUND WORKER ---
+
+def _embed_image(image_bytes: bytes, recognizer: "ArcFace"):
+    image = to_bgr_array(decode_image(image_bytes))
+    embedding, _ = generate_embedding_for_largest_face(image, get_detector(), recognizer)
+    return embedding
+
+
+def _without_tenant(payload: Dict) -> Dict:
+    """set_payload không cho phép đổi trường tenant."""
+    return {key: value for key, value in payload.items() if key != TENANT_FIELD}
+
+
+class ReembeddingWorker:
+    """Chạy lần lượt từng EmbeddingMigration trong nền; khi rảnh thì đồng bộ gallery của cascade."""
+
+    def __init__(self):
+        self._task: Optional[asyncio.Task] = None
+        self._wakeup = asyncio.Event()
+        self._last_verifier_sync: Optional[float] = None
+        # id -> image_url của ảnh model xác minh không embed được; chỉ thử lại khi ảnh được thay
+        self._verifier_failures: Dict[str, Optional[str]] = {}
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            with suppress(asyncio.CancelledError):
+                await self._task
+            self._task = None
+
+    def notify(self):
+        self._wakeup.set()
+
+    def _next_migration_id(self) -> Optional[str]:
+        db = SessionLocal()
+        try:
+            migration = (
+                db.query(EmbeddingMigration)
+                .filter(EmbeddingMigration.status.in_([MIGRATION_PENDING, MIGRATION_RUNNING]))
+                .order_by(EmbeddingMigration.created_at)
+                .first()
+            )
+            return migration.id if migration else None
+        finally:
+            db.close()
+
+    async def _run(self):
+        while True:
+            self._wakeup.clear()
+            migration_id = self._next_migration_id()
+            if migration_id is None:
+                if self._last_verifier_sync is None or time.monotonic() - self._last_verifier_sync >= CASCADE_SYNC_INTERVAL:
+                    try:
+                        await self._sync_verifier_gallery()
+                    except asyncio.CancelledError:
+                        raise
+                    except Exception as e:
+                        print(f"Syncing the cascade verifier gallery failed: {e}")
+                    self._last_verifier_sync = time.monotonic()
+                with suppress(asyncio.TimeoutError):
+                    await asyncio.wait_for(self._wakeup.wait(), MIGRATION_POLL_INTERVAL)
+                continue
+
+            try:
+                await self._process_migration(migration_id)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"Embedding migration {migration_id} failed: {e}")
+                self._mark_failed(migration_id, str(e))
+
+    def _mark_failed(self, migration_id: str, error: str):
+        db = SessionLocal()
+        try:
+            migration = db.get(EmbeddingMigration, migration_id)
+            if migration:
+                migration.status = MIGRATION_FAILED
+                migration.error = error
+                migration.finished_at = datetime.now(timezone.utc)
+                db.commit()
+        finally:
+            db.close()
+
+    async def _throttle(self):
+        await asyncio.sleep(MIGRATION_STREAM_PAUSE if active_stream_count() else MIGRATION_BATCH_PAUSE)
+
+    async def _sync_verifier_gallery(self):
+        """Embed bằng model xác minh các ảnh của collection đang hoạt động chưa có (hoặc đã bị thay) ở gallery của nó."""
+        version = get_verifier_version()
+        if version is None:
+            return
+        source = get_image_store()
+        target = get_image_store(version)
+        recognizer = None
+        embedded_total = 0
+        async for records in source.iter_pages(page_size=MIGRATION_BATCH_SIZE):
+            if self._wakeup.is_set():
+                # Có migration mới: nhường cho nó, lần rảnh sau tiếp tục đồng bộ
+                break
+            existing = {record.id: record for record in await target.retrieve([record.id for record in records])}
+            stale = [
+                record.id for record in records
+                if record.id in existing and existing[record.id].payload.get("image_url") != record.payload.get("image_url")
+            ]
+            if stale:
+                await target.delete(ids=stale)
+            todo = [
+                record for record in records
+                if (record.id not in existing or record.id in stale)
+                and self._verifier_failures.get(record.id, "") != record.payload.get("image_url")
+            ]
+            if not todo:
+                continue
+            if recognizer is None:
+                recognizer = await run_in_threadpool(get_recognizer, version)
+            embedded, failures = await self._reembed_missing(target, recognizer, todo)
+            failed_ids = {failure["id"] for failure in failures}
+            for record in todo:
+                if record.id in failed_ids:
+                    self._verifier_failures[record.id] = record.payload.get("image_url")
+                else:
+                    self._verifier_failures.pop(record.id, None)
+            embedded_total += embedded
+            await self._throttle()
+        if embedded_total:
+            print(f"Embedded {embedded_total} gallery images for cascade verifier '{version}'.")
+
+    async def _process_migration(self, migration_id: str):
+        db: Session = SessionLocal()
+        try:
+            migration = db.get(EmbeddingMigration, migration_id)
+            source = get_image_store(migration.source_version)
+            target = get_image_store(migration.target_version)
+            recognizer = await run_in_threadpool(get_recognizer, migration.target_version)
+            if recognizer.output_shape[-1] != target.vector_size:
+                raise RuntimeError(
+                    f"Model '{migration.target_version}' outputs {recognizer.output_shape[-1]}-d embeddings, "
+                    f"expected {target.vector_size}."
+                )
+            await target.setup()
+
+            set_migration_versions((migration.source_version, migration.target_version))
+            try:
+                if migration.status == MIGRATION_PENDING:
+                    migration.status = MIGRATION_RUNNING
+                    migration.started_at = datetime.now(timezone.utc)
+                    migration.source_total = await source.count()
+                    db.commit()
+
+                if migration.phase == PHASE_COPY:
+                    await self._copy(db, migration, target, source, recognizer)
+                    migration.phase = PHASE_VERIFY
+                    db.commit()
+
+                missing = await self._verify(db, migration, source, target, recognizer, sync_payload=True)
+                if missing > (migration.max_failures or 0):
+                    raise RuntimeError(
+                        f"{missing} images could not be re-embedded (max_failures={migration.max_failures}); "
+                        "see failures, then start a new migration."
+                    )
+
+                prototypes = get_prototype_index(migration.target_version)
+                await prototypes.prototypes.setup()
+                await prototypes.rebuild()
+
+                migration.status = MIGRATION_COMPLETED
+                migration.finished_at = datetime.now(timezone.utc)
+                db.commit()
+                set_active_version(migration.target_version)
+                print(f"Switched active embedding version to '{migration.target_version}'.")
+
+                # Bổ sung các ảnh được ghi vào phiên bản cũ ngay trước khi chuyển
+                await asyncio.sleep(MIGRATION_SWITCH_GRACE)
+                await self._verify(db, migration, source, target, recognizer, prototypes=prototypes)
+            finally:
+                set_migration_versions(None)
+        finally:
+            db.close()
+
+    async def _copy(self, db: Session, migration: EmbeddingMigration, target: VectorStore, source: VectorStore, recognizer):
+        while True:
+            started = time.perf_counter()
+            records, next_offset = await source.scroll(limit=MIGRATION_BATCH_SIZE, offset=migration.scroll_offset)
+            embedded, failures = await self._reembed_missing(target, recognizer, records)
+            self._record_batch(migration, len(records), embedded, failures, started)
+            migration.scroll_offset = next_offset
+            db.commit()
+            if next_offset is None:
+                return
+            await self._throttle()
+
+    async def _verify(
+        self,
+        db: Session,
+        migration: EmbeddingMigration,
+        source: VectorStore,
+        target: VectorStore,
+        recognizer,
+        sync_payload: bool = False,
+        prototypes: Optional[PrototypeIndex] = None,
+    ) -> int:
+        """Đối soát nguồn -> đích; trả về số ảnh vẫn chưa có ở đích."""
+        migration.failures = "[]"
+        migration.failed_count = 0
+        migration.source_total = await source.count()
+        db.commit()
+
+        missing = 0
+        async for records in source.iter_pages(page_size=MIGRATION_BATCH_SIZE):
+            started = time.perf_counter()
+            existing = {record.id: record for record in await target.retrieve([record.id for record in records])}
+            if sync_payload:
+                for record in records:
+                    current = existing.get(record.id)
+                    if current is not None and current.payload != record.payload:
+                        await target.set_payload(_without_tenant(record.payload), ids=[record.id])
+            todo = [record for record in records if record.id not in existing]
+            if todo:
+                embedded, failures = await self._reembed_missing(target, recognizer, todo, prototypes)
+                self._record_batch(migration, 0, embedded, failures, started)
+                missing += len(failures)
+                db.commit()
+                await self._throttle()
+
+        if sync_payload:
+            # Điểm có ở đích nhưng đã bị xóa khỏi nguồn
+            async for records in target.iter_pages(page_size=MIGRATION_BATCH_SIZE * 8, payload_fields=[TENANT_FIELD]):
+                ids = [record.id for record in records]
+                kept = {record.id for record in await source.retrieve(ids)}
+                extra = [record_id for record_id in ids if record_id not in kept]
+                if extra:
+                    await target.delete(ids=extra)
+        return missing
+
+    async def _reembed_missing(
+        self,
+        target: VectorStore,
+        recognizer,
+        records: List[VectorRecord],
+        prototypes: Optional[PrototypeIndex] = None,
+    ) -> Tuple[int, List[Dict[str, str]]]:
+        """Embed các bản ghi chưa có ở đích bằng model mới. Trả về (số ảnh đã embed, danh sách lỗi)."""
+        existing = {record.id for record in await target.retrieve([record.id for record in records])}
+        points, failures = [], []
+        for record in records:
+            if record.id in existing:
+                continue
+            url = record.payload.get("image_url") or record.payload.get("thumbnail_url")
+            try:
+                if not url:
+                    raise ValueError("No stored image.")
+                image_bytes = await download_img_from_r2(url)
+                embedding = await run_in_threadpool(_embed_image, image_bytes, recognizer)
+                if embedding is None:
+                    raise ValueError("No face detected with the new model.")
+                points.append(VectorRecord(id=record.id, vector=embedding, payload=record.payload))
+            except Exception as e:
+                failures.append({"id": record.id, "reason": str(e)})
+
+        await target.upsert(points)
+        if prototypes is not None:
+            by_user: Dict[str, List[Tuple[str, object]]] = {}
+            for point in points:
+                if point.payload.get("name"):
+                    by_user.setdefault(point.payload[TENANT_FIELD], []).append((point.payload["name"], point.vector))
+            for username, items in by_user.items():
+                await prototypes.add(username, items)
+        return len(points), failures
+
+    def _record_batch(
+        self,
+        migration: EmbeddingMigration,
+        processed: int,
+        embedded: int,
+        failures: List[Dict[str, str]],
+        started: float,
+    ):
+        migration.processed_count = (migration.processed_count or 0) + processed
+        migration.embedded_count = (migration.embedded_count or 0) + embedded
+        migration.failed_count = (migration.failed_count or 0) + len(failures)
+        recorded = json.loads(migration.failures or "[]")
+        recorded.extend(failures[: max(0, MAX_RECORDED_FAILURES - len(recorded))])
+        migration.failures = json.dumps(recorded, ensure_ascii=False)
+        migration.processing_seconds = (migration.processing_seconds or 0.0) + time.perf_counter() - started
+
+
+reembedding_worker = RemoteWorker("reembedding") if is_remote() else ReembeddingWorker()
+
+
+# --- API ENDPOINTS ---
+
+@router.get("/", response_model=EmbeddingStatusOut)
+def get_embedding_status(current_user: User = Depends(get_current_admin_user)):
+    migrating = get_migration_versions()
+    return EmbeddingStatusOut(
+        active_version=get_active_version(),
+        migrating_from=migrating[0] if migrating else None,
+        migrating_to=migrating[1] if migrating else None,
+    )
+
+
+@router.post("/migrations", response_model=EmbeddingMigrationOut, status_code=status.HTTP_202_ACCEPTED)
+def create_migration(
+    request: CreateMigration,
+    current_user: User = Depends(get_current_admin_user),
+    db: Session = Depends(get_db),
+):
+    """
+    Bắt đầu re-embed toàn bộ gallery bằng model `target_version` trong nền.
+    Tìm kiếm tiếp tục dùng phiên bản hiện tại cho tới khi migration hoàn tất.
+    """
+    target_version = request.target_version.strip()
+    try:
+        path = model_path_for_version(target_version)
+    except InvalidModelNameError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    if target_version == get_active_version():
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"'{target_version}' is already active.")
+    if not os.path.exists(path):
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"Model file '{path}' not found.",
+        )
+    in_progress = (
+        db.query(EmbeddingMigration)
+        .filter(EmbeddingMigration.status.in_([MIGRATION_PENDING, MIGRATION_RUNNING]))
+        .first()
+    )
+    if in_progress:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=f"Migration {in_progress.id} is already in progress.")
+
+    migration = EmbeddingMigration(
+        id=str(uuid.uuid4()),
+        source_version=get_active_version(),
+        target_version=target_version,
+        status=MIGRATION_PENDING,
+        phase=PHASE_COPY,
+        max_failures=request.max_failures,
+    )
+    db.add(migration)
+    db.commit()
+    db.refresh(migration)
+    reembedding_worker.notify()
+    return _migration_out(migration)
+
+
+@router.get("/migrations", response_model=List[EmbeddingMigrationOut])
+def list_migrations(
+    current_user: User = Depends(get_current_admin_user),
+    db: Session = Depends(get_db),
+):
+    migrations = db.query(EmbeddingMigration).order_by(EmbeddingMigration.created_at.desc()).all()
+    return [_migration_out(migration) for migration in migrations]
+
+
+@router.get("/migrations/{migration_id}", response_model=EmbeddingMigrationOut)
+def get_migration(
+    migration_id: str = Path(..., description="ID của migration"),
+    current_user: User = Depends(get_current_admin_user),
+    db: Session = Depends(get_db),
+):
+    """Tiến độ của migration: độ phủ, số ảnh đã embed, lỗi và tốc độ xử lý."""
+    migration = db.get(EmbeddingMigration, migration_id)
+    if migration is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Migration not found")
+    return _migration_out(migration)
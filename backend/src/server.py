@@ -1,9 +1,16 @@
+import time
+
+_import_started = time.perf_counter()
+
+import asyncio
 import os
+from contextlib import suppress
+
 from fastapi import Cookie, Depends, FastAPI, HTTPException, Response
 from fastapi.middleware.cors import CORSMiddleware
 from sqlalchemy.orm import Session
 
-from src import faces, reports, streaming
+from src import cascade, compaction, faces, gallery, jobs, metrics, model_admin, profiling, reembedding, reports, startup, streaming, unknown_faces
 
 from . import models
 from .auth import (
@@ -16,22 +23,41 @@ from .auth import (
 )
 
 # --- Imports have been updated ---
-from .database import engine, get_db
-from .qdrant_client import setup_qdrant
+from .database import get_db
+from .frame_ring import close_frame_ring
+from .inference_client import close_connections
+from .vector_store import close_vector_stores
 from .schemas import UserCreate, UserOut
 from contextlib import asynccontextmanager
 
 # --- End of updated imports ---
 from dotenv import load_dotenv
 load_dotenv()
-models.Base.metadata.create_all(bind=engine)
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    setup_qdrant()
+    # Bảng, model và vector store được chuẩn bị nền để server nhận kết nối ngay;
+    # /health/ready báo khi nào xong (xem src/startup.py)
+    warm_up_task = asyncio.create_task(startup.warm_up(_import_seconds))
     yield
+    warm_up_task.cancel()
+    with suppress(asyncio.CancelledError):
+        await warm_up_task
+    await startup.stop_background_workers()
+    await close_vector_stores()
+    close_connections()
+    close_frame_ring()
+    # Phiên profiling dở dang vẫn được ghi báo cáo
+    profiling.stop_profiling()
 
 app = FastAPI(lifespan=lifespan)
+# Thêm trước CORS để phản hồi 503 khi đang khởi động vẫn có header CORS
+app.middleware("http")(startup.readiness_gate)
+app.add_middleware(startup.WebSocketReadinessGate)
+# Ngoài readiness gate để đo cả các phản hồi 503 lúc khởi động
+if metrics.HTTP_METRICS:
+    app.middleware("http")(metrics.http_metrics)
+app.middleware("http")(profiling.profile_requests)
 
 cors_origins = os.getenv("CORS_URL")
 if cors_origins:
@@ -46,9 +72,19 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+app.include_router(startup.router)
 app.include_router(faces.router)
 app.include_router(streaming.router)
 app.include_router(reports.router)
+app.include_router(jobs.router)
+app.include_router(reembedding.router)
+app.include_router(gallery.router)
+app.include_router(compaction.router)
+app.include_router(unknown_faces.router)
+app.include_router(cascade.router)
+app.include_router(model_admin.router)
+app.include_router(metrics.router)
+app.include_router(profiling.router)
 
 @app.get("/hello")
 def read_root():
@@ -143,3 +179,5 @@ def logout(response: Response):
         samesite='none',
         secure=True)
     return {"msg": "Successfully logged out"}
+
+_import_seconds = time.perf_counter() - _import_started
@@ -0,0 +1,207 @@
+"""
+Khởi động nền và health check.
+
+Import `src.server` chỉ định nghĩa route; mọi việc tốn thời gian (tạo bảng,
+nạp model ONNX, mở vector store, kiểm tra cấu hình R2) chạy trong `warm_up()`
+do `lifespan` khởi chạy, các bước độc lập chạy song song. Trong lúc đó server
+đã nhận kết nối:
+
+- `GET /health/live`: tiến trình còn sống (503 chỉ khi khởi động thất bại,
+  để orchestrator khởi động lại).
+- `GET /health/ready`: 200 khi đã sẵn sàng phục vụ, 503 kèm các bước còn dở.
+
+Các route khác trả 503 (kèm Retry-After) cho tới khi sẵn sàng, còn WebSocket
+(/stream/ws) được đóng ngay với mã 1013 (Try Again Later). Khi xong, thời
+gian của từng bước được ghi ra log.
+"""
+import asyncio
+import os
+import time
+from dataclasses import dataclass, field
+from typing import Awaitable, Callable, Dict, List, Optional
+
+from fastapi import APIRouter, Request, WebSocket, status
+from fastapi.responses import JSONResponse
+from starlette.concurrency import run_in_threadpool
+from starlette.types import ASGIApp, Receive, Scope, Send
+
+from src import cascade, compaction, jobs, reembedding
+from src.database import engine
+from src.embeddings import get_image_store, get_recognizer, load_active_version
+from src.inference_client import is_remote, wait_for_services
+from src.model_registry import get_detector
+from src.models import Base
+from src.prototypes import get_prototype_index
+from src.utils import get_r2_config
+
+# Số giây client nên chờ trước khi thử lại khi server chưa sẵn sàng
+STARTUP_RETRY_AFTER = int(os.getenv("STARTUP_RETRY_AFTER", "5"))
+# Thời gian chờ tối đa để tiến trình inference sẵn sàng (khi chạy nhiều worker)
+INFERENCE_WAIT_TIMEOUT = float(os.getenv("INFERENCE_WAIT_TIMEOUT", "300"))
+# Các đường dẫn vẫn phục vụ trong lúc khởi động
+READINESS_EXEMPT_PATHS = ("/health", "/metrics", "/docs", "/redoc", "/openapi.json")
+
+router = APIRouter(
+    prefix="/health",
+    tags=["health"],
+)
+
+
+@dataclass
+class StartupState:
+    ready: bool = False
+    error: Optional[str] = None
+    # Thời gian (giây) của các bước đã xong, theo thứ tự hoàn tất
+    timings: Dict[str, float] = field(default_factory=dict)
+    pending: List[str] = field(default_factory=list)
+
+
+_state = StartupState()
+
+
+def is_ready() -> bool:
+    return _state.ready
+
+
+async def _timed(name: str, step: Callable[[], Awaitable[None]]):
+    _state.pending.append(name)
+    started = time.perf_counter()
+    try:
+        await step()
+    finally:
+        _state.pending.remove(name)
+    _state.timings[name] = time.perf_counter() - started
+
+
+async def _wait_for_inference():
+    await wait_for_services(INFERENCE_WAIT_TIMEOUT)
+
+
+async def _setup_database():
+    await run_in_threadpool(Base.metadata.create_all, bind=engine)
+    await run_in_threadpool(load_active_version)
+
+
+async def _setup_gallery():
+    # PrototypeIndex.setup() đếm ảnh trong image store nên phải chạy sau
+    await get_image_store().setup()
+    await get_prototype_index().setup()
+
+
+async def _load_detector():
+    await run_in_threadpool(get_detector)
+
+
+async def _load_recognizer():
+    await run_in_threadpool(get_recognizer)
+
+
+async def _check_r2():
+    get_r2_config()
+
+
+def _log_timings(import_seconds: Optional[float], total: float):
+    lines = [f"Startup finished in {total:.2f}s:"]
+    if import_seconds is not None:
+        lines.append(f"  {'import':<12} {import_seconds:6.2f}s")
+    lines.extend(f"  {name:<12} {seconds:6.2f}s" for name, seconds in _state.timings.items())
+    print("\n".join(lines))
+
+
+async def warm_up(import_seconds: Optional[float] = None):
+    """
+    Chạy mọi bước khởi động rồi bật các worker nền và đánh dấu sẵn sàng.
+    Bảng và phiên bản embedding đang hoạt động phải có trước; sau đó gallery,
+    hai model, model cascade và cấu hình R2 được chuẩn bị song song (model
+    ONNX nạp trong threadpool, onnxruntime nhả GIL khi chạy).
+
+    Ở worker API khi chạy nhiều worker, model và gallery thuộc tiến trình
+    inference: bước đầu tiên là chờ tiến trình đó, các bước sau chỉ còn là
+    lời gọi setup (idempotent) qua socket.
+    """
+    started = time.perf_counter()
+    try:
+        if is_remote():
+            await _timed("inference", _wait_for_inference)
+        await _timed("database", _setup_database)
+        await asyncio.gather(
+            _timed("gallery", _setup_gallery),
+            _timed("detector", _load_detector),
+            _timed("recognizer", _load_recognizer),
+            _timed("cascade", cascade.setup_cascade),
+            _timed("r2", _check_r2),
+        )
+    except Exception as e:
+        _state.error = f"{type(e).__name__}: {e}"
+        print(f"Startup failed: {_state.error}")
+        return
+    jobs.enrollment_worker.start()
+    reembedding.reembedding_worker.start()
+    compaction.compaction_worker.start()
+    _state.ready = True
+    _log_timings(import_seconds, time.perf_counter() - started)
+
+
+async def stop_background_workers():
+    await compaction.compaction_worker.stop()
+    await reembedding.reembedding_worker.stop()
+    await jobs.enrollment_worker.stop()
+
+
+async def readiness_gate(request: Request, call_next):
+    """Middleware HTTP: trả 503 cho mọi route (trừ health và docs) cho tới khi sẵn sàng."""
+    if _state.ready or request.url.path.startswith(READINESS_EXEMPT_PATHS):
+        return await call_next(request)
+    return JSONResponse(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        content={"detail": "Server failed to start." if _state.error else "Server is starting."},
+        headers={"Retry-After": str(STARTUP_RETRY_AFTER)},
+    )
+
+
+class WebSocketReadinessGate:
+    """
+    Middleware ASGI: middleware HTTP không thấy kết nối WebSocket, nên kết nối tới
+    trước khi sẵn sàng được nhận rồi đóng ngay với mã 1013 để client thử lại sau
+    (đóng trước khi accept chỉ cho client thấy lỗi bắt tay 403).
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "websocket" or _state.ready:
+            await self.app(scope, receive, send)
+            return
+        websocket = WebSocket(scope, receive, send)
+        await websocket.accept()
+        await websocket.close(
+            code=status.WS_1013_TRY_AGAIN_LATER,
+            reason="Server failed to start." if _state.error else "Server is starting.",
+        )
+
+
+# --- API ENDPOINTS ---
+
+@router.get("/live")
+def liveness():
+    if _state.error:
+        return JSONResponse(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            content={"status": "failed", "error": _state.error},
+        )
+    return {"status": "alive"}
+
+
+@router.get("/ready")
+def readiness():
+    body = {
+        "status": "ready" if _state.ready else "failed" if _state.error else "starting",
+        "pending": list(_state.pending),
+        "timings": {name: round(seconds, 3) for name, seconds in _state.timings.items()},
+    }
+    if _state.error:
+        body["error"] = _state.error
+    if not _state.ready:
+        return JSONResponse(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, content=body)
+    return body
@@ -1,26 +1,140 @@
 import asyncio
 import base64
+import os
+import time
 from datetime import datetime, timezone  # Import datetime and timezone
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+import numpy as np
 from fastapi import APIRouter, Depends, WebSocket, WebSocketDisconnect
 from PIL import Image
-import io
-import cv2
-import numpy as np
+from prometheus_client import REGISTRY, Counter, Gauge, Histogram
+from pydantic import BaseModel
 from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
 
 # Import dependency xác thực WebSocket chính xác từ auth.py
-from src.auth import get_current_user_ws
+from src.auth import get_current_admin_user, get_current_user_ws
 from src.models import User, FaceGroup # Import FaceGroup
-from src.faces import detector, recognizer
-from src.qdrant_client import get_qdrant_client, IMAGE_COLLECTION_NAME
-from qdrant_client import models as qdrant_models
+from src.embeddings import get_active_version, get_recognizer
+from src.model_registry import get_detector
+from src.cascade import match_faces
 from src.database import SessionLocal # Import SessionLocal to create db sessions
+from src.frame_ring import FrameRingStats, FrameSlot, get_frame_ring
+from src.imaging import decode_image, to_bgr_array
+from src.inference_client import SERVICE_TARGET, InferenceUnavailableError, acall, is_remote
+from src.metrics import LATENCY_BUCKETS
+from src.profiling import begin_sample, end_sample
+from src.quality import QUALITY_GATE, align_and_assess
+from src.unknown_faces import UNKNOWN_CLUSTERING, observe_unknown_faces
 
 router = APIRouter(
     prefix="/stream",
     tags=["streaming"],
 )
 
+# Số kết nối stream đang mở; các tác vụ nền (vd. re-embedding) giảm tốc khi > 0
+_active_streams = 0
+# Số stream các worker API báo về tiến trình inference chính: pid -> (số stream, thời điểm báo)
+_remote_streams: Dict[int, Tuple[int, float]] = {}
+# Worker báo lại định kỳ khi còn stream mở; báo cáo cũ hơn STREAM_REPORT_TTL bị bỏ qua
+# (worker đã chết mà chưa kịp báo về 0)
+STREAM_REPORT_INTERVAL = float(os.getenv("STREAM_REPORT_INTERVAL", "15"))
+STREAM_REPORT_TTL = 3 * STREAM_REPORT_INTERVAL
+_report_task: Optional[asyncio.Task] = None
+
+
+def active_stream_count() -> int:
+    """Số stream đang mở: của tiến trình này cộng với số các worker API đã báo về."""
+    now = time.monotonic()
+    remote = sum(count for count, reported_at in list(_remote_streams.values()) if now - reported_at < STREAM_REPORT_TTL)
+    return _active_streams + remote
+
+
+def record_remote_streams(worker_pid: int, count: int):
+    """Ghi nhận số stream một worker API đang mở (gọi ở tiến trình inference chính)."""
+    if count:
+        _remote_streams[worker_pid] = (count, time.monotonic())
+    else:
+        _remote_streams.pop(worker_pid, None)
+
+
+_stream_count_changed = asyncio.Event()
+
+
+async def _report_streams():
+    """Báo số stream của worker này về tiến trình chính; lặp lại định kỳ tới khi không còn stream nào."""
+    global _report_task
+    try:
+        while True:
+            _stream_count_changed.clear()
+            count = _active_streams
+            try:
+                await acall(SERVICE_TARGET, "report_streams", os.getpid(), count)
+            except InferenceUnavailableError as e:
+                print(f"Could not report stream count to the inference process: {e}")
+            if count == 0 and not _stream_count_changed.is_set():
+                return
+            try:
+                await asyncio.wait_for(_stream_count_changed.wait(), STREAM_REPORT_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+    finally:
+        _report_task = None
+
+
+def _stream_count_updated():
+    """Worker API: tiến trình chính cần biết số stream để giảm tốc các tác vụ nền của nó."""
+    global _report_task
+    if not is_remote():
+        return
+    _stream_count_changed.set()
+    if _report_task is None:
+        _report_task = asyncio.create_task(_report_streams())
+
+
+# --- metrics (src/metrics.py) ---
+
+STAGE_SECONDS = Histogram(
+    "face_stream_stage_seconds",
+    "Time spent in each stage of processing a stream frame.",
+    ("stage",),
+    buckets=LATENCY_BUCKETS,
+)
+FRAME_SECONDS = Histogram(
+    "face_stream_frame_seconds", "End-to-end processing time of a stream frame.", buckets=LATENCY_BUCKETS
+)
+FRAMES_PROCESSED = Counter("face_stream_frames_processed", "Stream frames processed.")
+# Khung hình bị thay bởi khung mới hơn trước khi kịp xử lý (latest-frame-wins)
+FRAMES_DROPPED = Counter("face_stream_frames_dropped", "Stream frames replaced by a newer one before processing.")
+FACES = Counter("face_stream_faces", "Faces seen on streams by outcome.", ("result",))
+ERRORS = Counter("face_stream_errors", "Errors while processing stream frames by stage.", ("stage",))
+# Gauge của từng tiến trình; khi chạy nhiều worker /metrics cộng giá trị của các tiến trình còn sống
+SESSIONS_ACTIVE = Gauge("face_stream_sessions_active", "Open stream WebSocket sessions.", multiprocess_mode="livesum")
+FRAMES_PENDING = Gauge(
+    "face_stream_frames_pending", "Sessions holding a received frame not yet processed.", multiprocess_mode="livesum"
+)
+FRAME_SLOTS_IN_USE = Gauge(
+    "face_stream_frame_slots_in_use",
+    "Shared-memory frame slots leased by sessions (multi-worker deployments).",
+    multiprocess_mode="livesum",
+)
+
+
+def _lease_slot() -> Optional[FrameSlot]:
+    slot = get_frame_ring().lease()
+    FRAME_SLOTS_IN_USE.set(get_frame_ring().stats().in_use)
+    return slot
+
+
+def _return_slot(slot: FrameSlot, retire: bool = False):
+    if retire:
+        slot.retire()
+    else:
+        slot.release()
+    FRAME_SLOTS_IN_USE.set(get_frame_ring().stats().in_use)
+
+
 # ... (FrameManager class remains the same) ...
 class FrameManager:
     """Manages the latest frame to be processed, preventing a backlog."""
@@ -28,10 +142,16 @@ class FrameManager:
     def __init__(self):
         self.latest_frame = None
         self.lock = asyncio.Lock()
+        self.overruns = 0
 
     async def set_frame(self, frame_bytes: bytes):
-        """Sets the latest frame, overwriting any previous one."""
+        """Sets the latest frame, overwriting (and counting) any unprocessed one."""
         async with self.lock:
+            if self.latest_frame is not None:
+                self.overruns += 1
+                FRAMES_DROPPED.inc()
+            else:
+                FRAMES_PENDING.inc()
             self.latest_frame = frame_bytes
 
     async def get_frame(self) -> bytes | None:
@@ -39,8 +159,58 @@ class FrameManager:
         async with self.lock:
             frame = self.latest_frame
             self.latest_frame = None
+            if frame is not None:
+                FRAMES_PENDING.dec()
             return frame
 
+    def discard(self):
+        """Bỏ khung chưa xử lý khi phiên đóng."""
+        if self.latest_frame is not None:
+            self.latest_frame = None
+            FRAMES_PENDING.dec()
+
+class DetectedFrame(NamedTuple):
+    image: Image.Image
+    bgr: np.ndarray
+    # Faces that passed the quality gate, with their embeddings in the same order
+    faces: List[Dict]
+    embeddings: np.ndarray
+    # (face, reason) of faces rejected by the quality gate
+    skipped: List[Tuple[Dict, str]]
+
+
+def detect_and_embed(frame_bytes: str, version: str, slot: Optional[FrameSlot] = None) -> DetectedFrame:
+    """
+    Decode a base64 data-URL frame, detect all faces and embed the ones that
+    pass the quality gate with the recognizer of embedding `version`.
+    The decoded image is returned too so unknown faces can be cropped and
+    ambiguous matches re-embedded by the cascade verifier.
+    With a shared-memory `slot` the BGR frame is decoded straight into it, so
+    the inference process reads it in place (see src/frame_ring.py).
+    CPU-bound; called through run_in_threadpool.
+    """
+    with STAGE_SECONDS.labels("decode").time():
+        image_data = base64.b64decode(frame_bytes.split(",")[1])
+        image = decode_image(image_data)
+        np_bgr_img = to_bgr_array(image, out=slot.frame((image.height, image.width, 3)) if slot else None)
+    with STAGE_SECONDS.labels("detect").time():
+        faces = get_detector().detect(np_bgr_img)
+    recognizer = get_recognizer(version)
+    if not QUALITY_GATE:
+        # Every face of the frame is embedded in a single model call
+        with STAGE_SECONDS.labels("embed").time():
+            embeddings = recognizer.get_normalized_embeddings(np_bgr_img, [face["landmarks"] for face in faces])
+        return DetectedFrame(image, np_bgr_img, faces, embeddings, [])
+
+    # Low-quality faces (blurred, profile, tiny) are never embedded
+    with STAGE_SECONDS.labels("align").time():
+        aligned, qualities = align_and_assess(np_bgr_img, faces)
+    kept = [i for i, quality in enumerate(qualities) if quality.passed]
+    skipped = [(faces[i], quality.reason) for i, quality in enumerate(qualities) if not quality.passed]
+    with STAGE_SECONDS.labels("embed").time():
+        embeddings = recognizer.get_normalized_embeddings_aligned([aligned[i] for i in kept])
+    return DetectedFrame(image, np_bgr_img, [faces[i] for i in kept], embeddings, skipped)
+
 # Tác vụ chạy ngầm để xử lý nhận dạng khuôn mặt
 async def recognition_task(
     websocket: WebSocket, frame_manager: FrameManager, current_user: User
@@ -49,82 +219,112 @@ async def recognition_task(
     Runs in the background, continuously processing the latest frame available
     from the FrameManager.
     """
-    qdrant_client = get_qdrant_client()
-    while True:
-        frame_bytes = await frame_manager.get_frame()
-        if frame_bytes:
-            try:
-                # 1. Decode image from base64 string
-                image_data = base64.b64decode(frame_bytes.split(",")[1])
-                image_pil = Image.open(io.BytesIO(image_data)).convert("RGB")
-                np_image = np.array(image_pil)
-                np_bgr_img = cv2.cvtColor(np_image, cv2.COLOR_RGB2BGR)
-
-                # 2. Detect all faces
-                faces = detector.detect(np_bgr_img)
-                results_to_send = []
-
-                if faces:
-                    db: Session = SessionLocal() # Create a new session for this task iteration
-                    try:
-                        for face in faces:
-                            # ... (embedding and search logic is the same) ...
-                            landmarks = np.array(face["landmarks"])
-                            embedding = recognizer.get_normalized_embedding(
-                                np_bgr_img, landmarks
+    # Slot shared memory của phiên, dùng lại cho mọi khung hình; chỉ cần khi model ở tiến trình khác
+    slot = _lease_slot() if is_remote() else None
+    decoding: Optional[asyncio.Future] = None
+    try:
+        while True:
+            frame_bytes = await frame_manager.get_frame()
+            if frame_bytes:
+                started = time.perf_counter()
+                sample = begin_sample("frame")
+                try:
+                    # 1-2. Decode, detect and embed every face off the event loop
+                    # Embedding và tìm kiếm của một khung hình dùng cùng một phiên bản
+                    version = get_active_version()
+                    # Shield: nếu phiên bị hủy giữa chừng, thread decode vẫn chạy tiếp và slot
+                    # chỉ được trả lại sau khi nó xong (xem finally)
+                    decoding = asyncio.ensure_future(run_in_threadpool(detect_and_embed, frame_bytes, version, slot))
+                    frame = await asyncio.shield(decoding)
+                    results_to_send = []
+                    unknown_faces, unknown_embeddings = [], []
+
+                    if frame.faces:
+                        # 3. Search all faces in one batched query; ambiguous matches go
+                        # through the cascade verifier when one is configured
+                        with STAGE_SECONDS.labels("search").time():
+                            matches = await match_faces(
+                                frame.bgr, frame.faces, frame.embeddings, current_user.username, version
                             )
-                            user_filter = qdrant_models.Filter(
-                                must=[
-                                    qdrant_models.FieldCondition(
-                                        key="user_id",
-                                        match=qdrant_models.MatchValue(
-                                            value=current_user.username
-                                        ),
+                        db_started = time.perf_counter()
+                        db: Session = SessionLocal() # Create a new session for this task iteration
+                        try:
+                            for face, embedding, best_match in zip(frame.faces, frame.embeddings, matches):
+                                box = list(map(int, face["bbox"]))
+                                if best_match is not None:
+                                    label = best_match.payload["name"]
+                                    results_to_send.append(
+                                        {
+                                            "box": box,
+                                            "label": label,
+                                            "score": best_match.score,
+                                        }
                                     )
-                                ]
-                            )
-                            hits = qdrant_client.query_points(
-                                collection_name=IMAGE_COLLECTION_NAME,
-                                query=embedding[0].tolist(),
-                                query_filter=user_filter,
-                                limit=1,
-                                score_threshold=0.4,
-                            )
-                            box = list(map(int, face["bbox"]))
-                            if hits.points:
-                                best_match = hits.points[0]
-                                label = best_match.payload["name"]
-                                results_to_send.append(
-                                    {
-                                        "box": box,
-                                        "label": label,
-                                        "score": best_match.score,
-                                    }
-                                )
-                                # --- START OF NEW LOGIC ---
-                                # Update the last_seen_at timestamp
-                                group = db.query(FaceGroup).filter_by(name=label, user_id=current_user.id).first()
-                                if group:
-                                    group.last_seen_at = datetime.now(timezone.utc)
-                                # --- END OF NEW LOGIC ---
-                            else:
-                                results_to_send.append(
-                                    {"box": box, "label": "Unknown", "score": 0.0}
-                                )
-                        db.commit() # Commit all timestamp updates at once
-                    except Exception as e:
-                        print(f"Error during face processing loop: {e}")
-                        db.rollback() # Rollback on error
-                    finally:
-                        db.close() # Always close the session
-
-                if results_to_send:
-                    await websocket.send_json({"results": results_to_send})
-
-            except Exception as e:
-                print(f"Error processing frame: {e}")
-
-        await asyncio.sleep(0.05)
+                                    # --- START OF NEW LOGIC ---
+                                    # Update the last_seen_at timestamp
+                                    group = db.query(FaceGroup).filter_by(name=label, user_id=current_user.id).first()
+                                    if group:
+                                        group.last_seen_at = datetime.now(timezone.utc)
+                                    # --- END OF NEW LOGIC ---
+                                else:
+                                    results_to_send.append(
+                                        {"box": box, "label": "Unknown", "score": 0.0}
+                                    )
+                                    unknown_faces.append(face)
+                                    unknown_embeddings.append(embedding)
+                            db.commit() # Commit all timestamp updates at once
+                        except Exception as e:
+                            print(f"Error during face processing loop: {e}")
+                            ERRORS.labels("db_write").inc()
+                            db.rollback() # Rollback on error
+                        finally:
+                            db.close() # Always close the session
+                        STAGE_SECONDS.labels("db_write").observe(time.perf_counter() - db_started)
+                        FACES.labels("recognized").inc(len(frame.faces) - len(unknown_faces))
+                        FACES.labels("unknown").inc(len(unknown_faces))
+
+                    # Mặt không đạt chất lượng vẫn được vẽ khung nhưng không được nhận dạng
+                    for face, reason in frame.skipped:
+                        results_to_send.append(
+                            {"box": list(map(int, face["bbox"])), "label": "Unknown", "score": 0.0, "quality": reason}
+                        )
+
+                    if frame.skipped:
+                        FACES.labels("low_quality").inc(len(frame.skipped))
+
+                    if results_to_send:
+                        with STAGE_SECONDS.labels("send").time():
+                            await websocket.send_json({"results": results_to_send})
+
+                    # Gom cụm khuôn mặt lạ sau khi đã trả kết quả để không làm chậm client
+                    if unknown_faces and UNKNOWN_CLUSTERING:
+                        await run_in_threadpool(
+                            observe_unknown_faces, current_user.username, version, frame.image, unknown_faces, unknown_embeddings
+                        )
+
+                    FRAMES_PROCESSED.inc()
+                    FRAME_SECONDS.observe(time.perf_counter() - started)
+
+                except InferenceUnavailableError as e:
+                    print(f"Error processing frame: {e}")
+                    ERRORS.labels("inference").inc()
+                    if slot is not None:
+                        # Lời gọi quá hạn có thể vẫn đang đọc slot ở tiến trình inference:
+                        # không decode khung tiếp theo vào đó
+                        _return_slot(slot, retire=True)
+                        slot = _lease_slot()
+                except Exception as e:
+                    print(f"Error processing frame: {e}")
+                    ERRORS.labels("frame").inc()
+                finally:
+                    end_sample(sample)
+
+            await asyncio.sleep(0.05)
+    finally:
+        if slot is not None:
+            if decoding is not None and not decoding.done():
+                await asyncio.wait([decoding])
+            _return_slot(slot)
 
 
 # ... (websocket_endpoint function remains the same) ...
@@ -133,7 +333,11 @@ async def websocket_endpoint(
     websocket: WebSocket,
     current_user: User = Depends(get_current_user_ws),
 ):
+    global _active_streams
     await websocket.accept()
+    _active_streams += 1
+    SESSIONS_ACTIVE.inc()
+    _stream_count_updated()
     print(f"WebSocket connection accepted for user: {current_user.username}")
     frame_manager = FrameManager()
     processing_task = asyncio.create_task(
@@ -146,5 +350,32 @@ async def websocket_endpoint(
     except WebSocketDisconnect:
         print(f"Client {current_user.username} disconnected.")
     finally:
+        _active_streams -= 1
+        SESSIONS_ACTIVE.dec()
+        _stream_count_updated()
         processing_task.cancel()
-        print(f"Recognition task for {current_user.username} cancelled.")
+        frame_manager.discard()
+        print(
+            f"Recognition task for {current_user.username} cancelled "
+            f"({frame_manager.overruns} frames dropped for newer ones)."
+        )
+
+
+class StreamStats(BaseModel):
+    active_streams: int
+    frames_processed: int
+    # Khung hình bị thay bởi khung mới hơn trước khi kịp xử lý (latest-frame-wins)
+    frame_overruns: int
+    # Slot shared memory khi model chạy ở tiến trình inference, None nếu chạy một tiến trình
+    frame_ring: Optional[FrameRingStats] = None
+
+
+@router.get("/stats", response_model=StreamStats)
+def get_stream_stats(current_user: User = Depends(get_current_admin_user)):
+    """Số liệu stream của worker xử lý request này."""
+    return StreamStats(
+        active_streams=_active_streams,
+        frames_processed=int(REGISTRY.get_sample_value("face_stream_frames_processed_total") or 0),
+        frame_overruns=int(REGISTRY.get_sample_value("face_stream_frames_dropped_total") or 0),
+        frame_ring=get_frame_ring().stats() if is_remote() else None,
+    )
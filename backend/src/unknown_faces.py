@@ -0,0 +1,356 @@
+"""
+Gom cụm trực tuyến các khuôn mặt "Unknown" xuất hiện trên stream.
+
+Mỗi tenant có một kho giới hạn trong bộ nhớ gồm tối đa UNKNOWN_MAX_CLUSTERS
+cụm. Một khuôn mặt lạ được gán vào cụm có tâm gần nhất nếu cosine similarity
+đạt UNKNOWN_CLUSTER_THRESHOLD, ngược lại nó mở một cụm mới (khi kho đầy, cụm
+lâu không xuất hiện nhất bị loại). Tâm cụm là tổng embedding nên được cập
+nhật tăng dần; hai cụm có tâm trôi lại gần nhau được gộp.
+
+Mỗi cụm chỉ giữ tối đa UNKNOWN_CLUSTER_SAMPLES mẫu (embedding + thumbnail đã
+encode), và một mẫu mới chỉ được giữ nếu nó đủ khác các mẫu đã có, nên bộ nhớ
+bị chặn bất kể stream chạy bao lâu. Khi promote, các mẫu được ghi thẳng vào
+gallery thành một FaceGroup mới mà không cần chạy lại inference.
+"""
+import asyncio
+import base64
+import os
+import threading
+import uuid
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from typing import Dict, List, Optional
+
+import numpy as np
+from fastapi import APIRouter, Depends, HTTPException, Path, Response, status
+from PIL import Image
+from pydantic import Field
+from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
+
+from src.auth import get_current_active_user
+from src.database import get_db
+from src.embeddings import get_active_version, get_image_store
+from src.inference_client import RemoteUnknownStore, is_remote
+from src.faces import add_to_face_groups
+from src.models import User
+from src.prototypes import get_prototype_index
+from src.schemas import BaseModel
+from src.utils import (
+    IMAGE_FORMATS,
+    THUMBNAIL_FORMAT,
+    THUMBNAIL_QUALITY,
+    crop_face_thumbnail,
+    encode_image,
+    upload_encoded_face_images,
+)
+from src.vector_store import VectorRecord
+
+# Tắt (0) để bỏ qua hoàn toàn các khuôn mặt lạ như trước
+UNKNOWN_CLUSTERING = os.getenv("UNKNOWN_CLUSTERING", "1") == "1"
+UNKNOWN_CLUSTER_THRESHOLD = float(os.getenv("UNKNOWN_CLUSTER_THRESHOLD", "0.5"))
+UNKNOWN_MAX_CLUSTERS = int(os.getenv("UNKNOWN_MAX_CLUSTERS", "100"))
+UNKNOWN_CLUSTER_SAMPLES = int(os.getenv("UNKNOWN_CLUSTER_SAMPLES", "10"))
+# Mẫu mới có similarity với một mẫu đã giữ từ ngưỡng này trở lên bị coi là trùng
+UNKNOWN_SAMPLE_DIVERSITY = float(os.getenv("UNKNOWN_SAMPLE_DIVERSITY", "0.9"))
+# Khuôn mặt nhỏ hơn (px, cạnh ngắn của bbox) không được gom cụm
+UNKNOWN_MIN_FACE_SIZE = int(os.getenv("UNKNOWN_MIN_FACE_SIZE", "40"))
+UPLOAD_CONCURRENCY = 8
+
+router = APIRouter(
+    prefix="/unknown-faces",
+    tags=["unknown-faces"],
+    responses={404: {"description": "Not found"}},
+)
+
+
+@dataclass
+class FaceSample:
+    embedding: np.ndarray
+    thumbnail: bytes
+    confidence: float
+
+
+@dataclass
+class UnknownCluster:
+    id: str
+    total: np.ndarray
+    count: int
+    first_seen_at: datetime
+    last_seen_at: datetime
+    samples: List[FaceSample] = field(default_factory=list)
+
+    @property
+    def centroid(self) -> np.ndarray:
+        norm = np.linalg.norm(self.total)
+        return self.total / norm if norm > 0 else self.total
+
+    def wants_sample(self, embedding: np.ndarray) -> bool:
+        if not self.samples:
+            return True
+        if len(self.samples) >= UNKNOWN_CLUSTER_SAMPLES:
+            return False
+        similarities = np.stack([s.embedding for s in self.samples]) @ embedding
+        return float(similarities.max()) < UNKNOWN_SAMPLE_DIVERSITY
+
+
+class UnknownFaceStore:
+    """Các cụm khuôn mặt lạ của một tenant. Thread-safe (observe chạy trong threadpool)."""
+
+    def __init__(self, version: str):
+        self.version = version
+        self._clusters: Dict[str, UnknownCluster] = {}
+        self._lock = threading.Lock()
+
+    def _nearest(self, embedding: np.ndarray, exclude: Optional[str] = None):
+        candidates = [c for c in self._clusters.values() if c.id != exclude]
+        if not candidates:
+            return None, -1.0
+        similarities = np.stack([c.centroid for c in candidates]) @ embedding
+        best = int(np.argmax(similarities))
+        return candidates[best], float(similarities[best])
+
+    def _evict(self):
+        oldest = min(self._clusters.values(), key=lambda c: c.last_seen_at)
+        del self._clusters[oldest.id]
+
+    def _merge_into(self, target: UnknownCluster, other: UnknownCluster):
+        target.total = target.total + other.total
+        target.count += other.count
+        target.first_seen_at = min(target.first_seen_at, other.first_seen_at)
+        for sample in other.samples:
+            if target.wants_sample(sample.embedding):
+                target.samples.append(sample)
+        del self._clusters[other.id]
+
+    def observe(self, thumbnail: Image.Image, face: Dict, embedding: np.ndarray):
+        """Gán một khuôn mặt lạ vào cụm; thumbnail (đã cắt) chỉ được encode khi mẫu được giữ."""
+        now = datetime.now(timezone.utc)
+        with self._lock:
+            cluster, score = self._nearest(embedding)
+            if cluster is None or score < UNKNOWN_CLUSTER_THRESHOLD:
+                if len(self._clusters) >= UNKNOWN_MAX_CLUSTERS:
+                    self._evict()
+                cluster = UnknownCluster(
+                    id=str(uuid.uuid4()),
+                    total=np.zeros_like(embedding),
+                    count=0,
+                    first_seen_at=now,
+                    last_seen_at=now,
+                )
+                self._clusters[cluster.id] = cluster
+            cluster.total = cluster.total + embedding
+            cluster.count += 1
+            cluster.last_seen_at = now
+            keep_sample = cluster.wants_sample(embedding)
+
+            # Tâm cụm vừa dịch chuyển: gộp với cụm khác nếu giờ đã đủ gần
+            neighbour, neighbour_score = self._nearest(cluster.centroid, exclude=cluster.id)
+            if neighbour is not None and neighbour_score >= UNKNOWN_CLUSTER_THRESHOLD:
+                target, other = (cluster, neighbour) if cluster.count >= neighbour.count else (neighbour, cluster)
+                self._merge_into(target, other)
+                cluster = target
+
+        if keep_sample:
+            encoded = encode_image(thumbnail, THUMBNAIL_FORMAT, THUMBNAIL_QUALITY)
+            sample = FaceSample(embedding=embedding, thumbnail=encoded, confidence=float(face["confidence"]))
+            with self._lock:
+                if cluster.id in self._clusters and cluster.wants_sample(embedding):
+                    cluster.samples.append(sample)
+
+    def observe_faces(self, thumbnails: List[Image.Image], faces: List[Dict], embeddings: List[np.ndarray]):
+        for thumbnail, face, embedding in zip(thumbnails, faces, embeddings):
+            self.observe(thumbnail, face, np.asarray(embedding, dtype=np.float32))
+
+    def clusters(self) -> List[UnknownCluster]:
+        with self._lock:
+            return sorted(self._clusters.values(), key=lambda c: c.count, reverse=True)
+
+    def get(self, cluster_id: str) -> Optional[UnknownCluster]:
+        with self._lock:
+            return self._clusters.get(cluster_id)
+
+    def pop(self, cluster_id: str) -> Optional[UnknownCluster]:
+        with self._lock:
+            return self._clusters.pop(cluster_id, None)
+
+    def restore(self, cluster: UnknownCluster):
+        with self._lock:
+            self._clusters.setdefault(cluster.id, cluster)
+
+
+_stores: Dict[str, UnknownFaceStore] = {}
+_stores_lock = threading.Lock()
+
+
+def get_unknown_store(username: str, version: Optional[str] = None) -> UnknownFaceStore:
+    """
+    Kho của tenant cho phiên bản embedding `version` (mặc định: phiên bản đang dùng).
+    Embedding của phiên bản cũ không dùng được nữa nên kho được làm mới khi phiên bản đổi.
+    """
+    version = version or get_active_version()
+    if is_remote():
+        # Cụm được gom chung cho mọi worker ở tiến trình inference chính
+        return RemoteUnknownStore(username, version)
+    with _stores_lock:
+        store = _stores.get(username)
+        if store is None or store.version != version:
+            store = _stores[username] = UnknownFaceStore(version)
+        return store
+
+
+def observe_unknown_faces(username: str, version: str, image: Image.Image, faces: List[Dict], embeddings: List[np.ndarray]):
+    """
+    Đưa các khuôn mặt không khớp ai vào kho. Thumbnail được cắt ở đây nên khi kho nằm ở
+    tiến trình inference chỉ các ảnh nhỏ này đi qua socket, không phải cả khung hình.
+    Tốn CPU (cắt / encode thumbnail); gọi qua run_in_threadpool.
+    """
+    kept = [
+        (face, embedding)
+        for face, embedding in zip(faces, embeddings)
+        if min(face["bbox"][2] - face["bbox"][0], face["bbox"][3] - face["bbox"][1]) >= UNKNOWN_MIN_FACE_SIZE
+    ]
+    if not kept:
+        return
+    thumbnails = [crop_face_thumbnail(image, face["bbox"]) for face, _ in kept]
+    get_unknown_store(username, version).observe_faces(
+        thumbnails, [face for face, _ in kept], [embedding for _, embedding in kept]
+    )
+
+
+# --- API MODELS ---
+
+class UnknownClusterOut(BaseModel):
+    id: str
+    count: int = Field(..., description="Số lần khuôn mặt này được nhìn thấy.")
+    sample_count: int
+    preview: Optional[str] = Field(None, description="Thumbnail của mẫu đầu tiên (data URL).")
+    first_seen_at: datetime
+    last_seen_at: datetime
+
+
+class PromoteClusterRequest(BaseModel):
+    name: str = Field(..., min_length=1, description="Tên FaceGroup mới.")
+    samples: Optional[List[int]] = Field(None, description="Chỉ số các mẫu cần thêm (mặc định: tất cả).")
+
+
+class PromoteClusterResponse(BaseModel):
+    name: str
+    point_ids: List[str]
+
+
+def _cluster_out(cluster: UnknownCluster) -> UnknownClusterOut:
+    preview = None
+    if cluster.samples:
+        content_type = IMAGE_FORMATS[THUMBNAIL_FORMAT][1]
+        preview = f"data:{content_type};base64,{base64.b64encode(cluster.samples[0].thumbnail).decode()}"
+    return UnknownClusterOut(
+        id=cluster.id,
+        count=cluster.count,
+        sample_count=len(cluster.samples),
+        preview=preview,
+        first_seen_at=cluster.first_seen_at,
+        last_seen_at=cluster.last_seen_at,
+    )
+
+
+def _get_cluster(username: str, cluster_id: str) -> UnknownCluster:
+    cluster = get_unknown_store(username).get(cluster_id)
+    if cluster is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Cluster not found")
+    return cluster
+
+
+# --- API ENDPOINTS ---
+
+@router.get("/clusters", response_model=List[UnknownClusterOut])
+def list_unknown_clusters(
+    min_count: int = 1,
+    current_user: User = Depends(get_current_active_user),
+):
+    """Các cụm khuôn mặt lạ của tenant, cụm được nhìn thấy nhiều nhất trước."""
+    clusters = get_unknown_store(current_user.username).clusters()
+    return [_cluster_out(c) for c in clusters if c.count >= min_count and c.samples]
+
+
+@router.get("/clusters/{cluster_id}/samples/{index}")
+def get_unknown_sample(
+    cluster_id: str = Path(..., description="ID của cụm"),
+    index: int = Path(..., ge=0, description="Chỉ số mẫu"),
+    current_user: User = Depends(get_current_active_user),
+):
+    cluster = _get_cluster(current_user.username, cluster_id)
+    if index >= len(cluster.samples):
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Sample not found")
+    return Response(content=cluster.samples[index].thumbnail, media_type=IMAGE_FORMATS[THUMBNAIL_FORMAT][1])
+
+
+@router.post("/clusters/{cluster_id}/promote", response_model=PromoteClusterResponse)
+async def promote_unknown_cluster(
+    request: PromoteClusterRequest,
+    cluster_id: str = Path(..., description="ID của cụm"),
+    current_user: User = Depends(get_current_active_user),
+    db: Session = Depends(get_db),
+):
+    """
+    Thêm các mẫu của cụm vào gallery thành FaceGroup `name` (hoặc bổ sung vào nhóm
+    đã có) bằng các embedding đã tính sẵn, rồi xóa cụm khỏi kho.
+    """
+    name = request.name.strip()
+    if not name:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Name must not be empty.")
+    store = get_unknown_store(current_user.username)
+    # Lấy cụm ra khỏi kho để stream không ghi thêm trong lúc promote
+    # Kho ở tiến trình inference khi chạy nhiều worker: lời gọi socket không chạy trên event loop
+    cluster = await run_in_threadpool(store.pop, cluster_id)
+    if cluster is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Cluster not found")
+
+    try:
+        indices = range(len(cluster.samples)) if request.samples is None else sorted(set(request.samples))
+        if any(i < 0 or i >= len(cluster.samples) for i in indices):
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Sample index out of range.")
+        samples = [cluster.samples[i] for i in indices]
+        if not samples:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="No samples to promote.")
+
+        sem = asyncio.Semaphore(UPLOAD_CONCURRENCY)
+
+        async def limited_upload(sample: FaceSample):
+            async with sem:
+                return await upload_encoded_face_images({"thumbnail": sample.thumbnail})
+
+        uploaded = await asyncio.gather(*(limited_upload(sample) for sample in samples))
+        points = [
+            VectorRecord(
+                id=str(uuid.uuid4()),
+                vector=sample.embedding,
+                payload={
+                    **image_urls,
+                    "user_id": current_user.username,
+                    "content_type": IMAGE_FORMATS[THUMBNAIL_FORMAT][1],
+                    "name": name,
+                },
+            )
+            for sample, image_urls in zip(samples, uploaded)
+        ]
+        await get_image_store(store.version).upsert(points)
+        await get_prototype_index(store.version).add(current_user.username, [(name, point.vector) for point in points])
+    except BaseException:
+        await run_in_threadpool(store.restore, cluster)
+        raise
+
+    add_to_face_groups(db, current_user.id, {name: len(points)})
+    db.commit()
+    return PromoteClusterResponse(name=name, point_ids=[point.id for point in points])
+
+
+@router.delete("/clusters/{cluster_id}", status_code=status.HTTP_204_NO_CONTENT)
+def dismiss_unknown_cluster(
+    cluster_id: str = Path(..., description="ID của cụm"),
+    current_user: User = Depends(get_current_active_user),
+):
+    """Bỏ một cụm (vd. người qua đường không cần lưu)."""
+    if get_unknown_store(current_user.username).pop(cluster_id) is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Cluster not found")
+    return Response(status_code=status.HTTP_204_NO_CONTENT)
@@ -1,64 +1,229 @@
 import asyncio
 import io
 import os
-from typing import Any, Dict, List, Optional, Tuple
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import TYPE_CHECKING, Any, Dict, List, Optional, Tuple
 from urllib.parse import urlparse
 import uuid
 
 import numpy as np
-import aioboto3
 from dotenv import load_dotenv
+from PIL import Image
+from starlette.concurrency import run_in_threadpool
 
-from lib.uniface.detection.srcfd import SCRFD
-from lib.uniface.recogition.models import ArcFace
+from src.imaging import decode_image
+from src.quality import QUALITY_GATE, FaceQualityError, align_and_assess
+
+if TYPE_CHECKING:
+    from lib.uniface.detection.srcfd import SCRFD
+    from lib.uniface.recogition.models import ArcFace
 
 load_dotenv()
 
-# Required ENV variables
-ENDPOINT_URL_R2 = os.getenv("ENDPOINT_URL_R2")
-AWS_ACCESS_KEY_ID_R2 = os.getenv("AWS_ACCESS_KEY_ID_R2")
-AWS_SECRET_ACCESS_KEY_R2 = os.getenv("AWS_SECRET_ACCESS_KEY_R2")
-PUBLIC_URL_R2 = os.getenv("PUBLIC_URL_R2")
 
-if not all([ENDPOINT_URL_R2, AWS_ACCESS_KEY_ID_R2, AWS_SECRET_ACCESS_KEY_R2, PUBLIC_URL_R2]):
-    raise RuntimeError("Missing required environment variables for R2")
+@dataclass(frozen=True)
+class R2Config:
+    endpoint: str
+    bucket: str
+    access_key_id: str
+    secret_access_key: str
+    public_url: str
+
+
+@lru_cache(maxsize=1)
+def get_r2_config() -> R2Config:
+    """
+    Đọc cấu hình R2 từ biến môi trường ở lần dùng đầu tiên (server kiểm tra khi khởi động),
+    để import module không đòi hỏi R2.
+    """
+    endpoint_url = os.getenv("ENDPOINT_URL_R2")
+    access_key_id = os.getenv("AWS_ACCESS_KEY_ID_R2")
+    secret_access_key = os.getenv("AWS_SECRET_ACCESS_KEY_R2")
+    public_url = os.getenv("PUBLIC_URL_R2")
+    if not all([endpoint_url, access_key_id, secret_access_key, public_url]):
+        raise RuntimeError("Missing required environment variables for R2")
 
-# Parse bucket and endpoint
-parsed = urlparse(ENDPOINT_URL_R2)
-bucket_name = parsed.path.lstrip("/")
-endpoint_base = f"{parsed.scheme}://{parsed.netloc}"
+    # Parse bucket and endpoint
+    parsed = urlparse(endpoint_url)
+    return R2Config(
+        endpoint=f"{parsed.scheme}://{parsed.netloc}",
+        bucket=parsed.path.lstrip("/"),
+        access_key_id=access_key_id,
+        secret_access_key=secret_access_key,
+        public_url=public_url,
+    )
 
-# FNV-1a hash (simple 32-bit)
 
+def r2_client():
+    """Client S3 async cho R2 (dùng với `async with`)."""
+    # aioboto3 mất ~0.5s để import nên chỉ được nạp khi thực sự truy cập R2
+    import aioboto3
 
-# Upload single image
-async def upload_img_to_r2(img) -> str:
+    config = get_r2_config()
+    return aioboto3.Session().client(
+        "s3",
+        endpoint_url=config.endpoint,
+        aws_access_key_id=config.access_key_id,
+        aws_secret_access_key=config.secret_access_key,
+        region_name="auto",
+    )
+
+
+# Stored image settings
+# STORE_ORIGINAL_IMAGES=false chỉ lưu thumbnail khuôn mặt, không lưu ảnh gốc.
+STORE_ORIGINAL_IMAGES = os.getenv("STORE_ORIGINAL_IMAGES", "true").lower() in ("1", "true", "yes")
+IMAGE_FORMAT = os.getenv("IMAGE_FORMAT", "JPEG").upper()
+IMAGE_QUALITY = int(os.getenv("IMAGE_QUALITY", "85"))
+THUMBNAIL_FORMAT = os.getenv("THUMBNAIL_FORMAT", "WEBP").upper()
+THUMBNAIL_QUALITY = int(os.getenv("THUMBNAIL_QUALITY", "80"))
+THUMBNAIL_MAX_SIZE = int(os.getenv("THUMBNAIL_MAX_SIZE", "256"))
+THUMBNAIL_MARGIN = float(os.getenv("THUMBNAIL_MARGIN", "0.3"))
+# Bản ghi được nhập từ snapshot gallery (src/gallery.py) trỏ tới ảnh R2 của gallery
+# khác; xóa, thay ảnh hay gộp bản ghi đó không được xóa các object dùng chung.
+SHARED_IMAGES_FIELD = "shared_images"
+
+# format -> (file extension, content type)
+IMAGE_FORMATS = {
+    "JPEG": ("jpg", "image/jpeg"),
+    "WEBP": ("webp", "image/webp"),
+}
+
+for _fmt in (IMAGE_FORMAT, THUMBNAIL_FORMAT):
+    if _fmt not in IMAGE_FORMATS:
+        raise RuntimeError(f"Unsupported image format '{_fmt}', expected one of {list(IMAGE_FORMATS)}")
+
+
+def encode_image(img: Image.Image, fmt: str = IMAGE_FORMAT, quality: int = IMAGE_QUALITY) -> bytes:
     """
-    img: PIL.Image
+    Encode một ảnh PIL sang JPEG/WebP.
+    Chạy đồng bộ (tốn CPU), nên gọi qua run_in_threadpool từ code async.
     """
     output = io.BytesIO()
-    img.convert("RGB").save(output, format="JPEG", quality=95, optimize=True)
-    jpeg_bytes = output.getvalue()
+    img.convert("RGB").save(output, format=fmt, quality=quality)
+    return output.getvalue()
 
-    key = f"{uuid.uuid4()}.jpg"
 
-    session = aioboto3.Session()
-    async with session.client(
-        "s3",
-        endpoint_url=endpoint_base,
-        aws_access_key_id=AWS_ACCESS_KEY_ID_R2,
-        aws_secret_access_key=AWS_SECRET_ACCESS_KEY_R2,
-        region_name="auto",
-    ) as s3:
+def crop_face_thumbnail(
+    img: Image.Image,
+    bbox: List[float],
+    max_size: int = THUMBNAIL_MAX_SIZE,
+    margin: float = THUMBNAIL_MARGIN,
+) -> Image.Image:
+    """
+    Cắt một vùng vuông quanh bbox khuôn mặt (nới rộng thêm `margin`)
+    và thu nhỏ sao cho cạnh dài nhất không vượt quá `max_size`.
+    """
+    x1, y1, x2, y2 = bbox
+    cx, cy = (x1 + x2) / 2, (y1 + y2) / 2
+    half = max(x2 - x1, y2 - y1) * (1 + margin) / 2
+
+    box = (
+        max(0, int(cx - half)),
+        max(0, int(cy - half)),
+        min(img.width, int(cx + half)),
+        min(img.height, int(cy + half)),
+    )
+    thumbnail = img.crop(box)
+    thumbnail.thumbnail((max_size, max_size), Image.Resampling.BILINEAR, reducing_gap=2.0)
+    return thumbnail
+
+
+async def upload_bytes_to_r2(body: bytes, fmt: str, key: Optional[str] = None) -> str:
+    """
+    Tải dữ liệu ảnh đã encode lên R2 và trả về URL công khai.
+    `key` (không gồm đuôi file) mặc định là một uuid4 mới; key cố định cho phép
+    ghi đè đúng đối tượng cũ khi một thao tác được chạy lại.
+    """
+    extension, content_type = IMAGE_FORMATS[fmt]
+    key = f"{key or uuid.uuid4()}.{extension}"
+
+    async with r2_client() as s3:
         await s3.put_object(
-            Bucket=bucket_name,
+            Bucket=get_r2_config().bucket,
             Key=key,
-            Body=jpeg_bytes,
-            ContentType="image/jpeg",
+            Body=body,
+            ContentType=content_type,
             ACL="public-read"
         )
 
-    return f"{PUBLIC_URL_R2}/{key}"
+    return f"{get_r2_config().public_url}/{key}"
+
+
+def is_stored_image_url(url: str) -> bool:
+    """URL có trỏ tới một object trong bucket R2 của ứng dụng (qua public_url) hay không."""
+    prefix = get_r2_config().public_url.rstrip("/") + "/"
+    if not url.startswith(prefix):
+        return False
+    key = url[len(prefix):]
+    return bool(key) and ".." not in key.split("/") and not any(c in key for c in "?#")
+
+
+# Upload single image
+async def upload_img_to_r2(img, fmt: str = IMAGE_FORMAT, quality: int = IMAGE_QUALITY) -> str:
+    """
+    img: PIL.Image
+    """
+    body = await run_in_threadpool(encode_image, img, fmt, quality)
+    return await upload_bytes_to_r2(body, fmt)
+
+
+def encode_original_image(image_bytes: bytes) -> bytes:
+    """
+    Ảnh gốc để lưu trên R2, ở đầy đủ độ phân giải (không bị giới hạn DECODE_MAX_SIDE
+    như bản dùng cho inference): giữ nguyên dữ liệu tải lên nếu đã đúng IMAGE_FORMAT,
+    ngược lại decode ở kích thước đầy đủ rồi encode lại.
+    """
+    with Image.open(io.BytesIO(image_bytes)) as img:
+        if img.format == IMAGE_FORMAT:
+            return image_bytes
+    return encode_image(decode_image(image_bytes, max_side=None), IMAGE_FORMAT, IMAGE_QUALITY)
+
+
+def encode_face_images(img: Image.Image, bbox: List[float], image_bytes: Optional[bytes] = None) -> Dict[str, bytes]:
+    """
+    Encode thumbnail khuôn mặt (và ảnh gốc nếu STORE_ORIGINAL_IMAGES).
+    `img` là bản đã decode cho inference (bbox theo tọa độ của nó); nếu có
+    `image_bytes` (dữ liệu tải lên), ảnh gốc được lưu từ đó ở đầy đủ độ phân giải.
+    Hàm đồng bộ, có thể chạy trong threadpool hoặc process pool.
+    """
+    thumbnail = crop_face_thumbnail(img, bbox)
+    encoded = {"thumbnail": encode_image(thumbnail, THUMBNAIL_FORMAT, THUMBNAIL_QUALITY)}
+    if STORE_ORIGINAL_IMAGES:
+        if image_bytes is not None:
+            encoded["image"] = encode_original_image(image_bytes)
+        else:
+            encoded["image"] = encode_image(img, IMAGE_FORMAT, IMAGE_QUALITY)
+    return encoded
+
+
+async def upload_encoded_face_images(encoded: Dict[str, bytes], key: Optional[str] = None) -> Dict[str, str]:
+    """
+    Tải kết quả của encode_face_images lên R2.
+    Trả về các trường payload `image_url` và `thumbnail_url`.
+    Nếu không lưu ảnh gốc, `image_url` trỏ tới thumbnail.
+    Với `key` (vd. point id), ảnh được lưu ở `<key>` và `<key>-thumb`.
+    """
+    if "image" not in encoded:
+        thumbnail_url = await upload_bytes_to_r2(encoded["thumbnail"], THUMBNAIL_FORMAT, key)
+        return {"image_url": thumbnail_url, "thumbnail_url": thumbnail_url}
+
+    image_url, thumbnail_url = await asyncio.gather(
+        upload_bytes_to_r2(encoded["image"], IMAGE_FORMAT, key),
+        upload_bytes_to_r2(encoded["thumbnail"], THUMBNAIL_FORMAT, f"{key}-thumb" if key else None),
+    )
+    return {"image_url": image_url, "thumbnail_url": thumbnail_url}
+
+
+async def upload_face_images(
+    img: Image.Image,
+    bbox: List[float],
+    image_bytes: Optional[bytes] = None,
+    key: Optional[str] = None,
+) -> Dict[str, str]:
+    """Encode (trong threadpool) và tải ảnh khuôn mặt lên R2."""
+    encoded = await run_in_threadpool(encode_face_images, img, bbox, image_bytes)
+    return await upload_encoded_face_images(encoded, key)
 
 
 # Upload multiple images with concurrency limit
@@ -80,19 +245,12 @@ async def upload_cropped_object_r2(data):
     return refined_data
 
 
-def generate_embedding_for_largest_face(
-    image: np.ndarray,
-    detector: SCRFD,
-    recognizer: ArcFace,
-    min_face_size: int = 50
-) -> Tuple[Optional[np.ndarray], Optional[Dict[str, Any]]]:
-    faces = detector.detect(image)
-    if not faces:
-        return None, None
+def find_largest_face(faces: List[Dict[str, Any]], min_face_size: int = 0) -> Optional[Dict[str, Any]]:
+    """Khuôn mặt có bbox lớn nhất trong các mặt có cả hai cạnh >= `min_face_size`."""
     largest_face = None
     max_area = 0
     for face in faces:
-        x1, y1, x2, y2 = map(int, face["bbox"])
+        x1, y1, x2, y2 = map(int, face["bbox"][:4])
         width, height = x2 - x1, y2 - y1
         if width < min_face_size or height < min_face_size:
             continue
@@ -100,9 +258,56 @@ def generate_embedding_for_largest_face(
         if area > max_area:
             max_area = area
             largest_face = face
+    return largest_face
 
+
+def align_largest_face(
+    image: np.ndarray,
+    detector: "SCRFD",
+    min_face_size: int = 50,
+) -> Tuple[Optional[np.ndarray], Optional[Dict[str, Any]]]:
+    """
+    Như generate_embedding_for_largest_face(check_quality=True) nhưng chỉ trả về
+    ảnh khuôn mặt đã căn chỉnh, để nhiều ảnh được embed chung một lần bằng
+    `get_normalized_embeddings_aligned`. Trả về (None, None) nếu không có mặt nào.
+    """
+    faces = detector.detect(image)
+    largest_face = find_largest_face(faces, 0 if QUALITY_GATE else min_face_size)
     if largest_face is None:
         return None, None
+    aligned, qualities = align_and_assess(image, [largest_face])
+    if QUALITY_GATE and not qualities[0].passed:
+        raise FaceQualityError(qualities[0].reason)
+    return aligned[0], largest_face
+
+
+def generate_embedding_for_largest_face(
+    image: np.ndarray,
+    detector: "SCRFD",
+    recognizer: "ArcFace",
+    min_face_size: int = 50,
+    check_quality: bool = False,
+) -> Tuple[Optional[np.ndarray], Optional[Dict[str, Any]]]:
+    """
+    Embed khuôn mặt lớn nhất trong ảnh. Trả về (None, None) nếu không có mặt nào.
+
+    Với `check_quality` (dùng khi enrollment), khuôn mặt lớn nhất phải qua cổng
+    chất lượng (src/quality.py), ngược lại FaceQualityError được raise kèm lý do.
+    """
+    faces = detector.detect(image)
+    if not faces:
+        return None, None
+    gated = check_quality and QUALITY_GATE
+    # Với cổng chất lượng, kích thước được kiểm tra ở đó và báo lý do rõ ràng hơn
+    largest_face = find_largest_face(faces, 0 if gated else min_face_size)
+    if largest_face is None:
+        return None, None
+
+    if gated:
+        aligned, qualities = align_and_assess(image, [largest_face])
+        if not qualities[0].passed:
+            raise FaceQualityError(qualities[0].reason)
+        return recognizer.get_normalized_embeddings_aligned(aligned)[0], largest_face
 
     try:
         np_landmarks = np.array(largest_face['landmarks'])
@@ -113,6 +318,39 @@ def generate_embedding_for_largest_face(
         return None, None
 
 
+def generate_embeddings_for_faces(
+    image: np.ndarray,
+    detector: "SCRFD",
+    recognizer: "ArcFace",
+    min_face_size: int = 0,
+    max_faces: Optional[int] = None,
+) -> Tuple[List[Dict[str, Any]], np.ndarray]:
+    """
+    Detect mọi khuôn mặt, giữ tối đa `max_faces` mặt lớn nhất có cạnh >= `min_face_size`
+    và embed tất cả trong một lần gọi model. Trả về (faces, embeddings n x dim).
+    """
+    faces = []
+    for face in detector.detect(image):
+        x1, y1, x2, y2 = map(int, face["bbox"][:4])
+        if x2 - x1 >= min_face_size and y2 - y1 >= min_face_size:
+            faces.append((face, (x2 - x1) * (y2 - y1)))
+    faces = [face for face, _ in sorted(faces, key=lambda item: -item[1])][:max_faces]
+    embeddings = recognizer.get_normalized_embeddings(image, [face["landmarks"] for face in faces])
+    return faces, embeddings
+
+
+async def download_img_from_r2(image_url: str) -> bytes:
+    """Tải nội dung một đối tượng trong R2 theo URL công khai của nó."""
+    key = urlparse(image_url).path.lstrip("/")
+    if not key:
+        raise ValueError(f"Could not extract key from URL: {image_url}")
+
+    async with r2_client() as s3:
+        response = await s3.get_object(Bucket=get_r2_config().bucket, Key=key)
+        async with response["Body"] as body:
+            return await body.read()
+
+
 async def delete_img_from_r2(image_url: str):
     """
     Xóa một đối tượng khỏi R2 bucket dựa trên URL công khai của nó.
@@ -128,19 +366,25 @@ async def delete_img_from_r2(image_url: str):
             print(f"Warning: Could not extract key from URL: {image_url}")
             return
 
-        session = aioboto3.Session()
-        async with session.client(
-            "s3",
-            endpoint_url=endpoint_base,
-            aws_access_key_id=AWS_ACCESS_KEY_ID_R2,
-            aws_secret_access_key=AWS_SECRET_ACCESS_KEY_R2,
-            region_name="auto",
-        ) as s3:
-            print(f"Attempting to delete {key} from bucket {bucket_name}")
-            await s3.delete_object(Bucket=bucket_name, Key=key)
+        bucket = get_r2_config().bucket
+        async with r2_client() as s3:
+            print(f"Attempting to delete {key} from bucket {bucket}")
+            await s3.delete_object(Bucket=bucket, Key=key)
             print(f"Successfully deleted {key} from R2.")
 
     except Exception as e:
         # Ghi lại lỗi nhưng không làm sập ứng dụng.
         # Việc không xóa được ảnh cũ không phải là một lỗi nghiêm trọng.
         print(f"Error deleting image {image_url} from R2: {e}")
+
+
+def owned_image_urls(payload: Dict[str, Any]) -> List[str]:
+    """URL ảnh gốc và thumbnail mà bản ghi sở hữu (rỗng nếu ảnh dùng chung với gallery khác)."""
+    if payload.get(SHARED_IMAGES_FIELD):
+        return []
+    return sorted({url for url in (payload.get("image_url"), payload.get("thumbnail_url")) if url})
+
+
+async def delete_face_images(payload: Dict[str, Any]):
+    """Xóa ảnh gốc và thumbnail của một bản ghi khuôn mặt khỏi R2 (trừ ảnh dùng chung)."""
+    await asyncio.gather(*(delete_img_from_r2(url) for url in owned_image_urls(payload)))
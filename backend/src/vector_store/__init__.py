@@ -0,0 +1,85 @@
+import os
+from typing import Dict
+
+from src.inference_client import is_remote
+from src.qdrant_client import IMAGE_COLLECTION_NAME, VECTOR_SIZE
+from src.vector_store.base import (
+    QUANTIZATION_TYPES,
+    TENANT_FIELD,
+    PayloadFilter,
+    ScoredRecord,
+    VectorRecord,
+    VectorStore,
+)
+
+# qdrant: Qdrant (local mode hoặc server qua QDRANT_URL)
+# numpy:  tìm kiếm chính xác trên file memory-mapped, phân vùng theo tenant
+# hnsw:   đồ thị HNSW (hnswlib) cho gallery lớn
+# remote: collection của tiến trình inference; tự chọn khi INFERENCE_SOCKETS được đặt
+VECTOR_STORE_BACKEND = "remote" if is_remote() else os.getenv("VECTOR_STORE_BACKEND", "qdrant").lower()
+VECTOR_STORE_PATH = os.getenv("VECTOR_STORE_PATH", "./local_vector_store")
+# Kiểu lượng tử mặc định cho mọi collection (none | float16 | int8), có thể ghi đè
+# theo từng collection: VECTOR_QUANTIZATION_COLLECTIONS="face_collection=int8,face_collection_prototypes=none"
+VECTOR_QUANTIZATION = os.getenv("VECTOR_QUANTIZATION", "none").lower()
+VECTOR_QUANTIZATION_COLLECTIONS = os.getenv("VECTOR_QUANTIZATION_COLLECTIONS", "")
+
+__all__ = [
+    "TENANT_FIELD",
+    "PayloadFilter",
+    "QUANTIZATION_TYPES",
+    "ScoredRecord",
+    "VectorRecord",
+    "VectorStore",
+    "close_vector_stores",
+    "create_vector_store",
+    "get_vector_store",
+    "quantization_for",
+]
+
+
+def quantization_for(collection_name: str) -> str:
+    """Kiểu lượng tử đã cấu hình cho collection."""
+    for item in VECTOR_QUANTIZATION_COLLECTIONS.split(","):
+        name, _, quantization = item.partition("=")
+        if name.strip() == collection_name and quantization.strip():
+            return quantization.strip().lower()
+    return VECTOR_QUANTIZATION
+
+
+def create_vector_store(
+    backend: str, collection_name: str, vector_size: int = VECTOR_SIZE, quantization: str = "none"
+) -> VectorStore:
+    if backend == "qdrant":
+        from src.vector_store.qdrant import QdrantVectorStore
+        return QdrantVectorStore(collection_name, vector_size, quantization)
+    if backend == "numpy":
+        from src.vector_store.numpy_store import NumpyVectorStore
+        return NumpyVectorStore(collection_name, vector_size, VECTOR_STORE_PATH, quantization)
+    if backend == "hnsw":
+        from src.vector_store.hnsw_store import HnswVectorStore
+        return HnswVectorStore(collection_name, vector_size, VECTOR_STORE_PATH, quantization)
+    if backend == "remote":
+        from src.vector_store.remote import RemoteVectorStore
+        return RemoteVectorStore(collection_name, vector_size, quantization)
+    raise RuntimeError(f"Unknown VECTOR_STORE_BACKEND '{backend}', expected qdrant, numpy or hnsw.")
+
+
+_stores: Dict[str, VectorStore] = {}
+
+
+def get_vector_store(collection_name: str = IMAGE_COLLECTION_NAME) -> VectorStore:
+    """Trả về store (singleton theo collection) của backend đã cấu hình."""
+    store = _stores.get(collection_name)
+    if store is None:
+        store = create_vector_store(
+            VECTOR_STORE_BACKEND, collection_name, quantization=quantization_for(collection_name)
+        )
+        _stores[collection_name] = store
+    return store
+
+
+async def close_vector_stores() -> None:
+    """Đóng mọi store đã mở (gọi một lần khi tắt ứng dụng)."""
+    for store in list(_stores.values()):
+        await store.close()
+    _stores.clear()
@@ -0,0 +1,157 @@
+import asyncio
+from abc import ABC, abstractmethod
+from dataclasses import dataclass, field
+from typing import Any, AsyncIterator, Dict, List, Optional, Sequence, Tuple
+
+import os
+
+import numpy as np
+
+# Bộ lọc payload dạng {"user_id": "alice", "name": ["A", "B"]}:
+# giá trị đơn là so khớp bằng, list là khớp một trong các giá trị.
+# Mọi điều kiện được kết hợp bằng AND.
+PayloadFilter = Dict[str, Any]
+
+# Trường payload xác định tenant; các engine cục bộ phân vùng dữ liệu theo trường này.
+TENANT_FIELD = "user_id"
+
+# none: float32; float16: nửa độ chính xác; int8: lượng tử vô hướng, 1 byte mỗi chiều.
+QUANTIZATION_TYPES = ("none", "float16", "int8")
+# Khi tìm trên vector lượng tử, lấy limit * RESCORE_OVERSAMPLING ứng viên để chấm lại bằng float32.
+RESCORE_OVERSAMPLING = int(os.getenv("RESCORE_OVERSAMPLING", "4"))
+
+
+@dataclass
+class VectorRecord:
+    id: str
+    payload: Dict[str, Any] = field(default_factory=dict)
+    vector: Optional[np.ndarray] = None
+
+
+@dataclass
+class ScoredRecord:
+    id: str
+    score: float
+    payload: Dict[str, Any] = field(default_factory=dict)
+
+
+def matches_filter(payload: Dict[str, Any], payload_filter: Optional[PayloadFilter]) -> bool:
+    """Kiểm tra một payload có thỏa bộ lọc hay không (dùng cho các engine cục bộ)."""
+    if not payload_filter:
+        return True
+    for key, expected in payload_filter.items():
+        value = payload.get(key)
+        if isinstance(expected, (list, tuple, set)):
+            if value not in expected:
+                return False
+        elif value != expected:
+            return False
+    return True
+
+
+class VectorStore(ABC):
+    """
+    Giao diện chung cho nơi lưu embedding khuôn mặt.
+
+    Mỗi instance quản lý một collection. Vector được lưu đã chuẩn hóa L2
+    và điểm trả về là cosine similarity (càng lớn càng giống). Với
+    quantization khác "none", điểm trả về vẫn là điểm float32 sau khi chấm lại.
+    """
+
+    def __init__(self, collection_name: str, vector_size: int, quantization: str = "none"):
+        if quantization not in QUANTIZATION_TYPES:
+            raise ValueError(f"Unknown quantization '{quantization}', expected one of {', '.join(QUANTIZATION_TYPES)}.")
+        self.collection_name = collection_name
+        self.vector_size = vector_size
+        self.quantization = quantization
+
+    @abstractmethod
+    async def setup(self) -> None:
+        """Tạo collection / nạp dữ liệu từ đĩa. Gọi một lần khi khởi động."""
+
+    async def close(self) -> None:
+        """Giải phóng tài nguyên và ghi dữ liệu còn lại xuống đĩa."""
+
+    @abstractmethod
+    async def upsert(self, records: Sequence[VectorRecord]) -> None:
+        """Thêm hoặc ghi đè các bản ghi (theo id). Mọi bản ghi phải có vector."""
+
+    @abstractmethod
+    async def retrieve(self, ids: Sequence[str], with_vectors: bool = False) -> List[VectorRecord]:
+        """Lấy các bản ghi theo id; id không tồn tại bị bỏ qua."""
+
+    @abstractmethod
+    async def delete(self, ids: Optional[Sequence[str]] = None, payload_filter: Optional[PayloadFilter] = None) -> None:
+        """Xóa theo danh sách id hoặc theo bộ lọc payload."""
+
+    @abstractmethod
+    async def scroll(
+        self,
+        payload_filter: Optional[PayloadFilter] = None,
+        limit: int = 100,
+        offset: Optional[str] = None,
+        with_vectors: bool = False,
+        payload_fields: Optional[Sequence[str]] = None,
+    ) -> Tuple[List[VectorRecord], Optional[str]]:
+        """
+        Duyệt các bản ghi theo trang. Trả về (records, offset của trang tiếp theo hoặc None).
+        `payload_fields` giới hạn các trường payload được trả về (mặc định: tất cả).
+        """
+
+    async def iter_pages(
+        self,
+        payload_filter: Optional[PayloadFilter] = None,
+        page_size: int = 256,
+        with_vectors: bool = False,
+        payload_fields: Optional[Sequence[str]] = None,
+    ) -> AsyncIterator[List[VectorRecord]]:
+        """Lần lượt trả về từng trang bản ghi thỏa bộ lọc, bộ nhớ chỉ giữ một trang mỗi lúc."""
+        offset = None
+        while True:
+            records, offset = await self.scroll(
+                payload_filter=payload_filter,
+                limit=page_size,
+                offset=offset,
+                with_vectors=with_vectors,
+                payload_fields=payload_fields,
+            )
+            if records:
+                yield records
+            if offset is None:
+                return
+
+    @abstractmethod
+    async def search(
+        self,
+        vector: np.ndarray,
+        payload_filter: Optional[PayloadFilter] = None,
+        limit: int = 5,
+        score_threshold: Optional[float] = None,
+    ) -> List[ScoredRecord]:
+        """Tìm các bản ghi gần `vector` nhất, sắp xếp theo điểm giảm dần."""
+
+    async def search_batch(
+        self,
+        vectors: Sequence[np.ndarray],
+        payload_filter: Optional[PayloadFilter] = None,
+        limit: int = 5,
+        score_threshold: Optional[float] = None,
+    ) -> List[List[ScoredRecord]]:
+        """
+        Tìm kiếm nhiều vector truy vấn với cùng bộ lọc, kết quả theo thứ tự truy vấn.
+        Mặc định chạy song song từng truy vấn; engine có thể gộp thành một lệnh.
+        """
+        return list(await asyncio.gather(*(self.search(vector, payload_filter, limit, score_threshold) for vector in vectors)))
+
+    @abstractmethod
+    async def set_payload(
+        self,
+        payload: Dict[str, Any],
+        ids: Optional[Sequence[str]] = None,
+        payload_filter: Optional[PayloadFilter] = None,
+    ) -> None:
+        """Ghi đè các trường payload cho các bản ghi theo id hoặc theo bộ lọc."""
+
+    @abstractmethod
+    async def count(self, payload_filter: Optional[PayloadFilter] = None) -> int:
+        """Đếm chính xác số bản ghi thỏa bộ lọc."""
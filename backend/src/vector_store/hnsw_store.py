@@ -0,0 +1,126 @@
+import json
+import os
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from src.vector_store.numpy_store import NumpyPartition, NumpyVectorStore
+
+try:
+    import hnswlib
+except ImportError:  # optional dependency, only needed for VECTOR_STORE_BACKEND=hnsw
+    hnswlib = None
+
+HNSW_M = int(os.getenv("HNSW_M", "16"))
+HNSW_EF_CONSTRUCTION = int(os.getenv("HNSW_EF_CONSTRUCTION", "200"))
+HNSW_EF_SEARCH = int(os.getenv("HNSW_EF_SEARCH", "64"))
+# Nếu số dòng thỏa bộ lọc nhỏ hơn ngưỡng này thì tìm chính xác trên các dòng đó
+EXACT_SEARCH_THRESHOLD = int(os.getenv("HNSW_EXACT_SEARCH_THRESHOLD", "2048"))
+
+
+class HnswPartition(NumpyPartition):
+    """
+    Partition NumPy kèm đồ thị HNSW (hnswlib) trên cùng các dòng.
+
+    Vector gốc vẫn nằm trong file memmap nên đồ thị có thể được dựng lại
+    bất cứ lúc nào. Đồ thị được lưu khi đóng store và chỉ được nạp lại nếu
+    log không thay đổi kể từ lần lưu đó (meta bị xóa ở lần ghi đầu tiên sau khi mở).
+    """
+
+    def __init__(self, directory: str, dim: int, quantization: str = "none"):
+        super().__init__(directory, dim, quantization)
+        self._index_path = os.path.join(directory, "hnsw.bin")
+        self._index_meta_path = os.path.join(directory, "hnsw.json")
+        self.index = self._load_or_build_index()
+
+    def _new_index(self, max_elements: int):
+        index = hnswlib.Index(space="ip", dim=self.dim)
+        index.init_index(max_elements=max_elements, ef_construction=HNSW_EF_CONSTRUCTION, M=HNSW_M)
+        index.set_ef(HNSW_EF_SEARCH)
+        return index
+
+    def _load_or_build_index(self):
+        if os.path.exists(self._index_path) and os.path.exists(self._index_meta_path):
+            with open(self._index_meta_path, encoding="utf-8") as f:
+                meta = json.load(f)
+            if meta == self._log_position():
+                index = hnswlib.Index(space="ip", dim=self.dim)
+                index.load_index(self._index_path, max_elements=self.capacity)
+                index.set_ef(HNSW_EF_SEARCH)
+                return index
+
+        index = self._new_index(self.capacity)
+        rows = np.flatnonzero(self.alive[: self.size])
+        if rows.size:
+            print(f"Building HNSW index for {self.directory} ({rows.size} vectors)...")
+            index.add_items(np.asarray(self.vectors[rows]), rows)
+        return index
+
+    def _derived_meta_paths(self) -> List[str]:
+        return super()._derived_meta_paths() + [self._index_meta_path]
+
+    def _grow(self):
+        super()._grow()
+        if hasattr(self, "index"):
+            self.index.resize_index(self.capacity)
+
+    def put(self, record_id: str, vector: np.ndarray, payload: Dict[str, Any]) -> int:
+        reused = record_id not in self.id_to_row and bool(self.free_rows)
+        row = super().put(record_id, vector, payload)
+        if reused:
+            try:
+                self.index.unmark_deleted(row)
+            except RuntimeError:
+                pass  # dòng đã bị xóa trước khi đồ thị được dựng lại, chưa có trong đồ thị
+        self.index.add_items(vector[None, :], np.array([row]))
+        return row
+
+    def delete(self, record_id: str) -> Optional[int]:
+        row = super().delete(record_id)
+        if row is not None:
+            self.index.mark_deleted(row)
+        return row
+
+    def close(self):
+        super().close()
+        self.index.save_index(self._index_path)
+        with open(self._index_meta_path, "w", encoding="utf-8") as f:
+            json.dump(self._log_position(), f)
+
+    def search(self, query: np.ndarray, mask: np.ndarray, limit: int) -> List[Tuple[int, float]]:
+        allowed = int(mask.sum())
+        if allowed == 0:
+            return []
+        if allowed <= EXACT_SEARCH_THRESHOLD:
+            return super().search(query, mask, limit)
+
+        k = min(limit, allowed)
+        self.index.set_ef(max(HNSW_EF_SEARCH, k))
+        try:
+            if allowed == len(self.id_to_row):
+                labels, distances = self.index.knn_query(query, k=k)
+            else:
+                labels, distances = self.index.knn_query(query, k=k, filter=lambda label: bool(mask[label]))
+        except RuntimeError:
+            # hnswlib không tìm đủ k kết quả (bộ lọc quá chặt so với ef)
+            return super().search(query, mask, limit)
+        # space="ip": distance = 1 - dot
+        return [(int(label), float(1.0 - distance)) for label, distance in zip(labels[0], distances[0])]
+
+    def search_batch(self, queries: np.ndarray, mask: np.ndarray, limit: int) -> List[List[Tuple[int, float]]]:
+        return [self.search(query, mask, limit) for query in queries]
+
+
+class HnswVectorStore(NumpyVectorStore):
+    """
+    Engine HNSW xấp xỉ cho gallery lớn, cùng ngữ nghĩa filter/upsert/delete/scroll
+    với NumpyVectorStore. Cần cài `hnswlib`. hnswlib giữ bản float32 riêng trong
+    đồ thị, nên quantization chỉ áp dụng cho nhánh tìm chính xác (tập lọc nhỏ).
+    """
+
+    partition_class = HnswPartition
+
+    def __init__(self, collection_name: str, vector_size: int, path: str, quantization: str = "none"):
+        if hnswlib is None:
+            raise RuntimeError("VECTOR_STORE_BACKEND=hnsw requires the 'hnswlib' package (pip install hnswlib).")
+        super().__init__(collection_name, vector_size, path, quantization)
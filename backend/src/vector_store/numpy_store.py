@@ -0,0 +1,769 @@
+import hashlib
+import json
+import mmap
+import os
+import threading
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+from starlette.concurrency import run_in_threadpool
+
+from src.vector_store.base import (
+    RESCORE_OVERSAMPLING,
+    TENANT_FIELD,
+    PayloadFilter,
+    ScoredRecord,
+    VectorRecord,
+    VectorStore,
+)
+
+INITIAL_CAPACITY = 1024
+# Khi số dòng log vượt quá COMPACT_FACTOR * số bản ghi còn sống (+ COMPACT_MIN_LINES),
+# log được viết lại thành một snapshot.
+COMPACT_FACTOR = 2
+COMPACT_MIN_LINES = 1000
+# Dưới ngưỡng này (số dòng thỏa bộ lọc / tổng số dòng) chỉ nhân ma trận trên các dòng được chọn.
+SPARSE_FILTER_RATIO = 0.125
+# Số dòng mã lượng tử được đổi sang float32 mỗi lần khi chấm điểm; khối nhỏ để nằm gọn trong cache.
+QUANTIZED_CHUNK_ROWS = 1024
+# Tên file và dtype của bản lượng tử theo kiểu lượng tử hóa
+QUANTIZED_DTYPES = {"float16": ("vectors.f16", np.float16), "int8": ("vectors.i8", np.int8)}
+# Snapshot trạng thái được ghi lại khi phần log chưa có trong snapshot vượt quá
+# max(SNAPSHOT_TAIL_LINES, số bản ghi / SNAPSHOT_TAIL_DIVISOR) dòng, giới hạn thời gian phát lại khi nạp.
+SNAPSHOT_TAIL_LINES = int(os.getenv("NUMPY_SNAPSHOT_TAIL_LINES", "10000"))
+SNAPSHOT_TAIL_DIVISOR = 20
+# Trường nhãn được lưu thành cột riêng trong snapshot, để lọc theo nhãn không cần giải mã payload
+LABEL_FIELD = "name"
+# Đánh dấu payload còn nằm trong snapshot, chưa được giải mã
+_ENCODED = object()
+
+
+def normalize(vector: np.ndarray) -> np.ndarray:
+    vector = np.asarray(vector, dtype=np.float32).ravel()
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm > 0 else vector
+
+
+def quantize(vectors: np.ndarray, quantization: str) -> Tuple[np.ndarray, Optional[np.ndarray]]:
+    """Mã hóa các vector (n x dim). int8 dùng một hệ số tỉ lệ cho mỗi dòng: v ~ code * scale."""
+    vectors = np.atleast_2d(np.asarray(vectors, dtype=np.float32))
+    if quantization == "float16":
+        return vectors.astype(np.float16), None
+    scales = np.abs(vectors).max(axis=1) / 127.0
+    scales[scales == 0] = 1.0
+    codes = np.rint(vectors / scales[:, None]).astype(np.int8)
+    return codes, scales.astype(np.float32)
+
+
+class LazyPayloads:
+    """
+    Payload theo dòng của một partition.
+
+    Các dòng nạp từ snapshot chỉ được giải mã JSON khi được truy cập lần đầu,
+    nên mở partition không phải phân tích toàn bộ payload.
+    """
+
+    def __init__(
+        self,
+        offsets: Optional[np.ndarray] = None,
+        blob: Optional[np.ndarray] = None,
+        labels: Optional[np.ndarray] = None,
+    ):
+        self._offsets = offsets
+        self._blob = blob
+        self._labels = labels
+        self._items: List[Any] = [_ENCODED] * (len(offsets) - 1 if offsets is not None else 0)
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def append(self, payload: Optional[Dict[str, Any]]):
+        self._items.append(payload)
+
+    def __setitem__(self, row: int, payload: Optional[Dict[str, Any]]):
+        self._items[row] = payload
+
+    def __getitem__(self, row: int) -> Optional[Dict[str, Any]]:
+        item = self._items[row]
+        if item is _ENCODED:
+            raw = self.encoded(row)
+            item = json.loads(raw) if raw else None
+            self._items[row] = item
+        return item
+
+    def encoded(self, row: int) -> bytes:
+        """Payload của dòng dưới dạng JSON (b"" nếu dòng trống), không giải mã nếu chưa cần."""
+        item = self._items[row]
+        if item is _ENCODED:
+            return self._blob[self._offsets[row]:self._offsets[row + 1]].tobytes()
+        if item is None:
+            return b""
+        return json.dumps(item, ensure_ascii=False).encode("utf-8")
+
+    def value(self, row: int, key: str) -> Any:
+        if self._items[row] is _ENCODED and key == LABEL_FIELD:
+            return str(self._labels[row]) or None
+        payload = self[row]
+        return payload.get(key) if payload else None
+
+
+def top_k(scores: np.ndarray, k: int) -> np.ndarray:
+    """Chỉ số của k điểm lớn nhất, sắp xếp giảm dần."""
+    if k >= scores.shape[0]:
+        return np.argsort(-scores)
+    candidates = np.argpartition(-scores, k - 1)[:k]
+    return candidates[np.argsort(-scores[candidates])]
+
+
+class NumpyPartition:
+    """
+    Dữ liệu của một tenant.
+
+    - vectors.f32: ma trận float32 (capacity x dim) được memory-map.
+    - records.jsonl: log các thao tác put/set/del kèm số dòng, phát lại khi nạp.
+    - vectors.f16 / vectors.i8 (+ scales.f32): bản lượng tử hóa nếu bật quantization.
+      Tìm kiếm quét bản lượng tử rồi chấm lại chính xác top ứng viên bằng float32,
+      nên ma trận float32 chỉ bị đọc ở vài dòng mỗi truy vấn.
+    - snapshot.json, ids.txt, payloads.bin (+ payload_offsets.npy), labels.npy:
+      trạng thái đã phát lại của log tới một vị trí byte. Khi nạp, partition
+      memory-map snapshot và chỉ phát lại phần log phía sau, payload được giải
+      mã khi cần; các file được map chỉ đọc nên các process dùng chung page cache.
+
+    Dòng bị xóa được đánh dấu trống và tái sử dụng cho bản ghi mới, nên số
+    dòng của một bản ghi không bao giờ thay đổi khi các bản ghi khác bị xóa.
+    """
+
+    def __init__(self, directory: str, dim: int, quantization: str = "none"):
+        self.directory = directory
+        self.dim = dim
+        self.quantization = quantization
+        self.codes: Optional[np.memmap] = None
+        self.scales: Optional[np.memmap] = None
+        self.ids: List[Optional[str]] = []
+        self.payloads = LazyPayloads()
+        self.id_to_row: Dict[str, int] = {}
+        self.free_rows: List[int] = []
+        # Chỉ mục ngược {key: {value: rows}} dựng khi cần, bị xóa khi dữ liệu thay đổi
+        self._postings: Dict[str, Dict[Any, np.ndarray]] = {}
+        self._log_lines = 0
+        self._snapshot_lines = 0
+        # File dẫn xuất (mã lượng tử, đồ thị HNSW) còn khớp với log; bị hủy ở lần ghi đầu tiên
+        self._derived_current = True
+
+        os.makedirs(directory, exist_ok=True)
+        self._vectors_path = os.path.join(directory, "vectors.f32")
+        self._log_path = os.path.join(directory, "records.jsonl")
+        self._quantized_meta_path = os.path.join(directory, "quantized.json")
+        self._snapshot_meta_path = os.path.join(directory, "snapshot.json")
+        self._open_vectors()
+        self._replay_log(self._load_snapshot())
+        self._prefetch()
+        if quantization != "none":
+            self._load_or_build_codes()
+        self._log = open(self._log_path, "a", encoding="utf-8")
+
+    # --- storage ---
+
+    @property
+    def size(self) -> int:
+        """Số dòng đã dùng (kể cả dòng trống)."""
+        return len(self.ids)
+
+    @property
+    def capacity(self) -> int:
+        return self.vectors.shape[0]
+
+    def _open_matrix(self, path: str, dtype, columns: int, capacity: int) -> np.memmap:
+        """Mở một file memmap `columns` cột, nới rộng tới `capacity` dòng nếu cần."""
+        row_bytes = np.dtype(dtype).itemsize * columns
+        if not os.path.exists(path):
+            with open(path, "wb"):
+                pass
+        if capacity > os.path.getsize(path) // row_bytes:
+            with open(path, "r+b") as f:
+                f.truncate(capacity * row_bytes)
+        shape = (capacity, columns) if columns > 1 else (capacity,)
+        return np.memmap(path, dtype=dtype, mode="r+", shape=shape)
+
+    def _open_vectors(self, capacity: int = 0):
+        if os.path.exists(self._vectors_path):
+            capacity = max(capacity, os.path.getsize(self._vectors_path) // (self.dim * 4))
+        capacity = max(capacity, INITIAL_CAPACITY)
+        self.vectors = self._open_matrix(self._vectors_path, np.float32, self.dim, capacity)
+        if self.quantization != "none":
+            filename, dtype = QUANTIZED_DTYPES[self.quantization]
+            self.codes = self._open_matrix(os.path.join(self.directory, filename), dtype, self.dim, capacity)
+            if self.quantization == "int8":
+                self.scales = self._open_matrix(os.path.join(self.directory, "scales.f32"), np.float32, 1, capacity)
+        alive = np.zeros(capacity, dtype=bool)
+        if hasattr(self, "alive"):
+            alive[: self.alive.shape[0]] = self.alive
+        self.alive = alive
+
+    def _grow(self):
+        self.vectors.flush()
+        capacity = self.capacity * 2
+        del self.vectors
+        for matrix in (self.codes, self.scales):
+            if matrix is not None:
+                matrix.flush()
+        self.codes = self.scales = None
+        self._open_vectors(capacity)
+
+    def _load_or_build_codes(self):
+        """Dùng bản lượng tử trên đĩa nếu khớp với log, ngược lại mã hóa lại từ float32."""
+        if os.path.exists(self._quantized_meta_path):
+            with open(self._quantized_meta_path, encoding="utf-8") as f:
+                meta = json.load(f)
+            if meta == {"type": self.quantization, **self._log_position()}:
+                return
+        rows = np.flatnonzero(self.alive[: self.size])
+        if rows.size:
+            print(f"Quantizing {rows.size} vectors in {self.directory} to {self.quantization}...")
+        for start in range(0, rows.size, QUANTIZED_CHUNK_ROWS):
+            chunk = rows[start:start + QUANTIZED_CHUNK_ROWS]
+            self._write_codes(chunk, self.vectors[chunk])
+
+    def _write_codes(self, rows, vectors: np.ndarray):
+        codes, scales = quantize(vectors, self.quantization)
+        self.codes[rows] = codes
+        if self.scales is not None:
+            self.scales[rows] = scales
+
+    def _load_snapshot(self) -> int:
+        """Nạp snapshot nếu còn khớp với log. Trả về vị trí byte trong log cần phát lại tiếp."""
+        if not os.path.exists(self._snapshot_meta_path) or not os.path.exists(self._log_path):
+            return 0
+        with open(self._snapshot_meta_path, encoding="utf-8") as f:
+            meta = json.load(f)
+        if meta["log_bytes"] > os.path.getsize(self._log_path):
+            return 0
+
+        with open(os.path.join(self.directory, "ids.txt"), encoding="utf-8") as f:
+            ids = [record_id or None for record_id in f.read().split("\n")] if meta["size"] else []
+        offsets = np.load(os.path.join(self.directory, "payload_offsets.npy"), mmap_mode="r")
+        blob_path = os.path.join(self.directory, "payloads.bin")
+        blob = np.memmap(blob_path, dtype=np.uint8, mode="r") if os.path.getsize(blob_path) else np.zeros(0, np.uint8)
+        labels = np.load(os.path.join(self.directory, "labels.npy"), mmap_mode="r")
+        if not (len(ids) == meta["size"] == len(offsets) - 1 == len(labels)):
+            return 0
+
+        while self.capacity < len(ids):
+            self._grow()
+        self.ids = ids
+        self.payloads = LazyPayloads(offsets, blob, labels)
+        self.id_to_row = {record_id: row for row, record_id in enumerate(ids) if record_id is not None}
+        self.alive[: len(ids)] = [record_id is not None for record_id in ids]
+        self._log_lines = self._snapshot_lines = meta["log_lines"]
+        return meta["log_bytes"]
+
+    def _write_snapshot(self):
+        """Ghi trạng thái hiện tại (tương ứng với toàn bộ log đã flush) thành snapshot."""
+        self._log.flush()
+        # Xóa meta trước: nếu dừng giữa chừng, lần nạp sau phát lại toàn bộ log
+        if os.path.exists(self._snapshot_meta_path):
+            os.remove(self._snapshot_meta_path)
+
+        offsets = np.zeros(self.size + 1, dtype=np.int64)
+        labels = []
+        with open(os.path.join(self.directory, "payloads.bin.tmp"), "wb") as f:
+            for row in range(self.size):
+                raw = self.payloads.encoded(row)
+                f.write(raw)
+                offsets[row + 1] = offsets[row] + len(raw)
+                label = self.payloads.value(row, LABEL_FIELD) if raw else None
+                labels.append(label if isinstance(label, str) else "")
+        with open(os.path.join(self.directory, "ids.txt.tmp"), "w", encoding="utf-8") as f:
+            f.write("\n".join(record_id or "" for record_id in self.ids))
+        with open(os.path.join(self.directory, "payload_offsets.npy.tmp"), "wb") as f:
+            np.save(f, offsets)
+        with open(os.path.join(self.directory, "labels.npy.tmp"), "wb") as f:
+            np.save(f, np.array(labels, dtype=str) if labels else np.zeros(0, dtype="<U1"))
+        for name in ("payloads.bin", "ids.txt", "payload_offsets.npy", "labels.npy"):
+            os.replace(os.path.join(self.directory, name + ".tmp"), os.path.join(self.directory, name))
+
+        with open(self._snapshot_meta_path, "w", encoding="utf-8") as f:
+            json.dump({"log_bytes": os.path.getsize(self._log_path), "log_lines": self._log_lines, "size": self.size}, f)
+        self._snapshot_lines = self._log_lines
+
+    def _prefetch(self):
+        """Yêu cầu kernel đọc trước ma trận tìm kiếm để truy vấn đầu tiên không phải chờ page fault."""
+        if not hasattr(mmap, "MADV_WILLNEED"):
+            return
+        for matrix in (self.codes, self.scales) if self.codes is not None else (self.vectors,):
+            if matrix is not None and matrix._mmap is not None:
+                matrix._mmap.madvise(mmap.MADV_WILLNEED)
+
+    def _replay_log(self, start: int = 0):
+        if not os.path.exists(self._log_path):
+            return
+        with open(self._log_path, "rb") as f:
+            f.seek(start)
+            for line in f:
+                if not line.strip():
+                    continue
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    # Dòng cuối bị ghi dở khi process dừng đột ngột
+                    break
+                self._log_lines += 1
+                op = entry["op"]
+                if op == "put":
+                    self._apply_put(entry["id"], entry["row"], entry["payload"])
+                elif op == "set" and entry["id"] in self.id_to_row:
+                    self.payloads[self.id_to_row[entry["id"]]].update(entry["payload"])
+                elif op == "del":
+                    self._apply_delete(entry["id"])
+        if self._log_lines > self._snapshot_lines:
+            print(f"Replayed {self._log_lines - self._snapshot_lines} log entries in {self.directory}.")
+        self.free_rows = [row for row in range(self.size) if self.ids[row] is None]
+
+    def _apply_put(self, record_id: str, row: int, payload: Dict[str, Any]):
+        while self.size <= row:
+            self.ids.append(None)
+            self.payloads.append(None)
+        while self.capacity <= row:
+            self._grow()
+        self.ids[row] = record_id
+        self.payloads[row] = payload
+        self.id_to_row[record_id] = row
+        self.alive[row] = True
+
+    def _apply_delete(self, record_id: str) -> Optional[int]:
+        row = self.id_to_row.pop(record_id, None)
+        if row is not None:
+            self.ids[row] = None
+            self.payloads[row] = None
+            self.alive[row] = False
+        return row
+
+    def _log_position(self) -> Dict[str, int]:
+        """Vị trí log mà file dẫn xuất được ghi tương ứng (ghi khi đóng, so khi mở)."""
+        size = os.path.getsize(self._log_path) if os.path.exists(self._log_path) else 0
+        return {"log_lines": self._log_lines, "log_bytes": size}
+
+    def _derived_meta_paths(self) -> List[str]:
+        return [self._quantized_meta_path]
+
+    def _write_log(self, entry: Dict[str, Any]):
+        if self._derived_current:
+            # Số dòng / byte của log có thể trùng lại sau compaction: meta của file dẫn xuất
+            # bị xóa trước lần ghi đầu tiên và chỉ được ghi lại khi đóng store
+            for path in self._derived_meta_paths():
+                if os.path.exists(path):
+                    os.remove(path)
+            self._derived_current = False
+        self._log.write(json.dumps(entry, ensure_ascii=False) + "\n")
+        self._log_lines += 1
+
+    def flush(self):
+        self.vectors.flush()
+        self._log.flush()
+        if self._log_lines > COMPACT_FACTOR * len(self.id_to_row) + COMPACT_MIN_LINES:
+            self._compact()
+        elif self._log_lines - self._snapshot_lines > max(SNAPSHOT_TAIL_LINES, len(self.id_to_row) // SNAPSHOT_TAIL_DIVISOR):
+            self._write_snapshot()
+
+    def _compact(self):
+        """Viết lại log thành snapshot chỉ gồm các bản ghi còn sống."""
+        tmp_path = self._log_path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            for row, record_id in enumerate(self.ids):
+                if record_id is not None:
+                    head = json.dumps({"op": "put", "id": record_id, "row": row}, ensure_ascii=False)
+                    f.write(head[:-1].encode("utf-8") + b', "payload": ' + self.payloads.encoded(row) + b"}\n")
+            f.flush()
+            os.fsync(f.fileno())
+        self._log.close()
+        if os.path.exists(self._snapshot_meta_path):
+            os.remove(self._snapshot_meta_path)
+        os.replace(tmp_path, self._log_path)
+        self._log = open(self._log_path, "a", encoding="utf-8")
+        self._log_lines = len(self.id_to_row)
+        self._write_snapshot()
+
+    def close(self):
+        self.flush()
+        if self._log_lines != self._snapshot_lines:
+            self._write_snapshot()
+        self._log.close()
+        if self.codes is not None:
+            for matrix in (self.codes, self.scales):
+                if matrix is not None:
+                    matrix.flush()
+            with open(self._quantized_meta_path, "w", encoding="utf-8") as f:
+                json.dump({"type": self.quantization, **self._log_position()}, f)
+
+    # --- mutations ---
+
+    def put(self, record_id: str, vector: np.ndarray, payload: Dict[str, Any]) -> int:
+        row = self.id_to_row.get(record_id)
+        if row is None:
+            row = self.free_rows.pop() if self.free_rows else self.size
+        # Ghi vector trước log: nếu dừng giữa chừng, dòng chưa có trong log bị bỏ qua khi nạp lại
+        while self.capacity <= row:
+            self._grow()
+        self.vectors[row] = vector
+        if self.codes is not None:
+            self._write_codes([row], vector)
+        self._apply_put(record_id, row, dict(payload))
+        self._write_log({"op": "put", "id": record_id, "row": row, "payload": payload})
+        self._postings.clear()
+        return row
+
+    def set_payload(self, row: int, payload: Dict[str, Any]):
+        self.payloads[row].update(payload)
+        self._write_log({"op": "set", "id": self.ids[row], "payload": payload})
+        self._postings.clear()
+
+    def delete(self, record_id: str) -> Optional[int]:
+        row = self._apply_delete(record_id)
+        if row is not None:
+            self.free_rows.append(row)
+            self._write_log({"op": "del", "id": record_id})
+            self._postings.clear()
+        return row
+
+    # --- queries ---
+
+    def _index(self, key: str) -> Dict[Any, np.ndarray]:
+        postings = self._postings.get(key)
+        if postings is None:
+            grouped: Dict[Any, List[int]] = {}
+            for row in range(self.size):
+                value = self.payloads.value(row, key)
+                try:
+                    grouped.setdefault(value, []).append(row)
+                except TypeError:
+                    continue  # giá trị không hash được (list, dict) không thể so khớp bằng bộ lọc
+            postings = {value: np.array(rows, dtype=np.int64) for value, rows in grouped.items()}
+            self._postings[key] = postings
+        return postings
+
+    def mask(self, payload_filter: Optional[PayloadFilter]) -> np.ndarray:
+        """Mảng bool (độ dài size) đánh dấu các dòng còn sống thỏa bộ lọc."""
+        mask = self.alive[: self.size].copy()
+        for key, expected in (payload_filter or {}).items():
+            if key == TENANT_FIELD:
+                continue  # đã được xử lý khi chọn partition
+            postings = self._index(key)
+            values = expected if isinstance(expected, (list, tuple, set)) else [expected]
+            matched = np.zeros(self.size, dtype=bool)
+            for value in values:
+                rows = postings.get(value)
+                if rows is not None:
+                    matched[rows] = True
+            mask &= matched
+        return mask
+
+    def scores(self, query: np.ndarray, mask: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Cosine similarity của `query` với các dòng thỏa `mask`. Trả về (rows, scores).
+        `query` có thể là ma trận (dim x q), khi đó scores có dạng (rows x q).
+        """
+        rows = np.flatnonzero(mask)
+        if rows.size == 0:
+            return rows, np.empty((0,) + query.shape[1:], dtype=np.float32)
+        if rows.size < self.size * SPARSE_FILTER_RATIO:
+            return rows, self.vectors[rows] @ query
+        return rows, (self.vectors[: self.size] @ query)[rows]
+
+    def approximate_scores(self, query: np.ndarray, rows: np.ndarray) -> np.ndarray:
+        """Điểm xấp xỉ của `rows` trên bản lượng tử, đổi sang float32 theo từng khối."""
+        sparse = rows.size < self.size * SPARSE_FILTER_RATIO
+        if sparse:
+            blocks = [rows[start:start + QUANTIZED_CHUNK_ROWS] for start in range(0, rows.size, QUANTIZED_CHUNK_ROWS)]
+        else:
+            blocks = [slice(start, min(start + QUANTIZED_CHUNK_ROWS, self.size)) for start in range(0, self.size, QUANTIZED_CHUNK_ROWS)]
+        parts = []
+        for block in blocks:
+            part = self.codes[block].astype(np.float32) @ query
+            if self.scales is not None:
+                part *= self.scales[block]
+            parts.append(part)
+        scores = np.concatenate(parts)
+        return scores if sparse else scores[rows]
+
+    def search(self, query: np.ndarray, mask: np.ndarray, limit: int) -> List[Tuple[int, float]]:
+        if self.codes is None:
+            rows, scores = self.scores(query, mask)
+        else:
+            # Chọn ứng viên trên bản lượng tử rồi chấm lại chính xác bằng float32
+            rows = np.flatnonzero(mask)
+            if rows.size:
+                approximate = self.approximate_scores(query, rows)
+                rows = np.sort(rows[top_k(approximate, limit * RESCORE_OVERSAMPLING)])
+            scores = self.vectors[rows] @ query
+        if rows.size == 0:
+            return []
+        order = top_k(scores, limit)
+        return [(int(rows[i]), float(scores[i])) for i in order]
+
+    def search_batch(self, queries: np.ndarray, mask: np.ndarray, limit: int) -> List[List[Tuple[int, float]]]:
+        """Như `search` cho nhiều truy vấn (q x dim): một phép nhân ma trận cho cả lô."""
+        if self.codes is not None:
+            return [self.search(query, mask, limit) for query in queries]
+        rows, scores = self.scores(queries.T, mask)
+        if rows.size == 0:
+            return [[] for _ in queries]
+        results = []
+        for column in scores.T:
+            order = top_k(column, limit)
+            results.append([(int(rows[i]), float(column[i])) for i in order])
+        return results
+
+    def record(self, row: int, with_vectors: bool = False, payload_fields: Optional[Sequence[str]] = None) -> VectorRecord:
+        vector = np.array(self.vectors[row]) if with_vectors else None
+        payload = self.payloads[row]
+        if payload_fields is not None:
+            payload = {key: payload[key] for key in payload_fields if key in payload}
+        return VectorRecord(id=self.ids[row], payload=dict(payload), vector=vector)
+
+
+class NumpyVectorStore(VectorStore):
+    """
+    Engine tìm kiếm chính xác (brute-force) trên NumPy, chạy trong process.
+
+    Mỗi tenant (giá trị `user_id`) là một partition riêng nằm trong
+    `<path>/<collection>/<hash tenant>/`, nên truy vấn của một tenant chỉ
+    nhân ma trận trên dữ liệu của tenant đó. Chỉ một process được mở thư mục
+    dữ liệu tại một thời điểm.
+    """
+
+    partition_class = NumpyPartition
+
+    def __init__(self, collection_name: str, vector_size: int, path: str, quantization: str = "none"):
+        super().__init__(collection_name, vector_size, quantization)
+        self.root = os.path.join(path, collection_name)
+        self.partitions: Dict[str, NumpyPartition] = {}
+        self._id_partition: Dict[str, str] = {}
+        self._lock = threading.RLock()
+
+    # --- partitions ---
+
+    @staticmethod
+    def _partition_key(tenant: Any) -> str:
+        return hashlib.sha1(str(tenant if tenant is not None else "").encode("utf-8")).hexdigest()[:20]
+
+    def _get_partition(self, tenant: Any, create: bool = False) -> Optional[NumpyPartition]:
+        key = self._partition_key(tenant)
+        partition = self.partitions.get(key)
+        if partition is None and create:
+            partition = self.partition_class(os.path.join(self.root, key), self.vector_size, self.quantization)
+            self.partitions[key] = partition
+        return partition
+
+    def _iter_partitions(self, payload_filter: Optional[PayloadFilter]) -> Iterator[Tuple[str, NumpyPartition]]:
+        tenants = (payload_filter or {}).get(TENANT_FIELD)
+        if tenants is None:
+            keys = sorted(self.partitions)
+        else:
+            if not isinstance(tenants, (list, tuple, set)):
+                tenants = [tenants]
+            keys = sorted({self._partition_key(tenant) for tenant in tenants})
+        for key in keys:
+            partition = self.partitions.get(key)
+            if partition is not None:
+                yield key, partition
+
+    def _locate(self, record_id: str) -> Optional[Tuple[NumpyPartition, int]]:
+        key = self._id_partition.get(record_id)
+        if key is None:
+            return None
+        partition = self.partitions[key]
+        return partition, partition.id_to_row[record_id]
+
+    # --- VectorStore ---
+
+    def _setup(self):
+        os.makedirs(self.root, exist_ok=True)
+        for key in sorted(os.listdir(self.root)):
+            directory = os.path.join(self.root, key)
+            if os.path.isdir(directory):
+                partition = self.partition_class(directory, self.vector_size, self.quantization)
+                self.partitions[key] = partition
+                for record_id in partition.id_to_row:
+                    self._id_partition[record_id] = key
+        total = sum(len(p.id_to_row) for p in self.partitions.values())
+        print(f"Loaded '{self.collection_name}': {total} vectors in {len(self.partitions)} partitions.")
+
+    async def setup(self) -> None:
+        await run_in_threadpool(self._setup)
+
+    def _close(self):
+        with self._lock:
+            for partition in self.partitions.values():
+                partition.close()
+
+    async def close(self) -> None:
+        await run_in_threadpool(self._close)
+
+    def _upsert(self, records: Sequence[VectorRecord]):
+        with self._lock:
+            touched = set()
+            for record in records:
+                tenant_key = self._partition_key(record.payload.get(TENANT_FIELD))
+                previous_key = self._id_partition.get(record.id)
+                if previous_key is not None and previous_key != tenant_key:
+                    self.partitions[previous_key].delete(record.id)
+                    touched.add(previous_key)
+                partition = self._get_partition(record.payload.get(TENANT_FIELD), create=True)
+                partition.put(record.id, normalize(record.vector), record.payload)
+                self._id_partition[record.id] = tenant_key
+                touched.add(tenant_key)
+            for key in touched:
+                self.partitions[key].flush()
+
+    async def upsert(self, records: Sequence[VectorRecord]) -> None:
+        if records:
+            await run_in_threadpool(self._upsert, records)
+
+    def _retrieve(self, ids: Sequence[str], with_vectors: bool) -> List[VectorRecord]:
+        with self._lock:
+            records = []
+            for record_id in ids:
+                located = self._locate(str(record_id))
+                if located:
+                    partition, row = located
+                    records.append(partition.record(row, with_vectors))
+            return records
+
+    async def retrieve(self, ids: Sequence[str], with_vectors: bool = False) -> List[VectorRecord]:
+        return await run_in_threadpool(self._retrieve, ids, with_vectors)
+
+    def _delete(self, ids: Optional[Sequence[str]], payload_filter: Optional[PayloadFilter]):
+        with self._lock:
+            touched = set()
+            if ids is not None:
+                for record_id in ids:
+                    key = self._id_partition.pop(str(record_id), None)
+                    if key is not None:
+                        self.partitions[key].delete(str(record_id))
+                        touched.add(key)
+            else:
+                for key, partition in list(self._iter_partitions(payload_filter)):
+                    for row in np.flatnonzero(partition.mask(payload_filter)):
+                        record_id = partition.ids[row]
+                        partition.delete(record_id)
+                        self._id_partition.pop(record_id, None)
+                        touched.add(key)
+            for key in touched:
+                self.partitions[key].flush()
+
+    async def delete(self, ids: Optional[Sequence[str]] = None, payload_filter: Optional[PayloadFilter] = None) -> None:
+        await run_in_threadpool(self._delete, ids, payload_filter)
+
+    def _scroll(self, payload_filter, limit, offset, with_vectors, payload_fields):
+        start_key, start_row = "", 0
+        if offset:
+            start_key, row = offset.split(":")
+            start_row = int(row)
+
+        with self._lock:
+            records = []
+            for key, partition in self._iter_partitions(payload_filter):
+                if key < start_key:
+                    continue
+                rows = np.flatnonzero(partition.mask(payload_filter))
+                if key == start_key:
+                    rows = rows[rows >= start_row]
+                for row in rows:
+                    if len(records) == limit:
+                        return records, f"{key}:{row}"
+                    records.append(partition.record(int(row), with_vectors, payload_fields))
+            return records, None
+
+    async def scroll(
+        self,
+        payload_filter: Optional[PayloadFilter] = None,
+        limit: int = 100,
+        offset: Optional[str] = None,
+        with_vectors: bool = False,
+        payload_fields: Optional[Sequence[str]] = None,
+    ) -> Tuple[List[VectorRecord], Optional[str]]:
+        return await run_in_threadpool(self._scroll, payload_filter, limit, offset, with_vectors, payload_fields)
+
+    @staticmethod
+    def _scored_records(hits, limit, score_threshold) -> List[ScoredRecord]:
+        hits.sort(key=lambda hit: -hit[0])
+        return [
+            ScoredRecord(id=partition.ids[row], score=score, payload=dict(partition.payloads[row]))
+            for score, partition, row in hits[:limit]
+            if score_threshold is None or score >= score_threshold
+        ]
+
+    def _search(self, vector, payload_filter, limit, score_threshold) -> List[ScoredRecord]:
+        query = normalize(vector)
+        with self._lock:
+            hits = []
+            for _, partition in self._iter_partitions(payload_filter):
+                mask = partition.mask(payload_filter)
+                for row, score in partition.search(query, mask, limit):
+                    hits.append((score, partition, row))
+            return self._scored_records(hits, limit, score_threshold)
+
+    def _search_batch(self, vectors, payload_filter, limit, score_threshold) -> List[List[ScoredRecord]]:
+        queries = np.stack([normalize(vector) for vector in vectors])
+        with self._lock:
+            hits = [[] for _ in vectors]
+            for _, partition in self._iter_partitions(payload_filter):
+                mask = partition.mask(payload_filter)
+                for query_hits, results in zip(hits, partition.search_batch(queries, mask, limit)):
+                    query_hits.extend((score, partition, row) for row, score in results)
+            return [self._scored_records(query_hits, limit, score_threshold) for query_hits in hits]
+
+    async def search(
+        self,
+        vector: np.ndarray,
+        payload_filter: Optional[PayloadFilter] = None,
+        limit: int = 5,
+        score_threshold: Optional[float] = None,
+    ) -> List[ScoredRecord]:
+        return await run_in_threadpool(self._search, vector, payload_filter, limit, score_threshold)
+
+    async def search_batch(
+        self,
+        vectors: Sequence[np.ndarray],
+        payload_filter: Optional[PayloadFilter] = None,
+        limit: int = 5,
+        score_threshold: Optional[float] = None,
+    ) -> List[List[ScoredRecord]]:
+        if len(vectors) == 0:
+            return []
+        return await run_in_threadpool(self._search_batch, vectors, payload_filter, limit, score_threshold)
+
+    def _set_payload(self, payload, ids, payload_filter):
+        if TENANT_FIELD in payload:
+            raise ValueError(f"Cannot change '{TENANT_FIELD}' with set_payload.")
+        with self._lock:
+            touched = set()
+            if ids is not None:
+                for record_id in ids:
+                    located = self._locate(str(record_id))
+                    if located:
+                        partition, row = located
+                        partition.set_payload(row, payload)
+                        touched.add(self._id_partition[str(record_id)])
+            else:
+                for key, partition in self._iter_partitions(payload_filter):
+                    for row in np.flatnonzero(partition.mask(payload_filter)):
+                        partition.set_payload(int(row), payload)
+                        touched.add(key)
+            for key in touched:
+                self.partitions[key].flush()
+
+    async def set_payload(
+        self,
+        payload: Dict[str, Any],
+        ids: Optional[Sequence[str]] = None,
+        payload_filter: Optional[PayloadFilter] = None,
+    ) -> None:
+        await run_in_threadpool(self._set_payload, payload, ids, payload_filter)
+
+    def _count(self, payload_filter: Optional[PayloadFilter]) -> int:
+        with self._lock:
+            return sum(int(p.mask(payload_filter).sum()) for _, p in self._iter_partitions(payload_filter))
+
+    async def count(self, payload_filter: Optional[PayloadFilter] = None) -> int:
+        return await run_in_threadpool(self._count, payload_filter)
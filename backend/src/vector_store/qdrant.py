@@ -0,0 +1,161 @@
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+from qdrant_client import models as qdrant_models
+
+from src.qdrant_client import get_qdrant_client, setup_qdrant
+from src.vector_store.base import RESCORE_OVERSAMPLING, PayloadFilter, ScoredRecord, VectorRecord, VectorStore
+
+
+def to_qdrant_filter(payload_filter: Optional[PayloadFilter]) -> Optional[qdrant_models.Filter]:
+    if not payload_filter:
+        return None
+    conditions = []
+    for key, expected in payload_filter.items():
+        if isinstance(expected, (list, tuple, set)):
+            match = qdrant_models.MatchAny(any=list(expected))
+        else:
+            match = qdrant_models.MatchValue(value=expected)
+        conditions.append(qdrant_models.FieldCondition(key=key, match=match))
+    return qdrant_models.Filter(must=conditions)
+
+
+def _to_record(point, with_vectors: bool) -> VectorRecord:
+    vector = np.asarray(point.vector, dtype=np.float32) if with_vectors and point.vector is not None else None
+    return VectorRecord(id=str(point.id), payload=point.payload or {}, vector=vector)
+
+
+class QdrantVectorStore(VectorStore):
+    """Lưu vector trong Qdrant (local mode hoặc server qua QDRANT_URL)."""
+
+    def __init__(self, collection_name: str, vector_size: int, quantization: str = "none"):
+        super().__init__(collection_name, vector_size, quantization)
+        self.client = get_qdrant_client()
+        self.search_params = None
+        if quantization == "int8":
+            # Vector gốc float32 nằm trên đĩa, chỉ dùng để chấm lại các ứng viên
+            self.search_params = qdrant_models.SearchParams(
+                quantization=qdrant_models.QuantizationSearchParams(rescore=True, oversampling=RESCORE_OVERSAMPLING)
+            )
+
+    async def setup(self) -> None:
+        await setup_qdrant(self.collection_name, self.vector_size, self.quantization)
+
+    async def upsert(self, records: Sequence[VectorRecord]) -> None:
+        if not records:
+            return
+        await self.client.upsert(
+            collection_name=self.collection_name,
+            points=[
+                qdrant_models.PointStruct(id=record.id, vector=record.vector.tolist(), payload=record.payload)
+                for record in records
+            ],
+            wait=True,
+        )
+
+    async def retrieve(self, ids: Sequence[str], with_vectors: bool = False) -> List[VectorRecord]:
+        points = await self.client.retrieve(
+            collection_name=self.collection_name,
+            ids=list(ids),
+            with_payload=True,
+            with_vectors=with_vectors,
+        )
+        return [_to_record(point, with_vectors) for point in points]
+
+    async def delete(self, ids: Optional[Sequence[str]] = None, payload_filter: Optional[PayloadFilter] = None) -> None:
+        if ids is not None:
+            selector = qdrant_models.PointIdsList(points=list(ids))
+        else:
+            selector = qdrant_models.FilterSelector(filter=to_qdrant_filter(payload_filter))
+        await self.client.delete(collection_name=self.collection_name, points_selector=selector, wait=True)
+
+    async def scroll(
+        self,
+        payload_filter: Optional[PayloadFilter] = None,
+        limit: int = 100,
+        offset: Optional[str] = None,
+        with_vectors: bool = False,
+        payload_fields: Optional[Sequence[str]] = None,
+    ) -> Tuple[List[VectorRecord], Optional[str]]:
+        points, next_offset = await self.client.scroll(
+            collection_name=self.collection_name,
+            scroll_filter=to_qdrant_filter(payload_filter),
+            limit=limit,
+            offset=offset,
+            with_payload=list(payload_fields) if payload_fields is not None else True,
+            with_vectors=with_vectors,
+        )
+        records = [_to_record(point, with_vectors) for point in points]
+        return records, str(next_offset) if next_offset is not None else None
+
+    async def search(
+        self,
+        vector: np.ndarray,
+        payload_filter: Optional[PayloadFilter] = None,
+        limit: int = 5,
+        score_threshold: Optional[float] = None,
+    ) -> List[ScoredRecord]:
+        response = await self.client.query_points(
+            collection_name=self.collection_name,
+            query=np.asarray(vector, dtype=np.float32).tolist(),
+            query_filter=to_qdrant_filter(payload_filter),
+            limit=limit,
+            score_threshold=score_threshold,
+            search_params=self.search_params,
+        )
+        return [ScoredRecord(id=str(hit.id), score=hit.score, payload=hit.payload or {}) for hit in response.points]
+
+    async def search_batch(
+        self,
+        vectors: Sequence[np.ndarray],
+        payload_filter: Optional[PayloadFilter] = None,
+        limit: int = 5,
+        score_threshold: Optional[float] = None,
+    ) -> List[List[ScoredRecord]]:
+        if len(vectors) == 0:
+            return []
+        query_filter = to_qdrant_filter(payload_filter)
+        responses = await self.client.query_batch_points(
+            collection_name=self.collection_name,
+            requests=[
+                qdrant_models.QueryRequest(
+                    query=np.asarray(vector, dtype=np.float32).tolist(),
+                    filter=query_filter,
+                    limit=limit,
+                    score_threshold=score_threshold,
+                    params=self.search_params,
+                    with_payload=True,
+                )
+                for vector in vectors
+            ],
+        )
+        return [
+            [ScoredRecord(id=str(hit.id), score=hit.score, payload=hit.payload or {}) for hit in response.points]
+            for response in responses
+        ]
+
+    async def set_payload(
+        self,
+        payload: Dict[str, Any],
+        ids: Optional[Sequence[str]] = None,
+        payload_filter: Optional[PayloadFilter] = None,
+    ) -> None:
+        if ids is not None:
+            await self.client.set_payload(
+                collection_name=self.collection_name, payload=payload, points=list(ids), wait=True
+            )
+        else:
+            await self.client.set_payload(
+                collection_name=self.collection_name,
+                payload=payload,
+                points=to_qdrant_filter(payload_filter),
+                wait=True,
+            )
+
+    async def count(self, payload_filter: Optional[PayloadFilter] = None) -> int:
+        result = await self.client.count(
+            collection_name=self.collection_name,
+            count_filter=to_qdrant_filter(payload_filter),
+            exact=True,
+        )
+        return result.count
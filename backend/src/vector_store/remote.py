@@ -0,0 +1,82 @@
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from src.inference_client import acall
+from src.vector_store.base import PayloadFilter, ScoredRecord, VectorRecord, VectorStore
+
+
+class RemoteVectorStore(VectorStore):
+    """
+    Collection nằm ở tiến trình inference chính (src/inference_service.py).
+    Dùng ở các worker API khi INFERENCE_SOCKETS được đặt; backend và lượng tử
+    thực sự là cấu hình của tiến trình inference.
+    """
+
+    def __init__(self, collection_name: str, vector_size: int, quantization: str = "none"):
+        super().__init__(collection_name, vector_size, quantization)
+        self.target = ("store", collection_name)
+
+    async def setup(self) -> None:
+        await acall(self.target, "setup")
+
+    async def close(self) -> None:
+        # Store thuộc về tiến trình inference, được đóng khi tiến trình đó dừng
+        pass
+
+    async def upsert(self, records: Sequence[VectorRecord]) -> None:
+        await acall(self.target, "upsert", list(records))
+
+    async def retrieve(self, ids: Sequence[str], with_vectors: bool = False) -> List[VectorRecord]:
+        return await acall(self.target, "retrieve", list(ids), with_vectors=with_vectors)
+
+    async def delete(self, ids: Optional[Sequence[str]] = None, payload_filter: Optional[PayloadFilter] = None) -> None:
+        await acall(self.target, "delete", ids=list(ids) if ids is not None else None, payload_filter=payload_filter)
+
+    async def scroll(
+        self,
+        payload_filter: Optional[PayloadFilter] = None,
+        limit: int = 100,
+        offset: Optional[str] = None,
+        with_vectors: bool = False,
+        payload_fields: Optional[Sequence[str]] = None,
+    ) -> Tuple[List[VectorRecord], Optional[str]]:
+        return await acall(
+            self.target,
+            "scroll",
+            payload_filter=payload_filter,
+            limit=limit,
+            offset=offset,
+            with_vectors=with_vectors,
+            payload_fields=list(payload_fields) if payload_fields is not None else None,
+        )
+
+    async def search(
+        self,
+        vector: np.ndarray,
+        payload_filter: Optional[PayloadFilter] = None,
+        limit: int = 5,
+        score_threshold: Optional[float] = None,
+    ) -> List[ScoredRecord]:
+        return await acall(self.target, "search", vector, payload_filter, limit, score_threshold)
+
+    async def search_batch(
+        self,
+        vectors: Sequence[np.ndarray],
+        payload_filter: Optional[PayloadFilter] = None,
+        limit: int = 5,
+        score_threshold: Optional[float] = None,
+    ) -> List[List[ScoredRecord]]:
+        # Một lời gọi cho cả lô; tiến trình inference gộp thành một truy vấn nếu engine hỗ trợ
+        return await acall(self.target, "search_batch", list(vectors), payload_filter, limit, score_threshold)
+
+    async def set_payload(
+        self,
+        payload: Dict[str, Any],
+        ids: Optional[Sequence[str]] = None,
+        payload_filter: Optional[PayloadFilter] = None,
+    ) -> None:
+        await acall(self.target, "set_payload", payload, ids=list(ids) if ids is not None else None, payload_filter=payload_filter)
+
+    async def count(self, payload_filter: Optional[PayloadFilter] = None) -> int:
+        return await acall(self.target, "count", payload_filter)
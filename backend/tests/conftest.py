@@ -0,0 +1,12 @@
+import os
+import sys
+
+# Các module src đọc cấu hình từ biến môi trường khi được import
+os.environ.setdefault("ENDPOINT_URL_R2", "http://r2.test/bucket")
+os.environ.setdefault("AWS_ACCESS_KEY_ID_R2", "test")
+os.environ.setdefault("AWS_SECRET_ACCESS_KEY_R2", "test")
+os.environ.setdefault("PUBLIC_URL_R2", "http://cdn.test")
+os.environ.setdefault("VECTOR_STORE_BACKEND", "numpy")
+os.environ["INFERENCE_SOCKETS"] = ""
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
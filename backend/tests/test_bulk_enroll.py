@@ -0,0 +1,76 @@
+import asyncio
+import io
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+
+import numpy as np
+from PIL import Image
+
+from scripts import bulk_enroll
+
+
+def test_bounded_map_limits_in_flight_tasks(monkeypatch):
+    lock = threading.Lock()
+    in_flight = peak = 0
+
+    def process(task):
+        nonlocal in_flight, peak
+        with lock:
+            in_flight += 1
+            peak = max(peak, in_flight)
+        time.sleep(0.01)
+        with lock:
+            in_flight -= 1
+        return task
+
+    monkeypatch.setattr(bulk_enroll, "_process_image", process)
+    tasks = [(f"{i}.jpg", f"{i}.jpg", "a") for i in range(40)]
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        results = list(bulk_enroll._bounded_map(pool, tasks, window=3))
+    assert sorted(results) == sorted(tasks)
+    assert peak <= 3
+
+
+def test_process_image_records_unexpected_errors(monkeypatch, tmp_path):
+    class BrokenDetector:
+        def detect(self, image):
+            raise RuntimeError("onnxruntime failure")
+
+    path = tmp_path / "face.jpg"
+    Image.fromarray(np.zeros((64, 64, 3), dtype=np.uint8)).save(path)
+    monkeypatch.setattr(bulk_enroll, "_detector", BrokenDetector())
+    relpath, label, vector, encoded, reason = bulk_enroll._process_image((str(path), "a/face.jpg", "a"))
+    assert vector is None and encoded is None
+    assert "onnxruntime failure" in reason
+
+
+def test_resumed_run_reconciles_people_finished_before_the_interruption(monkeypatch, tmp_path):
+    for person, images in (("Ann", ["1.jpg", "2.jpg"]), ("Bob", ["1.jpg"])):
+        (tmp_path / person).mkdir()
+        for image in images:
+            (tmp_path / person / image).write_bytes(b"")
+    checkpoint = tmp_path / "run.checkpoint"
+    # Ảnh của Ann đã được ghi trước khi bị ngắt; còn lại ảnh của Bob
+    checkpoint.write_text("Ann/1.jpg\nAnn/2.jpg\nBob/1.jpg\n", encoding="utf-8")
+    reconciled, rebuilt = [], []
+
+    async def reconcile(user, labels):
+        reconciled.append(set(labels))
+
+    async def rebuild(username, names=None):
+        rebuilt.append(set(names))
+
+    user = SimpleNamespace(username="alice", id=1)
+    query = SimpleNamespace(filter=lambda *args: SimpleNamespace(first=lambda: user))
+    session = SimpleNamespace(query=lambda model: query, close=lambda: None)
+    monkeypatch.setattr(bulk_enroll, "SessionLocal", lambda: session)
+    monkeypatch.setattr(bulk_enroll, "reconcile_face_groups", reconcile)
+    monkeypatch.setattr(bulk_enroll, "get_prototype_index", lambda: SimpleNamespace(rebuild=rebuild))
+    args = SimpleNamespace(
+        user="alice", directory=str(tmp_path), checkpoint=str(checkpoint), rebuild=False, workers=1,
+        threads_per_worker=1, batch_size=16, detector_model="", recognizer_model="",
+    )
+    asyncio.run(bulk_enroll.enroll(args))
+    assert reconciled == rebuilt == [{"Ann", "Bob"}]
@@ -0,0 +1,105 @@
+import asyncio
+
+import numpy as np
+import pytest
+
+import src.cascade as cascade
+import src.reembedding as reembedding
+from src.vector_store.base import ScoredRecord, VectorRecord
+from src.vector_store.numpy_store import NumpyVectorStore
+
+DIM = 4
+
+
+def unit(*values: float) -> np.ndarray:
+    vector = np.asarray(values, dtype=np.float32)
+    return vector / np.linalg.norm(vector)
+
+
+def payload(point_id: str, name: str) -> dict:
+    return {"user_id": "alice", "name": name, "image_url": f"http://cdn.test/{point_id}.jpg"}
+
+
+class FakeRecognizer:
+    """Embedding của khuôn mặt được mã hóa sẵn trong landmarks / nội dung ảnh."""
+
+    output_shape = (1, DIM)
+
+    def get_normalized_embeddings(self, image, landmarks_list):
+        return np.stack([unit(*landmarks) for landmarks in landmarks_list])
+
+
+@pytest.fixture
+def stores(tmp_path, monkeypatch):
+    stores = {version: NumpyVectorStore(f"faces_{version}", DIM, str(tmp_path)) for version in ("light", "heavy")}
+    for store in stores.values():
+        asyncio.run(store.setup())
+
+    def get_image_store(version=None):
+        return stores[version or "light"]
+
+    for module in (cascade, reembedding):
+        monkeypatch.setattr(module, "get_image_store", get_image_store)
+        monkeypatch.setattr(module, "get_recognizer", lambda version: FakeRecognizer())
+    monkeypatch.setattr(reembedding, "get_verifier_version", lambda: "heavy")
+    return get_image_store
+
+
+def test_ambiguous_face_falls_back_to_light_decision_without_verifier_vector(stores):
+    hits = [ScoredRecord(id="a", score=0.45, payload=payload("a", "Ann"))]
+    [result] = asyncio.run(cascade._verify(None, [{"landmarks": (1, 0, 0, 0)}], [hits], "heavy", threshold=0.4))
+    assert result is hits[0]
+    [result] = asyncio.run(cascade._verify(None, [{"landmarks": (1, 0, 0, 0)}], [hits], "heavy", threshold=0.5))
+    assert result is None
+
+
+def test_verifier_rescores_candidates_it_has_embedded(stores):
+    asyncio.run(stores("heavy").upsert([
+        VectorRecord(id="a", vector=unit(0, 1, 0, 0), payload=payload("a", "Ann")),
+        VectorRecord(id="b", vector=unit(1, 0, 0, 0), payload=payload("b", "Bob")),
+    ]))
+    hits = [ScoredRecord(id="a", score=0.5, payload=payload("a", "Ann")), ScoredRecord(id="b", score=0.45, payload=payload("b", "Bob"))]
+    [result] = asyncio.run(cascade._verify(None, [{"landmarks": (1, 0, 0, 0)}], [hits], "heavy", threshold=0.4))
+    assert result.id == "b" and result.score == pytest.approx(1.0)
+
+    # Ảnh đã bị thay: vector cũ không được dùng
+    replaced = [ScoredRecord(id="a", score=0.5, payload={**payload("a", "Ann"), "image_url": "http://cdn.test/new.jpg"})]
+    [result] = asyncio.run(cascade._verify(None, [{"landmarks": (1, 0, 0, 0)}], [replaced], "heavy", threshold=0.4))
+    assert result is replaced[0]
+
+
+def test_worker_builds_verifier_gallery_in_background(stores, monkeypatch):
+    images = {"http://cdn.test/a.jpg": unit(1, 0, 0, 0), "http://cdn.test/b.jpg": unit(0, 1, 0, 0)}
+
+    async def download(url):
+        if url not in images:
+            raise FileNotFoundError(url)
+        return url
+
+    async def no_pause():
+        pass
+
+    monkeypatch.setattr(reembedding, "download_img_from_r2", download)
+    monkeypatch.setattr(reembedding, "_embed_image", lambda url, recognizer: images[url])
+    asyncio.run(stores().upsert([
+        VectorRecord(id="a", vector=unit(1, 1, 0, 0), payload=payload("a", "Ann")),
+        VectorRecord(id="b", vector=unit(1, 1, 0, 0), payload=payload("b", "Bob")),
+        VectorRecord(id="c", vector=unit(1, 1, 0, 0), payload=payload("c", "Cat")),
+    ]))
+
+    async def scenario():
+        worker = reembedding.ReembeddingWorker()
+        worker._throttle = no_pause
+        await worker._sync_verifier_gallery()
+        assert sorted(record.id for record in (await stores("heavy").scroll())[0]) == ["a", "b"]
+        assert worker._verifier_failures == {"c": "http://cdn.test/c.jpg"}
+
+        # Ảnh b được thay: vector cũ bị thay bằng embedding của ảnh mới
+        images["http://cdn.test/b2.jpg"] = unit(0, 0, 1, 0)
+        await stores().set_payload({"image_url": "http://cdn.test/b2.jpg"}, ids=["b"])
+        await worker._sync_verifier_gallery()
+        [record] = await stores("heavy").retrieve(["b"], with_vectors=True)
+        assert record.payload["image_url"] == "http://cdn.test/b2.jpg"
+        np.testing.assert_allclose(record.vector, unit(0, 0, 1, 0))
+
+    asyncio.run(scenario())
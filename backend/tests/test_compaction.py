@@ -0,0 +1,118 @@
+import asyncio
+import json
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+import src.compaction as compaction
+from src.compaction import CompactionWorker, select_representatives
+from src.database import Base
+from src.models import CompactionGroupReport, CompactionJob, FaceGroup, PendingImageDeletion, User
+from src.utils import SHARED_IMAGES_FIELD
+from src.vector_store.base import VectorRecord
+from src.vector_store.numpy_store import NumpyVectorStore
+
+DIM = 4
+
+
+def unit(*values: float) -> np.ndarray:
+    vector = np.asarray(values, dtype=np.float32)
+    return vector / np.linalg.norm(vector)
+
+
+def test_near_duplicates_collapse_to_one():
+    vectors = np.stack([unit(1, 0, 0, 0), unit(1, 0.01, 0, 0), unit(1, -0.01, 0, 0), unit(0, 0, 1, 0)])
+    assert select_representatives(vectors, threshold=0.95).tolist() == [0, 3]
+
+
+def test_most_central_image_is_kept():
+    vectors = np.stack([unit(1, 0.2, 0, 0), unit(1, 0, 0, 0), unit(1, -0.2, 0, 0)])
+    assert select_representatives(vectors, threshold=0.9).tolist() == [1]
+
+
+def test_min_keep_adds_the_most_different_images():
+    vectors = np.stack([unit(1, 0, 0, 0), unit(1, 0.05, 0, 0), unit(1, -0.05, 0, 0), unit(1, 0, 0.5, 0)])
+    assert select_representatives(vectors, threshold=0.5).tolist() == [0]
+    assert select_representatives(vectors, threshold=0.5, min_keep=2).tolist() == [0, 3]
+    assert select_representatives(vectors[:2], threshold=0.5, min_keep=3).tolist() == [0, 1]
+
+
+@pytest.fixture
+def env(tmp_path, monkeypatch):
+    engine = create_engine(f"sqlite:///{tmp_path / 'test.db'}", connect_args={"check_same_thread": False})
+    Base.metadata.create_all(bind=engine)
+    session_factory = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+    store = NumpyVectorStore("faces", DIM, str(tmp_path / "store"))
+    asyncio.run(store.setup())
+    deleted = []
+
+    async def delete(url):
+        deleted.append(url)
+
+    async def remove(*args, **kwargs):
+        pass
+
+    monkeypatch.setattr(compaction, "SessionLocal", session_factory)
+    monkeypatch.setattr(compaction, "get_active_version", lambda: "v1")
+    monkeypatch.setattr(compaction, "get_image_store", lambda version=None: store)
+    monkeypatch.setattr(compaction, "get_mirror_stores", lambda: [])
+    monkeypatch.setattr(compaction, "get_prototype_index", lambda version=None: SimpleNamespace(remove=remove))
+    monkeypatch.setattr(compaction, "delete_img_from_r2", delete)
+    return SimpleNamespace(db=session_factory, store=store, deleted=deleted)
+
+
+def face(point_id: str, name: str, vector, **payload) -> VectorRecord:
+    return VectorRecord(
+        id=point_id,
+        vector=vector,
+        payload={"user_id": "alice", "name": name, "image_url": f"http://cdn.test/{point_id}.jpg", **payload},
+    )
+
+
+def test_job_reports_groups_and_deletes_stored_images(env):
+    asyncio.run(env.store.upsert([
+        face("a1", "Ann", unit(1, 0, 0, 0)),
+        face("a2", "Ann", unit(1, 0.01, 0, 0)),
+        face("a3", "Ann", unit(1, 0, 0.01, 0), **{SHARED_IMAGES_FIELD: True}),
+        face("b1", "Bob", unit(0, 1, 0, 0)),
+    ]))
+    db = env.db()
+    db.add(User(id=1, username="alice", hashed_password="x"))
+    db.add_all([FaceGroup(name="Ann", user_id=1, image_count=3), FaceGroup(name="Bob", user_id=1, image_count=1)])
+    db.add(CompactionJob(id="job", user_id=1, dry_run=False, threshold=0.95, min_keep=1))
+    db.commit()
+    db.close()
+
+    asyncio.run(CompactionWorker()._process_job("job"))
+
+    assert sorted(record.id for record in asyncio.run(env.store.scroll())[0]) == ["a1", "b1"]
+    # Ảnh dùng chung của a3 không bị xóa, và không còn URL nào chờ xóa
+    assert env.deleted == ["http://cdn.test/a2.jpg"]
+    db = env.db()
+    try:
+        assert db.query(PendingImageDeletion).count() == 0
+        job = db.get(CompactionJob, "job")
+        assert (job.status, job.images_before, job.images_removed) == ("completed", 4, 2)
+        reports = db.query(CompactionGroupReport).filter_by(job_id="job").order_by(CompactionGroupReport.id).all()
+        assert [(r.name, r.images_before, r.images_after) for r in reports] == [("Ann", 3, 1), ("Bob", 1, 1)]
+        assert sorted(json.loads(reports[0].removed_ids)) == ["a2", "a3"]
+        assert compaction._job_out(db, job).groups[0].removed_ids == json.loads(reports[0].removed_ids)
+        assert db.query(FaceGroup).filter_by(name="Ann").one().image_count == 1
+    finally:
+        db.close()
+
+
+def test_pending_deletions_survive_until_drained(env):
+    db = env.db()
+    db.add_all([PendingImageDeletion(image_url=f"http://cdn.test/{i}.jpg") for i in range(3)])
+    db.commit()
+    db.close()
+
+    asyncio.run(compaction.delete_pending_images())
+    assert sorted(env.deleted) == [f"http://cdn.test/{i}.jpg" for i in range(3)]
+    db = env.db()
+    assert db.query(PendingImageDeletion).count() == 0
+    db.close()
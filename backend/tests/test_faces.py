@@ -0,0 +1,55 @@
+import asyncio
+
+import numpy as np
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+import src.faces as faces
+from src.database import Base
+from src.models import FaceGroup, User
+from src.vector_store.base import VectorRecord
+from src.vector_store.numpy_store import NumpyVectorStore
+
+DIM = 4
+
+
+def test_grouped_listing_reads_at_most_images_per_group(tmp_path, monkeypatch):
+    store = NumpyVectorStore("faces", DIM, str(tmp_path / "store"))
+    asyncio.run(store.setup())
+    records = [("Big", i) for i in range(300)] + [("Small", i) for i in range(2)]
+    asyncio.run(store.upsert([
+        VectorRecord(
+            id=f"{name}-{i}",
+            vector=np.ones(DIM, dtype=np.float32),
+            payload={"user_id": "alice", "name": name, "image_url": f"http://cdn.test/{name}-{i}.jpg"},
+        )
+        for name, i in records
+    ]))
+    returned = []
+    scroll = store.scroll
+
+    async def counting_scroll(*args, **kwargs):
+        page, offset = await scroll(*args, **kwargs)
+        returned.append(len(page))
+        return page, offset
+
+    monkeypatch.setattr(store, "scroll", counting_scroll)
+    monkeypatch.setattr(faces, "get_image_store", lambda version=None: store)
+
+    engine = create_engine(f"sqlite:///{tmp_path / 'test.db'}", connect_args={"check_same_thread": False})
+    Base.metadata.create_all(bind=engine)
+    db = sessionmaker(bind=engine)()
+    user = User(id=1, username="alice", hashed_password="x")
+    db.add(user)
+    db.add_all([FaceGroup(name="Big", user_id=1, image_count=300), FaceGroup(name="Small", user_id=1, image_count=2)])
+    db.commit()
+
+    response = asyncio.run(faces.get_my_faces_grouped(
+        current_user=user, db=db, page=1, page_size=10, thumbnails=True, images_per_group=5
+    ))
+    db.close()
+    groups = {item.name: item for item in response.items}
+    assert (len(groups["Big"].images), groups["Big"].image_count) == (5, 300)
+    assert [image.id for image in groups["Small"].images] == ["Small-0", "Small-1"]
+    # Nhóm lớn không bị duyệt hết
+    assert sum(returned) == 7
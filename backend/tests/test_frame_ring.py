@@ -0,0 +1,53 @@
+import numpy as np
+import pytest
+
+import src.frame_ring as frame_ring
+from src.frame_ring import FrameRing, SharedArray, resolve_arrays
+
+
+@pytest.fixture
+def ring(monkeypatch):
+    ring = FrameRing(slots=2, slot_bytes=64)
+    monkeypatch.setattr(frame_ring, "_ring", ring)
+    yield ring
+    frame_ring._attached.pop(ring.name, None)
+    ring.close()
+
+
+def test_frames_in_slots_are_sent_by_reference(ring):
+    slot = ring.lease()
+    frame = slot.frame((4, 4, 3))
+    frame[:] = np.arange(48, dtype=np.uint8).reshape(4, 4, 3)
+    other = np.ones(3, dtype=np.float32)
+
+    args, kwargs = frame_ring.share_arrays((frame, "x"), {"other": other})
+    assert isinstance(args[0], SharedArray) and args[0].offset == slot.index * 64
+    assert args[1] == "x" and kwargs["other"] is other
+
+    (resolved, _), resolved_kwargs = resolve_arrays(args, kwargs)
+    np.testing.assert_array_equal(resolved, frame)
+    assert not resolved.flags.writeable and resolved_kwargs["other"] is other
+    assert ring.stats().shared == 1
+
+
+def test_only_contiguous_arrays_inside_the_segment_are_shared(ring):
+    frame = ring.lease().frame((4, 4, 3))
+    assert ring.share(frame[:, ::2]) is None
+    assert ring.share(np.zeros((4, 4, 3), dtype=np.uint8)) is None
+    assert ring.lease().frame((8, 8, 3)) is None
+    stats = ring.stats()
+    assert (stats.shared, stats.oversize, stats.in_use) == (0, 1, 2)
+
+
+def test_retired_slot_is_quarantined(ring):
+    first, second = ring.lease(), ring.lease()
+    ring.retire(first, quarantine=60)
+    second.release()
+    # Slot bị bỏ không được cho mượn lại trong thời gian cách ly
+    third = ring.lease()
+    assert third.index == second.index
+    assert ring.lease() is None
+
+    ring.retire(third, quarantine=0)
+    assert ring.lease().index == third.index
+    assert ring.stats().retired == 2
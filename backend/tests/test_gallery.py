@@ -0,0 +1,155 @@
+import asyncio
+import uuid
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+import src.gallery as gallery
+import src.utils as utils
+from src.gallery import SnapshotError, SnapshotReader, SnapshotWriter
+from src.vector_store.base import VectorRecord
+from src.vector_store.numpy_store import NumpyVectorStore
+
+DIM = 4
+CDN = "http://cdn.test"
+
+
+def record(point_id: str, name: str, vector, tenant: str = "alice") -> VectorRecord:
+    return VectorRecord(
+        id=point_id,
+        vector=np.asarray(vector, dtype=np.float32),
+        payload={
+            "user_id": tenant,
+            "name": name,
+            "image_url": f"{CDN}/{point_id}.jpg",
+            "thumbnail_url": f"{CDN}/{point_id}-thumb.webp",
+        },
+    )
+
+
+def write_snapshot(path, records, tenant="alice", version="v1"):
+    writer = SnapshotWriter(DIM)
+    try:
+        for start in range(0, len(records), 2):
+            writer.append(records[start:start + 2])
+        writer.finish(str(path), {"format": gallery.SNAPSHOT_FORMAT_VERSION, "tenant": tenant, "embedding_version": version})
+    finally:
+        writer.cleanup()
+
+
+def test_snapshot_round_trip(tmp_path):
+    rng = np.random.default_rng(0)
+    records = [record(str(uuid.uuid4()), name, rng.standard_normal(DIM)) for name in ["Ann", "Bảo", "Ann", "Chí Thanh", "D"]]
+    records[4].payload.pop("thumbnail_url")
+    write_snapshot(tmp_path / "g.npz", records)
+
+    reader = SnapshotReader(str(tmp_path / "g.npz"))
+    try:
+        assert reader.manifest["tenant"] == "alice" and reader.count == 5 and reader.dim == DIM
+        batches = list(reader.batches(3))
+    finally:
+        reader.close()
+    assert [len(vectors) for vectors, _ in batches] == [3, 2]
+    vectors = np.concatenate([vectors for vectors, _ in batches])
+    np.testing.assert_array_equal(vectors, np.stack([r.vector for r in records]))
+    columns = {column: sum((batch[column] for _, batch in batches), []) for column in gallery.SNAPSHOT_COLUMNS}
+    assert columns["id"] == [r.id for r in records]
+    assert columns["name"] == ["Ann", "Bảo", "Ann", "Chí Thanh", "D"]
+    assert columns["thumbnail_url"][4] == ""
+    # np.load đọc được cùng file
+    with np.load(tmp_path / "g.npz") as data:
+        np.testing.assert_array_equal(data["embeddings"], vectors)
+
+
+def test_reader_rejects_other_files(tmp_path):
+    (tmp_path / "bad.npz").write_bytes(b"not a zip")
+    with pytest.raises(SnapshotError):
+        SnapshotReader(str(tmp_path / "bad.npz"))
+    np.savez(tmp_path / "plain.npz", embeddings=np.zeros((1, DIM)))
+    with pytest.raises(SnapshotError):
+        SnapshotReader(str(tmp_path / "plain.npz"))
+
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    store = NumpyVectorStore("faces", DIM, str(tmp_path / "store"))
+    asyncio.run(store.setup())
+
+    async def rebuild(*args, **kwargs):
+        pass
+
+    async def reconcile(*args, **kwargs):
+        pass
+
+    monkeypatch.setattr(gallery, "get_active_version", lambda: "v1")
+    monkeypatch.setattr(gallery, "get_image_store", lambda version=None: store)
+    monkeypatch.setattr(gallery, "get_mirror_stores", lambda: [])
+    monkeypatch.setattr(gallery, "reconcile_face_groups", reconcile)
+    monkeypatch.setattr(gallery, "get_prototype_index", lambda version=None: SimpleNamespace(rebuild=rebuild))
+    return store
+
+
+def test_import_never_reuses_ids_of_other_tenants(tmp_path, store):
+    alice_id = str(uuid.uuid4())
+    asyncio.run(store.upsert([record(alice_id, "Ann", [1, 0, 0, 0])]))
+    # Snapshot sửa tay khai là của bob nhưng chứa id của alice
+    write_snapshot(tmp_path / "g.npz", [record(alice_id, "Eve", [0, 0, 1, 0])], tenant="bob")
+
+    bob = SimpleNamespace(username="bob", id=2)
+    result = asyncio.run(gallery.import_gallery(bob, str(tmp_path / "g.npz")))
+    assert result.imported == 1
+
+    # Bản ghi của alice không bị ghi đè
+    [original] = asyncio.run(store.retrieve([alice_id]))
+    assert original.payload["user_id"] == "alice" and original.payload["name"] == "Ann"
+    [imported] = asyncio.run(store.retrieve([gallery.imported_point_id("bob", alice_id)]))
+    assert imported.payload["user_id"] == "bob" and imported.payload[utils.SHARED_IMAGES_FIELD] is True
+    # Nhập lại cùng snapshot không tạo bản ghi trùng
+    asyncio.run(gallery.import_gallery(bob, str(tmp_path / "g.npz")))
+    assert asyncio.run(store.count({"user_id": "bob"})) == 1
+
+
+def test_reimport_into_own_gallery_keeps_ids(tmp_path, store):
+    point_id = str(uuid.uuid4())
+    asyncio.run(store.upsert([record(point_id, "Ann", [1, 0, 0, 0])]))
+    write_snapshot(tmp_path / "g.npz", [record(point_id, "Ann", [1, 0, 0, 0])])
+
+    alice = SimpleNamespace(username="alice", id=1)
+    asyncio.run(gallery.import_gallery(alice, str(tmp_path / "g.npz")))
+    assert asyncio.run(store.count()) == 1
+    [kept] = asyncio.run(store.retrieve([point_id]))
+    assert utils.SHARED_IMAGES_FIELD not in kept.payload
+
+
+def test_import_rejects_foreign_urls_before_replacing(tmp_path, store):
+    point_id = str(uuid.uuid4())
+    asyncio.run(store.upsert([record(point_id, "Ann", [1, 0, 0, 0])]))
+    forged = record(str(uuid.uuid4()), "Ann", [1, 0, 0, 0])
+    forged.payload["thumbnail_url"] = "http://169.254.169.254/latest/meta-data"
+    write_snapshot(tmp_path / "g.npz", [forged])
+
+    alice = SimpleNamespace(username="alice", id=1)
+    with pytest.raises(SnapshotError):
+        asyncio.run(gallery.import_gallery(alice, str(tmp_path / "g.npz"), replace=True))
+    assert asyncio.run(store.count({"user_id": "alice"})) == 1
+
+
+def test_shared_images_are_not_deleted(monkeypatch):
+    deleted = []
+
+    async def delete(url):
+        deleted.append(url)
+
+    monkeypatch.setattr(utils, "delete_img_from_r2", delete)
+    asyncio.run(utils.delete_face_images({"image_url": f"{CDN}/a.jpg", utils.SHARED_IMAGES_FIELD: True}))
+    assert deleted == []
+    asyncio.run(utils.delete_face_images({"image_url": f"{CDN}/a.jpg", "thumbnail_url": f"{CDN}/a-thumb.webp"}))
+    assert sorted(deleted) == [f"{CDN}/a-thumb.webp", f"{CDN}/a.jpg"]
+
+
+def test_stored_image_urls():
+    assert utils.is_stored_image_url(f"{CDN}/a.jpg")
+    assert not utils.is_stored_image_url(f"{CDN}.evil.com/a.jpg")
+    assert not utils.is_stored_image_url(f"{CDN}/")
+    assert not utils.is_stored_image_url(f"{CDN}/../a.jpg")
@@ -0,0 +1,40 @@
+import io
+
+import numpy as np
+from PIL import Image
+
+from src.imaging import DECODE_MAX_SIDE, decode_image
+from src.utils import encode_face_images
+
+
+def _image_bytes(width: int, height: int, fmt: str) -> bytes:
+    pixels = np.random.default_rng(0).integers(0, 255, (height, width, 3), dtype=np.uint8)
+    output = io.BytesIO()
+    Image.fromarray(pixels).save(output, format=fmt)
+    return output.getvalue()
+
+
+def test_decode_caps_inference_copy():
+    img = decode_image(_image_bytes(3000, 2000, "JPEG"))
+    assert max(img.size) == DECODE_MAX_SIDE
+
+
+def test_original_keeps_uploaded_bytes():
+    data = _image_bytes(3000, 2000, "JPEG")
+    encoded = encode_face_images(decode_image(data), [100, 100, 400, 400], data)
+    assert encoded["image"] == data
+    assert max(Image.open(io.BytesIO(encoded["thumbnail"])).size) <= 256
+
+
+def test_original_in_other_format_is_stored_at_full_size():
+    data = _image_bytes(3000, 2000, "PNG")
+    encoded = encode_face_images(decode_image(data), [100, 100, 400, 400], data)
+    stored = Image.open(io.BytesIO(encoded["image"]))
+    assert stored.format == "JPEG"
+    assert stored.size == (3000, 2000)
+
+
+def test_without_upload_bytes_falls_back_to_decoded_image():
+    data = _image_bytes(3000, 2000, "JPEG")
+    encoded = encode_face_images(decode_image(data), [100, 100, 400, 400])
+    assert max(Image.open(io.BytesIO(encoded["image"])).size) == DECODE_MAX_SIDE
@@ -0,0 +1,34 @@
+import asyncio
+import threading
+import time
+
+import src.inference_client as inference_client
+from src.inference_client import InferenceUnavailableError, RemoteWorker
+
+
+def test_notify_from_the_event_loop_does_not_block(monkeypatch):
+    called = threading.Event()
+
+    def slow_call(target, method):
+        time.sleep(0.2)
+        called.set()
+        raise InferenceUnavailableError("timed out")
+
+    monkeypatch.setattr(inference_client, "call", slow_call)
+
+    async def scenario():
+        started = time.perf_counter()
+        RemoteWorker("enrollment").notify()
+        elapsed = time.perf_counter() - started
+        await asyncio.get_running_loop().run_in_executor(None, called.wait, 1)
+        return elapsed
+
+    assert asyncio.run(scenario()) < 0.1
+    assert called.is_set()
+
+
+def test_notify_outside_the_event_loop_calls_directly(monkeypatch):
+    calls = []
+    monkeypatch.setattr(inference_client, "call", lambda target, method: calls.append((target, method)))
+    RemoteWorker("compaction").notify()
+    assert calls == [(("worker", "compaction"), "notify")]
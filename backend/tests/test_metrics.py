@@ -0,0 +1,107 @@
+import os
+import subprocess
+import sys
+
+import pytest
+from prometheus_client.parser import text_string_to_metric_families
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+import src.jobs as jobs
+import src.metrics as metrics
+import src.streaming as streaming
+from src.database import Base
+
+BACKEND = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def samples(text: str) -> dict:
+    return {
+        (sample.name, tuple(sorted(sample.labels.items()))): sample.value
+        for family in text_string_to_metric_families(text)
+        for sample in family.samples
+    }
+
+
+@pytest.fixture(autouse=True)
+def database(tmp_path, monkeypatch):
+    # Gauge số job enrollment đọc database lúc scrape
+    engine = create_engine(f"sqlite:///{tmp_path / 'test.db'}", connect_args={"check_same_thread": False})
+    Base.metadata.create_all(bind=engine)
+    monkeypatch.setattr(jobs, "SessionLocal", sessionmaker(autocommit=False, autoflush=False, bind=engine))
+
+
+def test_text_format():
+    before = samples(metrics.render_metrics().decode())
+    streaming.FRAMES_PROCESSED.inc()
+    streaming.STAGE_SECONDS.labels("detect").observe(0.003)
+    metrics.HTTP_REQUEST_SECONDS.labels("GET", "/faces/{face_id}", "200").observe(0.02)
+
+    text = metrics.render_metrics().decode()
+    after = samples(text)
+    assert "# TYPE face_stream_frames_processed_total counter" in text
+    assert "_created" not in text
+    key = ("face_stream_frames_processed_total", ())
+    assert after[key] == before.get(key, 0) + 1
+    # Bucket cộng dồn: quan sát 3 ms rơi vào le="0.005" trở lên
+    below, above = (("face_stream_stage_seconds_bucket", (("le", le), ("stage", "detect"))) for le in ("0.0025", "0.005"))
+    assert after[below] == before.get(below, 0)
+    assert after[above] == before.get(above, 0) + 1
+    route = (("method", "GET"), ("route", "/faces/{face_id}"), ("status", "200"))
+    assert after[("face_http_request_seconds_count", route)] >= 1
+    assert after[("face_enrollment_jobs_queued", ())] == 0
+
+
+def test_scrape_gauge_survives_errors(monkeypatch):
+    def broken():
+        raise RuntimeError("database is locked")
+
+    gauge = metrics.scrape_gauge("face_test_broken", "Always fails.", broken)
+    try:
+        text = metrics.render_metrics().decode()
+    finally:
+        metrics._scrape_registry.unregister(gauge)
+    assert "face_test_broken " not in text
+    assert "face_enrollment_jobs_queued 0.0" in text
+
+
+WORKER = """
+import src.streaming as streaming
+streaming.FRAMES_PROCESSED.inc(3)
+streaming.SESSIONS_ACTIVE.inc()
+"""
+
+
+SCRAPE = """
+import sys
+from prometheus_client import multiprocess
+import src.metrics as metrics
+print(metrics.render_metrics().decode())
+# Như hook child_exit của gunicorn.conf.py
+for pid in sys.argv[1:]:
+    multiprocess.mark_process_dead(int(pid))
+print(metrics.render_metrics().decode())
+"""
+
+
+def test_multiprocess_metrics_are_aggregated(tmp_path):
+    metrics_dir = tmp_path / "metrics"
+    metrics_dir.mkdir()
+    # cwd tạm: database SQLite mặc định được tạo ở thư mục hiện tại
+    env = {**os.environ, "PROMETHEUS_MULTIPROC_DIR": str(metrics_dir), "PYTHONPATH": BACKEND}
+    pids = []
+    for _ in range(2):
+        worker = subprocess.Popen(
+            [sys.executable, "-c", WORKER], cwd=tmp_path, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+        )
+        assert worker.wait() == 0
+        pids.append(str(worker.pid))
+    text = subprocess.run(
+        [sys.executable, "-c", SCRAPE, *pids], cwd=tmp_path, env=env, check=True, capture_output=True, text=True
+    ).stdout
+    before, after = (samples(part) for part in text.split("\n\n", 1))
+    assert before[("face_stream_frames_processed_total", ())] == 6
+    assert before[("face_stream_sessions_active", ())] == 2
+    # Gauge "livesum" không còn cộng worker đã thoát, counter vẫn giữ
+    assert after.get(("face_stream_sessions_active", ()), 0) == 0
+    assert after[("face_stream_frames_processed_total", ())] == 6
@@ -0,0 +1,53 @@
+from types import SimpleNamespace
+
+import pytest
+
+import src.model_registry as model_registry
+from src.model_registry import InvalidModelNameError, ModelRegistry, ModelSwapError, model_path
+
+
+@pytest.mark.parametrize("name", ["../secrets/key", "a/b", "", "x y", "/abs"])
+def test_model_names_cannot_leave_the_models_dir(name):
+    with pytest.raises(InvalidModelNameError):
+        model_path(name)
+
+
+def test_valid_model_names():
+    assert model_path("w600k_r50-fp16.v2").endswith("w600k_r50-fp16.v2.onnx")
+
+
+@pytest.fixture
+def models_dir(tmp_path, monkeypatch):
+    for name in ("old", "new"):
+        (tmp_path / f"{name}.onnx").write_bytes(name.encode())
+    monkeypatch.setattr(model_registry, "MODELS_DIR", str(tmp_path))
+    return tmp_path
+
+
+def loader(path):
+    return SimpleNamespace(path=path)
+
+
+def test_swap_requires_a_loaded_role(models_dir):
+    registry = ModelRegistry()
+    checked = []
+    with pytest.raises(ModelSwapError):
+        registry.swap("recognizer/new", "new", model_path("new"), loader, check=lambda *models: checked.append(models))
+    assert registry.entry("recognizer/new") is None
+
+    registry.get("recognizer/old", "old", model_path("old"), loader)
+    entry = registry.swap("recognizer/old", "new", model_path("new"), loader, check=lambda *models: checked.append(models))
+    assert entry.name == "new" and registry.get("recognizer/old", "old", model_path("old"), loader) is entry.model
+    assert len(checked) == 1
+
+
+def test_failed_check_keeps_the_current_model(models_dir):
+    registry = ModelRegistry()
+    current = registry.get("recognizer/old", "old", model_path("old"), loader)
+
+    def reject(old, new):
+        raise ModelSwapError("different embeddings")
+
+    with pytest.raises(ModelSwapError):
+        registry.swap("recognizer/old", "new", model_path("new"), loader, check=reject)
+    assert registry.get("recognizer/old", "old", model_path("old"), loader) is current
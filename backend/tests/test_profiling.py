@@ -0,0 +1,34 @@
+import re
+
+import pytest
+from fastapi import HTTPException
+
+import src.profiling as profiling
+from src.profiling import REPORT_ID_PATTERN, Profiler, StartProfiling
+
+
+def test_sessions_started_in_the_same_second_get_distinct_reports(tmp_path, monkeypatch):
+    monkeypatch.setattr(profiling, "PROFILE_DIR", str(tmp_path))
+    profiler = Profiler()
+    ids = []
+    for _ in range(2):
+        ids.append(profiler.start(sample_rate=1.0, duration_seconds=60).id)
+        profiler.stop()
+
+    assert ids[0] != ids[1]
+    assert all(re.match(REPORT_ID_PATTERN, report_id) for report_id in ids)
+    assert profiling.list_profile_reports() == sorted(ids, reverse=True)
+    assert profiling.read_report(ids[0]).id == ids[0]
+
+
+def test_report_ids_without_suffix_are_still_listed():
+    assert re.match(REPORT_ID_PATTERN, "20260101-120000-42")
+    assert not re.match(REPORT_ID_PATTERN, "20260101-120000-42-../x")
+
+
+def test_start_is_refused_with_multiple_workers(monkeypatch):
+    monkeypatch.setattr(profiling, "is_remote", lambda: True)
+    with pytest.raises(HTTPException) as error:
+        profiling.start_profiling(StartProfiling(), current_user=None)
+    assert error.value.status_code == 409
+    assert profiling._profiler.session is None
@@ -0,0 +1,89 @@
+import asyncio
+
+import numpy as np
+import pytest
+
+from src.prototypes import PrototypeIndex, prototype_id
+from src.vector_store.base import VectorRecord
+from src.vector_store.numpy_store import NumpyVectorStore
+
+DIM = 4
+
+
+def unit(*values: float) -> np.ndarray:
+    vector = np.asarray(values, dtype=np.float32)
+    return vector / np.linalg.norm(vector)
+
+
+def make_index(tmp_path) -> PrototypeIndex:
+    images = NumpyVectorStore("faces", DIM, str(tmp_path))
+    prototypes = NumpyVectorStore("faces_prototypes", DIM, str(tmp_path))
+    return PrototypeIndex(images, prototypes)
+
+
+async def prototype(index: PrototypeIndex, name: str):
+    records = await index.prototypes.retrieve([prototype_id("alice", name)], with_vectors=True)
+    return records[0] if records else None
+
+
+def test_add_and_remove_update_the_mean(tmp_path):
+    async def scenario():
+        index = make_index(tmp_path)
+        await index.images.setup()
+        await index.setup()
+
+        await index.add("alice", [("Ann", unit(1, 0, 0, 0)), ("Ann", unit(0, 1, 0, 0))])
+        record = await prototype(index, "Ann")
+        assert record.payload["image_count"] == 2
+        np.testing.assert_allclose(record.vector, unit(1, 1, 0, 0), atol=1e-6)
+
+        await index.remove("alice", [("Ann", unit(0, 1, 0, 0))])
+        record = await prototype(index, "Ann")
+        assert record.payload["image_count"] == 1
+        np.testing.assert_allclose(record.vector, unit(1, 0, 0, 0), atol=1e-6)
+
+        await index.remove("alice", [("Ann", unit(1, 0, 0, 0))])
+        assert await prototype(index, "Ann") is None
+
+    asyncio.run(scenario())
+
+
+def test_rename_merges_into_existing_group(tmp_path):
+    async def scenario():
+        index = make_index(tmp_path)
+        await index.images.setup()
+        await index.setup()
+
+        await index.add("alice", [("Ann", unit(1, 0, 0, 0)), ("Bob", unit(0, 1, 0, 0)), ("Bob", unit(0, 1, 0, 0))])
+        await index.rename("alice", "Ann", "Bob")
+
+        assert await prototype(index, "Ann") is None
+        record = await prototype(index, "Bob")
+        assert record.payload["image_count"] == 3
+        np.testing.assert_allclose(record.vector, unit(1, 2, 0, 0), atol=1e-6)
+
+    asyncio.run(scenario())
+
+
+def test_setup_rebuilds_from_images_and_search_uses_candidates(tmp_path):
+    async def scenario():
+        index = make_index(tmp_path)
+        await index.images.setup()
+        await index.images.upsert([
+            VectorRecord(id="1", vector=unit(1, 0, 0, 0), payload={"user_id": "alice", "name": "Ann"}),
+            VectorRecord(id="2", vector=unit(1, 0.2, 0, 0), payload={"user_id": "alice", "name": "Ann"}),
+            VectorRecord(id="3", vector=unit(0, 0, 1, 0), payload={"user_id": "alice", "name": "Cat"}),
+            VectorRecord(id="4", vector=unit(1, 0, 0, 0), payload={"user_id": "bob", "name": "Ann"}),
+        ])
+        await index.setup()
+
+        assert await index.prototypes.count() == 3
+        assert (await prototype(index, "Ann")).payload["image_count"] == 2
+
+        hits = await index.search(unit(0, 0, 1, 0.1), "alice", limit=5, candidates=1)
+        assert [hit.id for hit in hits] == ["3"]
+        [hits] = await index.search_batch([unit(1, 0, 0, 0)], "alice", limit=5, candidates=1)
+        assert [hit.id for hit in hits] == ["1", "2"]
+        assert hits[0].score == pytest.approx(1.0, abs=1e-5)
+
+    asyncio.run(scenario())
@@ -0,0 +1,57 @@
+import asyncio
+from types import SimpleNamespace
+
+from qdrant_client import models
+
+from src.qdrant_client import ensure_payload_indexes, tenant_hnsw_config
+
+
+class _FakeClient:
+    def __init__(self, payload_schema, hnsw_config):
+        self.info = SimpleNamespace(payload_schema=payload_schema, config=SimpleNamespace(hnsw_config=hnsw_config))
+        self.calls = []
+
+    async def get_collection(self, collection_name):
+        return self.info
+
+    async def create_payload_index(self, collection_name, field_name, field_schema, wait):
+        self.calls.append(("create", field_name, field_schema))
+
+    async def delete_payload_index(self, collection_name, field_name, wait):
+        self.calls.append(("delete", field_name))
+
+    async def update_collection(self, collection_name, hnsw_config):
+        self.calls.append(("hnsw", hnsw_config.m, hnsw_config.payload_m))
+        return True
+
+
+def test_wrong_tenant_index_is_recreated():
+    client = _FakeClient(
+        {
+            "user_id": models.PayloadIndexInfo(data_type=models.PayloadSchemaType.KEYWORD, points=0),
+            "name": models.PayloadIndexInfo(data_type=models.PayloadSchemaType.KEYWORD, points=0),
+        },
+        tenant_hnsw_config(),
+    )
+    asyncio.run(ensure_payload_indexes(client, "faces"))
+    assert [call[:2] for call in client.calls] == [("delete", "user_id"), ("create", "user_id")]
+    assert client.calls[1][2].is_tenant
+
+
+def test_missing_indexes_and_hnsw_are_created():
+    client = _FakeClient({}, models.HnswConfigDiff(m=16, payload_m=None))
+    asyncio.run(ensure_payload_indexes(client, "faces"))
+    assert [call[:2] for call in client.calls] == [("create", "user_id"), ("create", "name"), ("hnsw", 0)]
+
+
+def test_correct_schema_is_left_alone():
+    tenant = models.KeywordIndexParams(type=models.KeywordIndexType.KEYWORD, is_tenant=True)
+    client = _FakeClient(
+        {
+            "user_id": models.PayloadIndexInfo(data_type=models.PayloadSchemaType.KEYWORD, params=tenant, points=0),
+            "name": models.PayloadIndexInfo(data_type=models.PayloadSchemaType.KEYWORD, points=0),
+        },
+        tenant_hnsw_config(),
+    )
+    asyncio.run(ensure_payload_indexes(client, "faces"))
+    assert client.calls == []
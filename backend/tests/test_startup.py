@@ -0,0 +1,39 @@
+import pytest
+from fastapi import FastAPI, WebSocket
+from fastapi.testclient import TestClient
+from starlette.websockets import WebSocketDisconnect
+
+import src.startup as startup
+
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setattr(startup, "_state", startup.StartupState())
+    app = FastAPI()
+    app.middleware("http")(startup.readiness_gate)
+    app.add_middleware(startup.WebSocketReadinessGate)
+
+    @app.get("/faces")
+    def faces():
+        return {"ok": True}
+
+    @app.websocket("/stream/ws")
+    async def stream(websocket: WebSocket):
+        await websocket.accept()
+        await websocket.send_text("hello")
+        await websocket.close()
+
+    return TestClient(app)
+
+
+def test_routes_wait_for_readiness(client):
+    assert client.get("/faces").status_code == 503
+    with client.websocket_connect("/stream/ws") as websocket:
+        with pytest.raises(WebSocketDisconnect) as closed:
+            websocket.receive_text()
+    assert closed.value.code == 1013
+
+    startup._state.ready = True
+    assert client.get("/faces").json() == {"ok": True}
+    with client.websocket_connect("/stream/ws") as websocket:
+        assert websocket.receive_text() == "hello"
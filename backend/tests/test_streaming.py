@@ -0,0 +1,42 @@
+import asyncio
+
+import src.streaming as streaming
+
+
+def test_primary_counts_streams_reported_by_workers(monkeypatch):
+    monkeypatch.setattr(streaming, "_remote_streams", {})
+    streaming.record_remote_streams(101, 2)
+    streaming.record_remote_streams(102, 1)
+    assert streaming.active_stream_count() == 3
+
+    streaming.record_remote_streams(101, 0)
+    assert streaming.active_stream_count() == 1
+    # Worker chết mà không báo về 0: báo cáo cũ hết hạn
+    monkeypatch.setattr(streaming, "STREAM_REPORT_TTL", 0)
+    assert streaming.active_stream_count() == 0
+
+
+def test_worker_reports_until_its_streams_close(monkeypatch):
+    reports = []
+
+    async def acall(target, method, pid, count):
+        reports.append(count)
+
+    monkeypatch.setattr(streaming, "acall", acall)
+    monkeypatch.setattr(streaming, "is_remote", lambda: True)
+    monkeypatch.setattr(streaming, "STREAM_REPORT_INTERVAL", 0.01)
+
+    async def scenario():
+        monkeypatch.setattr(streaming, "_stream_count_changed", asyncio.Event())
+        monkeypatch.setattr(streaming, "_active_streams", 1)
+        streaming._stream_count_updated()
+        task = streaming._report_task
+        await asyncio.sleep(0.05)
+        assert len(reports) > 1 and set(reports) == {1}
+
+        streaming._active_streams = 0
+        streaming._stream_count_updated()
+        await asyncio.wait_for(task, 1)
+        assert reports[-1] == 0 and streaming._report_task is None
+
+    asyncio.run(scenario())
@@ -0,0 +1,42 @@
+import pickle
+
+import numpy as np
+from PIL import Image
+
+import src.unknown_faces as unknown_faces
+from src.unknown_faces import UnknownFaceStore
+from src.utils import THUMBNAIL_MAX_SIZE
+
+
+def face(x1, y1, x2, y2):
+    return {"bbox": [x1, y1, x2, y2], "confidence": 0.9}
+
+
+def test_only_face_thumbnails_reach_the_store(monkeypatch):
+    calls = []
+
+    class Recorder:
+        def observe_faces(self, thumbnails, faces, embeddings):
+            calls.append((thumbnails, faces, embeddings))
+
+    monkeypatch.setattr(unknown_faces, "get_unknown_store", lambda username, version: Recorder())
+    frame = Image.fromarray(np.zeros((1080, 1920, 3), dtype=np.uint8))
+    faces = [face(100, 100, 700, 700), face(0, 0, 10, 10)]
+    unknown_faces.observe_unknown_faces("alice", "v1", frame, faces, [np.ones(4), np.ones(4)])
+
+    # Mặt quá nhỏ bị bỏ; mặt còn lại chỉ gửi thumbnail đã thu nhỏ
+    [(thumbnails, sent_faces, _)] = calls
+    assert sent_faces == faces[:1]
+    assert max(thumbnails[0].size) <= THUMBNAIL_MAX_SIZE
+    assert len(pickle.dumps(thumbnails)) < len(pickle.dumps(frame)) / 10
+
+
+def test_store_keeps_encoded_samples():
+    store = UnknownFaceStore("v1")
+    thumbnail = Image.fromarray(np.full((64, 64, 3), 128, dtype=np.uint8))
+    embedding = np.asarray([1, 0, 0, 0], dtype=np.float32)
+    store.observe_faces([thumbnail, thumbnail], [face(0, 0, 64, 64)] * 2, [embedding, embedding])
+
+    [cluster] = store.clusters()
+    assert cluster.count == 2 and len(cluster.samples) == 1
+    assert isinstance(cluster.samples[0].thumbnail, bytes)
@@ -0,0 +1,39 @@
+import asyncio
+
+import src.utils as utils
+
+
+class _FakeS3:
+    def __init__(self, keys):
+        self.keys = keys
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+    async def put_object(self, Key, **kwargs):
+        self.keys.append(Key)
+
+
+def _upload(monkeypatch, encoded, key=None):
+    keys = []
+    monkeypatch.setattr(utils, "r2_client", lambda: _FakeS3(keys))
+    urls = asyncio.run(utils.upload_encoded_face_images(encoded, key))
+    return keys, urls
+
+
+def test_fixed_key_is_reused_on_retry(monkeypatch):
+    encoded = {"image": b"image", "thumbnail": b"thumb"}
+    first, urls = _upload(monkeypatch, encoded, key="point-1")
+    second, _ = _upload(monkeypatch, encoded, key="point-1")
+    assert sorted(first) == sorted(second) == ["point-1-thumb.webp", "point-1.jpg"]
+    assert urls["image_url"].endswith("/point-1.jpg")
+
+
+def test_random_keys_without_fixed_key(monkeypatch):
+    first, _ = _upload(monkeypatch, {"thumbnail": b"thumb"})
+    second, urls = _upload(monkeypatch, {"thumbnail": b"thumb"})
+    assert first != second
+    assert urls["image_url"] == urls["thumbnail_url"]
@@ -0,0 +1,271 @@
+import asyncio
+import threading
+import time
+
+import numpy as np
+import pytest
+
+from src.vector_store import hnsw_store, numpy_store
+from src.vector_store.base import VectorRecord
+from src.vector_store.numpy_store import NumpyVectorStore
+
+DIM = 8
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+def unit(index: int) -> np.ndarray:
+    vector = np.zeros(DIM, dtype=np.float32)
+    vector[index] = 1.0
+    return vector
+
+
+@pytest.fixture(params=["numpy", "hnsw"])
+def open_store(request, tmp_path, monkeypatch):
+    """Mở (hoặc mở lại) store trên cùng thư mục; hnsw luôn đi qua đồ thị thay vì quét chính xác."""
+    if request.param == "hnsw":
+        pytest.importorskip("hnswlib")
+        monkeypatch.setattr(hnsw_store, "EXACT_SEARCH_THRESHOLD", 0)
+        store_class = hnsw_store.HnswVectorStore
+    else:
+        store_class = NumpyVectorStore
+
+    def _open(**kwargs):
+        store = store_class("faces", DIM, str(tmp_path), **kwargs)
+        run(store.setup())
+        return store
+
+    return _open
+
+
+def seed(store):
+    run(store.upsert([
+        VectorRecord(id="a1", vector=unit(0), payload={"user_id": "alice", "name": "Ann"}),
+        VectorRecord(id="a2", vector=unit(1), payload={"user_id": "alice", "name": "Bob"}),
+        VectorRecord(id="b1", vector=unit(0), payload={"user_id": "bob", "name": "Ann"}),
+    ]))
+
+
+def test_search_is_scoped_to_tenant(open_store):
+    store = open_store()
+    seed(store)
+
+    hits = run(store.search(unit(0) + 0.1 * unit(1), {"user_id": "alice"}, limit=2))
+    assert [hit.id for hit in hits] == ["a1", "a2"]
+    assert hits[0].score == pytest.approx(1 / np.sqrt(1.01), abs=1e-5)
+    assert hits[0].payload == {"user_id": "alice", "name": "Ann"}
+
+    hits = run(store.search(unit(0), {"user_id": "alice", "name": "Bob"}, limit=5))
+    assert [hit.id for hit in hits] == ["a2"]
+    assert run(store.count({"user_id": "bob"})) == 1
+
+
+def test_delete_by_id_and_by_filter(open_store):
+    store = open_store()
+    seed(store)
+
+    run(store.delete(ids=["a1"]))
+    assert run(store.retrieve(["a1"])) == []
+    assert [hit.id for hit in run(store.search(unit(0), {"user_id": "alice"}))] == ["a2"]
+
+    run(store.delete(payload_filter={"user_id": "alice", "name": "Bob"}))
+    assert run(store.count({"user_id": "alice"})) == 0
+    assert run(store.count()) == 1
+
+
+def test_upsert_moves_record_between_tenants(open_store):
+    store = open_store()
+    seed(store)
+    run(store.upsert([VectorRecord(id="a1", vector=unit(2), payload={"user_id": "bob", "name": "Ann"})]))
+
+    assert run(store.count({"user_id": "alice"})) == 1
+    assert [hit.id for hit in run(store.search(unit(2), {"user_id": "bob"}, limit=1))] == ["a1"]
+
+
+def test_reopen_replays_log(open_store):
+    store = open_store()
+    seed(store)
+    run(store.set_payload({"name": "Carl"}, ids=["a2"]))
+    run(store.delete(ids=["b1"]))
+    # Không gọi close: trạng thái chỉ còn trong log, như khi process bị dừng đột ngột
+    for partition in store.partitions.values():
+        partition._log.flush()
+
+    reopened = open_store()
+    assert run(reopened.count()) == 2
+    [record] = run(reopened.retrieve(["a2"], with_vectors=True))
+    assert record.payload == {"user_id": "alice", "name": "Carl"}
+    np.testing.assert_allclose(record.vector, unit(1))
+    assert [hit.id for hit in run(reopened.search(unit(1), {"user_id": "alice"}, limit=1))] == ["a2"]
+    # Dòng của bản ghi đã xóa được tái sử dụng
+    run(reopened.upsert([VectorRecord(id="b2", vector=unit(3), payload={"user_id": "bob"})]))
+    assert run(reopened.retrieve(["b2"]))[0].id == "b2"
+
+
+@pytest.mark.parametrize("quantization", ["float16", "int8"])
+def test_quantized_search_rescores_with_float32(tmp_path, quantization):
+    rng = np.random.default_rng(0)
+    vectors = rng.standard_normal((300, DIM)).astype(np.float32)
+    records = [VectorRecord(id=str(i), vector=vector, payload={"user_id": "alice"}) for i, vector in enumerate(vectors)]
+    exact = NumpyVectorStore("faces", DIM, str(tmp_path / "exact"))
+    quantized = NumpyVectorStore("faces", DIM, str(tmp_path / "quantized"), quantization=quantization)
+    for store in (exact, quantized):
+        run(store.setup())
+        run(store.upsert(records))
+
+    queries = rng.standard_normal((20, DIM)).astype(np.float32)
+    for query in queries:
+        expected = run(exact.search(query, {"user_id": "alice"}, limit=5))
+        hits = run(quantized.search(query, {"user_id": "alice"}, limit=5))
+        assert [hit.id for hit in hits] == [hit.id for hit in expected]
+        # Điểm trả về là điểm float32 chính xác, không phải điểm xấp xỉ
+        assert [hit.score for hit in hits] == pytest.approx([hit.score for hit in expected], abs=1e-6)
+
+
+def test_quantized_codes_follow_the_log(tmp_path):
+    store = NumpyVectorStore("faces", DIM, str(tmp_path), quantization="int8")
+    run(store.setup())
+    seed(store)
+    run(store.close())
+
+    reopened = NumpyVectorStore("faces", DIM, str(tmp_path), quantization="int8")
+    run(reopened.setup())
+    run(reopened.upsert([VectorRecord(id="a1", vector=unit(3), payload={"user_id": "alice", "name": "Ann"})]))
+    hits = run(reopened.search(unit(3), {"user_id": "alice"}, limit=1))
+    assert [hit.id for hit in hits] == ["a1"]
+    assert hits[0].score == pytest.approx(1.0, abs=1e-6)
+    run(reopened.close())
+
+    # Đổi kiểu lượng tử: mã được dựng lại từ float32
+    converted = NumpyVectorStore("faces", DIM, str(tmp_path), quantization="float16")
+    run(converted.setup())
+    assert [hit.id for hit in run(converted.search(unit(1), {"user_id": "alice"}, limit=1))] == ["a2"]
+
+
+def test_rename_by_filter_and_paged_scroll(open_store):
+    store = open_store()
+    run(store.upsert([
+        VectorRecord(id=f"a{i}", vector=unit(i % DIM), payload={"user_id": "alice", "name": "Ann", "image_url": f"u{i}"})
+        for i in range(7)
+    ] + [VectorRecord(id="b1", vector=unit(0), payload={"user_id": "bob", "name": "Ann"})]))
+
+    run(store.set_payload({"name": "Anna"}, payload_filter={"user_id": "alice", "name": "Ann"}))
+    assert run(store.count({"user_id": "alice", "name": "Ann"})) == 0
+    assert run(store.count({"user_id": "alice", "name": "Anna"})) == 7
+    assert run(store.count({"user_id": "bob", "name": "Ann"})) == 1
+    with pytest.raises(ValueError):
+        run(store.set_payload({"user_id": "bob"}, payload_filter={"user_id": "alice"}))
+
+    async def collect():
+        pages = []
+        async for page in store.iter_pages({"user_id": "alice"}, page_size=3, payload_fields=["name"]):
+            pages.append(page)
+        return pages
+
+    pages = run(collect())
+    assert [len(page) for page in pages] == [3, 3, 1]
+    records = [record for page in pages for record in page]
+    assert sorted(record.id for record in records) == [f"a{i}" for i in range(7)]
+    assert all(record.payload == {"name": "Anna"} and record.vector is None for record in records)
+
+    # Đổi tên vẫn còn sau khi mở lại từ log
+    for partition in store.partitions.values():
+        partition._log.flush()
+    assert run(open_store().count({"user_id": "alice", "name": "Anna"})) == 7
+
+
+def test_reopen_from_snapshot_and_log_tail(open_store):
+    store = open_store()
+    seed(store)
+    run(store.close())
+
+    reopened = open_store()
+    [partition] = [p for p in reopened.partitions.values() if "a1" in p.id_to_row]
+    assert partition._snapshot_lines == partition._log_lines == 2
+    # Lọc theo nhãn đọc cột labels của snapshot, payload chưa bị giải mã
+    assert run(reopened.count({"user_id": "alice", "name": "Bob"})) == 1
+    assert all(not isinstance(item, dict) for item in partition.payloads._items)
+
+    run(reopened.set_payload({"name": "Carl"}, ids=["a2"]))
+    run(reopened.upsert([VectorRecord(id="a3", vector=unit(4), payload={"user_id": "alice", "name": "Dan"})]))
+    partition._log.flush()
+
+    # Snapshot cũ + phần log phía sau
+    tail = open_store()
+    [partition] = [p for p in tail.partitions.values() if "a1" in p.id_to_row]
+    assert partition._snapshot_lines == 2 and partition._log_lines == 4
+    assert run(tail.count({"user_id": "alice", "name": "Carl"})) == 1
+    assert [hit.id for hit in run(tail.search(unit(4), {"user_id": "alice"}, limit=1))] == ["a3"]
+    assert run(tail.retrieve(["a1"]))[0].payload == {"user_id": "alice", "name": "Ann"}
+
+
+def test_snapshot_ahead_of_log_falls_back_to_replay(open_store):
+    store = open_store()
+    seed(store)
+    run(store.close())
+    [partition] = [p for p in store.partitions.values() if "a1" in p.id_to_row]
+    # Log bị cắt ngắn hơn vị trí snapshot ghi nhận: snapshot không còn đáng tin
+    with open(partition._log_path, "rb") as f:
+        first_line = f.readline()
+    with open(partition._log_path, "wb") as f:
+        f.write(first_line)
+
+    reopened = open_store()
+    assert run(reopened.count({"user_id": "alice"})) == 1
+    assert run(reopened.retrieve(["a2"])) == []
+
+
+def test_reads_wait_for_the_lock_off_the_event_loop(open_store):
+    store = open_store()
+    seed(store)
+
+    async def scenario():
+        ticks = 0
+
+        async def ticker():
+            nonlocal ticks
+            while True:
+                await asyncio.sleep(0.01)
+                ticks += 1
+
+        ticking = asyncio.create_task(ticker())
+        # Như một upsert / compaction đang giữ lock trong threadpool
+        holder = threading.Thread(target=lambda: (store._lock.acquire(), time.sleep(0.2), store._lock.release()))
+        holder.start()
+        await asyncio.sleep(0.02)
+        count, records = await asyncio.gather(store.count({"user_id": "alice"}), store.retrieve(["a1"]))
+        ticking.cancel()
+        holder.join()
+        return ticks, count, records
+
+    ticks, count, records = run(scenario())
+    assert count == 2 and [record.id for record in records] == ["a1"]
+    assert ticks >= 5
+
+
+def test_derived_index_is_not_reused_after_compaction_and_crash(tmp_path, monkeypatch):
+    pytest.importorskip("hnswlib")
+    monkeypatch.setattr(hnsw_store, "EXACT_SEARCH_THRESHOLD", 0)
+    monkeypatch.setattr(numpy_store, "COMPACT_FACTOR", 1)
+    monkeypatch.setattr(numpy_store, "COMPACT_MIN_LINES", 0)
+
+    def open_store(quantization="none"):
+        store = hnsw_store.HnswVectorStore("faces", DIM, str(tmp_path), quantization=quantization)
+        run(store.setup())
+        return store
+
+    store = open_store("int8")
+    seed(store)
+    run(store.close())
+
+    # Ghi thêm rồi compaction đưa số dòng log về đúng số lúc đóng; process dừng đột ngột
+    store = open_store("int8")
+    run(store.upsert([VectorRecord(id="a1", vector=unit(5), payload={"user_id": "alice", "name": "Ann"})]))
+    [partition] = [p for p in store.partitions.values() if "a1" in p.id_to_row]
+    assert partition._log_lines == 2
+
+    reopened = open_store("int8")
+    hits = run(reopened.search(unit(5), {"user_id": "alice"}, limit=1))
+    assert [hit.id for hit in hits] == ["a1"] and hits[0].score == pytest.approx(1.0, abs=1e-6)